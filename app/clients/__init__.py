@@ -1,5 +1,16 @@
-from .base_client import BaseClient
+from .base_client import BaseClient, UpstreamStatusError
+from .dashscope_client import DashScopeClient
 from .deepseek_client import DeepSeekClient
 from .qwen_client import QwenClient
+from .registry import ModelRoute, ProviderConfig, ProviderRegistry
 
-__all__ = ['BaseClient', 'DeepSeekClient', 'QwenClient']
+__all__ = [
+    'BaseClient',
+    'DashScopeClient',
+    'DeepSeekClient',
+    'QwenClient',
+    'ModelRoute',
+    'ProviderConfig',
+    'ProviderRegistry',
+    'UpstreamStatusError',
+]
@@ -1,25 +1,23 @@
 """阿里百炼 API 客户端"""
 
-import json
 from typing import AsyncGenerator
-import time
-from app.utils.logger import logger
-from .base_client import BaseClient
 
-class BaiLianClient(BaseClient):
+from .dashscope_client import DashScopeClient
+from .registry import DASHSCOPE_NATIVE_API_URL
+
+class BaiLianClient(DashScopeClient):
     def __init__(
         self,
         api_key: str,
-        api_url: str = "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions",
+        api_url: str = DASHSCOPE_NATIVE_API_URL,
     ):
         """初始化阿里百炼客户端
 
         Args:
             api_key: 阿里百炼 API Key
-            api_url: API地址
+            api_url: 原生接口地址
         """
-        self.api_key = api_key
-        self.api_url = api_url
+        super().__init__(api_key, api_url)
 
     async def stream_chat(
         self,
@@ -39,53 +37,8 @@ class BaiLianClient(BaseClient):
                 内容类型: "reasoning" 或 "content"
                 内容: 实际的文本内容
         """
-        # 1. 准备请求头
-        headers = {
-            "Content-Type": "application/json",
-            "Accept": "text/event-stream",
-            "Authorization": f"Bearer {self.api_key}"
-        }
-        
-        # 2. 准备请求体
-        request_body = {
-            "model": model,
-            "messages": messages,
-            "stream": True,
-            "result_format": "message",
-            "parameters": {
-                "temperature": 0.7,
-                "top_p": 0.95,
-                "top_k": 40,
-                "repetition_penalty": 1.0,
-                "enable_search": False
-            }
-        }
-
-        logger.debug(f"发送请求到 {self.api_url}，请求体：{request_body}")
-
-        # 3. 发送请求并处理响应
-        async for chunk in self._make_request(headers, request_body, self.api_url):
-            chunk_str = chunk.decode("utf-8")
-            logger.debug(f"收到响应：{chunk_str}")
-
-            try:
-                lines = chunk_str.splitlines()
-                for line in lines:
-                    if line.startswith("data: "):
-                        json_str = line[len("data: "):]
-                        if json_str == "[DONE]":
-                            return
-
-                        data = json.loads(json_str)
-                        if data.get("output") and data["output"].get("choices"):
-                            choice = data["output"]["choices"][0]
-                            if choice.get("message"):
-                                if choice["message"].get("reasoning_content"):
-                                    yield "reasoning", choice["message"]["reasoning_content"]
-                                if choice["message"].get("content"):
-                                    yield "content", choice["message"]["content"]
-
-            except json.JSONDecodeError as e:
-                logger.error(f"JSON 解析错误: {e}")
-            except Exception as e:
-                logger.error(f"处理响应时发生错误: {e}")
\ No newline at end of file
+        async for content_type, content in super().stream_chat(messages, model=model):
+            if content_type == "reasoning":
+                yield "reasoning", content
+            elif content_type == "answer":
+                yield "content", content
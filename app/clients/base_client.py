@@ -1,12 +1,27 @@
 """基础客户端类,定义通用接口"""
 
+import asyncio
 from abc import ABC, abstractmethod
-from typing import AsyncGenerator, Optional
+from contextlib import aclosing
+from typing import AsyncGenerator, AsyncIterator, Optional, Union
 
 import aiohttp
 from aiohttp.client_exceptions import ClientError, ServerTimeoutError
+from yarl import URL
 
+from app.monitoring import tracing
+from app.monitoring.timing import timed
+from app.utils import json_codec
 from app.utils.logger import logger
+from .timeouts import DEADLINE_HEADER, AdaptiveTimeouts, remaining, request_timeout
+
+
+class UpstreamStatusError(ClientError):
+    """上游返回了非 2xx 状态码"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
 
 
 class BaseClient(ABC):
@@ -16,9 +31,23 @@ class BaseClient(ABC):
     # total: 总超时时间
     # connect: 连接超时时间
     # sock_read: 读取超时时间
-    # TODO: 默认时间的设置涉及到模型推理速度，需要根据实际情况进行调整
+    # 设置了 stream_timeouts 的流式请求改用分阶段的超时与卡顿检测，见 timeouts 模块
     DEFAULT_TIMEOUT = aiohttp.ClientTimeout(total=600, connect=10, sock_read=500)
 
+    # 连接池大小
+    POOL_LIMIT = 100
+
+    # 空闲连接的保持时间(秒)，启动预热建立的连接需要保留到第一批请求到达
+    KEEPALIVE_TIMEOUT = 60
+
+    # 消息内容超过该字符数时按消息分段编码，以分块传输编码流式上传请求体，0 表示总是一次编码
+    LARGE_PAYLOAD_CHARS = 1024 * 1024
+
+    # 所有客户端共享的连接池，保持长连接以复用 TCP/TLS 握手
+    # aiohttp 的会话不能跨事件循环使用，所以同时记录创建它的事件循环
+    _session: Optional[aiohttp.ClientSession] = None
+    _session_loop: Optional[asyncio.AbstractEventLoop] = None
+
     def __init__(
         self,
         api_key: str,
@@ -35,6 +64,103 @@ class BaseClient(ABC):
         self.api_key = api_key
         self.api_url = api_url
         self.timeout = timeout or self.DEFAULT_TIMEOUT
+        # 流式请求的分阶段超时，为空时只使用 timeout
+        self.stream_timeouts: Optional[AdaptiveTimeouts] = None
+
+    @staticmethod
+    def _deadline_headers(headers: dict) -> dict:
+        """请求有截止时间时，带上剩余的秒数告知上游"""
+        left = remaining()
+        if left is None:
+            return headers
+        return {**headers, DEADLINE_HEADER: f"{left:.3f}"}
+
+    @classmethod
+    def _get_session(cls) -> aiohttp.ClientSession:
+        """获取共享的连接池会话，不存在或已关闭时创建"""
+        loop = asyncio.get_running_loop()
+        session = BaseClient._session
+        if session is None or session.closed or BaseClient._session_loop is not loop:
+            connector = aiohttp.TCPConnector(
+                limit=cls.POOL_LIMIT,
+                keepalive_timeout=cls.KEEPALIVE_TIMEOUT,
+                ssl=False  # 禁用 SSL 验证
+            )
+            session = aiohttp.ClientSession(connector=connector)
+            BaseClient._session = session
+            BaseClient._session_loop = loop
+        return session
+
+    @classmethod
+    async def close_sessions(cls) -> None:
+        """关闭共享的连接池"""
+        session = BaseClient._session
+        BaseClient._session = None
+        BaseClient._session_loop = None
+        if session is not None and not session.closed:
+            await session.close()
+
+    async def warm_connection(self, api_url: Optional[str] = None) -> bool:
+        """预先建立到上游的连接并放回连接池
+
+        Args:
+            api_url: 目标地址，只使用其中的协议、主机与端口
+
+        Returns:
+            bool: 是否成功建立连接
+        """
+        origin = URL(api_url or self.api_url).origin()
+        try:
+            async with self._get_session().head(
+                origin, timeout=aiohttp.ClientTimeout(total=5), allow_redirects=False
+            ) as response:
+                await response.read()
+            return True
+        except Exception as e:
+            logger.debug(f"预热连接失败 {origin}: {e}")
+            return False
+
+    @staticmethod
+    def _content_chars(data: dict) -> int:
+        """估算请求中消息内容的字符数"""
+        total = 0
+        for message in data.get("messages") or ():
+            content = message.get("content")
+            if isinstance(content, str):
+                total += len(content)
+            elif isinstance(content, list):
+                for part in content:
+                    if isinstance(part, dict) and isinstance(part.get("text"), str):
+                        total += len(part["text"])
+        return total
+
+    def _encode_body(self, data: dict) -> Union[bytes, AsyncIterator[bytes]]:
+        """编码请求体
+
+        小请求一次编码为 bytes；超大的请求（例如 1M 上下文）按消息分段编码并流式上传，
+        不需要同时持有整个请求体的编码结果。每次调用都返回新的请求体，可以用于重试。
+        """
+        if self.LARGE_PAYLOAD_CHARS and self._content_chars(data) >= self.LARGE_PAYLOAD_CHARS:
+            async def upload() -> AsyncIterator[bytes]:
+                for segment in json_codec.iter_dumps(data, "messages"):
+                    yield segment
+
+            return upload()
+        return json_codec.dumps(data)
+
+    @staticmethod
+    def _start_span(name: str, target_url: str, data: dict, body) -> tracing.Span:
+        """为一次上游请求创建 client span，父 span 为当前的阶段"""
+        span = tracing.start_span(name, kind="client")
+        if span.recording:
+            span.set_attributes({
+                "server.address": URL(target_url).host,
+                "url.full": target_url,
+                "gen_ai.request.model": data.get("model"),
+                # 流式上传的请求体没有预先确定的长度
+                "http.request.body.size": len(body) if isinstance(body, bytes) else None,
+            })
+        return span
 
     async def _make_request(
         self, headers: dict, data: dict, api_url: Optional[str] = None, timeout: Optional[aiohttp.ClientTimeout] = None
@@ -51,52 +177,201 @@ class BaseClient(ABC):
             bytes: 原始响应数据
 
         Raises:
+            UpstreamStatusError: 上游返回非 2xx 状态码
             aiohttp.ClientError: 客户端错误
             ServerTimeoutError: 服务器超时
             Exception: 其他异常
         """
         request_timeout = timeout or self.timeout
         target_url = api_url or self.api_url
+        body = self._encode_body(data)
+        span = self._start_span("upstream_request", target_url, data, body)
 
         try:
-            # 使用 connector 参数来优化连接池，禁用 SSL 验证
-            connector = aiohttp.TCPConnector(
-                limit=100, 
-                force_close=True,
-                ssl=False  # 禁用 SSL 验证
-            )
-            
-            async with aiohttp.ClientSession(connector=connector) as session:
-                async with session.post(
-                    target_url, headers=headers, json=data, timeout=request_timeout
-                ) as response:
-                    # 检查响应状态
-                    if not response.ok:
-                        error_text = await response.text()
-                        error_msg = f"API 请求失败: 状态码 {response.status}, 错误信息: {error_text}"
-                        logger.error(error_msg)
-                        raise ClientError(error_msg)
-
-                    # 流式读取响应内容
-                    async for chunk in response.content.iter_any():
-                        if chunk:  # 过滤空chunks
-                            yield chunk
+            session = self._get_session()
+            async with session.post(
+                target_url, headers=tracing.inject(self._deadline_headers(headers), span), data=body,
+                timeout=request_timeout,
+            ) as response:
+                span.set_attribute("http.response.status_code", response.status)
+                # 检查响应状态
+                if not response.ok:
+                    error_text = await response.text()
+                    error_msg = f"API 请求失败: 状态码 {response.status}, 错误信息: {error_text}"
+                    logger.error(error_msg)
+                    raise UpstreamStatusError(response.status, error_msg)
+
+                # 流式读取响应内容
+                async for chunk in response.content.iter_any():
+                    if chunk:  # 过滤空chunks
+                        span.add("http.response.body.size", len(chunk))
+                        yield chunk
 
         except ServerTimeoutError as e:
             error_msg = f"请求超时: {str(e)}"
             logger.error(error_msg)
+            span.record_error(e)
             raise
 
         except ClientError as e:
             error_msg = f"客户端错误: {str(e)}"
             logger.error(error_msg)
+            span.record_error(e)
             raise
 
         except Exception as e:
             error_msg = f"请求处理异常: {str(e)}"
             logger.error(error_msg)
+            span.record_error(e)
+            raise
+
+        except BaseException as e:
+            # 提前关闭或取消
+            span.record_error(e)
+            raise
+
+        finally:
+            span.end()
+
+    @timed("upstream_post")
+    async def _post_json(
+        self, headers: dict, data: dict, api_url: Optional[str] = None, timeout: Optional[aiohttp.ClientTimeout] = None
+    ) -> bytes:
+        """发送非流式请求并返回完整的响应体
+
+        Args:
+            headers: 请求头
+            data: 请求数据
+            api_url: 自定义API地址，如果为None则使用实例默认值
+            timeout: 当前请求的超时设置,None则使用实例默认值
+
+        Returns:
+            bytes: 响应体
+
+        Raises:
+            UpstreamStatusError: 上游返回非 2xx 状态码
+            aiohttp.ClientError: 客户端错误
+            ServerTimeoutError: 服务器超时
+        """
+        target_url = api_url or self.api_url
+        request_body = self._encode_body(data)
+        span = self._start_span("upstream_post", target_url, data, request_body)
+        try:
+            async with self._get_session().post(
+                target_url, headers=tracing.inject(self._deadline_headers(headers), span), data=request_body,
+                timeout=timeout or self.timeout,
+            ) as response:
+                body = await response.read()
+                span.set_attributes({
+                    "http.response.status_code": response.status,
+                    "http.response.body.size": len(body),
+                })
+                if not response.ok:
+                    error_msg = (
+                        f"API 请求失败: 状态码 {response.status}, "
+                        f"错误信息: {body.decode('utf-8', 'replace')}"
+                    )
+                    logger.error(error_msg)
+                    raise UpstreamStatusError(response.status, error_msg)
+                return body
+
+        except ServerTimeoutError as e:
+            logger.error(f"请求超时: {str(e)}")
+            span.record_error(e)
+            raise
+
+        except ClientError as e:
+            logger.error(f"客户端错误: {str(e)}")
+            span.record_error(e)
+            raise
+
+        except BaseException as e:
+            span.record_error(e)
             raise
 
+        finally:
+            span.end()
+
+    @timed("upstream_request")
+    async def _iter_sse_data(
+        self, headers: dict, data: dict, api_url: Optional[str] = None, timeout: Optional[aiohttp.ClientTimeout] = None
+    ) -> AsyncGenerator[bytes, None]:
+        """发送请求并按行解析 SSE 响应
+
+        网络分块并不保证与 SSE 行边界对齐，这里保留未完整的行直到下一个分块到达。
+
+        设置了 stream_timeouts 时，等待第一个事件超过 first_token、相邻事件的间隔超过 idle
+        （不含调用方处理事件的时间）时抛出 StreamStallError，并记录成功收到事件的耗时用于调整超时。
+
+        耗时记录为 upstream_request 阶段：收到 ``[DONE]`` 或响应正常结束时 outcome 为 ok，
+        只有调用方在流结束前关闭时才是 closed。
+
+        Args:
+            headers: 请求头
+            data: 请求数据
+            api_url: 自定义API地址，如果为None则使用实例默认值
+            timeout: 当前请求的超时设置,None则使用实例默认值
+
+        Yields:
+            bytes: 每个 ``data:`` 字段的原始内容，遇到 ``[DONE]`` 时结束
+
+        Raises:
+            StreamStallError: 上游流卡顿
+        """
+        adaptive = self.stream_timeouts
+        limits = adaptive.current() if adaptive is not None else None
+        if limits is not None and timeout is None:
+            timeout = request_timeout(limits, self.timeout)
+        phase, wait = ("first_token", limits.first_token) if limits is not None else (None, None)
+        loop = asyncio.get_running_loop()
+        # 开始等待下一个事件的时间
+        waiting_since = loop.time()
+
+        pending = b""
+        # 提前结束时立即关闭响应，把连接交还给连接池
+        async with aclosing(self._make_request(headers, data, api_url, timeout)) as chunks:
+            while True:
+                watchdog = asyncio.timeout_at(waiting_since + wait if wait is not None else None)
+                try:
+                    async with watchdog:
+                        chunk = await anext(chunks)
+                except StopAsyncIteration:
+                    break
+                except TimeoutError:
+                    if watchdog.expired():
+                        raise adaptive.stalled(phase, wait) from None
+                    raise
+
+                if pending:
+                    chunk = pending + chunk
+                lines = chunk.split(b"\n")
+                pending = lines.pop()
+                received = False
+                for line in lines:
+                    if not line.startswith(b"data:"):
+                        continue
+                    payload = line[5:].strip()
+                    if payload == b"[DONE]":
+                        return
+                    if payload:
+                        if adaptive is not None and not received:
+                            received = True
+                            waited = loop.time() - waiting_since
+                            if phase == "first_token":
+                                adaptive.observe_first_token(waited)
+                                phase, wait = "idle", limits.idle
+                            else:
+                                adaptive.observe_gap(waited)
+                        yield payload
+                if received:
+                    waiting_since = loop.time()
+
+        # 处理末尾没有换行符的最后一行
+        if pending.startswith(b"data:"):
+            payload = pending[5:].strip()
+            if payload and payload != b"[DONE]":
+                yield payload
+
     @abstractmethod
     async def stream_chat(
         self, messages: list, model: str
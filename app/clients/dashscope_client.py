@@ -0,0 +1,176 @@
+"""DashScope 原生协议客户端
+
+原生接口 ``/api/v1/services/aigc/text-generation/generation`` 的请求体为
+``{"model", "input": {"messages"}, "parameters"}``，响应为 ``output.choices[0].message``。
+
+流式请求总是开启 ``incremental_output``：不开启时每个事件都重复携带截至目前的全部文本，
+传输与解析的字节数随回答长度平方增长。每个事件附带累计用量与 request_id，
+流结束时以 ``("usage", DashScopeUsage)`` 输出最后一次报告的用量。
+"""
+
+from typing import Any, AsyncGenerator, AsyncIterator, Mapping, Optional, Tuple, Union
+
+import aiohttp
+from aiohttp.client_exceptions import ClientError
+
+from app.utils import json_codec
+from app.utils.logger import logger
+from .base_client import BaseClient
+from .registry import DASHSCOPE_NATIVE_API_URL, ProviderConfig, ProviderRegistry
+
+
+class DashScopeClient(BaseClient):
+    def __init__(
+        self,
+        api_key: str,
+        api_url: str = DASHSCOPE_NATIVE_API_URL,
+        registry: Optional[ProviderRegistry] = None,
+    ):
+        """初始化 DashScope 原生协议客户端
+
+        Args:
+            api_key: API Key
+            api_url: 原生接口地址
+            registry: 上游服务注册表，模型路由到原生协议的上游时使用对应的地址与认证
+        """
+        super().__init__(api_key, api_url)
+        self.registry = registry
+        self._headers = ProviderConfig("dashscope", api_url, api_key, request_format="dashscope").headers
+
+    def _target(self, model: str) -> Tuple[str, Mapping[str, str]]:
+        """模型对应的接口地址与请求头"""
+        if self.registry is not None:
+            route = self.registry.resolve(model)
+            if route.provider.request_format == "dashscope":
+                return route.provider.api_url, route.headers
+        return self.api_url, self._headers
+
+    @staticmethod
+    def _build_request_body(
+        messages: list,
+        model: str,
+        model_arg: Optional[tuple[float, float, float, float]],
+        stream: bool = True,
+    ) -> dict:
+        """构造原生协议的请求体，原生接口不支持 frequency_penalty，忽略该参数
+
+        model_arg 为 None 时不携带采样参数，由上游使用模型默认值（推理模型的请求即如此）。
+        """
+        parameters = {"result_format": "message"}
+        if model_arg is not None:
+            temperature, top_p, presence_penalty, _ = model_arg
+            parameters.update({
+                "temperature": float(temperature),
+                "top_p": float(top_p),
+                "presence_penalty": float(presence_penalty),
+                "enable_search": False,
+            })
+        if stream:
+            parameters["incremental_output"] = True
+        return {"model": model, "parameters": parameters, "input": {"messages": messages}}
+
+    def _encode_body(self, data: dict) -> Union[bytes, AsyncIterator[bytes]]:
+        """消息位于 input 中，超大请求体按 input.messages 分段编码"""
+        inner = data.get("input") or {}
+        if self.LARGE_PAYLOAD_CHARS and self._content_chars(inner) >= self.LARGE_PAYLOAD_CHARS:
+            async def upload() -> AsyncIterator[bytes]:
+                head = json_codec.dumps({name: value for name, value in data.items() if name != "input"})
+                yield head[:-1] + b',"input":'
+                for segment in json_codec.iter_dumps(inner, "messages"):
+                    yield segment
+                yield b"}"
+
+            return upload()
+        return json_codec.dumps(data)
+
+    async def stream_chat(
+        self,
+        messages: list,
+        model_arg: Optional[tuple[float, float, float, float]] = (0.7, 0.95, 0.0, 0.0),
+        model: str = "qwen-plus",
+    ) -> AsyncGenerator[tuple[str, Any], None]:
+        """流式对话
+
+        Args:
+            messages: 消息列表
+            model_arg: 模型参数 (temperature, top_p, presence_penalty, frequency_penalty)，None 时使用模型默认值
+            model: 模型名称
+
+        Yields:
+            tuple[str, Any]: (内容类型, 内容)
+                "reasoning" / "answer": 推理与回答的文本增量
+                "usage": 流结束时上游报告的用量 DashScopeUsage
+
+        Raises:
+            ClientError: 上游返回错误事件
+        """
+        api_url, headers = self._target(model)
+        request_body = self._build_request_body(messages, model, model_arg)
+        logger.debug("发送请求到 %s，请求体：%s", api_url, request_body)
+
+        usage = None
+        request_id = None
+        async for payload in self._iter_sse_data(headers, request_body, api_url):
+            try:
+                event = json_codec.decode_dashscope_event(payload)
+            except json_codec.DecodeError as e:
+                logger.error(f"JSON 解析错误: {e}")
+                logger.error(f"错误的JSON字符串: {payload[:200]!r}")
+                continue
+
+            if event.code:
+                raise ClientError(
+                    f"DashScope 返回错误: {event.code}, 错误信息: {event.message}, request_id: {event.request_id}"
+                )
+            request_id = event.request_id or request_id
+            usage = event.usage or usage
+            delta = event.delta
+            if delta is None:
+                continue
+            if delta.reasoning_content:
+                yield "reasoning", delta.reasoning_content
+            if delta.content:
+                logger.debug("生成内容：%s", delta.content)
+                yield "answer", delta.content
+
+        if usage is not None:
+            logger.info(
+                f"DashScope 请求 {request_id} 结束，输入 {usage.input_tokens} token，"
+                f"输出 {usage.output_tokens} token，缓存命中 {usage.cached_tokens} token"
+            )
+            yield "usage", usage
+        else:
+            logger.info(f"DashScope 请求 {request_id} 结束")
+
+    async def complete_chat(
+        self,
+        messages: list,
+        model_arg: tuple[float, float, float, float] = (0.7, 0.95, 0.0, 0.0),
+        model: str = "qwen-plus",
+        timeout: Optional[aiohttp.ClientTimeout] = None,
+    ) -> str:
+        """非流式对话，返回完整的回答
+
+        Args:
+            messages: 消息列表
+            model_arg: 模型参数 (temperature, top_p, presence_penalty, frequency_penalty)
+            model: 模型名称
+            timeout: 当前请求的超时设置,None则使用实例默认值
+
+        Returns:
+            str: 回答内容
+        """
+        api_url, stream_headers = self._target(model)
+        headers = {name: value for name, value in stream_headers.items() if name != "X-DashScope-SSE"}
+        headers["Accept"] = "application/json"
+        request_body = self._build_request_body(messages, model, model_arg, stream=False)
+        logger.debug("发送非流式请求到 %s，请求体：%s", api_url, request_body)
+
+        body = await self._post_json(headers, request_body, api_url, timeout)
+        try:
+            message = json_codec.decode_completion_message(body)
+        except json_codec.DecodeError as e:
+            logger.error(f"JSON 解析错误: {e}")
+            logger.error(f"错误的JSON字符串: {body[:200]!r}")
+            raise
+        return (message.content if message is not None else None) or ""
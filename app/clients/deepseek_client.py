@@ -1,11 +1,14 @@
 """DeepSeek API 客户端"""
 
-import json
-from typing import AsyncGenerator
+from typing import AsyncGenerator, Optional
 
+from app.utils import json_codec
 from app.utils.logger import logger
 
 from .base_client import BaseClient
+from .dashscope_client import DashScopeClient
+from .registry import ProviderRegistry
+from .think_parser import ThinkTagParser
 
 
 class DeepSeekClient(BaseClient):
@@ -13,37 +16,19 @@ class DeepSeekClient(BaseClient):
         self,
         api_key: str,
         api_url: str = "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions",
+        registry: Optional[ProviderRegistry] = None,
     ):
         """初始化 DeepSeek 客户端
 
         Args:
             api_key: DeepSeek API密钥
             api_url: DeepSeek API地址
+            registry: 上游服务注册表，模型路由到非默认上游（例如本地 vLLM）时使用对应的地址与认证，
+                路由到原生协议的上游时经 DashScope 原生接口请求
         """
         super().__init__(api_key, api_url)
-
-    def _process_think_tag_content(self, content: str) -> tuple[bool, str]:
-        """处理包含 think 标签的内容
-
-        Args:
-            content: 需要处理的内容字符串
-
-        Returns:
-            tuple[bool, str]:
-                bool: 是否检测到完整的 think 标签对
-                str: 处理后的内容
-        """
-        has_start = "<think>" in content
-        has_end = "</think>" in content
-
-        if has_start and has_end:
-            return True, content
-        elif has_start:
-            return False, content
-        elif not has_start and not has_end:
-            return False, content
-        else:
-            return True, content
+        self.registry = registry
+        self.native = DashScopeClient(api_key, registry=registry)
 
     async def stream_chat(
         self,
@@ -56,6 +41,8 @@ class DeepSeekClient(BaseClient):
         Args:
             messages: 消息列表
             model: 模型名称
+            is_origin_reasoning: 是否使用原生推理（reasoning_content 字段），
+                否则从 <think></think> 标签中提取推理内容
 
         Yields:
             tuple[str, str]: (内容类型, 内容)
@@ -67,90 +54,78 @@ class DeepSeekClient(BaseClient):
             "Content-Type": "application/json",
             "Accept": "text/event-stream",
         }
+        api_url = self.api_url
+        if self.registry is not None:
+            route = self.registry.resolve(model)
+            if route.provider.request_format == "dashscope":
+                async for item in self._stream_native(messages, model, is_origin_reasoning):
+                    yield item
+                return
+            if route.provider.name != self.registry.default_provider:
+                headers = route.headers
+                api_url = route.provider.api_url
         data = {
             "model": model,
             "messages": messages,
             "stream": True,
         }
 
-        logger.debug(f"开始流式对话：{data}")
-
-        accumulated_content = ""
-        is_collecting_think = False
+        logger.debug("开始流式对话：%s", data)
 
-        async for chunk in self._make_request(headers, data):
-            chunk_str = chunk.decode("utf-8")
+        think_parser = ThinkTagParser()
 
+        async for payload in self._iter_sse_data(headers, data, api_url):
             try:
-                lines = chunk_str.splitlines()
-                for line in lines:
-                    if line.startswith("data: "):
-                        json_str = line[len("data: ") :]
-                        if json_str == "[DONE]":
-                            return
-
-                        data = json.loads(json_str)
-                        if (
-                            data
-                            and data.get("choices")
-                            and data["choices"][0].get("delta")
-                        ):
-                            delta = data["choices"][0]["delta"]
-
-                            if is_origin_reasoning:
-                                # 处理 reasoning_content
-                                if delta.get("reasoning_content"):
-                                    content = delta["reasoning_content"]
-                                    logger.debug(f"提取推理内容：{content}")
-                                    yield "reasoning", content
-
-                                if delta.get("reasoning_content") is None and delta.get(
-                                    "content"
-                                ):
-                                    content = delta["content"]
-                                    logger.info(
-                                        f"提取内容信息，推理阶段结束: {content}"
-                                    )
-                                    yield "content", content
-                            else:
-                                # 处理其他模型的输出
-                                if delta.get("content"):
-                                    content = delta["content"]
-                                    if content == "":  # 只跳过完全空的字符串
-                                        continue
-                                    logger.debug(f"非原生推理内容：{content}")
-                                    accumulated_content += content
-
-                                    # 检查累积的内容是否包含完整的 think 标签对
-                                    is_complete, processed_content = (
-                                        self._process_think_tag_content(
-                                            accumulated_content
-                                        )
-                                    )
-
-                                    if "<think>" in content and not is_collecting_think:
-                                        # 开始收集推理内容
-                                        logger.debug(f"开始收集推理内容：{content}")
-                                        is_collecting_think = True
-                                        yield "reasoning", content
-                                    elif is_collecting_think:
-                                        if "</think>" in content:
-                                            # 推理内容结束
-                                            logger.debug(f"推理内容结束：{content}")
-                                            is_collecting_think = False
-                                            yield "reasoning", content
-                                            # 输出空的 content 来触发下一阶段处理
-                                            yield "content", ""
-                                            # 重置累积内容
-                                            accumulated_content = ""
-                                        else:
-                                            # 继续收集推理内容
-                                            yield "reasoning", content
-                                    else:
-                                        # 普通内容
-                                        yield "content", content
-
-            except json.JSONDecodeError as e:
+                delta = json_codec.decode_chat_delta(payload)
+                if delta is None:
+                    continue
+
+                if is_origin_reasoning:
+                    # 处理 reasoning_content
+                    if delta.reasoning_content:
+                        content = delta.reasoning_content
+                        logger.debug("提取推理内容：%s", content)
+                        yield "reasoning", content
+
+                    if delta.reasoning_content is None and delta.content:
+                        content = delta.content
+                        logger.info(f"提取内容信息，推理阶段结束: {content}")
+                        yield "content", content
+                else:
+                    # 处理其他模型的输出，推理内容位于 <think></think> 标签中
+                    if delta.content:
+                        logger.debug("非原生推理内容：%s", delta.content)
+                        for item in think_parser.feed(delta.content):
+                            yield item
+
+            except json_codec.DecodeError as e:
                 logger.error(f"JSON 解析错误: {e}")
             except Exception as e:
                 logger.error(f"处理 chunk 时发生错误: {e}")
+
+        if not is_origin_reasoning:
+            for item in think_parser.flush():
+                yield item
+
+    async def _stream_native(
+        self, messages: list, model: str, is_origin_reasoning: bool
+    ) -> AsyncGenerator[tuple[str, str], None]:
+        """经 DashScope 原生接口流式对话，输出与兼容模式相同的 ("reasoning" / "content", 文本)
+
+        原生接口的推理内容位于 message.reasoning_content，不携带采样参数；用量事件在此丢弃。
+        """
+        think_parser = ThinkTagParser()
+        async for content_type, content in self.native.stream_chat(messages, None, model):
+            if content_type == "reasoning":
+                logger.debug("提取推理内容：%s", content)
+                yield "reasoning", content
+            elif content_type == "answer":
+                if is_origin_reasoning:
+                    yield "content", content
+                else:
+                    for item in think_parser.feed(content):
+                        yield item
+
+        if not is_origin_reasoning:
+            for item in think_parser.flush():
+                yield item
@@ -1,35 +1,65 @@
-"""阿里百炼 Qwen API 客户端"""
+"""阿里百炼 Qwen API 客户端
 
-import json
-import os
-from typing import AsyncGenerator
-import time
+使用 OpenAI 兼容协议（DashScope 兼容模式、OpenRouter、vLLM 等）；
+路由到 DashScope 原生协议的模型交给 DashScopeClient 处理。
+"""
+
+from typing import Any, AsyncGenerator, Optional
+
+import aiohttp
+
+from app.config import Settings
+from app.utils import json_codec
 from app.utils.logger import logger
 from .base_client import BaseClient
+from .dashscope_client import DashScopeClient
+from .registry import ProviderRegistry
 
 class QwenClient(BaseClient):
     def __init__(
         self,
         api_key: str,
         api_url: str = "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions",
+        registry: Optional[ProviderRegistry] = None,
     ):
         """初始化阿里百炼 Qwen 客户端
 
         Args:
             api_key: API Key
             api_url: API地址
+            registry: 上游服务注册表，为空时只包含以 api_key/api_url 为默认上游的内置路由
         """
         super().__init__(api_key, api_url)
-        # 获取 OpenRouter 配置
-        self.openrouter_api_key = os.getenv("OPENROUTER_API_KEY")
-        self.openrouter_api_url = os.getenv("OPENROUTER_API_URL")
+        self.registry = registry or ProviderRegistry.from_settings(
+            Settings(dashscope_api_key=api_key, dashscope_api_url=api_url)
+        )
+        self.native = DashScopeClient(api_key, registry=self.registry)
+
+    @staticmethod
+    def _build_request_body(
+        messages: list,
+        model: str,
+        model_arg: tuple[float, float, float, float],
+        stream: bool = True,
+    ) -> dict:
+        """构造 OpenAI 兼容格式的请求体"""
+        temperature, top_p, presence_penalty, frequency_penalty = model_arg
+        return {
+            "model": model,
+            "messages": messages,
+            "stream": stream,
+            "temperature": float(temperature),
+            "top_p": float(top_p),
+            "presence_penalty": float(presence_penalty),
+            "frequency_penalty": float(frequency_penalty),
+        }
 
     async def stream_chat(
         self,
         messages: list,
         model_arg: tuple[float, float, float, float] = (0.7, 0.95, 0.0, 0.0),
         model: str = "qwen2.5-14b-instruct-1m",
-    ) -> AsyncGenerator[tuple[str, str], None]:
+    ) -> AsyncGenerator[tuple[str, Any], None]:
         """流式对话
 
         Args:
@@ -38,110 +68,83 @@ class QwenClient(BaseClient):
             model: 模型名称
 
         Yields:
-            tuple[str, str]: (内容类型, 内容)
-                内容类型: "answer"
+            tuple[str, Any]: (内容类型, 内容)
+                内容类型: "answer"；原生协议的上游还可能输出 "reasoning" 与 "usage"，见 DashScopeClient
                 内容: 实际的文本内容
         """
-        # 判断是否使用 OpenRouter API
-        is_openrouter = "openrouter.ai" in model or (
-            model.startswith("google/") or 
-            model.startswith("anthropic/") or 
-            model.startswith("meta/") or 
-            model.startswith("mistral/")
-        )
+        route = self.registry.resolve(model)
+        if route.provider.request_format == "dashscope":
+            async for item in self.native.stream_chat(messages, model_arg, model):
+                yield item
+            return
 
-        # 根据不同的 API 设置请求头和请求体
-        if is_openrouter:
-            headers = {
-                "Content-Type": "application/json",
-                "Accept": "text/event-stream",
-                "Authorization": f"Bearer {self.openrouter_api_key}",
-                "HTTP-Referer": "https://github.com/ErlichLiu/DeepClaude",
-                "X-Title": "DeepClaude"
-            }
-            api_url = self.openrouter_api_url
-        else:
-            headers = {
-                "Content-Type": "application/json",
-                "Accept": "text/event-stream",
-                "Authorization": f"Bearer {self.api_key}"
-            }
-            api_url = self.api_url
-
-        # 准备请求体
-        temperature, top_p, presence_penalty, frequency_penalty = model_arg
-        request_body = {
-            "model": model,
-            "messages": messages,
-            "stream": True,
-            "temperature": float(temperature),
-            "top_p": float(top_p),
-        }
+        headers = route.headers
+        api_url = route.provider.api_url
+        request_body = self._build_request_body(messages, model, model_arg)
 
-        # 对于 OpenRouter API，添加特定参数
-        if is_openrouter:
-            request_body.update({
-                "presence_penalty": float(presence_penalty),
-                "frequency_penalty": float(frequency_penalty)
-            })
-        else:
-            # DashScope API 特定参数
-            request_body.update({
-                "result_format": "message",
-                "parameters": {
-                    "temperature": float(temperature),
-                    "top_p": float(top_p),
-                    "top_k": 40,
-                    "repetition_penalty": 1.0,
-                    "enable_search": False
-                }
-            })
-
-        logger.debug(f"发送请求到 {api_url}，请求体：{request_body}")
+        logger.debug("发送请求到 %s，请求体：%s", api_url, request_body)
 
         # 发送请求并处理响应
-        async for chunk in self._make_request(headers, request_body, api_url):
-            chunk_str = chunk.decode("utf-8")
-            logger.debug(f"收到响应：{chunk_str}")
-
+        async for payload in self._iter_sse_data(headers, request_body, api_url):
             try:
-                lines = chunk_str.splitlines()
-                for line in lines:
-                    if line.startswith("data: "):
-                        json_str = line[len("data: "):]
-                        if json_str == "[DONE]":
-                            logger.info("收到结束标记")
-                            return
-
-                        data = json.loads(json_str)
-                        logger.debug(f"解析的JSON数据：{data}")
-                        
-                        if is_openrouter:
-                            # OpenRouter API 响应格式处理
-                            if data.get("choices") and data["choices"][0].get("delta"):
-                                delta = data["choices"][0]["delta"]
-                                if delta.get("content"):
-                                    content = delta["content"]
-                                    logger.debug(f"生成内容：{content}")
-                                    yield "answer", content
-                        else:
-                            # DashScope API 响应格式处理
-                            if data.get("output") and data["output"].get("choices"):
-                                choice = data["output"]["choices"][0]
-                                logger.debug(f"处理choice：{choice}")
-                                
-                                if choice.get("message"):
-                                    message = choice["message"]
-                                    logger.debug(f"处理message：{message}")
-                                    
-                                    if message.get("content"):
-                                        content = message["content"]
-                                        logger.debug(f"生成内容：{content}")
-                                        yield "answer", content
-
-            except json.JSONDecodeError as e:
+                delta = json_codec.decode_chat_delta(payload)
+                if delta is not None and delta.content:
+                    content = delta.content
+                    logger.debug("生成内容：%s", content)
+                    yield "answer", content
+
+            except json_codec.DecodeError as e:
                 logger.error(f"JSON 解析错误: {e}")
-                logger.error(f"错误的JSON字符串: {json_str}")
+                logger.error(f"错误的JSON字符串: {payload[:200]!r}")
             except Exception as e:
                 logger.error(f"处理响应时发生错误: {e}")
-                logger.exception(e) 
\ No newline at end of file
+                logger.exception(e)
+
+        logger.info("收到结束标记")
+
+    async def complete_chat(
+        self,
+        messages: list,
+        model_arg: tuple[float, float, float, float] = (0.7, 0.95, 0.0, 0.0),
+        model: str = "qwen2.5-14b-instruct-1m",
+        timeout: Optional[aiohttp.ClientTimeout] = None,
+    ) -> str:
+        """非流式对话，返回完整的回答
+
+        上游支持 stream=false 时一次取回完整响应，只解析一次 JSON；
+        否则退化为流式请求，用列表收集片段后一次拼接。
+
+        Args:
+            messages: 消息列表
+            model_arg: 模型参数 (temperature, top_p, presence_penalty, frequency_penalty)
+            model: 模型名称
+            timeout: 当前请求的超时设置,None则使用实例默认值
+
+        Returns:
+            str: 回答内容
+        """
+        route = self.registry.resolve(model)
+        api_url = route.provider.api_url
+
+        if not route.provider.supports_non_stream:
+            parts = []
+            async for content_type, content in self.stream_chat(messages, model_arg, model):
+                if content_type == "answer":
+                    parts.append(content)
+            return "".join(parts)
+        if route.provider.request_format == "dashscope":
+            return await self.native.complete_chat(messages, model_arg, model, timeout)
+
+        headers = dict(route.headers)
+        headers["Accept"] = "application/json"
+        request_body = self._build_request_body(messages, model, model_arg, stream=False)
+        logger.debug("发送非流式请求到 %s，请求体：%s", api_url, request_body)
+
+        body = await self._post_json(headers, request_body, api_url, timeout)
+        try:
+            message = json_codec.decode_completion_message(body)
+        except json_codec.DecodeError as e:
+            logger.error(f"JSON 解析错误: {e}")
+            logger.error(f"错误的JSON字符串: {body[:200]!r}")
+            raise
+        return (message.content if message is not None else None) or ""
@@ -0,0 +1,280 @@
+"""上游服务与模型路由注册表
+
+启动时加载一次，把模型名映射到对应的上游服务（地址、认证、请求格式）和提示词模板。
+同一个模型名的解析结果会被缓存，请求路径上只有一次字典查找。模型名由客户端决定，
+缓存按最近使用淘汰，最多保存 ``max_cached_routes`` 个模型名。
+
+路由规则按以下顺序匹配：
+1. 精确匹配的模型名
+2. 最长的前缀规则（例如 ``google/``）
+3. 包含规则（例如模型名中包含 ``qwen`` 时使用 qwen 提示词模板）
+4. 默认上游
+"""
+
+import json
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Dict, List, Mapping, Optional, Tuple
+
+from app.utils.logger import logger
+
+if TYPE_CHECKING:  # pragma: no cover
+    from app.config import Settings
+
+# 支持的请求格式
+# openai: OpenAI 兼容的 /chat/completions（DashScope 兼容模式、OpenRouter、vLLM、llama.cpp 等）
+# dashscope: DashScope 原生协议 /api/v1/services/aigc/text-generation/generation（增量输出）
+REQUEST_FORMATS = ("openai", "dashscope")
+
+DASHSCOPE_NATIVE_API_URL = "https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation"
+
+
+def _dashscope_format(api_url: str) -> str:
+    """根据 DashScope 地址判断协议：/chat/completions 为兼容模式，其余为原生协议"""
+    return "openai" if api_url.rstrip("/").endswith("/chat/completions") else "dashscope"
+
+
+@dataclass(frozen=True)
+class ProviderConfig:
+    """上游服务配置"""
+
+    name: str
+    api_url: str
+    api_key: Optional[str] = None
+    request_format: str = "openai"
+    extra_headers: Mapping[str, str] = field(default_factory=dict)
+    # 是否支持 stream=false 的非流式调用，不支持时非流式请求退化为流式拼接
+    supports_non_stream: bool = True
+    # 是否支持在消息内容中使用 cache_control 提示前缀缓存
+    supports_cache_control: bool = False
+    # 续写回答时在末尾 assistant 消息上设置为 true 的字段，例如 DashScope 的 partial，为空时不设置
+    assistant_prefix: Optional[str] = None
+
+    def __post_init__(self):
+        if self.request_format not in REQUEST_FORMATS:
+            raise ValueError(f"不支持的请求格式: {self.request_format}")
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        """流式请求使用的请求头，没有 API Key 时不发送 Authorization"""
+        headers = {
+            "Content-Type": "application/json",
+            "Accept": "text/event-stream",
+        }
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        if self.request_format == "dashscope":
+            # 原生协议需要显式开启 SSE
+            headers["X-DashScope-SSE"] = "enable"
+        headers.update(self.extra_headers)
+        return headers
+
+
+@dataclass(frozen=True)
+class ModelRoute:
+    """模型的解析结果"""
+
+    model: str
+    provider: ProviderConfig
+    headers: Mapping[str, str]
+    prompt_template: str = "default"
+
+
+@dataclass(frozen=True)
+class _Rule:
+    pattern: str
+    provider: Optional[str]
+    prompt_template: Optional[str]
+
+
+class ProviderRegistry:
+    """上游服务与模型路由注册表"""
+
+    def __init__(self, default_provider: ProviderConfig, max_cached_routes: int = 1024):
+        """初始化注册表
+
+        Args:
+            default_provider: 没有匹配到任何规则时使用的上游服务
+            max_cached_routes: 最多缓存的模型名数，超出时淘汰最久未使用的
+        """
+        self.providers: Dict[str, ProviderConfig] = {default_provider.name: default_provider}
+        self.default_provider = default_provider.name
+        self._exact: Dict[str, _Rule] = {}
+        self._prefixes: List[_Rule] = []
+        self._contains: List[_Rule] = []
+        self.max_cached_routes = max_cached_routes
+        # 模型名 -> 解析结果，按最近使用排序
+        self._cache: "OrderedDict[str, ModelRoute]" = OrderedDict()
+
+    def register_provider(self, provider: ProviderConfig) -> None:
+        """注册上游服务，同名服务会被覆盖"""
+        self.providers[provider.name] = provider
+        self._cache.clear()
+
+    def add_model(
+        self, model: str, provider: Optional[str] = None, prompt_template: Optional[str] = None
+    ) -> None:
+        """添加模型路由规则
+
+        Args:
+            model: 模型名；以 ``*`` 结尾时按前缀匹配，例如 ``google/*``
+            provider: 上游服务名称，为空时使用默认上游
+            prompt_template: 提示词模板名称，为空时继承其他规则或使用 default
+        """
+        if provider is not None and provider not in self.providers:
+            raise ValueError(f"未注册的上游服务: {provider}")
+        if model.endswith("*"):
+            self._prefixes.append(_Rule(model[:-1], provider, prompt_template))
+            self._prefixes.sort(key=lambda rule: len(rule.pattern), reverse=True)
+        else:
+            self._exact[model] = _Rule(model, provider, prompt_template)
+        self._cache.clear()
+
+    def add_keyword(self, keyword: str, prompt_template: str) -> None:
+        """模型名中包含 keyword（不区分大小写）时使用指定的提示词模板"""
+        self._contains.append(_Rule(keyword.lower(), None, prompt_template))
+        self._cache.clear()
+
+    def _match(self, model: str) -> Tuple[Optional[str], Optional[str]]:
+        provider = prompt_template = None
+        rules = []
+        if model in self._exact:
+            rules.append(self._exact[model])
+        rules.extend(rule for rule in self._prefixes if model.startswith(rule.pattern))
+        lowered = model.lower()
+        rules.extend(rule for rule in self._contains if rule.pattern in lowered)
+        # 先匹配到的规则优先，未设置的字段由后面的规则补全
+        for rule in rules:
+            provider = provider or rule.provider
+            prompt_template = prompt_template or rule.prompt_template
+        return provider, prompt_template
+
+    def resolve(self, model: str) -> ModelRoute:
+        """解析模型对应的上游服务与提示词模板
+
+        Args:
+            model: 模型名称
+
+        Returns:
+            ModelRoute: 解析结果
+        """
+        route = self._cache.get(model)
+        if route is not None:
+            self._cache.move_to_end(model)
+            return route
+        provider_name, prompt_template = self._match(model)
+        provider = self.providers[provider_name or self.default_provider]
+        route = ModelRoute(model, provider, provider.headers, prompt_template or "default")
+        self._cache[model] = route
+        if len(self._cache) > self.max_cached_routes:
+            self._cache.popitem(last=False)
+        return route
+
+    def load_file(self, path: str, api_keys: Optional[Mapping[str, str]] = None) -> None:
+        """从 JSON 文件加载额外的上游服务与模型路由
+
+        api_key_env 指定的环境变量由调用方读取后通过 api_keys 传入（见 Settings.provider_api_keys）。
+
+        文件格式::
+
+            {
+                "providers": {
+                    "vllm": {"api_url": "http://10.0.0.2:8000/v1/chat/completions",
+                             "api_key_env": "VLLM_API_KEY", "request_format": "openai",
+                             "supports_non_stream": true, "supports_cache_control": false,
+                             "assistant_prefix": null}
+                },
+                "models": {
+                    "qwen2.5-72b-instruct": {"provider": "vllm", "prompt_template": "qwen"},
+                    "llama/*": {"provider": "vllm", "prompt_template": "meta/"}
+                }
+            }
+        """
+        with open(path, encoding="utf-8") as f:
+            config = json.load(f)
+        for name, item in config.get("providers", {}).items():
+            api_key = item.get("api_key")
+            if api_key is None and item.get("api_key_env"):
+                api_key = (api_keys or {}).get(item["api_key_env"])
+            self.register_provider(ProviderConfig(
+                name=name,
+                api_url=item["api_url"],
+                api_key=api_key,
+                request_format=item.get("request_format", "openai"),
+                extra_headers=item.get("headers", {}),
+                supports_non_stream=item.get("supports_non_stream", True),
+                supports_cache_control=item.get("supports_cache_control", False),
+                assistant_prefix=item.get("assistant_prefix"),
+            ))
+        for model, item in config.get("models", {}).items():
+            self.add_model(model, item.get("provider"), item.get("prompt_template"))
+
+    @classmethod
+    def from_settings(cls, settings: "Settings") -> "ProviderRegistry":
+        """根据配置创建默认注册表
+
+        - DashScope（默认上游）：DASHSCOPE_API_KEY / DASHSCOPE_API_URL，地址以 /chat/completions
+          结尾时使用兼容模式，否则使用原生协议
+        - DashScope 原生协议：DASHSCOPE_NATIVE_API_URL，DASHSCOPE_NATIVE_MODELS 为逗号分隔的模型名，
+          以 * 结尾表示前缀，这些模型使用增量输出的原生协议
+        - OpenRouter：OPENROUTER_API_KEY / OPENROUTER_API_URL，google/ anthropic/ meta/ mistral/ 前缀的模型
+        - 本地 OpenAI 兼容服务（vLLM、llama.cpp 等）：LOCAL_OPENAI_API_URL / LOCAL_OPENAI_API_KEY，
+          LOCAL_OPENAI_MODELS 为逗号分隔的模型名，以 * 结尾表示前缀
+        - PROVIDERS_FILE：额外的 JSON 配置文件，见 load_file
+
+        Args:
+            settings: 服务配置，环境变量由 Settings.from_env 读取
+        """
+        dashscope_api_url = settings.dashscope_api_url
+        dashscope_api_key = settings.dashscope_api_key
+        request_format = _dashscope_format(dashscope_api_url)
+        registry = cls(ProviderConfig(
+            name="dashscope",
+            api_url=dashscope_api_url,
+            api_key=dashscope_api_key,
+            request_format=request_format,
+            supports_cache_control=request_format == "openai",
+            assistant_prefix="partial",
+        ))
+
+        if settings.dashscope_native_models:
+            registry.register_provider(ProviderConfig(
+                name="dashscope-native",
+                api_url=settings.dashscope_native_api_url or DASHSCOPE_NATIVE_API_URL,
+                api_key=dashscope_api_key,
+                request_format="dashscope",
+                assistant_prefix="partial",
+            ))
+            for model in settings.dashscope_native_models:
+                registry.add_model(model, "dashscope-native")
+
+        registry.register_provider(ProviderConfig(
+            name="openrouter",
+            api_url=settings.openrouter_api_url,
+            api_key=settings.openrouter_api_key,
+            request_format="openai",
+            extra_headers={
+                "HTTP-Referer": "https://github.com/ErlichLiu/DeepClaude",
+                "X-Title": "DeepClaude",
+            },
+            supports_cache_control=True,
+        ))
+        for prefix in ("google/", "anthropic/", "meta/", "mistral/"):
+            registry.add_model(prefix + "*", "openrouter", prefix)
+        registry.add_keyword("qwen", "qwen")
+
+        if settings.local_openai_api_url:
+            registry.register_provider(ProviderConfig(
+                name="local",
+                api_url=settings.local_openai_api_url,
+                api_key=settings.local_openai_api_key,
+                request_format="openai",
+            ))
+            for model in settings.local_openai_models:
+                registry.add_model(model, "local")
+
+        if settings.providers_file:
+            registry.load_file(settings.providers_file, dict(settings.provider_api_keys))
+
+        logger.info(f"已加载上游服务: {', '.join(registry.providers)}")
+        return registry
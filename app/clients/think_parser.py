@@ -0,0 +1,101 @@
+"""<think> 标签增量解析器
+
+非原生推理模型（例如基于 R1 蒸馏的 llama / qwen 密集模型）把推理过程放在
+``<think>...</think>`` 标签中，和回答一起通过 content 字段流式返回。标签可能被
+拆分在多个 delta 中（例如 ``</thi`` + ``nk>``），这里用一个只保留标签长度以内
+前瞻缓冲的状态机逐段解析，每个 delta 的处理代价只与 delta 本身的长度有关。
+"""
+
+from typing import List, Tuple
+
+
+class ThinkTagParser:
+    """把流式文本切分为推理内容和回答内容
+
+    状态：
+        waiting: 等待 <think>，之前的空白会被忽略；如果先出现了其他文本，
+            说明模型没有输出推理标签，直接进入回答阶段
+        reasoning: 位于 <think> 与 </think> 之间
+        answer: </think> 之后
+    """
+
+    START_TAG = "<think>"
+    END_TAG = "</think>"
+
+    def __init__(self):
+        self.state = "waiting"
+        self._pending = ""
+
+    @staticmethod
+    def _partial_tag_length(text: str, tag: str) -> int:
+        """返回 text 末尾可能是 tag 前缀的最大长度"""
+        for size in range(min(len(tag) - 1, len(text)), 0, -1):
+            if tag.startswith(text[-size:]):
+                return size
+        return 0
+
+    def feed(self, text: str) -> List[Tuple[str, str]]:
+        """解析一个 delta
+
+        Args:
+            text: 新收到的文本
+
+        Returns:
+            List[Tuple[str, str]]: (内容类型, 内容) 列表，内容类型为 "reasoning" 或 "content"；
+                推理结束时会先输出一个空的 content，用来通知下一阶段开始
+        """
+        buffer = self._pending + text if self._pending else text
+        self._pending = ""
+        if self.state == "answer":
+            return [("content", buffer)] if buffer else []
+
+        results: List[Tuple[str, str]] = []
+
+        while buffer:
+            if self.state == "answer":
+                results.append(("content", buffer))
+                break
+
+            tag = self.START_TAG if self.state == "waiting" else self.END_TAG
+            index = buffer.find(tag)
+            if index < 0:
+                keep = self._partial_tag_length(buffer, tag)
+                if keep:
+                    self._pending = buffer[-keep:]
+                    buffer = buffer[:-keep]
+                self._emit(results, buffer)
+                break
+
+            self._emit(results, buffer[:index])
+            if self.state == "answer":
+                # 标签之前已经出现了回答内容，标签本身也按回答处理
+                results.append(("content", buffer[index:]))
+                break
+            buffer = buffer[index + len(tag):]
+            if self.state == "waiting":
+                self.state = "reasoning"
+            elif self.state == "reasoning":
+                self.state = "answer"
+                results.append(("content", ""))
+
+        return results
+
+    def _emit(self, results: List[Tuple[str, str]], text: str) -> None:
+        if not text:
+            return
+        if self.state == "reasoning":
+            results.append(("reasoning", text))
+        elif self.state == "waiting":
+            if text.strip():
+                # 没有推理标签，全部作为回答内容
+                self.state = "answer"
+                results.append(("content", text))
+        else:
+            results.append(("content", text))
+
+    def flush(self) -> List[Tuple[str, str]]:
+        """流结束时输出前瞻缓冲中剩余的文本"""
+        pending, self._pending = self._pending, ""
+        results: List[Tuple[str, str]] = []
+        self._emit(results, pending)
+        return results
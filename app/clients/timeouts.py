@@ -0,0 +1,213 @@
+"""上游流的分阶段超时与卡顿检测
+
+固定的 ``sock_read=500`` 意味着卡住的上游要八分钟以上才会被发现。这里把一次流式请求的等待分为三段：
+
+- connect：建立连接
+- first_token：从发出请求到收到第一个 ``data:`` 事件
+- idle：相邻两个事件之间的间隔
+
+推理阶段与回答阶段各有一组超时。``AdaptiveTimeouts`` 记录成功请求的首个事件耗时与事件间隔，
+样本足够时超时取 ``multiplier`` 倍的分位数，并限制在 [下限, 配置值] 之间；样本不足时使用配置值。
+超过 first_token 或 idle 时抛出 ``StreamStallError``，它是 ``ServerTimeoutError`` 的子类，
+由回答阶段的续写、推理阶段使用已收到的推理内容等既有的错误处理接管。
+
+请求的截止时间保存在上下文变量中：网关收到 ``X-Request-Timeout`` 请求头（剩余秒数）时设置，
+发往上游的请求带上同名请求头告知剩余的时间，并据此限制整个请求的超时。
+"""
+
+import time
+from collections import deque
+from contextvars import ContextVar, Token
+from dataclasses import dataclass
+from typing import Deque, Optional
+
+import aiohttp
+from aiohttp.client_exceptions import ServerTimeoutError
+
+from app.monitoring.metrics import REGISTRY, MetricsRegistry
+
+# 请求与响应中表示剩余时间(秒)的请求头
+DEADLINE_HEADER = "X-Request-Timeout"
+
+_deadline: ContextVar[Optional[float]] = ContextVar("deepxy_deadline", default=None)
+
+
+def set_deadline(seconds: Optional[float]) -> Token:
+    """设置当前请求的剩余时间，None 表示不限制
+
+    Returns:
+        Token: 用于 reset_deadline 恢复
+    """
+    return _deadline.set(time.monotonic() + seconds if seconds is not None else None)
+
+
+def reset_deadline(token: Token) -> None:
+    """恢复设置之前的截止时间"""
+    _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """当前请求剩余的时间(秒)，没有截止时间时返回 None"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.monotonic())
+
+
+def parse_deadline_header(value: Optional[str]) -> Optional[float]:
+    """解析请求头中的剩余秒数，无效或不是正数时返回 None"""
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        return None
+    return seconds if seconds > 0 else None
+
+
+class StreamStallError(ServerTimeoutError):
+    """上游流在 first_token 或 idle 期限内没有输出"""
+
+    def __init__(self, stage: str, phase: str, seconds: float):
+        super().__init__(f"{stage} 阶段的上游流 {seconds:.1f}s 内没有输出（{phase}）")
+        self.stage = stage
+        self.phase = phase
+        self.seconds = seconds
+
+
+@dataclass(frozen=True)
+class StreamTimeouts:
+    """一次流式请求的各段超时(秒)"""
+
+    connect: float
+    first_token: float
+    idle: float
+
+
+def parse_timeouts(value: str, default: StreamTimeouts) -> StreamTimeouts:
+    """解析 ``connect=10,first_token=60,idle=30`` 格式的配置，未设置的项使用默认值
+
+    Raises:
+        ValueError: 配置格式无效
+    """
+    options = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, seconds = item.partition("=")
+        name = name.strip()
+        if name not in ("connect", "first_token", "idle"):
+            raise ValueError(f"无效的超时配置: {item}")
+        try:
+            options[name] = float(seconds)
+        except ValueError:
+            raise ValueError(f"无效的超时配置: {item}") from None
+        if options[name] <= 0:
+            raise ValueError(f"无效的超时配置: {item}")
+    return StreamTimeouts(
+        connect=options.get("connect", default.connect),
+        first_token=options.get("first_token", default.first_token),
+        idle=options.get("idle", default.idle),
+    )
+
+
+REASONING_TIMEOUTS = StreamTimeouts(connect=10.0, first_token=120.0, idle=60.0)
+ANSWER_TIMEOUTS = StreamTimeouts(connect=10.0, first_token=60.0, idle=30.0)
+
+
+def _quantile(samples: Deque[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class AdaptiveTimeouts:
+    """按观测到的延迟分布调整一个阶段的超时"""
+
+    def __init__(
+        self,
+        stage: str,
+        limits: StreamTimeouts,
+        floor: StreamTimeouts = StreamTimeouts(connect=1.0, first_token=5.0, idle=5.0),
+        multiplier: float = 4.0,
+        quantile: float = 0.99,
+        min_samples: int = 50,
+        max_samples: int = 2048,
+        refresh_interval: float = 10.0,
+        clock=time.monotonic,
+        registry: MetricsRegistry = REGISTRY,
+    ):
+        """初始化
+
+        Args:
+            stage: 阶段名称，reasoning 或 answer
+            limits: 配置的超时，也是调整后的上限
+            floor: 调整后的下限
+            multiplier: 超时为分位数的多少倍
+            quantile: 使用的分位数
+            min_samples: 至少有这么多样本才调整
+            max_samples: 每种样本最多保留的数量
+            refresh_interval: 重新计算的最小间隔(秒)
+            clock: 时钟，便于测试
+            registry: 指标注册表
+        """
+        self.stage = stage
+        self.limits = limits
+        self.floor = floor
+        self.multiplier = multiplier
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.refresh_interval = refresh_interval
+        self.clock = clock
+        self._first_token: Deque[float] = deque(maxlen=max_samples)
+        self._gaps: Deque[float] = deque(maxlen=max_samples)
+        self._current = limits
+        self._refreshed_at = clock()
+        self._stalls = registry.counter(
+            "deepxy_upstream_stalls_total", "上游流超过 first_token / idle 期限没有输出的次数", ("stage", "phase")
+        )
+        self._gauge = registry.gauge(
+            "deepxy_stream_timeout_seconds", "当前使用的上游流超时(秒)", ("stage", "phase")
+        )
+        self._export()
+
+    def _export(self) -> None:
+        for phase in ("connect", "first_token", "idle"):
+            self._gauge.set(getattr(self._current, phase), stage=self.stage, phase=phase)
+
+    def _adapt(self, samples: Deque[float], floor: float, limit: float) -> float:
+        if len(samples) < self.min_samples:
+            return limit
+        return min(limit, max(floor, self.multiplier * _quantile(samples, self.quantile)))
+
+    def current(self) -> StreamTimeouts:
+        """当前的超时，按间隔根据样本重新计算"""
+        now = self.clock()
+        if now - self._refreshed_at >= self.refresh_interval:
+            self._refreshed_at = now
+            self._current = StreamTimeouts(
+                connect=self.limits.connect,
+                first_token=self._adapt(self._first_token, self.floor.first_token, self.limits.first_token),
+                idle=self._adapt(self._gaps, self.floor.idle, self.limits.idle),
+            )
+            self._export()
+        return self._current
+
+    def observe_first_token(self, seconds: float) -> None:
+        self._first_token.append(seconds)
+
+    def observe_gap(self, seconds: float) -> None:
+        self._gaps.append(seconds)
+
+    def stalled(self, phase: str, seconds: float) -> StreamStallError:
+        """记录一次卡顿并返回对应的异常"""
+        self._stalls.inc(stage=self.stage, phase=phase)
+        return StreamStallError(self.stage, phase, seconds)
+
+
+def request_timeout(timeouts: StreamTimeouts, default: aiohttp.ClientTimeout) -> aiohttp.ClientTimeout:
+    """一次流式请求的 aiohttp 超时：连接用阶段的 connect，读取由卡顿检测负责，
+    总时长不超过请求剩余的时间"""
+    left = remaining()
+    if left is not None:
+        # aiohttp 把 0 当作不限制，已经到期的请求也要保留一个很小的正数
+        left = max(left, 0.001)
+    total = default.total if left is None else (min(left, default.total) if default.total else left)
+    return aiohttp.ClientTimeout(total=total, connect=timeouts.connect, sock_read=None)
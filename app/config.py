@@ -0,0 +1,234 @@
+"""服务配置
+
+启动时只读取一次 .env 与环境变量，得到不可变的 Settings 对象，
+其他模块通过 get_settings() 获取，不在导入时读取环境变量或产生日志。
+"""
+
+import json
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Mapping, Optional, Tuple
+
+
+def _bool(value: Optional[str], default: bool) -> bool:
+    if value is None or value == "":
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _list(value: Optional[str]) -> Tuple[str, ...]:
+    return tuple(item.strip() for item in (value or "").split(",") if item.strip())
+
+
+def _provider_api_keys(env: Mapping[str, str], providers_file: Optional[str]) -> Tuple[Tuple[str, str], ...]:
+    """读取 PROVIDERS_FILE 中各上游 api_key_env 指定的环境变量
+
+    Returns:
+        Tuple[Tuple[str, str], ...]: 已设置的 (环境变量名, 值)
+    """
+    if not providers_file:
+        return ()
+    with open(providers_file, encoding="utf-8") as f:
+        providers = json.load(f).get("providers", {})
+    names = sorted({item["api_key_env"] for item in providers.values() if item.get("api_key_env")})
+    return tuple((name, env[name]) for name in names if env.get(name))
+
+
+@dataclass(frozen=True)
+class Settings:
+    """服务配置"""
+
+    dashscope_api_key: Optional[str] = None
+    dashscope_api_url: str = "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions"
+    dashscope_native_api_url: Optional[str] = None
+    dashscope_native_models: Tuple[str, ...] = ()
+    openrouter_api_key: Optional[str] = None
+    openrouter_api_url: str = "https://openrouter.ai/api/v1/chat/completions"
+    local_openai_api_url: Optional[str] = None
+    local_openai_api_key: Optional[str] = None
+    local_openai_models: Tuple[str, ...] = ()
+    providers_file: Optional[str] = None
+    provider_api_keys: Tuple[Tuple[str, str], ...] = ()
+    json_backend: Optional[str] = None
+    allow_api_key: Optional[str] = None
+    allow_origins: Tuple[str, ...] = ("*",)
+    deepseek_model: str = "deepseek-r1"
+    qwen_model: str = "qwen2.5-14b-instruct-1m"
+    is_origin_reasoning: bool = True
+    prompt_cache_hints: bool = False
+    non_stream_timeout: float = 300.0
+    warmup_connections: int = 2
+    warmup_timeout: float = 10.0
+    drain_grace_period: float = 120.0
+    admission_max_in_flight: int = 256
+    admission_queue_size: int = 128
+    admission_queue_timeout: float = 10.0
+    admission_max_loop_lag: float = 0.2
+    admission_max_rss_mb: int = 0
+    priority_api_keys: str = ""
+    admin_api_key: Optional[str] = None
+    api_keys_file: Optional[str] = None
+    api_keys_reload_interval: float = 5.0
+    usage_ledger_path: Optional[str] = None
+    usage_ledger_flush_interval: float = 1.0
+    max_body_bytes: int = 4 * 1024 * 1024
+    max_messages: int = 256
+    max_message_chars: int = 200_000
+    slow_callback_threshold: float = 0.1
+    stream_resume_ttl: float = 300.0
+    stream_buffer_max_bytes: int = 1024 * 1024
+    stream_detach_timeout: float = 60.0
+    stream_spill_dir: Optional[str] = None
+    conversation_ttl: float = 3600.0
+    conversation_max_turns: int = 10000
+    large_payload_chars: int = 1024 * 1024
+    slo_p95: str = ""
+    degrade_levels: str = (
+        "reasoning=2000; reasoning=1000,model=qwen2.5-7b-instruct; "
+        "reasoning=1000,model=qwen2.5-7b-instruct,skip=low"
+    )
+    degrade_max_queue: int = 32
+    degrade_window: float = 60.0
+    degrade_recover_after: float = 60.0
+    reasoning_bypass: bool = False
+    reasoning_bypass_model: Optional[str] = None
+    reasoning_bypass_threshold: float = 0.8
+    answer_continuation_attempts: int = 2
+    answer_fallback_models: Tuple[str, ...] = ()
+    reasoning_timeouts: str = ""
+    answer_timeouts: str = ""
+    capture_dir: Optional[str] = None
+    capture_sample_rate: float = 0.01
+    capture_segment_mb: int = 64
+    capture_max_segments: int = 20
+    capture_redact_pii: bool = True
+    capture_redactors: Tuple[str, ...] = ()
+    tracing_exporter: str = ""
+    tracing_endpoint: str = "http://127.0.0.1:4318/v1/traces"
+    tracing_file: Optional[str] = None
+    tracing_sample_rate: float = 0.01
+    tracing_service_name: str = "deepxy"
+
+    @classmethod
+    def from_env(cls, environ: Optional[Mapping[str, str]] = None) -> "Settings":
+        """从环境变量创建配置
+
+        Args:
+            environ: 环境变量，为空时使用 os.environ
+
+        Returns:
+            Settings: 配置对象
+        """
+        env = os.environ if environ is None else environ
+        defaults = cls()
+        allow_origins = env.get("ALLOW_ORIGINS", "*")
+        return cls(
+            dashscope_api_key=env.get("DASHSCOPE_API_KEY") or None,
+            dashscope_api_url=env.get("DASHSCOPE_API_URL") or defaults.dashscope_api_url,
+            dashscope_native_api_url=env.get("DASHSCOPE_NATIVE_API_URL") or None,
+            dashscope_native_models=_list(env.get("DASHSCOPE_NATIVE_MODELS")),
+            openrouter_api_key=env.get("OPENROUTER_API_KEY") or None,
+            openrouter_api_url=env.get("OPENROUTER_API_URL") or defaults.openrouter_api_url,
+            local_openai_api_url=env.get("LOCAL_OPENAI_API_URL") or None,
+            local_openai_api_key=env.get("LOCAL_OPENAI_API_KEY") or None,
+            local_openai_models=_list(env.get("LOCAL_OPENAI_MODELS")),
+            providers_file=env.get("PROVIDERS_FILE") or None,
+            provider_api_keys=_provider_api_keys(env, env.get("PROVIDERS_FILE")),
+            json_backend=(env.get("JSON_BACKEND") or "").strip().lower() or None,
+            allow_api_key=env.get("ALLOW_API_KEY") or None,
+            allow_origins=tuple(allow_origins.split(",")) if allow_origins else (),
+            deepseek_model=env.get("DEEPSEEK_MODEL", defaults.deepseek_model),
+            qwen_model=env.get("QWEN_MODEL", defaults.qwen_model),
+            is_origin_reasoning=_bool(env.get("IS_ORIGIN_REASONING"), defaults.is_origin_reasoning),
+            prompt_cache_hints=_bool(env.get("PROMPT_CACHE_HINTS"), defaults.prompt_cache_hints),
+            non_stream_timeout=float(env.get("NON_STREAM_TIMEOUT") or defaults.non_stream_timeout),
+            warmup_connections=int(env.get("WARMUP_CONNECTIONS") or defaults.warmup_connections),
+            warmup_timeout=float(env.get("WARMUP_TIMEOUT") or defaults.warmup_timeout),
+            drain_grace_period=float(env.get("DRAIN_GRACE_PERIOD") or defaults.drain_grace_period),
+            admission_max_in_flight=int(
+                env.get("ADMISSION_MAX_IN_FLIGHT") or defaults.admission_max_in_flight
+            ),
+            admission_queue_size=int(env.get("ADMISSION_QUEUE_SIZE") or defaults.admission_queue_size),
+            admission_queue_timeout=float(
+                env.get("ADMISSION_QUEUE_TIMEOUT") or defaults.admission_queue_timeout
+            ),
+            admission_max_loop_lag=float(
+                env.get("ADMISSION_MAX_LOOP_LAG_MS") or defaults.admission_max_loop_lag * 1000
+            ) / 1000,
+            admission_max_rss_mb=int(env.get("ADMISSION_MAX_RSS_MB") or defaults.admission_max_rss_mb),
+            priority_api_keys=env.get("PRIORITY_API_KEYS", defaults.priority_api_keys),
+            admin_api_key=env.get("ADMIN_API_KEY") or None,
+            api_keys_file=env.get("API_KEYS_FILE") or None,
+            api_keys_reload_interval=float(
+                env.get("API_KEYS_RELOAD_INTERVAL") or defaults.api_keys_reload_interval
+            ),
+            usage_ledger_path=env.get("USAGE_LEDGER_PATH") or None,
+            usage_ledger_flush_interval=float(
+                env.get("USAGE_LEDGER_FLUSH_INTERVAL") or defaults.usage_ledger_flush_interval
+            ),
+            max_body_bytes=int(env.get("MAX_BODY_BYTES") or defaults.max_body_bytes),
+            max_messages=int(env.get("MAX_MESSAGES") or defaults.max_messages),
+            max_message_chars=int(env.get("MAX_MESSAGE_CHARS") or defaults.max_message_chars),
+            slow_callback_threshold=float(
+                env.get("SLOW_CALLBACK_MS") or defaults.slow_callback_threshold * 1000
+            ) / 1000,
+            stream_resume_ttl=float(env.get("STREAM_RESUME_TTL") or defaults.stream_resume_ttl),
+            stream_buffer_max_bytes=int(
+                env.get("STREAM_BUFFER_MAX_BYTES") or defaults.stream_buffer_max_bytes
+            ),
+            stream_detach_timeout=float(
+                env.get("STREAM_DETACH_TIMEOUT") or defaults.stream_detach_timeout
+            ),
+            stream_spill_dir=env.get("STREAM_SPILL_DIR") or None,
+            conversation_ttl=float(env.get("CONVERSATION_TTL") or defaults.conversation_ttl),
+            conversation_max_turns=int(
+                env.get("CONVERSATION_MAX_TURNS") or defaults.conversation_max_turns
+            ),
+            large_payload_chars=int(env.get("LARGE_PAYLOAD_CHARS") or defaults.large_payload_chars),
+            slo_p95=env.get("SLO_P95") or defaults.slo_p95,
+            degrade_levels=env.get("DEGRADE_LEVELS") or defaults.degrade_levels,
+            degrade_max_queue=int(env.get("DEGRADE_MAX_QUEUE") or defaults.degrade_max_queue),
+            degrade_window=float(env.get("DEGRADE_WINDOW") or defaults.degrade_window),
+            degrade_recover_after=float(
+                env.get("DEGRADE_RECOVER_AFTER") or defaults.degrade_recover_after
+            ),
+            reasoning_bypass=_bool(env.get("REASONING_BYPASS"), defaults.reasoning_bypass),
+            reasoning_bypass_model=env.get("REASONING_BYPASS_MODEL") or None,
+            reasoning_bypass_threshold=float(
+                env.get("REASONING_BYPASS_THRESHOLD") or defaults.reasoning_bypass_threshold
+            ),
+            answer_continuation_attempts=int(
+                env.get("ANSWER_CONTINUATION_ATTEMPTS") or defaults.answer_continuation_attempts
+            ),
+            answer_fallback_models=tuple(
+                model.strip() for model in env.get("ANSWER_FALLBACK_MODELS", "").split(",") if model.strip()
+            ),
+            reasoning_timeouts=env.get("REASONING_TIMEOUTS") or defaults.reasoning_timeouts,
+            answer_timeouts=env.get("ANSWER_TIMEOUTS") or defaults.answer_timeouts,
+            capture_dir=env.get("CAPTURE_DIR") or None,
+            capture_sample_rate=float(env.get("CAPTURE_SAMPLE_RATE") or defaults.capture_sample_rate),
+            capture_segment_mb=int(env.get("CAPTURE_SEGMENT_MB") or defaults.capture_segment_mb),
+            capture_max_segments=int(env.get("CAPTURE_MAX_SEGMENTS") or defaults.capture_max_segments),
+            capture_redact_pii=_bool(env.get("CAPTURE_REDACT_PII"), defaults.capture_redact_pii),
+            capture_redactors=tuple(
+                path.strip() for path in env.get("CAPTURE_REDACTORS", "").split(",") if path.strip()
+            ),
+            tracing_exporter=(env.get("TRACING_EXPORTER") or defaults.tracing_exporter).strip().lower(),
+            tracing_endpoint=env.get("TRACING_ENDPOINT") or defaults.tracing_endpoint,
+            tracing_file=env.get("TRACING_FILE") or None,
+            tracing_sample_rate=float(env.get("TRACING_SAMPLE_RATE") or defaults.tracing_sample_rate),
+            tracing_service_name=env.get("TRACING_SERVICE_NAME") or defaults.tracing_service_name,
+        )
+
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """加载 .env 并返回进程内唯一的配置对象
+
+    已存在的环境变量优先于 .env 中的值。
+    """
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    return Settings.from_env()
@@ -0,0 +1,395 @@
+"""简单问题跳过推理阶段
+
+问候、自我介绍之类的简单问题不需要 R1 的推理，推理阶段只会让回答晚几十秒出现。
+``ReasoningBypass`` 在请求开始前用本地的分类器判断最后一条用户消息是否简单，
+简单时跳过推理阶段，原始消息直接交给回答模型。
+
+分类器是可替换的，按顺序询问，第一个给出明确结论的分类器决定结果：
+
+- ``HeuristicClassifier``：规则判断，问候语等简短消息跳过推理，含代码、公式或
+  "为什么""证明"之类关键词的消息需要推理，其余不下结论
+- ``NgramClassifier``：字符 n-gram 哈希特征的逻辑回归模型，离线训练后以 JSON 保存::
+
+      python -m app.deepxy.bypass train samples.jsonl -o bypass.json
+
+  样本每行为 ``{"text": "...", "bypass": true}``
+
+都不下结论时执行推理。请求可以用 ``"reasoning": "always" / "never"`` 覆盖判断结果。
+"""
+
+import argparse
+import json
+import math
+import random
+import re
+import time
+import zlib
+from typing import Dict, Iterable, List, Optional, Protocol, Sequence, Tuple
+
+from app.monitoring import timing
+from app.monitoring.metrics import REGISTRY, MetricsRegistry
+from app.utils.logger import logger
+
+def last_user_text(messages: Sequence[dict]) -> Optional[str]:
+    """最后一条消息为用户消息时返回其文本，否则返回 None"""
+    if not messages or messages[-1].get("role") != "user":
+        return None
+    content = messages[-1].get("content")
+    if isinstance(content, list):
+        if any(part.get("type") != "text" for part in content):
+            # 图片等非文本内容交给推理阶段
+            return None
+        content = "".join(part.get("text") or "" for part in content)
+    return content or None
+
+
+class PromptClassifier(Protocol):
+    """判断消息是否可以跳过推理阶段"""
+
+    name: str
+
+    def classify(self, text: str) -> Optional[bool]:
+        """True 表示跳过推理，False 表示需要推理，None 表示不下结论"""
+
+
+class HeuristicClassifier:
+    """按长度、问候语与关键词判断"""
+
+    name = "heuristic"
+
+    # 整条消息只由问候、自我介绍类的问题与标点、语气词组成
+    _FILLER = r"[\W_呀啊呢吧吗哦哈嘛]*"
+    _GREETING = (
+        r"(你好|您好|嗨|哈喽|在吗|早上好|中午好|下午好|晚上好|早安|晚安|谢谢|多谢|感谢|再见|拜拜|好的|收到|"
+        r"hi|hello|hey|thanks|thank you|good (morning|afternoon|evening|night)|bye|ok|okay)( there)?"
+    )
+    _IDENTITY = (
+        r"(请?(简单|简要)?地?(介绍一下?|做个?介绍)你自己|做个?自我介绍|自我介绍一下|你是谁|你叫什么(名字)?|你能做什么|"
+        r"who are you|introduce yourself|what can you do)"
+    )
+    TRIVIAL = re.compile(
+        rf"^{_FILLER}(?:{_GREETING}{_FILLER})*(?:{_IDENTITY}{_FILLER})?$", re.IGNORECASE
+    )
+    COMPLEX = re.compile(
+        r"```|\$\$|\\\(|\d\s*[-+*/^=]\s*\d|"
+        r"为什么|为何|证明|推导|计算|求解|分析|比较|对比|步骤|原理|算法|代码|程序|实现|优化|设计|翻译|总结|"
+        r"\b(why|prove|derive|calculate|compute|solve|analy[sz]e|compare|step|algorithm|code|implement|"
+        r"optimi[sz]e|design|translate|summari[sz]e)\b",
+        re.IGNORECASE,
+    )
+
+    def __init__(self, max_chars: int = 40):
+        """初始化
+
+        Args:
+            max_chars: 超过该长度的消息不会判定为简单
+        """
+        self.max_chars = max_chars
+
+    def classify(self, text: str) -> Optional[bool]:
+        text = text.strip()
+        if self.COMPLEX.search(text):
+            return False
+        if len(text) <= self.max_chars and self.TRIVIAL.match(text):
+            return True
+        return None
+
+
+def _features(text: str, ngram: Tuple[int, int], buckets: int) -> Dict[int, float]:
+    """字符 n-gram 哈希到固定数量的桶，值为出现次数的 log 缩放"""
+    text = re.sub(r"\s+", " ", text.strip().lower())
+    counts: Dict[int, float] = {}
+    for n in range(ngram[0], ngram[1] + 1):
+        for i in range(len(text) - n + 1):
+            index = zlib.crc32(text[i:i + n].encode()) % buckets
+            counts[index] = counts.get(index, 0.0) + 1.0
+    return {index: 1.0 + math.log(count) for index, count in counts.items()}
+
+
+def _sigmoid(value: float) -> float:
+    if value < -30:
+        return 0.0
+    return 1.0 / (1.0 + math.exp(-value))
+
+
+class NgramClassifier:
+    """字符 n-gram 逻辑回归"""
+
+    name = "model"
+
+    def __init__(
+        self,
+        weights: Dict[int, float],
+        bias: float = 0.0,
+        buckets: int = 1 << 16,
+        ngram: Tuple[int, int] = (1, 3),
+        threshold: float = 0.8,
+        max_chars: int = 200,
+    ):
+        """初始化
+
+        Args:
+            weights: 桶下标到权重的稀疏映射
+            bias: 偏置
+            buckets: 哈希桶数量，必须与训练时一致
+            ngram: n-gram 的最小与最大长度，必须与训练时一致
+            threshold: 跳过推理的概率阈值，低于 1 - threshold 时判定需要推理
+            max_chars: 超过该长度的消息不下结论
+        """
+        self.weights = weights
+        self.bias = bias
+        self.buckets = buckets
+        self.ngram = ngram
+        self.threshold = threshold
+        self.max_chars = max_chars
+
+    def probability(self, text: str) -> float:
+        """可以跳过推理的概率"""
+        features = _features(text, self.ngram, self.buckets)
+        return _sigmoid(self.bias + sum(self.weights.get(i, 0.0) * v for i, v in features.items()))
+
+    def classify(self, text: str) -> Optional[bool]:
+        if len(text) > self.max_chars:
+            return None
+        probability = self.probability(text)
+        if probability >= self.threshold:
+            return True
+        if probability <= 1 - self.threshold:
+            return False
+        return None
+
+    @classmethod
+    def train(
+        cls,
+        samples: Sequence[Tuple[str, bool]],
+        buckets: int = 1 << 16,
+        ngram: Tuple[int, int] = (1, 3),
+        epochs: int = 20,
+        learning_rate: float = 0.1,
+        l2: float = 1e-4,
+        seed: int = 0,
+        **kwargs,
+    ) -> "NgramClassifier":
+        """用随机梯度下降训练
+
+        Args:
+            samples: (文本, 是否跳过推理) 列表
+            buckets: 哈希桶数量
+            ngram: n-gram 的最小与最大长度
+            epochs: 训练轮数
+            learning_rate: 学习率
+            l2: L2 正则系数
+            seed: 打乱样本的随机种子
+            **kwargs: 传给构造函数的其他参数
+
+        Returns:
+            NgramClassifier: 训练好的分类器
+        """
+        data = [(_features(text, ngram, buckets), 1.0 if label else 0.0) for text, label in samples]
+        weights: Dict[int, float] = {}
+        bias = 0.0
+        rng = random.Random(seed)
+        for _ in range(epochs):
+            rng.shuffle(data)
+            for features, label in data:
+                score = bias + sum(weights.get(i, 0.0) * v for i, v in features.items())
+                gradient = _sigmoid(score) - label
+                bias -= learning_rate * gradient
+                for i, v in features.items():
+                    weight = weights.get(i, 0.0)
+                    weights[i] = weight - learning_rate * (gradient * v + l2 * weight)
+        weights = {i: round(w, 6) for i, w in weights.items() if abs(w) >= 1e-6}
+        return cls(weights, bias, buckets, ngram, **kwargs)
+
+    def to_dict(self) -> dict:
+        return {
+            "buckets": self.buckets,
+            "ngram": list(self.ngram),
+            "bias": self.bias,
+            "weights": {str(i): w for i, w in sorted(self.weights.items())},
+        }
+
+    def save(self, path: str) -> None:
+        """保存为 JSON"""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, path: str, threshold: float = 0.8) -> "NgramClassifier":
+        """从 JSON 加载
+
+        Raises:
+            OSError: 文件无法读取
+            ValueError: 文件格式无效
+        """
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        try:
+            weights = {int(i): float(w) for i, w in data["weights"].items()}
+            ngram = tuple(int(n) for n in data["ngram"])
+            return cls(weights, float(data["bias"]), int(data["buckets"]), ngram, threshold)
+        except (KeyError, TypeError, AttributeError) as e:
+            raise ValueError(f"无效的分类模型文件 {path}: {e}") from None
+
+
+class ReasoningBypass:
+    """决定请求是否跳过推理阶段，并统计跳过的次数与节省的时间"""
+
+    def __init__(
+        self,
+        classifiers: Sequence[PromptClassifier],
+        default_reasoning_seconds: float = 20.0,
+        smoothing: float = 0.1,
+        registry: MetricsRegistry = REGISTRY,
+    ):
+        """初始化
+
+        Args:
+            classifiers: 按顺序询问的分类器
+            default_reasoning_seconds: 还没有观测到推理耗时时，估计每次跳过节省的时间(秒)
+            smoothing: 推理阶段耗时的指数移动平均系数
+            registry: 指标注册表
+        """
+        self.classifiers = list(classifiers)
+        self.reasoning_seconds = default_reasoning_seconds
+        self.smoothing = smoothing
+        self._decisions = registry.counter(
+            "deepxy_reasoning_bypass_decisions_total",
+            "是否跳过推理阶段的判断次数",
+            ("decision", "source"),
+        )
+        self._saved = registry.counter(
+            "deepxy_reasoning_bypass_saved_seconds_total",
+            "跳过推理阶段估计节省的时间(秒)，按推理阶段耗时的移动平均估计",
+        )
+        registry.gauge(
+            "deepxy_reasoning_stage_estimate_seconds", "推理阶段耗时的移动平均(秒)"
+        ).set_function(lambda: self.reasoning_seconds)
+
+    def install(self) -> None:
+        """订阅推理阶段的耗时"""
+        timing.add_listener(self.observe)
+
+    def uninstall(self) -> None:
+        """取消订阅"""
+        timing.remove_listener(self.observe)
+
+    def observe(self, stage: str, outcome: str, seconds: float) -> None:
+        """记录一次完整的推理阶段耗时"""
+        if stage == "deepseek_stage" and outcome == "ok":
+            self.reasoning_seconds += self.smoothing * (seconds - self.reasoning_seconds)
+
+    def _record(self, bypass: bool, source: str) -> bool:
+        self._decisions.inc(decision="bypass" if bypass else "reason", source=source)
+        if bypass:
+            self._saved.inc(self.reasoning_seconds)
+        return bypass
+
+    def decide(self, messages: Sequence[dict], mode: str = "auto") -> bool:
+        """判断请求是否跳过推理阶段
+
+        Args:
+            messages: 消息列表
+            mode: 请求的 reasoning 参数，auto 时由分类器判断
+
+        Returns:
+            bool: 是否跳过推理阶段
+        """
+        if mode != "auto":
+            return self._record(mode == "never", "override")
+        text = last_user_text(messages)
+        if text is not None:
+            for classifier in self.classifiers:
+                result = classifier.classify(text)
+                if result is not None:
+                    if result:
+                        logger.info(f"{classifier.name} 判定为简单问题，跳过推理阶段")
+                    return self._record(result, classifier.name)
+        return self._record(False, "default")
+
+
+def build_bypass(
+    enabled: bool,
+    model_path: Optional[str] = None,
+    threshold: float = 0.8,
+    max_chars: int = 40,
+) -> Optional[ReasoningBypass]:
+    """按配置创建，未启用时返回 None
+
+    Args:
+        enabled: 是否启用
+        model_path: n-gram 模型文件，为空时只使用规则判断
+        threshold: 模型跳过推理的概率阈值
+        max_chars: 规则判断为简单问题的最大长度
+
+    Returns:
+        Optional[ReasoningBypass]: 跳过推理的判断
+    """
+    if not enabled:
+        return None
+    classifiers: List[PromptClassifier] = [HeuristicClassifier(max_chars)]
+    if model_path:
+        classifiers.append(NgramClassifier.load(model_path, threshold))
+    return ReasoningBypass(classifiers)
+
+
+def _read_samples(path: str) -> List[Tuple[str, bool]]:
+    samples = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                sample = json.loads(line)
+                samples.append((sample["text"], bool(sample["bypass"])))
+    return samples
+
+
+def _evaluate(classifier: NgramClassifier, samples: Iterable[Tuple[str, bool]]) -> Tuple[int, int, int]:
+    """返回 (判断正确数, 不下结论数, 样本数)"""
+    correct = undecided = total = 0
+    for text, label in samples:
+        total += 1
+        result = classifier.classify(text)
+        if result is None:
+            undecided += 1
+        elif result == label:
+            correct += 1
+    return correct, undecided, total
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="训练跳过推理阶段的分类模型")
+    commands = parser.add_subparsers(dest="command", required=True)
+    train = commands.add_parser("train", help="训练模型")
+    train.add_argument("samples", help='样本文件，每行为 {"text": ..., "bypass": true/false}')
+    train.add_argument("-o", "--output", required=True, help="输出的模型文件")
+    train.add_argument("--buckets", type=int, default=1 << 16)
+    train.add_argument("--epochs", type=int, default=20)
+    train.add_argument("--holdout", type=float, default=0.2, help="留作验证的样本比例")
+    evaluate = commands.add_parser("eval", help="评估模型")
+    evaluate.add_argument("model")
+    evaluate.add_argument("samples")
+    evaluate.add_argument("--threshold", type=float, default=0.8)
+    args = parser.parse_args(argv)
+
+    samples = _read_samples(args.samples)
+    if args.command == "train":
+        random.Random(0).shuffle(samples)
+        split = int(len(samples) * (1 - args.holdout))
+        started = time.perf_counter()
+        classifier = NgramClassifier.train(samples[:split], buckets=args.buckets, epochs=args.epochs)
+        classifier.save(args.output)
+        print(f"训练 {split} 条样本用时 {time.perf_counter() - started:.1f}s，保存到 {args.output}")
+        samples = samples[split:]
+    else:
+        classifier = NgramClassifier.load(args.model, args.threshold)
+    if samples:
+        correct, undecided, total = _evaluate(classifier, samples)
+        decided = total - undecided
+        print(
+            f"验证 {total} 条：判断 {decided} 条，准确率 {correct / max(decided, 1):.1%}，"
+            f"不下结论 {undecided} 条"
+        )
+
+
+if __name__ == "__main__":
+    main()
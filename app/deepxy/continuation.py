@@ -0,0 +1,135 @@
+"""回答阶段的续写恢复
+
+长回答输出到一半时上游断开，重新运行整个流程要再等一次推理。续写恢复保留已经发给客户端的
+回答，把它作为最后一条 assistant 消息重新请求同一个或备用的回答模型，让模型接着往下写：
+
+- 支持续写的上游（例如 DashScope 的 ``partial``）在这条消息上设置对应的字段，
+  见 ``ProviderConfig.assistant_prefix``；其他上游把末尾的 assistant 消息当作回答的开头
+- 模型仍可能从头开始重写，或者重复已输出内容的结尾，``PrefixDeduper`` 去掉这些重复的文本
+
+只有暂时性的错误（超时与卡顿、连接断开、上游 5xx 或 429）才续写，见 ``is_transient``；
+请求本身无效（4xx）或内容审核等错误重试也会同样失败，直接抛出。
+"""
+
+from typing import Optional
+
+from aiohttp.client_exceptions import ClientConnectionError, ClientPayloadError, ServerTimeoutError
+
+from app.clients import UpstreamStatusError
+from app.monitoring.metrics import REGISTRY, MetricsRegistry
+
+
+def is_transient(error: BaseException) -> bool:
+    """判断回答流的错误是否为暂时性的，值得续写
+
+    Args:
+        error: 回答流抛出的异常
+
+    Returns:
+        bool: 超时与卡顿（StreamStallError）、连接断开、上游 5xx 或 429 时为 True
+    """
+    if isinstance(error, UpstreamStatusError):
+        return error.status >= 500 or error.status == 429
+    return isinstance(
+        error, (ServerTimeoutError, ClientConnectionError, ClientPayloadError, ConnectionError, TimeoutError)
+    )
+
+
+def continuation_messages(messages: list, partial: str, prefix_flag: Optional[str] = None) -> list:
+    """在消息列表末尾加上已输出的回答
+
+    Args:
+        messages: 回答阶段的消息列表
+        partial: 已输出的回答
+        prefix_flag: 上游标记续写的字段名，为空时不设置
+
+    Returns:
+        list: 新的消息列表，不修改原列表
+    """
+    message = {"role": "assistant", "content": partial}
+    if prefix_flag:
+        message[prefix_flag] = True
+    return [*messages, message]
+
+
+def _common_prefix(a: str, b: str) -> int:
+    length = min(len(a), len(b))
+    for i in range(length):
+        if a[i] != b[i]:
+            return i
+    return length
+
+
+class PrefixDeduper:
+    """去掉续写输出中与已输出回答重复的部分
+
+    续写的开头先缓存起来，确定属于以下哪种情况后再输出：
+
+    - 从头重写：开头与已输出的回答相同，丢弃相同的部分
+    - 重复结尾：开头与已输出回答的结尾相同，丢弃重叠的部分
+    - 正常续写：原样输出
+    """
+
+    def __init__(self, partial: str, window: int = 64, min_overlap: int = 4):
+        """初始化
+
+        Args:
+            partial: 已输出的回答
+            window: 判断重复结尾时最多缓存的字符数
+            min_overlap: 至少重复这么多字符才认为是重复
+        """
+        self.partial = partial
+        self.window = window
+        self.min_overlap = min_overlap
+        # 丢弃的重复字符数
+        self.dropped = 0
+        self._buffer: Optional[str] = ""
+
+    def _tail_overlap(self, text: str) -> int:
+        for length in range(min(len(self.partial), len(text)), self.min_overlap - 1, -1):
+            if self.partial.endswith(text[:length]):
+                return length
+        return 0
+
+    def _decide(self, final: bool) -> Optional[str]:
+        """确定重复的部分，返回应输出的文本；还需要更多输出才能判断时返回 None"""
+        buffer = self._buffer
+        common = _common_prefix(buffer, self.partial)
+        if common == len(buffer) and common < len(self.partial) and not final:
+            # 到目前为止都在重写已输出的内容
+            return None
+        if common >= self.min_overlap:
+            self.dropped = common
+        elif len(buffer) < self.window and not final:
+            return None
+        else:
+            self.dropped = self._tail_overlap(buffer)
+        self._buffer = None
+        return buffer[self.dropped:]
+
+    def feed(self, text: str) -> str:
+        """输入续写的一段输出，返回可以发给客户端的文本（可能为空）"""
+        if self._buffer is None:
+            return text
+        self._buffer += text
+        return self._decide(final=False) or ""
+
+    def flush(self) -> str:
+        """续写结束时输出仍在缓存中的文本"""
+        if self._buffer is None:
+            return ""
+        return self._decide(final=True)
+
+
+class ContinuationMetrics:
+    """续写恢复的指标"""
+
+    def __init__(self, registry: MetricsRegistry = REGISTRY):
+        self.attempts = registry.counter(
+            "deepxy_answer_continuations_total",
+            "回答流中断后重新请求的次数，已有输出时为续写；outcome 为 resumed（完成）/ failed（再次失败）",
+            ("outcome",),
+        )
+        self.duplicate_chars = registry.counter(
+            "deepxy_answer_continuation_duplicate_chars_total", "续写输出中被去掉的重复字符数"
+        )
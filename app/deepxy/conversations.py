@@ -0,0 +1,156 @@
+"""服务端保存的对话历史
+
+客户端在请求中设置 ``store: true`` 后，网关保存这一轮的新消息与回答，响应的 ``id``
+即为这一轮的ID。下一轮请求只需发送新的消息并通过 ``previous_response_id`` 指向上一轮，
+网关沿着父节点拼接出完整的历史。
+
+每一轮只保存本轮新增的消息、回答与推理内容，历史通过父节点共享，
+内存与请求体大小都不随对话长度增长。读取历史时刷新整条链上每一轮的过期时间，
+超过 ttl 未被使用或超出数量上限（按最近使用淘汰）的轮次被删除。
+
+推理内容只做保存，不会放入后续轮次的上游请求（R1 不接受历史中的推理内容）。
+"""
+
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+
+from app.monitoring.metrics import REGISTRY, MetricsRegistry
+from app.utils.errors import InvalidRequestError
+
+
+@dataclass(frozen=True)
+class Turn:
+    """一轮对话"""
+
+    tenant_id: str
+    parent_id: Optional[str]
+    messages: Tuple[dict, ...]
+    answer: str
+    reasoning: str
+
+
+class ConversationStore:
+    """带 TTL 与数量上限的对话轮次存储"""
+
+    def __init__(
+        self,
+        ttl: float = 3600.0,
+        max_turns: int = 100_000,
+        max_depth: int = 1000,
+        registry: MetricsRegistry = REGISTRY,
+    ):
+        """初始化
+
+        Args:
+            ttl: 轮次未被使用时保留的时间(秒)
+            max_turns: 最多保存的轮次数，超出时淘汰最久未使用的
+            max_depth: 一条对话最多的轮次数
+            registry: 指标注册表
+        """
+        self.ttl = ttl
+        self.max_turns = max_turns
+        self.max_depth = max_depth
+        # response_id -> (过期时间, 轮次)，按最近使用排序
+        self._turns: "OrderedDict[str, Tuple[float, Turn]]" = OrderedDict()
+
+        self._lookups = registry.counter(
+            "deepxy_conversation_lookups_total", "previous_response_id 的查找结果", ("outcome",)
+        )
+        registry.gauge("deepxy_conversation_turns", "保存的对话轮次数").set_function(
+            lambda: len(self._turns)
+        )
+
+    def __len__(self) -> int:
+        return len(self._turns)
+
+    def _evict(self, now: float) -> None:
+        # 按最近使用排序，最前面的最先过期
+        while self._turns:
+            response_id, (expires_at, _) = next(iter(self._turns.items()))
+            if expires_at > now and len(self._turns) <= self.max_turns:
+                break
+            del self._turns[response_id]
+
+    def _chain(self, response_id: str, tenant_id: str) -> List[Tuple[str, Turn]]:
+        """从某一轮开始沿父节点回溯，返回由新到旧的轮次"""
+        chain = []
+        current: Optional[str] = response_id
+        while current is not None:
+            entry = self._turns.get(current)
+            if entry is None or entry[1].tenant_id != tenant_id:
+                self._lookups.inc(outcome="miss")
+                raise InvalidRequestError(
+                    f"previous_response_id {response_id} 不存在或已过期",
+                    details={"type": "invalid_request_error", "param": "previous_response_id"},
+                )
+            chain.append((current, entry[1]))
+            if len(chain) > self.max_depth:
+                raise InvalidRequestError(
+                    f"对话超过 {self.max_depth} 轮",
+                    details={"type": "invalid_request_error", "param": "previous_response_id"},
+                )
+            current = entry[1].parent_id
+        return chain
+
+    def _touch(self, chain: List[Tuple[str, Turn]], now: float) -> None:
+        # 越早的轮次排得越靠后，淘汰时先淘汰后面的轮次，不会留下缺少祖先的对话
+        for turn_id, turn in chain:
+            self._turns[turn_id] = (now + self.ttl, turn)
+            self._turns.move_to_end(turn_id)
+
+    def save(
+        self,
+        response_id: str,
+        tenant_id: str,
+        parent_id: Optional[str],
+        messages: Sequence[dict],
+        answer: str,
+        reasoning: str = "",
+    ) -> None:
+        """保存一轮对话，并刷新之前各轮的过期时间
+
+        Args:
+            response_id: 本轮的响应ID
+            tenant_id: 所属租户
+            parent_id: 上一轮的响应ID
+            messages: 本轮新增的消息（不含历史）
+            answer: 回答内容
+            reasoning: 推理内容
+        """
+        now = time.monotonic()
+        chain = [(response_id, Turn(tenant_id, parent_id, tuple(messages), answer, reasoning))]
+        if parent_id is not None:
+            try:
+                chain.extend(self._chain(parent_id, tenant_id))
+            except InvalidRequestError:
+                # 请求期间上一轮已被淘汰，本轮仍然保存，之后引用时返回不存在
+                pass
+        self._touch(chain, now)
+        self._evict(now)
+
+    def history(self, response_id: str, tenant_id: str) -> List[dict]:
+        """拼接截至某一轮（含该轮回答）的完整消息列表
+
+        Args:
+            response_id: previous_response_id
+            tenant_id: 请求所属的租户，只能读取自己的对话
+
+        Returns:
+            List[dict]: 消息列表，消息对象与保存时共享，调用方不应修改
+
+        Raises:
+            InvalidRequestError: 轮次不存在、已过期、属于其他租户或对话过长
+        """
+        now = time.monotonic()
+        self._evict(now)
+        chain = self._chain(response_id, tenant_id)
+        self._lookups.inc(outcome="hit")
+        self._touch(chain, now)
+
+        messages = []
+        for _, turn in reversed(chain):
+            messages.extend(turn.messages)
+            messages.append({"role": "assistant", "content": turn.answer})
+        return messages
@@ -1,74 +1,40 @@
 """DeepXY 服务，用于协调 DeepSeek 和 Qwen 模型的调用"""
 
 import asyncio
-import json
+import secrets
 import time
-from typing import AsyncGenerator, Tuple
-
-from app.clients import DeepSeekClient, QwenClient
+from contextlib import aclosing
+from typing import TYPE_CHECKING, AsyncGenerator, Callable, Optional, Sequence, Tuple
+
+from app.clients import DeepSeekClient, ProviderRegistry, QwenClient
+from app.clients.timeouts import (
+    ANSWER_TIMEOUTS,
+    REASONING_TIMEOUTS,
+    AdaptiveTimeouts,
+    StreamStallError,
+    StreamTimeouts,
+)
+from app.config import Settings
+from app.monitoring import tracing
+from app.monitoring.timing import timed
+from app.utils import json_codec
 from app.utils.logger import logger
+from app.utils.quota import estimate_tokens
+from app.utils.retry import retry
+from . import prompts
+from .continuation import ContinuationMetrics, PrefixDeduper, continuation_messages, is_transient
+from .non_stream import NonStreamEngine
+
+if TYPE_CHECKING:  # pragma: no cover
+    from app.utils.quota import Usage
+    from .bypass import ReasoningBypass
 
 
 class DeepXY:
     """处理 DeepSeek 和 Qwen 模型的流式输出衔接"""
 
-    # 不同模型的提示词模板
-    PROMPT_TEMPLATES = {
-        "default": """
-Here's my original input:
-{original_content}
-
-Here's my another model's reasoning process:
-{reasoning}
-
-Based on this reasoning, provide your response directly to me:""",
-        
-        "google/": """
-Original Query:
-{original_content}
-
-Reasoning Analysis:
-{reasoning}
-
-Instructions: Based on the above reasoning, generate a comprehensive response. Focus on accuracy and clarity.""",
-        
-        "anthropic/": """
-[Previous Analysis]
-{reasoning}
-
-[Original Query]
-{original_content}
-
-[Task]
-Using the above analysis, provide a detailed and well-structured response. Maintain a professional tone and ensure factual accuracy.""",
-        
-        "qwen": """
-原始问题：
-{original_content}
-
-推理过程：
-{reasoning}
-
-请基于以上推理过程，给出完整的回答。注意保持语言的流畅性和专业性。""",
-        
-        "meta/": """
-Input: {original_content}
-
-Reasoning:
-{reasoning}
-
-Task: Synthesize the above reasoning into a coherent response. Prioritize clarity and logical flow.""",
-        
-        "mistral/": """
-Context:
-- Original query: {original_content}
-- Reasoning provided: {reasoning}
-
-Generate a response that:
-1. Incorporates the reasoning insights
-2. Addresses the original query directly
-3. Maintains a clear and concise style"""
-    }
+    # 不同模型的提示词模板，见 prompts 模块
+    PROMPT_TEMPLATES = prompts.PROMPT_TEMPLATES
 
     def __init__(
         self,
@@ -77,6 +43,14 @@ Generate a response that:
         deepseek_api_url: str = "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions",
         qwen_api_url: str = "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions",
         is_origin_reasoning: bool = True,
+        registry: Optional[ProviderRegistry] = None,
+        prompt_cache_hints: bool = False,
+        non_stream_timeout: float = 300.0,
+        reasoning_bypass: Optional["ReasoningBypass"] = None,
+        continuation_attempts: int = 2,
+        answer_fallback_models: Sequence[str] = (),
+        reasoning_timeouts: StreamTimeouts = REASONING_TIMEOUTS,
+        answer_timeouts: StreamTimeouts = ANSWER_TIMEOUTS,
     ):
         """初始化 API 客户端
 
@@ -86,35 +60,48 @@ Generate a response that:
             deepseek_api_url: DeepSeek API地址
             qwen_api_url: Qwen API地址
             is_origin_reasoning: 是否使用原生推理
+            registry: 上游服务注册表，为空时只包含以 qwen_api_key/qwen_api_url 为默认上游的内置路由
+            prompt_cache_hints: 是否向支持的上游发送 cache_control 前缀缓存提示
+            non_stream_timeout: 非流式请求的默认截止时间(秒)
+            reasoning_bypass: 判断简单问题跳过推理阶段，为空时总是执行推理
+            continuation_attempts: 回答流中断后续写的最多次数，0 表示不续写
+            answer_fallback_models: 续写依次使用的备用回答模型，为空时重试原模型
+            reasoning_timeouts: 推理阶段上游流的超时上限，按观测到的延迟自动收紧
+            answer_timeouts: 回答阶段上游流的超时上限，按观测到的延迟自动收紧
         """
+        self.registry = registry or ProviderRegistry.from_settings(
+            Settings(dashscope_api_key=qwen_api_key, dashscope_api_url=qwen_api_url)
+        )
         self.deepseek_client = DeepSeekClient(
-            deepseek_api_key, deepseek_api_url
+            deepseek_api_key, deepseek_api_url, self.registry
         )
         self.qwen_client = QwenClient(
-            qwen_api_key, qwen_api_url
+            qwen_api_key, qwen_api_url, self.registry
+        )
+        self.deepseek_client.stream_timeouts = self.deepseek_client.native.stream_timeouts = AdaptiveTimeouts(
+            "reasoning", reasoning_timeouts
+        )
+        self.qwen_client.stream_timeouts = self.qwen_client.native.stream_timeouts = AdaptiveTimeouts(
+            "answer", answer_timeouts
         )
         self.is_origin_reasoning = is_origin_reasoning
-
-    def _get_prompt_template(self, model: str) -> str:
+        self.prompt_cache_hints = prompt_cache_hints
+        self.non_stream_engine = NonStreamEngine(self, non_stream_timeout)
+        self.reasoning_bypass = reasoning_bypass
+        self.continuation_attempts = continuation_attempts
+        self.answer_fallback_models = tuple(answer_fallback_models)
+        self._continuations = ContinuationMetrics()
+
+    def _get_prompt_template(self, model: str) -> prompts.CompiledTemplate:
         """根据模型名称获取对应的提示词模板
 
         Args:
             model: 模型名称
 
         Returns:
-            str: 提示词模板
+            CompiledTemplate: 编译后的提示词模板
         """
-        # 检查是否是特定模型
-        for prefix in self.PROMPT_TEMPLATES:
-            if model.startswith(prefix):
-                return self.PROMPT_TEMPLATES[prefix]
-        
-        # 如果是通义千问模型
-        if "qwen" in model.lower():
-            return self.PROMPT_TEMPLATES["qwen"]
-        
-        # 默认模板
-        return self.PROMPT_TEMPLATES["default"]
+        return prompts.get_template(self.registry.resolve(model).prompt_template)
 
     def _format_prompt(self, model: str, original_content: str, reasoning: str) -> str:
         """格式化提示词
@@ -127,29 +114,224 @@ Generate a response that:
         Returns:
             str: 格式化后的提示词
         """
-        template = self._get_prompt_template(model)
-        return template.format(
-            original_content=original_content,
-            reasoning=reasoning
+        return self._get_prompt_template(model).render(original_content, reasoning)
+
+    def _build_qwen_messages(
+        self, messages: list, reasoning: Optional[str], deepseek_content: str, qwen_model: str
+    ) -> list:
+        """构造 Qwen 的输入消息
+
+        布局为 system 消息、对话历史、DeepSeek 的回答（如果有）、带推理内容的用户消息，
+        用户消息中原始问题位于推理内容之前，使每次请求的前缀尽量保持稳定，
+        以便命中上游的前缀缓存。不会修改传入的消息。
+
+        Args:
+            messages: 初始消息列表
+            reasoning: DeepSeek 的推理内容，None 表示跳过了推理阶段，直接使用原始消息
+            deepseek_content: DeepSeek 的回答内容
+            qwen_model: Qwen 模型名称
+
+        Returns:
+            list: Qwen 的消息列表
+
+        Raises:
+            ValueError: 消息列表为空或没有用户消息
+        """
+        if reasoning is None:
+            return messages
+
+        # system 消息统一放在最前面
+        system_messages = []
+        qwen_messages = []
+        for message in messages:
+            if message.get("role", "") == "system":
+                system_messages.append(message)
+            else:
+                qwen_messages.append(message)
+
+        # 检查过滤后的消息列表是否为空
+        if not qwen_messages:
+            raise ValueError("消息列表为空，无法处理 Qwen 请求")
+
+        # 获取最后一个用户消息的位置
+        last_user_index = None
+        for index in range(len(qwen_messages) - 1, -1, -1):
+            if qwen_messages[index].get("role") == "user":
+                last_user_index = index
+                break
+
+        if last_user_index is None:
+            raise ValueError("未找到用户消息，无法处理请求")
+
+        route = self.registry.resolve(qwen_model)
+        original_content = qwen_messages[last_user_index]["content"]
+        template = prompts.get_template(route.prompt_template)
+        if self.prompt_cache_hints and route.provider.supports_cache_control:
+            # 在推理内容之前设置缓存断点，之前的内容（system、历史与原始问题）可被上游缓存
+            stable, variable = template.render_parts(original_content, reasoning)
+            fixed_content = [
+                {"type": "text", "text": stable, "cache_control": {"type": "ephemeral"}},
+                {"type": "text", "text": variable},
+            ]
+        else:
+            fixed_content = template.render(original_content, reasoning)
+
+        # 创建新的消息列表，确保最后一个消息是用户消息
+        new_messages = (
+            system_messages
+            + qwen_messages[:last_user_index]
+            + qwen_messages[last_user_index + 1:]
         )
 
+        # 添加DeepSeek的回答（如果有）
+        if deepseek_content:
+            new_messages.append({'role': 'assistant', 'content': deepseek_content})
+
+        # 添加修改后的用户消息作为最后一条消息
+        new_messages.append({'role': 'user', 'content': fixed_content})
+        return new_messages
+
+    def _reasoning_budget(
+        self, messages: list, reasoning: str, max_reasoning_tokens: Optional[int]
+    ) -> Optional[int]:
+        """按请求的 reasoning 参数与跳过推理的判断确定推理 token 上限
+
+        Args:
+            messages: 消息列表
+            reasoning: 请求的 reasoning 参数，auto / always / never
+            max_reasoning_tokens: 降级等已确定的推理 token 上限
+
+        Returns:
+            Optional[int]: 推理 token 上限，0 表示跳过推理阶段
+        """
+        if max_reasoning_tokens == 0:
+            # 已因降级跳过推理阶段
+            return 0
+        if self.reasoning_bypass is None:
+            return 0 if reasoning == "never" else max_reasoning_tokens
+        return 0 if self.reasoning_bypass.decide(messages, reasoning) else max_reasoning_tokens
+
+    def _continuation_model(self, model: str, attempt: int) -> str:
+        """第 attempt 次续写使用的模型：依次使用备用模型，用完后重复最后一个"""
+        if not self.answer_fallback_models:
+            return model
+        return self.answer_fallback_models[min(attempt, len(self.answer_fallback_models)) - 1]
+
+    @retry(max_retries=1, base_delay=0.2, retry_errors=(StreamStallError,))
+    async def open_reasoning_stream(
+        self, messages: list, deepseek_model: str
+    ) -> AsyncGenerator[Tuple[str, str], None]:
+        """打开推理阶段的上游流，取得第一个片段后返回
+
+        第一个片段之前上游卡住时还没有任何输出，换一个连接重试一次；之后的卡顿不再重试，
+        由调用方使用已收到的推理内容继续。
+
+        Args:
+            messages: 初始消息列表
+            deepseek_model: DeepSeek 模型名称
+
+        Returns:
+            AsyncGenerator[Tuple[str, str], None]: 从第一个片段开始的 (类型, 内容) 流
+
+        Raises:
+            StreamStallError: 重试后仍然没有输出
+        """
+        stream = self.deepseek_client.stream_chat(messages, deepseek_model, self.is_origin_reasoning)
+        try:
+            first = await anext(stream)
+        except StopAsyncIteration:
+            return stream
+        except BaseException:
+            await stream.aclose()
+            raise
+        return _prepend(first, stream)
+
+    @staticmethod
+    def new_chat_id() -> str:
+        """生成会话ID
+
+        带有随机部分，续传时不能通过时间戳猜到其他请求的ID
+        """
+        return f"chatcmpl-{hex(int(time.time() * 1000))[2:]}{secrets.token_hex(6)}"
+
+    @staticmethod
+    def _encode_chunk(
+        chat_id: str,
+        created_time: int,
+        model: str,
+        content: str = "",
+        reasoning_content: str = "",
+        index: int = 0,
+        finish_reason: Optional[str] = None,
+    ) -> bytes:
+        """编码一个 chat.completion.chunk 格式的 SSE 事件
+
+        Args:
+            chat_id: 会话ID
+            created_time: 创建时间戳
+            model: 模型名称
+            content: 回答内容
+            reasoning_content: 推理内容
+            index: 候选回答的序号
+            finish_reason: 候选回答结束的原因，为空时不输出该字段
+
+        Returns:
+            bytes: SSE 事件数据
+        """
+        choice = {
+            "index": index,
+            "delta": {
+                "role": "assistant",
+                "reasoning_content": reasoning_content,
+                "content": content,
+            },
+        }
+        if finish_reason is not None:
+            choice["finish_reason"] = finish_reason
+        return json_codec.sse_event({
+            "id": chat_id,
+            "object": "chat.completion.chunk",
+            "created": created_time,
+            "model": model,
+            "choices": [choice],
+        })
+
     async def chat_completions_with_stream(
         self,
         messages: list,
         model_arg: Tuple[float, float, float, float],
         deepseek_model: str = "deepseek-r1",
         qwen_model: str = "qwen2.5-14b-instruct-1m",
+        usage: Optional["Usage"] = None,
+        candidates: Optional[Sequence[Tuple[str, Tuple[float, float, float, float]]]] = None,
+        chat_id: Optional[str] = None,
+        on_finish: Optional[Callable[[str, str], None]] = None,
+        max_reasoning_tokens: Optional[int] = None,
+        reasoning: str = "auto",
     ) -> AsyncGenerator[bytes, None]:
         """处理完整的流式输出过程
 
+        请求多个候选回答时，DeepSeek 只推理一次，推理内容在 index 0 上输出；
+        各候选回答并发生成，按 choices[].index 区分交错输出，每个候选结束时
+        输出一个带 finish_reason 的事件。
+
+        推理内容达到 max_reasoning_tokens 时提前断开 DeepSeek，用已收到的推理内容继续；
+        为 0 时跳过推理阶段，原始消息直接交给 Qwen；简单问题同样跳过推理阶段，见 bypass 模块。
+
         Args:
             messages: 初始消息列表
             model_arg: 模型参数
             deepseek_model: DeepSeek 模型名称
             qwen_model: Qwen 模型名称
+            usage: 用量统计，输出推理与回答片段时累加
+            candidates: 多个候选回答的 (模型, 参数)，index 与顺序一致；为空时只生成一个回答
+            chat_id: 会话ID，为空时自动生成
+            on_finish: 流正常结束时以 (推理内容, 第一个候选回答) 调用，用于保存对话
+            max_reasoning_tokens: 推理阶段的 token 上限，None 表示不限制，0 表示跳过推理阶段
+            reasoning: 是否执行推理阶段，auto 时由 reasoning_bypass 判断，always / never 覆盖判断结果
 
         Yields:
-            字节流数据，格式如下：
+            字节流数据，每个事件带有 ``id: <chat_id>:<序号>``，用于断线续传，格式如下：
             {
                 "id": "chatcmpl-xxx",
                 "object": "chat.completion.chunk",
@@ -165,163 +347,212 @@ Generate a response that:
                 }]
             }
         """
+        max_reasoning_tokens = self._reasoning_budget(messages, reasoning, max_reasoning_tokens)
         # 生成唯一的会话ID和时间戳
-        chat_id = f"chatcmpl-{hex(int(time.time() * 1000))[2:]}"
+        chat_id = chat_id or self.new_chat_id()
         created_time = int(time.time())
+        multiple = bool(candidates) and len(candidates) > 1
+        candidates = list(candidates) if candidates else [(qwen_model, model_arg)]
 
         # 创建队列，用于收集输出数据
         output_queue = asyncio.Queue()
-        # 队列，用于传递 DeepSeek 推理内容给 Qwen
-        qwen_queue = asyncio.Queue()
+        # DeepSeek 的推理结果 (推理内容, 回答内容)，所有候选回答共用
+        reasoning_ready = asyncio.get_running_loop().create_future()
 
         # 用于存储 DeepSeek 的推理累积内容
         reasoning_content = []
+        # 第一个候选回答，on_finish 需要时才收集
+        answer_parts = [] if on_finish is not None else None
 
+        @tracing.traced("process_deepseek")
+        @timed("deepseek_stage")
         async def process_deepseek():
             logger.info(f"开始处理 DeepSeek 流，使用模型：{deepseek_model}")
+            span = tracing.current_span()
+            span.set_attribute("gen_ai.request.model", deepseek_model)
+            reasoning_tokens = 0.0
             try:
-                deepseek_messages = messages.copy()
-                async for content_type, content in self.deepseek_client.stream_chat(
-                    deepseek_messages, deepseek_model, self.is_origin_reasoning
-                ):
-                    if content_type == "reasoning":
-                        reasoning_content.append(content)
-                        response = {
-                            "id": chat_id,
-                            "object": "chat.completion.chunk",
-                            "created": created_time,
-                            "model": deepseek_model,
-                            "choices": [
-                                {
-                                    "index": 0,
-                                    "delta": {
-                                        "role": "assistant",
-                                        "reasoning_content": content,
-                                        "content": "",
-                                    },
-                                }
-                            ],
-                        }
-                        await output_queue.put(
-                            f"data: {json.dumps(response)}\n\n".encode("utf-8")
-                        )
-                    elif content_type == "content":
-                        # 当收到 content 类型时，将完整的推理内容发送到 qwen_queue，并结束 DeepSeek 流处理
-                        logger.info(
-                            f"DeepSeek 推理完成，收集到的推理内容长度：{len(''.join(reasoning_content))}"
-                        )
-                        await qwen_queue.put(("".join(reasoning_content), content))
-                        break
+                # 客户端不会修改消息列表，不需要复制
+                stream = await self.open_reasoning_stream(messages, deepseek_model)
+                async with aclosing(stream):
+                    async for content_type, content in stream:
+                        if content_type == "reasoning":
+                            reasoning_content.append(content)
+                            if usage is not None:
+                                usage.add_reasoning(content)
+                            await output_queue.put(
+                                self._encode_chunk(
+                                    chat_id, created_time, deepseek_model, reasoning_content=content
+                                )
+                            )
+                            if max_reasoning_tokens is not None:
+                                reasoning_tokens += estimate_tokens(content)
+                                if reasoning_tokens >= max_reasoning_tokens:
+                                    logger.info(f"推理内容达到 {max_reasoning_tokens} token 上限，提前结束推理阶段")
+                                    reasoning_ready.set_result(("".join(reasoning_content), ""))
+                                    break
+                        elif content_type == "content":
+                            # 当收到 content 类型时，把完整的推理内容交给 Qwen，并结束 DeepSeek 流处理
+                            logger.info(
+                                f"DeepSeek 推理完成，收集到的推理内容长度：{len(''.join(reasoning_content))}"
+                            )
+                            reasoning_ready.set_result(("".join(reasoning_content), content))
+                            break
+            except StreamStallError as e:
+                # 卡住的推理不再等待，使用已收到的推理内容继续（见 finally）
+                logger.warning(f"{e}，使用已收到的推理内容继续")
+                span.set_attribute("deepxy.stall", e.phase)
             except Exception as e:
                 logger.error(f"处理 DeepSeek 流时发生错误: {e}")
-                await qwen_queue.put(("", ""))
+                span.record_error(e)
+                reasoning_ready.set_result(("", ""))
+            finally:
+                # 上游在输出回答前就结束时，使用已收到的推理内容
+                if not reasoning_ready.done():
+                    reasoning_ready.set_result(("".join(reasoning_content), ""))
+                if span.recording:
+                    span.set_attribute(
+                        "gen_ai.usage.reasoning_tokens", round(estimate_tokens("".join(reasoning_content)))
+                    )
             # 用 None 标记 DeepSeek 任务结束
             logger.info("DeepSeek 任务处理完成，标记结束")
             await output_queue.put(None)
 
-        async def process_qwen():
+        async def emit(index: int, model: str, answer: list, content: str) -> None:
+            """输出一段回答"""
+            if not content:
+                return
+            if usage is not None:
+                usage.add_completion(content)
+            answer.append(content)
+            await output_queue.put(
+                self._encode_chunk(chat_id, created_time, model, content=content, index=index)
+            )
+
+        # 包含等待 DeepSeek 推理内容的时间
+        @tracing.traced("process_qwen")
+        @timed("qwen_stage")
+        async def process_qwen(index: int, qwen_model: str, model_arg: Tuple[float, float, float, float]):
+            span = tracing.current_span()
+            span.set_attributes({"gen_ai.request.model": qwen_model, "deepxy.candidate.index": index})
             try:
                 logger.info("等待获取 DeepSeek 的推理内容...")
-                reasoning, deepseek_content = await qwen_queue.get()
+                # shield: 单个候选被取消时不影响其他候选
+                reasoning, deepseek_content = await asyncio.shield(reasoning_ready)
                 logger.debug(
                     f"获取到推理内容，内容长度：{len(reasoning) if reasoning else 0}"
                 )
-                if not reasoning:
+                if reasoning is None:
+                    logger.info("跳过了推理阶段，直接使用原始消息")
+                elif not reasoning:
                     logger.warning("未能获取到有效的推理内容，将使用默认提示继续")
                     reasoning = "获取推理内容失败"
 
-                # 构造 Qwen 的输入消息
-                qwen_messages = messages.copy()
-                
-                # 处理可能 messages 内存在 role = system 的情况
-                qwen_messages = [
-                    message
-                    for message in qwen_messages
-                    if message.get("role", "") != "system"
-                ]
-
-                # 检查过滤后的消息列表是否为空
-                if not qwen_messages:
-                    raise ValueError("消息列表为空，无法处理 Qwen 请求")
-
-                # 获取最后一个用户消息的内容
-                last_user_message = None
-                for message in reversed(qwen_messages):
-                    if message.get("role") == "user":
-                        last_user_message = message
-                        break
-
-                if not last_user_message:
-                    raise ValueError("未找到用户消息，无法处理请求")
-
-                # 修改最后一个用户消息的内容
-                original_content = last_user_message["content"]
-                fixed_content = self._format_prompt(qwen_model, original_content, reasoning)
-                
-                # 创建新的消息列表，确保最后一个消息是用户消息
-                new_messages = []
-                for message in qwen_messages:
-                    if message == last_user_message:
-                        continue
-                    new_messages.append(message)
-                
-                # 添加DeepSeek的回答（如果有）
-                if deepseek_content:
-                    new_messages.append({'role': 'assistant', 'content': deepseek_content})
-                
-                # 添加修改后的用户消息作为最后一条消息
-                new_messages.append({'role': 'user', 'content': fixed_content})
-
-                logger.info(f"开始处理 Qwen 流，使用模型: {qwen_model}")
-                logger.debug(f"Qwen 消息列表: {new_messages}")
-
-                async for content_type, content in self.qwen_client.stream_chat(
-                    messages=new_messages,
-                    model_arg=model_arg,
-                    model=qwen_model,
-                ):
-                    if content_type == "answer":
-                        response = {
-                            "id": chat_id,
-                            "object": "chat.completion.chunk",
-                            "created": created_time,
-                            "model": qwen_model,
-                            "choices": [
-                                {
-                                    "index": 0,
-                                    "delta": {
-                                        "role": "assistant",
-                                        "content": content,
-                                        "reasoning_content": "",
-                                    },
-                                }
-                            ],
-                        }
-                        await output_queue.put(
-                            f"data: {json.dumps(response)}\n\n".encode("utf-8")
+                new_messages = self._build_qwen_messages(
+                    messages, reasoning, deepseek_content, qwen_model
+                )
+
+                # 本候选已输出的回答，续写时作为 assistant 消息的开头
+                answer = answer_parts if index == 0 and answer_parts is not None else []
+                model = qwen_model
+                attempt = 0
+                while True:
+                    request_messages = new_messages
+                    deduper = None
+                    if attempt and answer:
+                        partial = "".join(answer)
+                        route = self.registry.resolve(model)
+                        request_messages = continuation_messages(
+                            new_messages, partial, route.provider.assistant_prefix
                         )
+                        deduper = PrefixDeduper(partial)
+
+                    logger.info(f"开始处理 Qwen 流，使用模型: {model}")
+                    logger.debug("Qwen 消息列表: %s", request_messages)
+                    try:
+                        async for content_type, content in self.qwen_client.stream_chat(
+                            messages=request_messages,
+                            model_arg=model_arg,
+                            model=model,
+                        ):
+                            if content_type == "answer":
+                                if deduper is not None:
+                                    content = deduper.feed(content)
+                                await emit(index, model, answer, content)
+                            elif content_type == "usage" and usage is not None:
+                                # 原生协议的上游报告命中前缀缓存的输入 token 数
+                                usage.cached_tokens += content.cached_tokens
+                        if deduper is not None:
+                            await emit(index, model, answer, deduper.flush())
+                    except Exception as e:
+                        if deduper is not None:
+                            # 缓存中的续写内容同样有效，输出后从这里继续
+                            await emit(index, model, answer, deduper.flush())
+                        if attempt:
+                            self._continuations.attempts.inc(outcome="failed")
+                        if attempt >= self.continuation_attempts or not is_transient(e):
+                            raise
+                        attempt += 1
+                        model = self._continuation_model(qwen_model, attempt)
+                        span.set_attribute("deepxy.retry.attempts", attempt)
+                        logger.warning(
+                            f"Qwen 流在输出 {sum(map(len, answer))} 个字符后中断: {e}，"
+                            f"第 {attempt} 次使用 {model} 续写"
+                        )
+                        continue
+                    if attempt:
+                        self._continuations.attempts.inc(outcome="resumed")
+                    if deduper is not None:
+                        self._continuations.duplicate_chars.inc(deduper.dropped)
+                    if span.recording:
+                        span.set_attributes({
+                            "gen_ai.response.model": model,
+                            "gen_ai.usage.output_tokens": round(estimate_tokens("".join(answer))),
+                        })
+                    break
             except Exception as e:
                 logger.error(f"处理 Qwen 流时发生错误: {e}")
                 logger.exception(e)  # 打印完整的错误堆栈
+                span.record_error(e)
+            if multiple:
+                await output_queue.put(
+                    self._encode_chunk(chat_id, created_time, qwen_model, index=index, finish_reason="stop")
+                )
             # 用 None 标记 Qwen 任务结束
             logger.info("Qwen 任务处理完成，标记结束")
             await output_queue.put(None)
 
         # 创建并发任务
-        asyncio.create_task(process_deepseek())
-        asyncio.create_task(process_qwen())
-
-        # 等待两个任务完成，通过计数判断
-        finished_tasks = 0
-        while finished_tasks < 2:
-            item = await output_queue.get()
-            if item is None:
-                finished_tasks += 1
-            else:
-                yield item
+        if max_reasoning_tokens == 0:
+            reasoning_ready.set_result((None, ""))
+            tasks = []
+        else:
+            tasks = [asyncio.create_task(process_deepseek())]
+        tasks.extend(
+            asyncio.create_task(process_qwen(index, model, args))
+            for index, (model, args) in enumerate(candidates)
+        )
 
-        # 发送结束标记
-        yield b"data: [DONE]\n\n"
+        try:
+            # 等待所有任务完成，通过计数判断
+            finished_tasks = 0
+            seq = 0
+            while finished_tasks < len(tasks):
+                item = await output_queue.get()
+                if item is None:
+                    finished_tasks += 1
+                else:
+                    yield b"id: %s:%d\n%s" % (chat_id.encode(), seq, item)
+                    seq += 1
+
+            if on_finish is not None:
+                on_finish("".join(reasoning_content), "".join(answer_parts))
+            # 发送结束标记
+            yield b"id: %s:%d\ndata: [DONE]\n\n" % (chat_id.encode(), seq)
+        finally:
+            # 客户端断开时停止仍在进行的上游请求
+            for task in tasks:
+                task.cancel()
 
     async def chat_completions_without_stream(
         self,
@@ -329,6 +560,11 @@ Generate a response that:
         model_arg: tuple[float, float, float, float],
         deepseek_model: str = "deepseek-r1",
         qwen_model: str = "qwen2.5-14b-instruct-1m",
+        timeout: Optional[float] = None,
+        usage: Optional["Usage"] = None,
+        candidates: Optional[Sequence[Tuple[str, Tuple[float, float, float, float]]]] = None,
+        max_reasoning_tokens: Optional[int] = None,
+        reasoning: str = "auto",
     ) -> dict:
         """处理非流式输出过程
 
@@ -337,87 +573,29 @@ Generate a response that:
             model_arg: 模型参数
             deepseek_model: DeepSeek 模型名称
             qwen_model: Qwen 模型名称
+            timeout: 整个请求的截止时间(秒)，None则使用 non_stream_timeout
+            usage: 用量统计
+            candidates: 多个候选回答的 (模型, 参数)，共用一次推理；为空时只生成一个回答
+            max_reasoning_tokens: 推理阶段的 token 上限，None 表示不限制，0 表示跳过推理阶段
+            reasoning: 是否执行推理阶段，auto 时由 reasoning_bypass 判断，always / never 覆盖判断结果
 
         Returns:
             dict: OpenAI 格式的完整响应
-        """
-        chat_id = f"chatcmpl-{hex(int(time.time() * 1000))[2:]}"
-        created_time = int(time.time())
-        reasoning_content = []
-        deepseek_content = ""
-
-        # 1. 获取 DeepSeek 的推理内容（仍然使用流式）
-        try:
-            deepseek_messages = messages.copy()
-            async for content_type, content in self.deepseek_client.stream_chat(
-                deepseek_messages, deepseek_model, self.is_origin_reasoning
-            ):
-                if content_type == "reasoning":
-                    reasoning_content.append(content)
-                elif content_type == "content":
-                    deepseek_content = content
-                    break
-        except Exception as e:
-            logger.error(f"获取 DeepSeek 推理内容时发生错误: {e}")
-            reasoning_content = ["获取推理内容失败"]
 
-        # 2. 构造 Qwen 的输入消息
-        reasoning = "".join(reasoning_content)
-        qwen_messages = messages.copy()
-        if deepseek_content:
-            qwen_messages.append({'role': 'assistant', 'content': deepseek_content})
-
-        # 处理可能 messages 内存在 role = system 的情况
-        qwen_messages = [
-            message
-            for message in qwen_messages
-            if message.get("role", "") != "system"
-        ]
-
-        # 检查过滤后的消息列表是否为空
-        if not qwen_messages:
-            raise ValueError("消息列表为空，无法处理 Qwen 请求")
-
-        # 获取最后一个消息并检查其角色
-        last_message = qwen_messages[-1]
-        if last_message.get("role", "") != "user":
-            raise ValueError("最后一个消息的角色不是用户，无法处理请求")
-
-        # 修改最后一个消息的内容
-        original_content = last_message["content"]
-        fixed_content = self._format_prompt(qwen_model, original_content, reasoning)
-        last_message["content"] = fixed_content
+        Raises:
+            TimeoutError: 超过截止时间仍未得到回答
+        """
+        return await self.non_stream_engine.complete(
+            messages, model_arg, deepseek_model, qwen_model, timeout, usage, candidates, self.new_chat_id(),
+            self._reasoning_budget(messages, reasoning, max_reasoning_tokens),
+        )
 
-        # 3. 获取 Qwen 的回答
-        qwen_response = ""
-        try:
-            async for content_type, content in self.qwen_client.stream_chat(
-                messages=qwen_messages,
-                model_arg=model_arg,
-                model=qwen_model,
-            ):
-                if content_type == "answer":
-                    qwen_response += content
-        except Exception as e:
-            logger.error(f"获取 Qwen 回答时发生错误: {e}")
-            qwen_response = "获取回答失败"
-
-        # 4. 构造完整的响应
-        response = {
-            "id": chat_id,
-            "object": "chat.completion",
-            "created": created_time,
-            "model": qwen_model,
-            "choices": [
-                {
-                    "index": 0,
-                    "message": {
-                        "role": "assistant",
-                        "content": qwen_response,
-                        "reasoning_content": reasoning,
-                    },
-                }
-            ],
-        }
 
-        return response 
\ No newline at end of file
+async def _prepend(first: Tuple[str, str], stream: AsyncGenerator[Tuple[str, str], None]):
+    """先输出已取得的第一个片段，再输出流的其余部分"""
+    try:
+        yield first
+        async for item in stream:
+            yield item
+    finally:
+        await stream.aclose()
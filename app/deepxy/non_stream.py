@@ -0,0 +1,264 @@
+"""非流式输出引擎
+
+非流式请求的调用方通常是批处理任务，关心的是单个 worker 的吞吐量：
+- 推理阶段仍然使用流式调用（R1 的推理内容只有流式接口会返回），片段收集到列表中
+  一次拼接，收到第一个回答片段后立即断开上游
+- 回答阶段在上游支持时使用 stream=false，整个响应只解析一次 JSON
+- 整个请求有一个截止时间：推理阶段最多占用其中 reasoning_budget 的比例，
+  超时后保留已收到的推理内容继续；回答阶段使用剩余时间，超时返回 504
+- 推理阶段进行的同时预热回答阶段的上游连接
+- 请求多个候选回答（n > 1）时只推理一次，各候选回答并发获取；全部失败时返回上游的错误，
+  部分失败时失败的 choice 标记为 finish_reason "error"
+- 降级时推理内容达到 token 上限后提前断开，或跳过推理阶段
+"""
+
+import asyncio
+import builtins
+import time
+from contextlib import aclosing
+from typing import TYPE_CHECKING, Optional, Sequence, Set, Tuple
+
+import aiohttp
+
+from app.clients.timeouts import StreamStallError
+from app.monitoring import tracing
+from app.monitoring.timing import timed
+from app.utils import errors
+from app.utils.logger import logger
+from app.utils.quota import estimate_tokens
+
+if TYPE_CHECKING:  # pragma: no cover
+    from app.utils.quota import Usage
+    from .deepxy import DeepXY
+
+
+class NonStreamEngine:
+    """DeepXY 的非流式输出引擎"""
+
+    def __init__(self, deep_xy: "DeepXY", default_timeout: float = 300.0, reasoning_budget: float = 0.7):
+        """初始化非流式引擎
+
+        Args:
+            deep_xy: DeepXY 实例，复用其客户端、注册表与提示词
+            default_timeout: 默认的请求截止时间(秒)
+            reasoning_budget: 推理阶段最多占用截止时间的比例
+        """
+        self.deep_xy = deep_xy
+        self.default_timeout = default_timeout
+        self.reasoning_budget = reasoning_budget
+        # 持有后台任务的引用，避免任务在完成前被回收
+        self._background: Set[asyncio.Task] = set()
+
+    def _warm_answer_endpoint(self, qwen_model: str) -> None:
+        """在后台预热回答阶段上游的连接"""
+        api_url = self.deep_xy.registry.resolve(qwen_model).provider.api_url
+        task = asyncio.create_task(self.deep_xy.qwen_client.warm_connection(api_url))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    @tracing.traced("process_deepseek")
+    @timed("deepseek_stage")
+    async def _collect_reasoning(
+        self, messages: list, deepseek_model: str, budget: float, max_tokens: Optional[int] = None
+    ) -> Tuple[str, str]:
+        """获取 DeepSeek 的推理内容
+
+        Args:
+            messages: 初始消息列表
+            deepseek_model: DeepSeek 模型名称
+            budget: 推理阶段可用的时间(秒)
+            max_tokens: 推理内容的 token 上限，None 表示不限制
+
+        Returns:
+            Tuple[str, str]: (推理内容, DeepSeek 的回答内容)
+        """
+        span = tracing.current_span()
+        span.set_attribute("gen_ai.request.model", deepseek_model)
+        reasoning_parts = []
+        reasoning_tokens = 0.0
+        deepseek_content = ""
+        try:
+            async with asyncio.timeout(budget):
+                stream = await self.deep_xy.open_reasoning_stream(messages, deepseek_model)
+                async with aclosing(stream):
+                    async for content_type, content in stream:
+                        if content_type == "reasoning":
+                            reasoning_parts.append(content)
+                            if max_tokens is not None:
+                                reasoning_tokens += estimate_tokens(content)
+                                if reasoning_tokens >= max_tokens:
+                                    logger.info(f"推理内容达到 {max_tokens} token 上限，提前结束推理阶段")
+                                    break
+                        elif content_type == "content":
+                            deepseek_content = content
+                            break
+        except StreamStallError as e:
+            logger.warning(f"{e}，使用已收到的 {len(reasoning_parts)} 个推理片段继续")
+            span.set_attribute("deepxy.stall", e.phase)
+        except builtins.TimeoutError:
+            logger.warning(
+                f"DeepSeek 推理超过 {budget:.1f}s，使用已收到的 {len(reasoning_parts)} 个推理片段继续"
+            )
+            span.set_attribute("deepxy.stall", "budget")
+        except Exception as e:
+            logger.error(f"获取 DeepSeek 推理内容时发生错误: {e}")
+            span.record_error(e)
+
+        reasoning = "".join(reasoning_parts)
+        if span.recording:
+            span.set_attribute("gen_ai.usage.reasoning_tokens", round(estimate_tokens(reasoning)))
+        if not reasoning:
+            logger.warning("未能获取到有效的推理内容，将使用默认提示继续")
+            reasoning = "获取推理内容失败"
+        return reasoning, deepseek_content
+
+    @tracing.traced("process_qwen")
+    async def _answer(
+        self,
+        messages: list,
+        reasoning: Optional[str],
+        deepseek_content: str,
+        qwen_model: str,
+        model_arg: Tuple[float, float, float, float],
+        remaining: float,
+    ) -> str:
+        """获取一个候选回答
+
+        Raises:
+            TimeoutError: 超过剩余时间
+            errors.APIError: 上游返回错误
+        """
+        span = tracing.current_span()
+        span.set_attribute("gen_ai.request.model", qwen_model)
+        qwen_messages = self.deep_xy._build_qwen_messages(
+            messages, reasoning, deepseek_content, qwen_model
+        )
+        try:
+            answer = await self.deep_xy.qwen_client.complete_chat(
+                qwen_messages,
+                model_arg,
+                qwen_model,
+                timeout=aiohttp.ClientTimeout(total=remaining),
+            )
+        except (builtins.TimeoutError, errors.DeepClaudeError):
+            raise
+        except Exception as e:
+            logger.error(f"获取 Qwen 回答时发生错误: {e}")
+            span.record_error(e)
+            raise errors.APIError(
+                f"获取回答失败: {e}", details={"stage": "answer", "model": qwen_model}
+            ) from e
+        if span.recording:
+            span.set_attribute("gen_ai.usage.output_tokens", round(estimate_tokens(answer)))
+        return answer
+
+    @timed("non_stream_request")
+    async def complete(
+        self,
+        messages: list,
+        model_arg: Tuple[float, float, float, float],
+        deepseek_model: str = "deepseek-r1",
+        qwen_model: str = "qwen2.5-14b-instruct-1m",
+        timeout: Optional[float] = None,
+        usage: Optional["Usage"] = None,
+        candidates: Optional[Sequence[Tuple[str, Tuple[float, float, float, float]]]] = None,
+        chat_id: Optional[str] = None,
+        max_reasoning_tokens: Optional[int] = None,
+    ) -> dict:
+        """处理非流式请求
+
+        Args:
+            messages: 初始消息列表
+            model_arg: 模型参数
+            deepseek_model: DeepSeek 模型名称
+            qwen_model: Qwen 模型名称
+            timeout: 整个请求的截止时间(秒)，None则使用默认值
+            usage: 用量统计
+            candidates: 多个候选回答的 (模型, 参数)，共用一次推理；为空时只生成一个回答
+            chat_id: 会话ID，为空时按时间戳生成
+            max_reasoning_tokens: 推理阶段的 token 上限，None 表示不限制，0 表示跳过推理阶段
+
+        Returns:
+            dict: OpenAI 格式的完整响应，choices 的顺序与 candidates 一致。部分候选回答
+                失败时，失败的 choice 的 finish_reason 为 "error"，并带有 error 字段
+
+        Raises:
+            TimeoutError: 超过截止时间仍未得到回答
+            APIError: 所有候选回答都失败
+        """
+        chat_id = chat_id or f"chatcmpl-{hex(int(time.time() * 1000))[2:]}"
+        created_time = int(time.time())
+        timeout = timeout or self.default_timeout
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        candidates = list(candidates) if candidates else [(qwen_model, model_arg)]
+
+        # 1. 推理阶段，同时预热回答阶段的连接
+        for model in dict.fromkeys(model for model, _ in candidates):
+            self._warm_answer_endpoint(model)
+        if max_reasoning_tokens == 0:
+            reasoning, deepseek_content = None, ""
+        else:
+            reasoning, deepseek_content = await self._collect_reasoning(
+                messages, deepseek_model, timeout * self.reasoning_budget, max_reasoning_tokens
+            )
+
+        # 2. 在剩余时间内并发获取所有候选回答
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            raise errors.TimeoutError(
+                f"请求超过截止时间 {timeout:.1f}s", details={"stage": "reasoning"}
+            )
+        try:
+            async with asyncio.timeout(remaining):
+                answers = await asyncio.gather(*(
+                    self._answer(messages, reasoning, deepseek_content, model, args, remaining)
+                    for model, args in candidates
+                ), return_exceptions=True)
+        except builtins.TimeoutError:
+            raise errors.TimeoutError(
+                f"请求超过截止时间 {timeout:.1f}s", details={"stage": "answer"}
+            )
+        failures = [answer for answer in answers if isinstance(answer, BaseException)]
+        if len(failures) == len(answers):
+            # 没有任何可用的回答，按第一个错误返回（上游错误为 502，超时为 504）
+            if isinstance(failures[0], builtins.TimeoutError):
+                raise errors.TimeoutError(
+                    f"请求超过截止时间 {timeout:.1f}s", details={"stage": "answer"}
+                ) from failures[0]
+            raise failures[0]
+
+        reasoning = reasoning or ""
+        if usage is not None:
+            usage.add_reasoning(reasoning)
+            for answer in answers:
+                if isinstance(answer, str):
+                    usage.add_completion(answer)
+
+        # 3. 构造完整的响应
+        return {
+            "id": chat_id,
+            "object": "chat.completion",
+            "created": created_time,
+            "model": candidates[0][0],
+            "choices": [self._choice(index, answer, reasoning) for index, answer in enumerate(answers)],
+        }
+
+    @staticmethod
+    def _choice(index: int, answer, reasoning: str) -> dict:
+        """构造一个 choice，失败的候选回答没有内容，finish_reason 为 error"""
+        if isinstance(answer, BaseException):
+            error = answer if isinstance(answer, errors.DeepClaudeError) else errors.TimeoutError(
+                "回答超时", details={"stage": "answer"}
+            )
+            return {
+                "index": index,
+                "message": {"role": "assistant", "content": "", "reasoning_content": reasoning},
+                "finish_reason": "error",
+                "error": {"message": error.message, "code": error.error_code, "status": error.http_status},
+            }
+        return {
+            "index": index,
+            "message": {"role": "assistant", "content": answer, "reasoning_content": reasoning},
+            "finish_reason": "stop",
+        }
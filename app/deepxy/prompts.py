@@ -0,0 +1,150 @@
+"""Qwen 阶段的提示词模板
+
+模板在首次使用时编译为片段列表并按内容哈希缓存，渲染时只做一次字符串拼接，
+不再每次请求都调用 ``str.format`` 解析模板。
+
+所有模板都采用"稳定内容在前"的布局：原始问题位于推理内容之前。这样同一个问题
+（或同一段对话历史）的多次请求拥有相同的前缀，上游的前缀缓存（DashScope 上下文缓存、
+vLLM prefix caching 等）可以命中。渲染结果可以在推理内容之前拆分为稳定部分与
+可变部分，用于在支持的上游上附加 cache_control 提示。
+"""
+
+import hashlib
+import string
+from functools import lru_cache
+from typing import Dict, List, Tuple, Union
+
+# 模板中允许使用的字段
+FIELDS = ("original_content", "reasoning")
+
+# 不同模型的提示词模板，原始问题必须位于推理内容之前
+PROMPT_TEMPLATES = {
+    "default": """
+Here's my original input:
+{original_content}
+
+Here's my another model's reasoning process:
+{reasoning}
+
+Based on this reasoning, provide your response directly to me:""",
+
+    "google/": """
+Original Query:
+{original_content}
+
+Reasoning Analysis:
+{reasoning}
+
+Instructions: Based on the above reasoning, generate a comprehensive response. Focus on accuracy and clarity.""",
+
+    "anthropic/": """
+[Original Query]
+{original_content}
+
+[Previous Analysis]
+{reasoning}
+
+[Task]
+Using the above analysis, provide a detailed and well-structured response. Maintain a professional tone and ensure factual accuracy.""",
+
+    "qwen": """
+原始问题：
+{original_content}
+
+推理过程：
+{reasoning}
+
+请基于以上推理过程，给出完整的回答。注意保持语言的流畅性和专业性。""",
+
+    "meta/": """
+Input: {original_content}
+
+Reasoning:
+{reasoning}
+
+Task: Synthesize the above reasoning into a coherent response. Prioritize clarity and logical flow.""",
+
+    "mistral/": """
+Context:
+- Original query: {original_content}
+- Reasoning provided: {reasoning}
+
+Generate a response that:
+1. Incorporates the reasoning insights
+2. Addresses the original query directly
+3. Maintains a clear and concise style"""
+}
+
+
+class CompiledTemplate:
+    """编译后的提示词模板
+
+    ``_stable`` 为第一个 ``{reasoning}`` 之前的片段，``_variable`` 为其余片段；
+    片段是字面文本或字段名（以元组 ``(field,)`` 表示）。
+    """
+
+    __slots__ = ("source", "digest", "_stable", "_variable", "_segments")
+
+    def __init__(self, source: str):
+        """编译模板
+
+        Args:
+            source: 模板文本，使用 ``{original_content}`` 与 ``{reasoning}`` 两个字段
+
+        Raises:
+            ValueError: 模板包含未知字段、格式说明，或推理内容出现在原始问题之前
+        """
+        self.source = source
+        self.digest = hashlib.sha256(source.encode("utf-8")).hexdigest()[:16]
+
+        segments: List[Union[str, Tuple[str]]] = []
+        for literal, field, spec, conversion in string.Formatter().parse(source):
+            if literal:
+                segments.append(literal)
+            if field is None:
+                continue
+            if field not in FIELDS or spec or conversion:
+                raise ValueError(f"提示词模板包含不支持的字段: {{{field}}}")
+            segments.append((field,))
+
+        split = next((i for i, s in enumerate(segments) if s == ("reasoning",)), len(segments))
+        if ("original_content",) in segments[split:]:
+            raise ValueError("提示词模板中原始问题必须位于推理内容之前")
+        self._stable = tuple(segments[:split])
+        self._variable = tuple(segments[split:])
+        self._segments = tuple(segments)
+
+    @staticmethod
+    def _join(segments: tuple, values: Dict[str, str]) -> str:
+        return "".join(s if s.__class__ is str else values[s[0]] for s in segments)
+
+    def render_parts(self, original_content: str, reasoning: str) -> Tuple[str, str]:
+        """渲染模板并在推理内容之前拆分
+
+        Args:
+            original_content: 原始问题
+            reasoning: 推理内容
+
+        Returns:
+            Tuple[str, str]: (稳定部分, 可变部分)
+        """
+        values = {"original_content": original_content, "reasoning": reasoning}
+        return self._join(self._stable, values), self._join(self._variable, values)
+
+    def render(self, original_content: str, reasoning: str) -> str:
+        """渲染完整的提示词
+
+        一次拼接所有片段，长上下文时不会先生成稳定部分再复制一次
+        """
+        return self._join(self._segments, {"original_content": original_content, "reasoning": reasoning})
+
+
+@lru_cache(maxsize=64)
+def compile_template(source: str) -> CompiledTemplate:
+    """编译模板，相同内容的模板只编译一次"""
+    return CompiledTemplate(source)
+
+
+def get_template(name: str) -> CompiledTemplate:
+    """按名称获取编译后的模板，未知名称使用 default"""
+    return compile_template(PROMPT_TEMPLATES.get(name, PROMPT_TEMPLATES["default"]))
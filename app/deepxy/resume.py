@@ -0,0 +1,336 @@
+"""可续传的 SSE 流
+
+流式响应的每个事件都带有 ``id: <chat_id>:<序号>``。管道（DeepSeek + Qwen）在独立的
+后台任务中运行，输出写入每个流自己的环形缓冲区，客户端只是缓冲区的订阅者：
+
+- 客户端断开后管道继续运行 ``detach_timeout`` 秒，期间没有客户端重新连接才取消
+- 客户端带着 ``Last-Event-ID`` 重新请求时，从缓冲区补发之后的事件并继续接收新的事件，
+  不会再次请求上游
+- 流结束后缓冲区再保留 ``ttl`` 秒，供断线的客户端取回剩余的输出
+
+缓冲区按字节数限制大小，超出时丢弃最早的事件；配置了溢出目录时，被丢弃的事件
+追加写入磁盘文件，续传时从文件中读取。
+"""
+
+import asyncio
+import os
+import re
+from collections import deque
+from typing import AsyncGenerator, Deque, Dict, List, Optional, Tuple
+
+from app.monitoring.metrics import REGISTRY, MetricsRegistry
+from app.utils.logger import logger
+
+_EVENT_ID = re.compile(r"^(chatcmpl-[0-9A-Za-z]+):(\d+)$")
+
+
+def parse_event_id(value: Optional[str]) -> Optional[Tuple[str, int]]:
+    """解析 ``Last-Event-ID``
+
+    Args:
+        value: 请求头的值
+
+    Returns:
+        Optional[Tuple[str, int]]: (chat_id, 序号)，格式无效时返回 None
+    """
+    match = _EVENT_ID.match((value or "").strip())
+    if match is None:
+        return None
+    return match.group(1), int(match.group(2))
+
+
+class StreamBuffer:
+    """单个流的事件缓冲区，事件序号从 0 开始连续编号"""
+
+    def __init__(self, chat_id: str, tenant_id: str, max_bytes: int, spill_dir: Optional[str] = None):
+        """初始化缓冲区
+
+        Args:
+            chat_id: 会话ID
+            tenant_id: 流所属的租户，只有同一租户可以续传
+            max_bytes: 内存中保留的最大字节数
+            spill_dir: 溢出目录，为空时直接丢弃超出的事件
+        """
+        self.chat_id = chat_id
+        self.tenant_id = tenant_id
+        self.max_bytes = max_bytes
+        self.done = False
+        self.subscribers = 0
+        self._events: Deque[bytes] = deque()
+        self._bytes = 0
+        # 内存中第一个事件的序号
+        self._first_seq = 0
+        self._changed = asyncio.Event()
+        self._spill_path = os.path.join(spill_dir, f"{chat_id}.sse") if spill_dir else None
+        self._spill_file = None
+        # 已溢出事件在文件中的起始位置，下标即序号
+        self._spill_offsets: List[int] = []
+        self._spill_size = 0
+
+    @property
+    def next_seq(self) -> int:
+        """下一个事件的序号"""
+        return self._first_seq + len(self._events)
+
+    @property
+    def size(self) -> int:
+        """内存中的字节数"""
+        return self._bytes
+
+    def can_resume(self, last_seq: int) -> bool:
+        """序号 last_seq 之后的事件是否都还能取回"""
+        seq = last_seq + 1
+        if seq > self.next_seq:
+            return False
+        if seq >= self._first_seq:
+            return True
+        # 被丢弃的事件都已经写入溢出文件
+        return self._spill_file is not None and len(self._spill_offsets) == self._first_seq
+
+    def append(self, event: bytes) -> None:
+        """追加一个事件并通知订阅者"""
+        self._events.append(event)
+        self._bytes += len(event)
+        while self._bytes > self.max_bytes and len(self._events) > 1:
+            self._evict()
+        self._notify()
+
+    def _evict(self) -> None:
+        event = self._events.popleft()
+        self._bytes -= len(event)
+        if self._spill_path is not None:
+            try:
+                if self._spill_file is None:
+                    self._spill_file = open(self._spill_path, "wb")
+                self._spill_file.write(event)
+                self._spill_offsets.append(self._spill_size)
+                self._spill_size += len(event)
+            except OSError as e:
+                logger.error(f"写入流溢出文件失败，不再溢出: {e}")
+                self._close_spill()
+                self._spill_path = None
+        self._first_seq += 1
+
+    @staticmethod
+    def _read_spilled(path: str, start: int, end: int) -> bytes:
+        with open(path, "rb") as f:
+            f.seek(start)
+            return f.read(end - start)
+
+    def finish(self) -> None:
+        """标记流已结束"""
+        self.done = True
+        self._notify()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def subscribe(self, last_seq: int = -1) -> AsyncGenerator[bytes, None]:
+        """从 last_seq 之后开始输出事件，直到流结束
+
+        Args:
+            last_seq: 客户端已经收到的最后一个事件的序号，-1 表示从头开始
+
+        Yields:
+            bytes: SSE 事件（已溢出的部分合并为一块）
+        """
+        seq = last_seq + 1
+        while True:
+            if seq < self._first_seq:
+                if seq >= len(self._spill_offsets) or self._spill_file is None:
+                    # 消费太慢，未读的事件已经被丢弃
+                    logger.warning(f"流 {self.chat_id} 的订阅者落后于缓冲区，断开连接")
+                    return
+                # 在事件循环中 flush，读取在线程中进行，只读取到当前的文件末尾
+                self._spill_file.flush()
+                spilled = len(self._spill_offsets)
+                yield await asyncio.to_thread(
+                    self._read_spilled, self._spill_path, self._spill_offsets[seq], self._spill_size
+                )
+                seq = spilled
+                continue
+            if seq < self.next_seq:
+                yield self._events[seq - self._first_seq]
+                seq += 1
+                continue
+            if self.done:
+                return
+            await self._changed.wait()
+
+    def _close_spill(self) -> None:
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
+
+    def close(self) -> None:
+        """释放缓冲区并删除溢出文件"""
+        self._events.clear()
+        self._bytes = 0
+        self._close_spill()
+        if self._spill_path is not None and self._spill_offsets:
+            try:
+                os.remove(self._spill_path)
+            except OSError:
+                pass
+
+
+class StreamRegistry:
+    """进行中与刚结束的流，按 chat_id 查找"""
+
+    def __init__(
+        self,
+        ttl: float = 300.0,
+        max_bytes: int = 1024 * 1024,
+        detach_timeout: float = 60.0,
+        spill_dir: Optional[str] = None,
+        registry: MetricsRegistry = REGISTRY,
+    ):
+        """初始化
+
+        Args:
+            ttl: 流结束后保留缓冲区的时间(秒)
+            max_bytes: 每个流在内存中保留的最大字节数
+            detach_timeout: 没有订阅者时管道继续运行的时间(秒)
+            spill_dir: 溢出目录，为空时不溢出到磁盘
+            registry: 指标注册表
+        """
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.detach_timeout = detach_timeout
+        self.spill_dir = spill_dir
+        self._buffers: Dict[str, StreamBuffer] = {}
+        self._producers: Dict[str, asyncio.Task] = {}
+        self._detach_timers: Dict[str, asyncio.TimerHandle] = {}
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+        self._resumes = registry.counter(
+            "deepxy_stream_resumes_total", "带 Last-Event-ID 的重新连接", ("outcome",)
+        )
+        self._abandoned = registry.counter(
+            "deepxy_stream_abandoned_total", "客户端断开后未重新连接而取消的流"
+        )
+        registry.gauge("deepxy_stream_buffers", "保留中的流缓冲区数").set_function(
+            lambda: len(self._buffers)
+        )
+        registry.gauge("deepxy_stream_buffer_bytes", "流缓冲区占用的内存字节数").set_function(
+            lambda: sum(buffer.size for buffer in self._buffers.values())
+        )
+
+    def start(self, chat_id: str, tenant_id: str, source: AsyncGenerator[bytes, None]) -> StreamBuffer:
+        """在后台任务中运行管道，输出写入新的缓冲区
+
+        Args:
+            chat_id: 会话ID，与事件 id 中的一致
+            tenant_id: 流所属的租户
+            source: 管道输出的 SSE 事件
+
+        Returns:
+            StreamBuffer: 缓冲区，客户端通过 subscribe() 读取
+        """
+        buffer = StreamBuffer(chat_id, tenant_id, self.max_bytes, self.spill_dir)
+        self._buffers[chat_id] = buffer
+        self._producers[chat_id] = asyncio.get_running_loop().create_task(self._produce(buffer, source))
+        # 客户端在响应开始前断开时也不会一直运行
+        self._arm_detach_timer(buffer)
+        return buffer
+
+    async def _produce(self, buffer: StreamBuffer, source: AsyncGenerator[bytes, None]) -> None:
+        try:
+            async for event in source:
+                buffer.append(event)
+        except asyncio.CancelledError:
+            logger.info(f"流 {buffer.chat_id} 已取消")
+        except Exception as e:
+            logger.error(f"流 {buffer.chat_id} 处理失败: {e}")
+        finally:
+            buffer.finish()
+            self._producers.pop(buffer.chat_id, None)
+            self._cancel_detach_timer(buffer.chat_id)
+            await source.aclose()
+            if self.ttl > 0:
+                asyncio.get_running_loop().call_later(self.ttl, self._expire, buffer)
+            else:
+                self._expire(buffer)
+
+    def _expire(self, buffer: StreamBuffer) -> None:
+        if self._buffers.get(buffer.chat_id) is buffer:
+            del self._buffers[buffer.chat_id]
+        # 仍有订阅者时等最后一个订阅者读完再释放
+        if buffer.subscribers == 0:
+            buffer.close()
+
+    def _arm_detach_timer(self, buffer: StreamBuffer) -> None:
+        self._cancel_detach_timer(buffer.chat_id)
+        if not buffer.done:
+            self._detach_timers[buffer.chat_id] = asyncio.get_running_loop().call_later(
+                self.detach_timeout, self._abandon, buffer
+            )
+
+    def _cancel_detach_timer(self, chat_id: str) -> None:
+        timer = self._detach_timers.pop(chat_id, None)
+        if timer is not None:
+            timer.cancel()
+
+    def _abandon(self, buffer: StreamBuffer) -> None:
+        self._detach_timers.pop(buffer.chat_id, None)
+        producer = self._producers.get(buffer.chat_id)
+        if buffer.subscribers == 0 and producer is not None:
+            logger.info(f"流 {buffer.chat_id} 的客户端 {self.detach_timeout:.0f}s 内没有重新连接，取消上游请求")
+            self._abandoned.inc()
+            producer.cancel()
+
+    async def attach(self, buffer: StreamBuffer, last_seq: int = -1) -> AsyncGenerator[bytes, None]:
+        """订阅缓冲区，最后一个订阅者断开时开始计时取消管道
+
+        Args:
+            buffer: 缓冲区
+            last_seq: 客户端已经收到的最后一个事件的序号
+
+        Yields:
+            bytes: SSE 事件
+        """
+        buffer.subscribers += 1
+        self._cancel_detach_timer(buffer.chat_id)
+        try:
+            async for event in buffer.subscribe(last_seq):
+                yield event
+        finally:
+            buffer.subscribers -= 1
+            if buffer.subscribers == 0:
+                if self._buffers.get(buffer.chat_id) is not buffer:
+                    buffer.close()
+                else:
+                    self._arm_detach_timer(buffer)
+
+    def resume(self, last_event_id: Optional[str], tenant_id: str) -> Optional[AsyncGenerator[bytes, None]]:
+        """按 Last-Event-ID 续传
+
+        Args:
+            last_event_id: 请求头的值
+            tenant_id: 请求所属的租户
+
+        Returns:
+            Optional[AsyncGenerator[bytes, None]]: 续传的事件流；流不存在、已过期、
+            属于其他租户或所需事件已被丢弃时返回 None，由调用方按新请求处理
+        """
+        parsed = parse_event_id(last_event_id)
+        if parsed is None:
+            return None
+        chat_id, last_seq = parsed
+        buffer = self._buffers.get(chat_id)
+        if buffer is None or buffer.tenant_id != tenant_id or not buffer.can_resume(last_seq):
+            self._resumes.inc(outcome="missed")
+            return None
+        self._resumes.inc(outcome="replayed" if buffer.done else "reattached")
+        return self.attach(buffer, last_seq)
+
+    async def close(self) -> None:
+        """取消进行中的管道并释放所有缓冲区"""
+        producers = list(self._producers.values())
+        for producer in producers:
+            producer.cancel()
+        await asyncio.gather(*producers, return_exceptions=True)
+        for buffer in list(self._buffers.values()):
+            self._expire(buffer)
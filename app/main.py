@@ -1,69 +1,309 @@
-import os
+import asyncio
 import sys
+from contextlib import asynccontextmanager
+from functools import partial
 
-from dotenv import load_dotenv
 from fastapi import Depends, FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 
+from app.clients import BaseClient, ProviderRegistry
+from app.clients.timeouts import (
+    ANSWER_TIMEOUTS,
+    DEADLINE_HEADER,
+    REASONING_TIMEOUTS,
+    parse_deadline_header,
+    parse_timeouts,
+    remaining,
+    set_deadline,
+)
+from app.config import get_settings
+from app.deepxy.bypass import build_bypass
+from app.deepxy.conversations import ConversationStore
 from app.deepxy.deepxy import DeepXY
-from app.utils.auth import verify_api_key
+from app.deepxy.resume import StreamRegistry
+from app.monitoring import metrics, tracing
+from app.monitoring.admission import AdmissionController, parse_priority_keys, release_after
+from app.monitoring.degradation import DegradationController, parse_levels, parse_slo
+from app.monitoring.drain import DrainController
+from app.monitoring.health import ReadinessState, warm_up
+from app.monitoring.loop_monitor import LoopLagMonitor
+from app.utils import json_codec
+from app.utils.auth import KeyStore, Tenant, admin_key_verifier, api_key_verifier
+from app.utils.errors import DeepClaudeError, InvalidRequestError
 from app.utils.logger import logger
+from app.utils.quota import QuotaManager
+from app.utils.schemas import (
+    answer_candidates,
+    check_message_limits,
+    read_body,
+    request_adapter,
+    validate_chat_request,
+)
 
-# 加载环境变量
-load_dotenv()
+# 加载配置（.env 只在这里读取一次）
+settings = get_settings()
+if settings.json_backend:
+    json_codec.use_backend(settings.json_backend)
 
-app = FastAPI(title="DeepXY API")
+# 就绪状态，启动预热完成后就绪
+readiness = ReadinessState()
 
-# 从环境变量获取 CORS配置, API 密钥、地址以及模型名称
-ALLOW_ORIGINS = os.getenv("ALLOW_ORIGINS", "*")
+# 收到 SIGTERM 时排空进行中的请求，再关闭连接池
+drain = DrainController(readiness, settings.drain_grace_period, on_drained=BaseClient.close_sessions)
 
-# DashScope 配置
-DASHSCOPE_API_KEY = os.getenv("DASHSCOPE_API_KEY")
-DASHSCOPE_API_URL = os.getenv("DASHSCOPE_API_URL", "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions")
+# 准入控制：按优先级限制并发，过载时排队或返回 429
+loop_monitor = LoopLagMonitor(slow_callback_threshold=settings.slow_callback_threshold)
+admission = AdmissionController(
+    max_in_flight=settings.admission_max_in_flight,
+    max_queue=settings.admission_queue_size,
+    queue_timeout=settings.admission_queue_timeout,
+    max_loop_lag=settings.admission_max_loop_lag,
+    max_rss_bytes=settings.admission_max_rss_mb * 1024 * 1024,
+    priority_keys=parse_priority_keys(settings.priority_api_keys),
+    loop_monitor=loop_monitor,
+)
 
-# 模型配置
-DEEPSEEK_MODEL = os.getenv("DEEPSEEK_MODEL", "deepseek-r1")
-QWEN_MODEL = os.getenv("QWEN_MODEL", "qwen2.5-14b-instruct-1m")
+# 租户认证、配额与用量账本
+key_store = KeyStore(settings.api_keys_file, settings.allow_api_key, settings.api_keys_reload_interval)
+verify_api_key = api_key_verifier(key_store)
+usage_ledger = None
+if settings.usage_ledger_path:
+    from app.monitoring.ledger import UsageLedger
 
-IS_ORIGIN_REASONING = os.getenv("IS_ORIGIN_REASONING", "True").lower() == "true"
+    usage_ledger = UsageLedger(settings.usage_ledger_path, flush_interval=settings.usage_ledger_flush_interval)
+quota = QuotaManager(usage_ledger)
+
+# 抽样录制线上流量，供离线回放压测
+capture = None
+if settings.capture_dir:
+    from app.monitoring.capture import TrafficCapture, load_redactor, redact_pii
+
+    redactors = [redact_pii] if settings.capture_redact_pii else []
+    redactors += [load_redactor(path) for path in settings.capture_redactors]
+    capture = TrafficCapture(
+        settings.capture_dir,
+        sample_rate=settings.capture_sample_rate,
+        max_segment_bytes=settings.capture_segment_mb * 1024 * 1024,
+        max_segments=settings.capture_max_segments,
+        redactors=redactors,
+    )
+
+# 服务端保存的对话历史
+conversations = None
+if settings.conversation_ttl > 0:
+    conversations = ConversationStore(settings.conversation_ttl, settings.conversation_max_turns)
+
+# 断线续传：管道在后台运行，输出保存在每个流的缓冲区中
+streams = None
+if settings.stream_resume_ttl > 0:
+    streams = StreamRegistry(
+        ttl=settings.stream_resume_ttl,
+        max_bytes=settings.stream_buffer_max_bytes,
+        detach_timeout=settings.stream_detach_timeout,
+        spill_dir=settings.stream_spill_dir,
+    )
+
+# 分布式追踪：按比例抽样，结束的 span 由后台任务批量导出
+tracer = tracing.build_tracer(
+    settings.tracing_exporter,
+    settings.tracing_endpoint,
+    settings.tracing_file,
+    settings.tracing_sample_rate,
+    settings.tracing_service_name,
+)
+if tracer is not None:
+    tracing.set_tracer(tracer)
+
+# 按 SLO 自动降级：阶段耗时或排队超出目标时缩短推理、换用小模型、低优先级跳过推理
+degradation = None
+slo = parse_slo(settings.slo_p95)
+if slo:
+    degradation = DegradationController(
+        slo,
+        parse_levels(settings.degrade_levels),
+        queue_depth=lambda: admission.queue_length,
+        max_queue_depth=settings.degrade_max_queue,
+        window=settings.degrade_window,
+        recover_after=settings.degrade_recover_after,
+    )
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """启动时在后台预热上游连接并接管 SIGTERM，退出时关闭连接池"""
+    drain.install_signal_handler()
+    loop_monitor.start()
+    # 预先编译请求校验器，避免第一个请求承担编译耗时
+    request_adapter(settings.max_messages, settings.max_message_chars)
+    key_store.start()
+    if usage_ledger is not None:
+        usage_ledger.start()
+    if capture is not None:
+        capture.start()
+    if tracer is not None:
+        tracer.processor.start()
+    if degradation is not None:
+        degradation.install()
+    if deep_xy.reasoning_bypass is not None:
+        deep_xy.reasoning_bypass.install()
+    api_urls = {provider.api_url for provider in registry.providers.values() if provider.api_key}
+    api_urls.add(settings.dashscope_api_url)
+    warmup_task = asyncio.create_task(warm_up(
+        readiness,
+        deep_xy.qwen_client,
+        sorted(api_urls),
+        connections=settings.warmup_connections,
+        timeout=settings.warmup_timeout,
+    ))
+    yield
+    warmup_task.cancel()
+    await loop_monitor.stop()
+    if degradation is not None:
+        degradation.uninstall()
+    if deep_xy.reasoning_bypass is not None:
+        deep_xy.reasoning_bypass.uninstall()
+    if streams is not None:
+        await streams.close()
+    await key_store.stop()
+    if usage_ledger is not None:
+        await usage_ledger.stop()
+    if capture is not None:
+        await capture.stop()
+    if tracer is not None:
+        await tracer.processor.stop()
+    await BaseClient.close_sessions()
 
-# 检查环境变量状态
-logger.info(f"DASHSCOPE_API_KEY环境变量状态: {'已设置' if DASHSCOPE_API_KEY else '未设置'}")
 
-# CORS设置
-allow_origins_list = ALLOW_ORIGINS.split(",") if ALLOW_ORIGINS else []
+app = FastAPI(title="DeepXY API", lifespan=lifespan)
+
+
+@app.exception_handler(DeepClaudeError)
+async def deep_claude_error_handler(request: Request, exc: DeepClaudeError):
+    """按 docs/error_codes.md 的格式返回错误"""
+    headers = {}
+    if "retry_after" in exc.details:
+        headers["Retry-After"] = str(exc.details["retry_after"])
+    error = {
+        "message": exc.message,
+        "code": exc.error_code,
+        "status": exc.http_status,
+        "details": exc.details,
+    }
+    # 与 OpenAI 的错误格式兼容
+    for key in ("type", "param"):
+        if key in exc.details:
+            error[key] = exc.details[key]
+    return JSONResponse({"error": error}, status_code=exc.http_status, headers=headers)
+
+# 模型配置
+DEEPSEEK_MODEL = settings.deepseek_model
+QWEN_MODEL = settings.qwen_model
+
+# 检查环境变量状态
+logger.info(f"DASHSCOPE_API_KEY环境变量状态: {'已设置' if settings.dashscope_api_key else '未设置'}")
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=allow_origins_list,
+    allow_origins=list(settings.allow_origins),
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
 # 创建 DeepXY 实例
-if not DASHSCOPE_API_KEY:
+if not settings.dashscope_api_key:
     logger.critical("请设置环境变量 DASHSCOPE_API_KEY")
     sys.exit(1)
 
+# 上游服务与模型路由在启动时加载一次
+registry = ProviderRegistry.from_settings(settings)
+# 超大请求体（长上下文）流式上传
+BaseClient.LARGE_PAYLOAD_CHARS = settings.large_payload_chars
+
 deep_xy = DeepXY(
-    DASHSCOPE_API_KEY,
-    DASHSCOPE_API_KEY,
-    DASHSCOPE_API_URL,
-    DASHSCOPE_API_URL,
-    IS_ORIGIN_REASONING,
+    settings.dashscope_api_key,
+    settings.dashscope_api_key,
+    settings.dashscope_api_url,
+    settings.dashscope_api_url,
+    settings.is_origin_reasoning,
+    registry,
+    settings.prompt_cache_hints,
+    settings.non_stream_timeout,
+    build_bypass(
+        settings.reasoning_bypass, settings.reasoning_bypass_model, settings.reasoning_bypass_threshold
+    ),
+    settings.answer_continuation_attempts,
+    settings.answer_fallback_models,
+    parse_timeouts(settings.reasoning_timeouts, REASONING_TIMEOUTS),
+    parse_timeouts(settings.answer_timeouts, ANSWER_TIMEOUTS),
 )
 
-# 验证日志级别
-logger.debug("当前日志级别为 DEBUG")
-logger.info("开始请求")
-
 @app.get("/")
 async def root():
     logger.info("访问了根路径")
     return {"message": "Welcome to DeepXY API"}
 
+@app.get("/health/live")
+async def health_live():
+    """存活检查"""
+    return {"status": "alive"}
+
+
+# 兼容旧的健康检查地址
+app.add_api_route("/health", health_live, methods=["GET"])
+
+
+@app.get("/health/ready")
+async def health_ready():
+    """就绪检查，启动预热完成前返回 503"""
+    return JSONResponse(readiness.snapshot(), status_code=200 if readiness.ready else 503)
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus 指标"""
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+
+verify_admin_key = admin_key_verifier(settings.admin_api_key)
+
+
+@app.get("/admin/loop", dependencies=[Depends(verify_admin_key)])
+async def admin_loop():
+    """事件循环延迟与最近的慢回调"""
+    return loop_monitor.snapshot()
+
+
+@app.get("/admin/degradation", dependencies=[Depends(verify_admin_key)])
+async def admin_degradation():
+    """当前的降级等级与各阶段的滚动延迟"""
+    if degradation is None:
+        return {"enabled": False}
+    return {"enabled": True, **degradation.snapshot()}
+
+
+@app.get("/admin/profile", dependencies=[Depends(verify_admin_key)])
+async def admin_profile(seconds: float = 10.0, mode: str = "sampling", interval_ms: float = 5.0):
+    """剖析进程一段时间
+
+    sampling 模式返回 collapsed stack，可直接用于生成火焰图；
+    cprofile 模式返回按累计耗时排序的统计结果。
+    """
+    from app.monitoring import profiler
+
+    try:
+        result = await profiler.profile(seconds, mode, interval_ms / 1000)
+    except ValueError as e:
+        raise InvalidRequestError(str(e))
+    except profiler.ProfilerBusyError as e:
+        return JSONResponse(
+            {"error": {"message": str(e), "code": "PROFILER_BUSY", "status": 409}},
+            status_code=409,
+        )
+    return PlainTextResponse(result)
+
+
 @app.get("/v1/models")
 async def list_models():
     """
@@ -100,67 +340,204 @@ async def list_models():
     return {"object": "list", "data": models}
 
 @app.post("/v1/chat/completions")
-async def chat_completions(request: Request):
+async def chat_completions(request: Request, tenant: Tenant = Depends(verify_api_key)):
     """处理聊天完成请求，支持流式和非流式输出
 
     请求体格式应与 OpenAI API 保持一致，包含：
     - messages: 消息列表
     - model: 模型名称（可选）
     - stream: 是否使用流式输出（可选，默认为 True)
-    - temperature: 随机性 (可选)
+    - temperature: 随机性（可选，0 到 2）
     - top_p: top_p (可选)
     - presence_penalty: 话题新鲜度（可选）
     - frequency_penalty: 频率惩罚度（可选）
+
+    带 ``Last-Event-ID`` 请求头时，如果对应的流仍在进行或刚结束，直接从缓冲区续传。
+    带 ``X-Request-Timeout`` 请求头（剩余秒数）时，上游请求不超过这个时间，并把剩余时间转发给上游。
+    带 ``traceparent`` 请求头时，请求的 span 沿用其中的 trace。
     """
 
+    # 断线重连：从缓冲区续传，不再请求上游
+    last_event_id = request.headers.get("Last-Event-ID")
+    if last_event_id and streams is not None:
+        resumed = streams.resume(last_event_id, tenant.id)
+        if resumed is not None:
+            return StreamingResponse(resumed, media_type="text/event-stream")
+
+    # 请求的截止时间，保存在上下文变量中，由上游客户端读取
+    set_deadline(parse_deadline_header(request.headers.get(DEADLINE_HEADER)))
+
+    # 排空期间不再接受新的请求；接受的请求从这里起计入进行中的请求，直到响应结束
+    slot = drain.admit()
+    if slot is None:
+        return JSONResponse(
+            {"error": {"message": "服务正在重启，请稍后重试", "code": "SERVICE_DRAINING", "status": 503}},
+            status_code=503,
+            headers={"Retry-After": "5"},
+        )
+
+    # 被抽中的请求记录请求与响应
+    captured = capture.begin(tenant.id, request.headers) if capture is not None else None
+
+    # 请求的 span，阶段任务与上游请求的 span 都是它的子 span；流式请求在输出结束时结束
+    root_span = tracing.start_span(
+        "chat_completions",
+        kind="server",
+        parent=tracing.parse_traceparent(
+            request.headers.get(tracing.TRACEPARENT_HEADER), request.headers.get(tracing.TRACESTATE_HEADER)
+        ),
+    )
+    tracing.use_span(root_span)
+    root_span.set_attribute("deepxy.tenant", tenant.id)
+    streaming = False
     try:
-        # 1. 获取基础信息
-        body = await request.json()
-        messages = body.get("messages")
+        # 1. 读取并校验请求体，过大时返回 413，参数无效时返回 400，此时还没有连接上游
+        # 不保留原始请求体的引用，解析后即可释放（长上下文请求可达数 MB）
+        body = validate_chat_request(
+            await read_body(request.stream(), settings.max_body_bytes, request.headers.get("Content-Length")),
+            settings.max_messages,
+            settings.max_message_chars,
+        )
+        messages = body["messages"]
+
+        # 服务端保存的对话：客户端只发送新的消息，历史由网关拼接
+        previous_response_id = body.get("previous_response_id")
+        if previous_response_id is not None:
+            if conversations is None:
+                raise InvalidRequestError(
+                    "服务端未启用对话保存",
+                    details={"type": "invalid_request_error", "param": "previous_response_id"},
+                )
+            messages = conversations.history(previous_response_id, tenant.id) + messages
+            check_message_limits(
+                messages, settings.max_messages, settings.max_message_chars, param="previous_response_id"
+            )
+        # 继续已保存的对话时默认保存本轮
+        store = conversations is not None and body.get("store", previous_response_id is not None)
+        if captured is not None:
+            # 录制拼接后的完整历史，回放时不依赖网关保存的对话
+            captured.request = {
+                key: value for key, value in body.items() if key not in ("previous_response_id", "store")
+            }
+            captured.request["messages"] = messages
 
         # 获取模型id
-        body_model = body.get("model", "qwen2.5-14b-instruct-1m")
-        qwen_model = QWEN_MODEL if QWEN_MODEL != "" else body_model
+        qwen_model = QWEN_MODEL if QWEN_MODEL != "" else body["model"]
+        root_span.set_attributes({"gen_ai.request.model": qwen_model, "deepxy.stream": body["stream"]})
 
-        # 2. 获取并验证参数
+        # 2. 获取参数
         model_arg = get_and_validate_params(body)
         stream = model_arg[4]  # 获取 stream 参数
+        # n > 1 时共用一次推理生成多个候选回答
+        candidates = answer_candidates(body, qwen_model)
+
+        # 3. 租户配额与准入控制，被拒绝时返回 429
+        lease = quota.acquire(tenant, messages)
+        lease.model = qwen_model
+        lease.stream = stream
+        lease.request_id = request.headers.get("X-Request-ID", "")
+        authorization = request.headers.get("Authorization", "")
+        priority = admission.priority_for(
+            authorization.removeprefix("Bearer ").strip() or None,
+            request.headers.get("X-Priority"),
+            tenant.priority,
+        )
+        try:
+            ticket = await admission.acquire(priority)
+        except BaseException:
+            lease.cancel()
+            raise
+
+        # 过载降级：限制推理 token 数、换用小模型或跳过推理阶段
+        max_reasoning_tokens = None
+        if degradation is not None:
+            max_reasoning_tokens, answer_model = degradation.plan(priority)
+            if answer_model is not None:
+                qwen_model = lease.model = answer_model
+                candidates = [(answer_model, args) for _, args in candidates]
+
+        # 4. 根据 stream 参数返回相应的响应
+        def save_turn(chat_id: str, reasoning: str, answer: str) -> None:
+            if answer:
+                conversations.save(
+                    chat_id, tenant.id, previous_response_id, body["messages"], answer, reasoning
+                )
 
-        # 3. 根据 stream 参数返回相应的响应
         if stream:
-            return StreamingResponse(
+            chat_id = deep_xy.new_chat_id()
+            events = drain.track_stream(release_after(
                 deep_xy.chat_completions_with_stream(
                     messages=messages,
                     model_arg=model_arg[:4],  # 不传递 stream 参数
                     deepseek_model=DEEPSEEK_MODEL,
                     qwen_model=qwen_model,
+                    usage=lease.usage,
+                    candidates=candidates,
+                    chat_id=chat_id,
+                    on_finish=partial(save_turn, chat_id) if store else None,
+                    max_reasoning_tokens=max_reasoning_tokens,
+                    reasoning=body.get("reasoning", "auto"),
                 ),
-                media_type="text/event-stream",
-            )
+                ticket,
+                lease,
+            ), slot)
+            if streams is not None:
+                events = streams.attach(streams.start(chat_id, tenant.id, events))
+            if captured is not None:
+                events = capture.wrap_stream(events, captured)
+            events = tracing.end_after(events, root_span)
+            streaming = True
+            return StreamingResponse(events, media_type="text/event-stream")
         else:
             # 非流式输出
-            response = await deep_xy.chat_completions_without_stream(
-                messages=messages,
-                model_arg=model_arg[:4],  # 不传递 stream 参数
-                deepseek_model=DEEPSEEK_MODEL,
-                qwen_model=qwen_model,
-            )
+            left = remaining()
+            try:
+                async with drain.track_request(slot):
+                    response = await deep_xy.chat_completions_without_stream(
+                        messages=messages,
+                        model_arg=model_arg[:4],  # 不传递 stream 参数
+                        deepseek_model=DEEPSEEK_MODEL,
+                        qwen_model=qwen_model,
+                        timeout=min(left, settings.non_stream_timeout) if left is not None else None,
+                        usage=lease.usage,
+                        candidates=candidates,
+                        max_reasoning_tokens=max_reasoning_tokens,
+                        reasoning=body.get("reasoning", "auto"),
+                    )
+            finally:
+                ticket.release()
+                lease.release()
+            if store:
+                message = response["choices"][0]["message"]
+                save_turn(response["id"], message.get("reasoning_content", ""), message["content"])
+            if captured is not None:
+                capture.finish(captured, response=response)
             return response
 
+    except DeepClaudeError as e:
+        if captured is not None:
+            capture.finish(captured, status=e.http_status)
+        root_span.set_attribute("http.response.status_code", e.http_status)
+        root_span.record_error(e)
+        raise
     except Exception as e:
         logger.error(f"处理请求时发生错误: {e}")
+        if captured is not None:
+            capture.finish(captured, status=500, completed=False)
+        root_span.record_error(e)
         return {"error": str(e)}
+    finally:
+        if not streaming:
+            # 没有交给 track_request/track_stream 的请求（校验失败、被拒绝等）在这里释放
+            slot.release()
+            root_span.end()
 
 def get_and_validate_params(body):
-    """提取获取和验证请求参数的函数"""
-    temperature: float = body.get("temperature", 0.7)
-    top_p: float = body.get("top_p", 0.95)
-    presence_penalty: float = body.get("presence_penalty", 0.0)
-    frequency_penalty: float = body.get("frequency_penalty", 0.0)
-    stream: bool = body.get("stream", True)
-
-    # 验证温度参数
-    if not isinstance(temperature, (float)) or temperature < 0.0 or temperature > 1.0:
-        raise ValueError("temperature 必须在 0 到 1 之间")
-
-    return (temperature, top_p, presence_penalty, frequency_penalty, stream)
+    """提取模型参数，取值范围已经由 validate_chat_request 校验"""
+    return (
+        body["temperature"],
+        body["top_p"],
+        body["presence_penalty"],
+        body["frequency_penalty"],
+        body["stream"],
+    )
@@ -1,11 +1,41 @@
-"""监控模块"""
+"""监控模块
 
-from .performance import ModelPerformanceMonitor
-from .failover import ModelFailoverHandler
-from .cache import ModelResponseCache
+子模块在首次访问时才导入，导入本包不会加载未使用的监控组件。
+"""
+
+import importlib
+
+_EXPORTS = {
+    "ModelPerformanceMonitor": ".performance",
+    "ModelFailoverHandler": ".failover",
+    "ModelResponseCache": ".cache",
+    "ReadinessState": ".health",
+    "DrainController": ".drain",
+    "MetricsRegistry": ".metrics",
+    "AdmissionController": ".admission",
+    "LoopLagMonitor": ".loop_monitor",
+    "SamplingProfiler": ".profiler",
+    "timed": ".timing",
+}
 
 __all__ = [
     "ModelPerformanceMonitor",
     "ModelFailoverHandler",
-    "ModelResponseCache"
-] 
\ No newline at end of file
+    "ModelResponseCache",
+    "ReadinessState",
+    "DrainController",
+    "MetricsRegistry",
+    "AdmissionController",
+    "LoopLagMonitor",
+    "SamplingProfiler",
+    "timed",
+]
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
@@ -0,0 +1,321 @@
+"""准入控制与负载卸除
+
+根据进行中的请求数、事件循环延迟与进程内存决定是否接受新的对话请求：
+- 请求按 API Key 或 X-Priority 请求头分为 high / normal / low 三个优先级
+- 每个优先级只能使用一部分并发额度，负载升高时低优先级最先排队或被拒绝，
+  高优先级始终保留余量
+- 超出额度的请求进入有界的等待队列，按优先级出队；预计等待时间超过截止时间、
+  队列已满或等待超时时立即返回 429 与 Retry-After，而不是让所有请求一起超时
+- 事件循环延迟或内存超过阈值（按优先级缩放）时直接拒绝
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import resource
+import time
+import weakref
+from typing import AsyncGenerator, Dict, List, Mapping, Optional
+
+from app.utils.errors import RateLimitError
+from .loop_monitor import LoopLagMonitor
+from .metrics import REGISTRY, MetricsRegistry
+
+# 优先级，数值越小越重要
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+PRIORITY_NAMES = {value: name for name, value in PRIORITIES.items()}
+DEFAULT_PRIORITY = PRIORITIES["normal"]
+
+# 各优先级可以使用的并发额度比例，事件循环延迟与内存阈值同样按该比例缩放
+CAPACITY_SHARE = {0: 1.0, 1: 0.85, 2: 0.6}
+
+
+def parse_priority_keys(value: str) -> Dict[str, int]:
+    """解析 ``key1:high,key2:low`` 格式的 API Key 优先级配置"""
+    keys = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        key, _, name = item.rpartition(":")
+        if not key or name not in PRIORITIES:
+            raise ValueError(f"无效的优先级配置: {item}")
+        keys[key] = PRIORITIES[name]
+    return keys
+
+
+def current_rss_bytes() -> int:
+    """当前进程的常驻内存，无法读取 /proc 时退化为峰值内存"""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class AdmissionTicket:
+    """占用的并发额度，请求结束时释放"""
+
+    __slots__ = ("controller", "priority", "admitted_at", "_released")
+
+    def __init__(self, controller: "AdmissionController", priority: int):
+        self.controller = controller
+        self.priority = priority
+        self.admitted_at = time.monotonic()
+        self._released = False
+
+    def release(self) -> None:
+        """释放额度，重复调用无副作用"""
+        if not self._released:
+            self._released = True
+            self.controller._release(self)
+
+
+class _Waiter:
+    __slots__ = ("priority", "deadline", "future")
+
+    def __init__(self, priority: int, deadline: float, future: asyncio.Future):
+        self.priority = priority
+        self.deadline = deadline
+        self.future = future
+
+
+class AdmissionController:
+    """准入控制器"""
+
+    def __init__(
+        self,
+        max_in_flight: int = 256,
+        max_queue: int = 128,
+        queue_timeout: float = 10.0,
+        max_loop_lag: float = 0.2,
+        max_rss_bytes: int = 0,
+        priority_keys: Optional[Mapping[str, int]] = None,
+        loop_monitor: Optional[LoopLagMonitor] = None,
+        registry: MetricsRegistry = REGISTRY,
+    ):
+        """初始化准入控制器
+
+        Args:
+            max_in_flight: 最大并发请求数，0 表示不限制
+            max_queue: 等待队列长度
+            queue_timeout: 最长排队时间(秒)
+            max_loop_lag: 事件循环延迟阈值(秒)，0 表示不检查
+            max_rss_bytes: 内存阈值(字节)，0 表示不检查
+            priority_keys: API Key 到优先级的映射
+            loop_monitor: 事件循环延迟采样器
+            registry: 指标注册表
+        """
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.max_loop_lag = max_loop_lag
+        self.max_rss_bytes = max_rss_bytes
+        self.priority_keys = dict(priority_keys or {})
+        self.loop_monitor = loop_monitor
+        self.in_flight = 0
+        # 平均占用时长，用于估计排队时间
+        self.avg_service_time = 0.0
+
+        self._queue: List[tuple] = []
+        self._queued = {priority: 0 for priority in CAPACITY_SHARE}
+        self._seq = itertools.count()
+
+        registry.gauge("deepxy_admission_in_flight", "占用并发额度的请求数").set_function(
+            lambda: self.in_flight
+        )
+        registry.gauge("deepxy_admission_queue_length", "排队等待的请求数").set_function(
+            lambda: self.queue_length
+        )
+        self._admitted = registry.counter(
+            "deepxy_admission_admitted_total", "被接受的请求数", ("priority",)
+        )
+        self._rejected = registry.counter(
+            "deepxy_admission_rejected_total", "被拒绝的请求数", ("priority", "reason")
+        )
+        self._wait_seconds = registry.counter(
+            "deepxy_admission_queue_wait_seconds_total", "排队等待的总时长", ("priority",)
+        )
+
+    @property
+    def queue_length(self) -> int:
+        """排队等待的请求数"""
+        return sum(self._queued.values())
+
+    def priority_for(
+        self,
+        api_key: Optional[str] = None,
+        requested: Optional[str] = None,
+        default: Optional[str] = None,
+    ) -> int:
+        """确定请求的优先级
+
+        API Key 决定可用的最高优先级，请求头只能在此基础上降低优先级。
+
+        Args:
+            api_key: 请求使用的 API Key
+            requested: X-Priority 请求头的值
+            default: API Key 不在 PRIORITY_API_KEYS 中时使用的优先级（例如租户配置的优先级）
+
+        Returns:
+            int: 优先级
+        """
+        base = PRIORITIES.get(default, DEFAULT_PRIORITY) if default else DEFAULT_PRIORITY
+        priority = self.priority_keys.get(api_key, base) if api_key else base
+        if requested:
+            requested_priority = PRIORITIES.get(requested.strip().lower())
+            if requested_priority is not None:
+                priority = max(priority, requested_priority)
+        return priority
+
+    def _capacity(self, priority: int) -> int:
+        return max(1, int(self.max_in_flight * CAPACITY_SHARE[priority]))
+
+    def _pressure(self, priority: int) -> Optional[str]:
+        """事件循环延迟或内存超出该优先级的阈值时返回原因"""
+        share = CAPACITY_SHARE[priority]
+        if self.max_loop_lag and self.loop_monitor is not None:
+            if self.loop_monitor.lag_ewma > self.max_loop_lag * share:
+                return "loop_lag"
+        if self.max_rss_bytes and current_rss_bytes() > self.max_rss_bytes * share:
+            return "memory"
+        return None
+
+    def _waiting_ahead(self, priority: int) -> int:
+        return sum(count for p, count in self._queued.items() if p <= priority)
+
+    def _estimated_wait(self, priority: int) -> float:
+        if not self.avg_service_time:
+            return 0.0
+        return (self._waiting_ahead(priority) + 1) * self.avg_service_time / self._capacity(priority)
+
+    def _reject(self, priority: int, reason: str, retry_after: float) -> RateLimitError:
+        self._rejected.inc(priority=PRIORITY_NAMES[priority], reason=reason)
+        retry_after = max(1, math.ceil(retry_after))
+        return RateLimitError(
+            "服务繁忙，请稍后重试",
+            details={"reason": reason, "priority": PRIORITY_NAMES[priority], "retry_after": retry_after},
+        )
+
+    def _admit(self, priority: int) -> AdmissionTicket:
+        self.in_flight += 1
+        self._admitted.inc(priority=PRIORITY_NAMES[priority])
+        return AdmissionTicket(self, priority)
+
+    async def acquire(self, priority: int = DEFAULT_PRIORITY, timeout: Optional[float] = None) -> AdmissionTicket:
+        """申请并发额度
+
+        Args:
+            priority: 请求的优先级
+            timeout: 最长排队时间(秒)，不超过 queue_timeout
+
+        Returns:
+            AdmissionTicket: 请求结束时需要调用 release()
+
+        Raises:
+            RateLimitError: 请求被拒绝，details 中包含 retry_after
+        """
+        reason = self._pressure(priority)
+        if reason:
+            raise self._reject(priority, reason, self.avg_service_time or 1)
+
+        if not self.max_in_flight:
+            return self._admit(priority)
+
+        # 没有同级或更高优先级的请求在排队时直接获得额度
+        if self.in_flight < self._capacity(priority) and not self._waiting_ahead(priority):
+            return self._admit(priority)
+
+        timeout = self.queue_timeout if timeout is None else min(timeout, self.queue_timeout)
+        estimated = self._estimated_wait(priority)
+        if estimated > timeout:
+            raise self._reject(priority, "deadline", estimated)
+
+        if sum(self._queued.values()) >= self.max_queue:
+            if not self._evict_lower(priority):
+                raise self._reject(priority, "queue_full", estimated or self.avg_service_time)
+
+        # 清理已经结束的等待者，避免堆无限增长
+        if len(self._queue) > 2 * self.max_queue + 16:
+            self._queue = [item for item in self._queue if not item[2].future.done()]
+            heapq.heapify(self._queue)
+
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(priority, loop.time() + timeout, loop.create_future())
+        heapq.heappush(self._queue, (priority, next(self._seq), waiter))
+        self._queued[priority] += 1
+        start = time.monotonic()
+        try:
+            return await asyncio.wait_for(waiter.future, timeout)
+        except BaseException as e:
+            # 超时或取消与分配额度同时发生时，归还已经分配到的额度
+            future = waiter.future
+            if future.done() and not future.cancelled() and future.exception() is None:
+                future.result().release()
+            if isinstance(e, asyncio.TimeoutError):
+                raise self._reject(priority, "queue_timeout", self._estimated_wait(priority)) from None
+            raise
+        finally:
+            self._wait_seconds.inc(time.monotonic() - start, priority=PRIORITY_NAMES[priority])
+            if not waiter.future.done() or waiter.future.cancelled():
+                self._queued[priority] -= 1
+                waiter.future.cancel()
+
+    def _evict_lower(self, priority: int) -> bool:
+        """队列已满时淘汰一个优先级更低的请求"""
+        candidates = [item for item in self._queue if not item[2].future.done()]
+        if not candidates:
+            return False
+        worst = max(candidates, key=lambda item: (item[0], item[1]))
+        if worst[0] <= priority:
+            return False
+        waiter = worst[2]
+        self._queued[waiter.priority] -= 1
+        waiter.future.set_exception(self._reject(waiter.priority, "evicted", self._estimated_wait(waiter.priority)))
+        return True
+
+    def _release(self, ticket: AdmissionTicket) -> None:
+        self.in_flight -= 1
+        duration = time.monotonic() - ticket.admitted_at
+        self.avg_service_time = (
+            duration if not self.avg_service_time else 0.2 * duration + 0.8 * self.avg_service_time
+        )
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """按优先级唤醒排队的请求"""
+        loop_time = None
+        while self._queue:
+            priority, _, waiter = self._queue[0]
+            if waiter.future.done():
+                heapq.heappop(self._queue)
+                continue
+            if self.in_flight >= self._capacity(priority):
+                break
+            heapq.heappop(self._queue)
+            loop_time = loop_time or asyncio.get_running_loop().time()
+            if waiter.deadline < loop_time:
+                continue
+            self._queued[priority] -= 1
+            waiter.future.set_result(self._admit(priority))
+
+
+def release_after(stream: AsyncGenerator[bytes, None], *tickets) -> AsyncGenerator[bytes, None]:
+    """流式响应结束时释放额度
+
+    tickets 为任意提供 release() 的对象（准入额度、租户配额等），按顺序释放。
+    客户端在响应开始前断开时生成器不会被执行，此时在生成器被回收时释放。
+    """
+    def release():
+        for ticket in tickets:
+            ticket.release()
+
+    async def guarded():
+        try:
+            async for item in stream:
+                yield item
+        finally:
+            release()
+            await stream.aclose()
+
+    generator = guarded()
+    weakref.finalize(generator, release)
+    return generator
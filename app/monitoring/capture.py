@@ -0,0 +1,369 @@
+"""线上流量抽样录制
+
+按比例抽样记录请求与响应，用于离线回放（``tests/performance/replay.py``）按真实流量的形态压测新版本。
+
+- 是否录制在请求开始时决定，未抽中的请求没有额外开销
+- 请求路径上只把记录追加到内存缓冲区，脱敏、序列化、压缩与写文件都由后台任务在线程中完成；
+  缓冲区已满时丢弃新的记录并计数，而不是阻塞请求
+- 记录写入 gzip 压缩的 JSONL 分段文件，每批追加为一个独立的 gzip 成员，进程异常退出时
+  已写入的部分仍然可读；分段达到大小上限后换新文件，只保留最新的若干个分段
+- 写入前依次调用脱敏钩子，钩子接收一条记录并返回处理后的记录，返回 None 时丢弃该记录。
+  内置的 ``redact_pii`` 替换邮箱、手机号、身份证号、银行卡号与密钥
+
+每条记录的格式::
+
+    {"ts": 1700000000.0, "tenant": "...", "stream": true, "headers": {...},
+     "request": {...}, "status": 200, "completed": true, "ttft_ms": 850, "latency_ms": 23000,
+     "response_bytes": 18000, "response": {...}}
+"""
+
+import asyncio
+import gzip
+import importlib
+import os
+import random
+import re
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import AsyncIterator, Callable, Iterable, Iterator, List, Mapping, Optional, Sequence, Tuple
+
+from app.utils import json_codec
+from app.utils.logger import logger
+from .metrics import REGISTRY, MetricsRegistry
+
+# 脱敏钩子：接收一条记录，返回处理后的记录，返回 None 表示丢弃
+Redactor = Callable[[dict], Optional[dict]]
+
+# 录制的请求头，不记录认证信息
+CAPTURED_HEADERS = ("X-Priority", "X-Request-Timeout")
+
+SEGMENT_PREFIX = "capture-"
+SEGMENT_SUFFIX = ".jsonl.gz"
+
+_PII_PATTERNS = (
+    (re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+"), "[EMAIL]"),
+    (re.compile(r"\b(?:sk|pk|ak)-[A-Za-z0-9_-]{16,}"), "[SECRET]"),
+    (re.compile(r"(?<![\dA-Za-z])\d{17}[\dXx](?![\dA-Za-z])"), "[ID]"),
+    (re.compile(r"(?<!\d)\d{16,19}(?!\d)"), "[CARD]"),
+    (re.compile(r"(?<!\d)(?:\+?86[- ]?)?1[3-9]\d{9}(?!\d)"), "[PHONE]"),
+)
+
+
+def _redact_value(value):
+    if isinstance(value, str):
+        for pattern, replacement in _PII_PATTERNS:
+            value = pattern.sub(replacement, value)
+        return value
+    if isinstance(value, list):
+        return [_redact_value(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _redact_value(item) for key, item in value.items()}
+    return value
+
+
+def redact_pii(record: dict) -> dict:
+    """替换请求与响应中的邮箱、手机号、身份证号、银行卡号与密钥"""
+    for key in ("request", "response"):
+        if key in record:
+            record[key] = _redact_value(record[key])
+    return record
+
+
+def load_redactor(path: str) -> Redactor:
+    """按 ``module:function`` 格式加载脱敏钩子
+
+    Raises:
+        ValueError: 格式无效或找不到对应的函数
+    """
+    module_name, _, attr = path.partition(":")
+    if not module_name or not attr:
+        raise ValueError(f"无效的脱敏钩子: {path}，格式应为 module:function")
+    try:
+        return getattr(importlib.import_module(module_name.strip()), attr.strip())
+    except (ImportError, AttributeError) as e:
+        raise ValueError(f"无法加载脱敏钩子 {path}: {e}") from None
+
+
+def _response_text(raw: bytes) -> dict:
+    """从 SSE 响应体中取出推理内容与各个回答"""
+    reasoning: List[str] = []
+    choices: dict = {}
+    for line in raw.split(b"\n"):
+        if not line.startswith(b"data: ") or line == b"data: [DONE]":
+            continue
+        try:
+            event = json_codec.loads(line[6:])
+        except json_codec.DecodeError:
+            continue
+        for choice in event.get("choices") or ():
+            delta = choice.get("delta") or {}
+            if delta.get("reasoning_content"):
+                reasoning.append(delta["reasoning_content"])
+            if delta.get("content"):
+                choices.setdefault(choice.get("index", 0), []).append(delta["content"])
+    return {
+        "reasoning_content": "".join(reasoning),
+        "choices": ["".join(parts) for _, parts in sorted(choices.items())],
+    }
+
+
+@dataclass
+class CaptureEntry:
+    """一个被抽中的请求，请求结束时交给 ``TrafficCapture.finish``"""
+
+    tenant: str
+    headers: dict
+    ts: float = field(default_factory=time.time)
+    started: float = field(default_factory=time.monotonic)
+    request: Optional[dict] = None
+    stream: bool = False
+    first_byte_at: Optional[float] = None
+    response_bytes: int = 0
+    chunks: List[bytes] = field(default_factory=list)
+
+    def to_record(self, status: int, completed: bool, response: Optional[dict]) -> dict:
+        return {
+            "ts": self.ts,
+            "tenant": self.tenant,
+            "stream": self.stream,
+            "headers": self.headers,
+            "request": self.request,
+            "status": status,
+            "completed": completed,
+            "ttft_ms": round((self.first_byte_at - self.started) * 1000) if self.first_byte_at else None,
+            "latency_ms": round((time.monotonic() - self.started) * 1000),
+            "response_bytes": self.response_bytes,
+            "response": response,
+        }
+
+
+class TrafficCapture:
+    """抽样录制请求与响应，后台写入压缩的 JSONL 分段文件"""
+
+    def __init__(
+        self,
+        directory: str,
+        sample_rate: float = 0.01,
+        max_segment_bytes: int = 64 * 1024 * 1024,
+        max_segments: int = 20,
+        redactors: Sequence[Redactor] = (redact_pii,),
+        max_response_bytes: int = 1024 * 1024,
+        flush_interval: float = 1.0,
+        batch_size: int = 256,
+        max_pending: int = 10000,
+        rng: Callable[[], float] = random.random,
+        registry: MetricsRegistry = REGISTRY,
+    ):
+        """初始化
+
+        Args:
+            directory: 分段文件所在的目录
+            sample_rate: 录制的请求比例，0 到 1
+            max_segment_bytes: 单个分段文件的大小上限(压缩后)
+            max_segments: 最多保留的分段数，超出时删除最旧的
+            redactors: 写入前依次调用的脱敏钩子
+            max_response_bytes: 每个流式响应最多保留的字节数，超出部分只计数
+            flush_interval: 最长写入间隔(秒)
+            batch_size: 缓冲区达到该数量时立即写入
+            max_pending: 缓冲区上限，超出时丢弃新的记录
+            rng: 返回 [0, 1) 随机数的函数，便于测试
+            registry: 指标注册表
+        """
+        self.directory = Path(directory)
+        self.sample_rate = sample_rate
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segments = max_segments
+        self.redactors = list(redactors)
+        self.max_response_bytes = max_response_bytes
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.rng = rng
+        self._pending: List[dict] = []
+        self._segment: Optional[Path] = None
+        self._sequence = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+        self._written = registry.counter("deepxy_capture_records_total", "写入录制文件的请求数")
+        self._dropped = registry.counter(
+            "deepxy_capture_dropped_total",
+            "没有写入的录制记录数，reason 为 overflow（缓冲区已满）/ redacted（脱敏钩子丢弃）/ error（写入失败）",
+            ("reason",),
+        )
+        self._bytes = registry.counter("deepxy_capture_bytes_total", "写入录制文件的压缩后字节数")
+        registry.gauge("deepxy_capture_pending", "等待写入录制文件的记录数").set_function(
+            lambda: len(self._pending)
+        )
+
+    def begin(self, tenant: str, headers: Mapping[str, str]) -> Optional[CaptureEntry]:
+        """请求开始时决定是否录制
+
+        Returns:
+            Optional[CaptureEntry]: 被抽中时返回录制项，否则返回 None
+        """
+        if self.sample_rate <= 0 or self.rng() >= self.sample_rate:
+            return None
+        return CaptureEntry(
+            tenant=tenant,
+            headers={name: headers[name] for name in CAPTURED_HEADERS if name in headers},
+        )
+
+    def finish(
+        self,
+        entry: CaptureEntry,
+        status: int = 200,
+        response: Optional[dict] = None,
+        completed: bool = True,
+    ) -> None:
+        """请求结束时提交记录，没有请求体（校验失败）的请求不录制"""
+        if entry.request is None:
+            return
+        record = entry.to_record(status, completed, response)
+        if entry.chunks:
+            # 流式响应在写入线程中解析
+            record["raw"] = b"".join(entry.chunks)
+        if len(self._pending) >= self.max_pending:
+            self._dropped.inc(reason="overflow")
+            return
+        self._pending.append(record)
+        if len(self._pending) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    async def wrap_stream(self, events: AsyncIterator[bytes], entry: CaptureEntry) -> AsyncIterator[bytes]:
+        """转发流式响应并记录首包时间与输出，流结束或客户端断开时提交记录"""
+        entry.stream = True
+        completed = False
+        try:
+            async for chunk in events:
+                if entry.first_byte_at is None:
+                    entry.first_byte_at = time.monotonic()
+                entry.response_bytes += len(chunk)
+                if entry.response_bytes <= self.max_response_bytes:
+                    entry.chunks.append(chunk)
+                yield chunk
+            completed = True
+        finally:
+            self.finish(entry, completed=completed)
+
+    def _redact(self, record: dict) -> Optional[dict]:
+        raw = record.pop("raw", None)
+        if raw is not None:
+            record["response"] = _response_text(raw)
+        for redactor in self.redactors:
+            record = redactor(record)
+            if record is None:
+                return None
+        return record
+
+    def _next_segment(self) -> Path:
+        self._sequence += 1
+        name = f"{SEGMENT_PREFIX}{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{self._sequence:05d}{SEGMENT_SUFFIX}"
+        return self.directory / name
+
+    def _prune(self) -> None:
+        """换新分段前删除最旧的分段，给新分段留出位置"""
+        segments = list_segments(self.directory)
+        for path in segments[:max(0, len(segments) - self.max_segments + 1)]:
+            path.unlink(missing_ok=True)
+
+    def _write(self, records: List[dict]) -> Tuple[int, int]:
+        """在写入线程中脱敏、压缩并追加到当前分段
+
+        Returns:
+            Tuple[int, int]: 写入的字节数与记录数
+        """
+        lines = []
+        for record in records:
+            try:
+                record = self._redact(record)
+            except Exception as e:
+                logger.error(f"录制记录脱敏失败，丢弃该记录: {e}")
+                record = None
+            if record is not None:
+                lines.append(json_codec.dumps(record) + b"\n")
+        if not lines:
+            return 0, 0
+        data = gzip.compress(b"".join(lines))
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if self._segment is None or (
+            self._segment.exists() and self._segment.stat().st_size + len(data) > self.max_segment_bytes
+        ):
+            self._prune()
+            self._segment = self._next_segment()
+        # 每批是一个完整的 gzip 成员，读取时按顺序解压即可
+        with open(self._segment, "ab") as f:
+            f.write(data)
+        return len(data), len(lines)
+
+    async def flush(self) -> int:
+        """把缓冲区中的记录写入文件
+
+        Returns:
+            int: 写入的记录数
+        """
+        if not self._pending:
+            return 0
+        records, self._pending = self._pending, []
+        try:
+            size, written = await asyncio.to_thread(self._write, records)
+        except OSError as e:
+            logger.error(f"写入录制文件失败，丢弃 {len(records)} 条记录: {e}")
+            self._dropped.inc(len(records), reason="error")
+            return 0
+        except Exception:
+            # 脱敏钩子或编码出错，记录已经取出，计入丢弃后交给调用方
+            self._dropped.inc(len(records), reason="error")
+            raise
+        if written < len(records):
+            self._dropped.inc(len(records) - written, reason="redacted")
+        self._bytes.inc(size)
+        self._written.inc(written)
+        return written
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                # 不让单次写入的错误结束后台任务，否则之后的记录都会堆积在缓冲区中
+                logger.exception(f"写入录制记录时发生错误: {e}")
+
+    def start(self) -> None:
+        """在当前事件循环中启动后台写入"""
+        if self._task is None or self._task.done():
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """停止后台写入并写入剩余的记录"""
+        if self._task is not None:
+            # 不取消任务，避免正在进行的写入与最后一次写入同时追加同一个分段
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+
+def list_segments(directory: Path) -> List[Path]:
+    """目录中的分段文件，按创建时间从旧到新排列"""
+    return sorted(directory.glob(f"{SEGMENT_PREFIX}*{SEGMENT_SUFFIX}"), key=lambda path: path.name)
+
+
+def iter_records(paths: Iterable[str]) -> Iterator[dict]:
+    """按顺序读取分段文件或目录中的录制记录"""
+    for path in map(Path, paths):
+        for segment in list_segments(path) if path.is_dir() else [path]:
+            with gzip.open(segment, "rb") as f:
+                for line in f:
+                    if line.strip():
+                        yield json_codec.loads(line)
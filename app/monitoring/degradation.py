@@ -0,0 +1,287 @@
+"""按 SLO 自动降级
+
+上游变慢时继续发送完整的 R1 推理与大模型回答只会让延迟越来越高。降级控制器订阅
+``timed`` 记录的阶段耗时，按滚动窗口计算各阶段的 p95，并结合准入队列的长度决定服务等级：
+
+- 任一阶段的 p95 超过 SLO 或排队请求数超过上限时，降低一级
+- 所有阶段的 p95 低于 SLO 的 ``recover_ratio`` 且队列恢复后，保持 ``recover_after`` 秒再升高一级
+- 每次调整后清空窗口，按新等级下的耗时重新判断，避免旧的样本让等级连续下降
+
+等级从 0（不降级）开始，每一级可以限制推理阶段的 token 数、换用更小的回答模型，
+以及让低优先级的请求跳过推理阶段。评估在请求到达时顺带进行，不需要后台任务。
+"""
+
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Deque, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from app.utils.logger import logger
+from .admission import PRIORITIES, PRIORITY_NAMES
+from .metrics import REGISTRY, MetricsRegistry
+from . import timing
+
+
+@dataclass(frozen=True)
+class DegradationLevel:
+    """一个降级等级"""
+
+    name: str
+    # 推理阶段最多的 token 数，None 表示不限制
+    max_reasoning_tokens: Optional[int] = None
+    # 替换回答模型，None 表示使用请求的模型
+    answer_model: Optional[str] = None
+    # 不高于该优先级（数值不小于）的请求跳过推理阶段，None 表示都不跳过
+    skip_reasoning_priority: Optional[int] = None
+
+    def reasoning_tokens_for(self, priority: int) -> Optional[int]:
+        """请求的推理 token 上限，0 表示跳过推理阶段"""
+        if self.skip_reasoning_priority is not None and priority >= self.skip_reasoning_priority:
+            return 0
+        return self.max_reasoning_tokens
+
+
+NORMAL = DegradationLevel("normal")
+
+
+def parse_levels(value: str) -> List[DegradationLevel]:
+    """解析降级等级配置
+
+    各等级以 ``;`` 分隔，按降级程度从轻到重排列，每一级是逗号分隔的 ``key=value``：
+    ``reasoning`` 推理 token 上限，``model`` 回答模型，``skip`` 跳过推理阶段的优先级
+    （high / normal / low），例如::
+
+        reasoning=2000; reasoning=1000,model=qwen-turbo; reasoning=1000,model=qwen-turbo,skip=low
+
+    Returns:
+        List[DegradationLevel]: 包含等级 0（不降级）在内的等级列表
+
+    Raises:
+        ValueError: 配置格式无效
+    """
+    levels = [NORMAL]
+    for spec in filter(None, (part.strip() for part in value.split(";"))):
+        options = {}
+        for item in filter(None, (part.strip() for part in spec.split(","))):
+            key, sep, option = item.partition("=")
+            if not sep or key.strip() not in ("reasoning", "model", "skip"):
+                raise ValueError(f"无效的降级配置: {item}")
+            options[key.strip()] = option.strip()
+        try:
+            max_reasoning_tokens = int(options["reasoning"]) if "reasoning" in options else None
+        except ValueError:
+            raise ValueError(f"无效的推理 token 上限: {options['reasoning']}") from None
+        skip = options.get("skip")
+        if skip is not None and skip not in PRIORITIES:
+            raise ValueError(f"无效的优先级: {skip}")
+        levels.append(DegradationLevel(
+            name=f"level{len(levels)}",
+            max_reasoning_tokens=max_reasoning_tokens,
+            answer_model=options.get("model") or None,
+            skip_reasoning_priority=PRIORITIES[skip] if skip is not None else None,
+        ))
+    return levels
+
+
+def parse_slo(value: str) -> Dict[str, float]:
+    """解析 ``stage=seconds,...`` 格式的各阶段 p95 目标"""
+    slo = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        stage, _, seconds = item.partition("=")
+        try:
+            slo[stage.strip()] = float(seconds)
+        except ValueError:
+            raise ValueError(f"无效的 SLO 配置: {item}") from None
+        if not stage.strip() or slo[stage.strip()] <= 0:
+            raise ValueError(f"无效的 SLO 配置: {item}")
+    return slo
+
+
+def _quantile(values: Sequence[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class DegradationController:
+    """按滚动延迟与队列长度调整服务等级"""
+
+    def __init__(
+        self,
+        slo: Mapping[str, float],
+        levels: Sequence[DegradationLevel],
+        queue_depth: Optional[Callable[[], int]] = None,
+        max_queue_depth: int = 0,
+        window: float = 60.0,
+        quantile: float = 0.95,
+        min_samples: int = 20,
+        interval: float = 5.0,
+        recover_ratio: float = 0.7,
+        recover_after: float = 60.0,
+        max_samples: int = 2048,
+        clock: Callable[[], float] = time.monotonic,
+        registry: MetricsRegistry = REGISTRY,
+    ):
+        """初始化
+
+        Args:
+            slo: 阶段名称（与 timed 的 stage 一致）到 p95 目标(秒)的映射
+            levels: 降级等级，第一个为不降级
+            queue_depth: 返回当前排队请求数的函数
+            max_queue_depth: 排队请求数上限，0 表示不检查
+            window: 滚动窗口(秒)
+            quantile: 计算的分位数
+            min_samples: 窗口内至少有这么多样本才判断延迟
+            interval: 两次评估的最小间隔(秒)，也是两次降级的最小间隔
+            recover_ratio: 延迟与队列低于目标的该比例才算恢复
+            recover_after: 恢复后保持多久(秒)才升高一级
+            max_samples: 每个阶段最多保留的样本数
+            clock: 时钟，便于测试
+            registry: 指标注册表
+        """
+        if not levels:
+            raise ValueError("至少需要一个等级")
+        self.slo = dict(slo)
+        self.levels = list(levels)
+        self.queue_depth = queue_depth
+        self.max_queue_depth = max_queue_depth
+        self.window = window
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.interval = interval
+        self.recover_ratio = recover_ratio
+        self.recover_after = recover_after
+        self.clock = clock
+        self.index = 0
+        self._samples: Dict[str, Deque[Tuple[float, float]]] = {
+            stage: deque(maxlen=max_samples) for stage in self.slo
+        }
+        now = clock()
+        self._evaluated_at = now
+        self._changed_at = now
+        # 开始满足恢复条件的时间
+        self._healthy_since: Optional[float] = None
+
+        registry.gauge("deepxy_degradation_level", "当前的降级等级，0 表示不降级").set_function(
+            lambda: self.index
+        )
+        self._transitions = registry.counter(
+            "deepxy_degradation_transitions_total", "降级等级的调整次数", ("direction", "reason")
+        )
+        self._degraded = registry.counter(
+            "deepxy_degraded_requests_total", "按降级等级调整的请求数", ("action",)
+        )
+        self._stage_quantile = registry.gauge(
+            "deepxy_slo_stage_latency_seconds", "滚动窗口内各阶段耗时的分位数", ("stage",)
+        )
+
+    @property
+    def level(self) -> DegradationLevel:
+        """当前等级"""
+        return self.levels[self.index]
+
+    def install(self) -> None:
+        """订阅阶段耗时"""
+        timing.add_listener(self.observe)
+
+    def uninstall(self) -> None:
+        """取消订阅"""
+        timing.remove_listener(self.observe)
+
+    def observe(self, stage: str, outcome: str, seconds: float) -> None:
+        """记录一次阶段耗时，客户端断开而取消或关闭的调用不计入"""
+        samples = self._samples.get(stage)
+        if samples is not None and outcome not in ("cancelled", "closed"):
+            samples.append((self.clock(), seconds))
+
+    def _latencies(self, now: float) -> Dict[str, float]:
+        """窗口内样本足够的各阶段分位数"""
+        latencies = {}
+        for stage, samples in self._samples.items():
+            while samples and samples[0][0] < now - self.window:
+                samples.popleft()
+            if len(samples) >= self.min_samples:
+                latencies[stage] = _quantile([seconds for _, seconds in samples], self.quantile)
+                self._stage_quantile.set(latencies[stage], stage=stage)
+        return latencies
+
+    def _change(self, index: int, reason: str, now: float) -> None:
+        direction = "down" if index > self.index else "up"
+        logger.warning(
+            f"服务等级从 {self.level.name} 调整为 {self.levels[index].name}（{reason}）"
+        )
+        self._transitions.inc(direction=direction, reason=reason.split(" ", 1)[0])
+        self.index = index
+        self._changed_at = now
+        self._healthy_since = None
+        for samples in self._samples.values():
+            samples.clear()
+
+    def evaluate(self) -> DegradationLevel:
+        """按间隔评估是否需要调整等级
+
+        Returns:
+            DegradationLevel: 评估后的等级
+        """
+        now = self.clock()
+        if now - self._evaluated_at < self.interval:
+            return self.level
+        self._evaluated_at = now
+
+        latencies = self._latencies(now)
+        depth = self.queue_depth() if self.queue_depth is not None else 0
+        breached = [
+            f"{stage} p{self.quantile * 100:g}={seconds:.2f}s>{self.slo[stage]:g}s"
+            for stage, seconds in latencies.items() if seconds > self.slo[stage]
+        ]
+        reason = "latency" if breached else "queue"
+        if self.max_queue_depth and depth > self.max_queue_depth:
+            breached.append(f"queue={depth}>{self.max_queue_depth}")
+        if breached:
+            self._healthy_since = None
+            if self.index < len(self.levels) - 1 and now - self._changed_at >= self.interval:
+                self._change(self.index + 1, f"{reason} {', '.join(breached)}", now)
+            return self.level
+
+        healthy = all(
+            seconds <= self.slo[stage] * self.recover_ratio for stage, seconds in latencies.items()
+        ) and (not self.max_queue_depth or depth <= self.max_queue_depth * self.recover_ratio)
+        if not healthy or self.index == 0:
+            self._healthy_since = None
+            return self.level
+        if self._healthy_since is None:
+            self._healthy_since = now
+        elif now - self._healthy_since >= self.recover_after:
+            self._change(self.index - 1, "recovered", now)
+        return self.level
+
+    def plan(self, priority: int) -> Tuple[Optional[int], Optional[str]]:
+        """按当前等级确定请求的降级方式
+
+        Args:
+            priority: 请求的优先级
+
+        Returns:
+            Tuple[Optional[int], Optional[str]]: (推理 token 上限，0 表示跳过推理阶段; 替换的回答模型)
+        """
+        level = self.evaluate()
+        max_reasoning_tokens = level.reasoning_tokens_for(priority)
+        if max_reasoning_tokens == 0:
+            self._degraded.inc(action="skip_reasoning")
+        elif max_reasoning_tokens is not None:
+            self._degraded.inc(action="reasoning_budget")
+        if level.answer_model is not None:
+            self._degraded.inc(action="answer_model")
+        return max_reasoning_tokens, level.answer_model
+
+    def snapshot(self) -> dict:
+        """当前等级与各阶段的滚动分位数"""
+        latencies = self._latencies(self.clock())
+        return {
+            "level": self.index,
+            "name": self.level.name,
+            "levels": len(self.levels),
+            "slo": self.slo,
+            "latency": latencies,
+            "queue_depth": self.queue_depth() if self.queue_depth is not None else 0,
+            "skip_reasoning": PRIORITY_NAMES.get(self.level.skip_reasoning_priority),
+        }
@@ -0,0 +1,244 @@
+"""优雅退出
+
+收到 SIGTERM 后进入排空（drain）模式：
+1. 就绪检查变为 503，新的对话请求返回 503
+2. 等待进行中的请求（包括持续数分钟的 SSE 流）在宽限期内完成
+3. 宽限期结束后取消仍未完成的流，关闭上游连接池
+4. 调用原有的 SIGTERM 处理函数（uvicorn 的退出逻辑）
+
+再次收到 SIGTERM 时跳过剩余的宽限期。排空进度通过 /metrics 输出。
+"""
+
+import asyncio
+import os
+import signal
+import time
+import weakref
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator, Awaitable, Callable, Optional, Set
+
+from app.utils.logger import logger
+from .health import ReadinessState
+from .metrics import REGISTRY, MetricsRegistry
+
+
+class DrainSlot:
+    """admit() 占用的进行中请求计数
+
+    请求被接受时计数即加一，交给 track_request/track_stream 后在请求结束时释放，
+    出错时由调用方释放。release() 可以重复调用。
+    """
+
+    def __init__(self, controller: "DrainController"):
+        self._controller = controller
+        self._task = controller._enter()
+        self.released = False
+
+    def adopt(self) -> None:
+        """由当前任务接管，宽限期结束时取消的是当前任务"""
+        task = asyncio.current_task()
+        if task is not self._task:
+            self._controller._tasks.discard(self._task)
+            self._task = task
+            if task is not None and not self.released:
+                self._controller._tasks.add(task)
+
+    def release(self, cancelled: bool = False) -> None:
+        if self.released:
+            return
+        self.released = True
+        self._controller._exit(self._task, cancelled)
+
+
+class DrainController:
+    """跟踪进行中的请求并在退出时排空"""
+
+    def __init__(
+        self,
+        readiness: ReadinessState,
+        grace_period: float = 120.0,
+        on_drained: Optional[Callable[[], Awaitable[None]]] = None,
+        registry: MetricsRegistry = REGISTRY,
+    ):
+        """初始化排空控制器
+
+        Args:
+            readiness: 就绪状态，排空开始时标记为未就绪
+            grace_period: 等待进行中请求完成的宽限期(秒)
+            on_drained: 排空结束后执行的清理（例如关闭连接池）
+            registry: 指标注册表
+        """
+        self.readiness = readiness
+        self.grace_period = grace_period
+        self.on_drained = on_drained
+        self.draining = False
+        self.drain_started_at: Optional[float] = None
+        self._in_flight = 0
+        self._tasks: Set[asyncio.Task] = set()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._skip_grace = asyncio.Event()
+        self._drain_task: Optional[asyncio.Task] = None
+        self._previous_handler = None
+
+        self._in_flight_gauge = registry.gauge(
+            "deepxy_in_flight_requests", "进行中的对话请求数"
+        )
+        self._in_flight_gauge.set_function(lambda: self._in_flight)
+        self._draining_gauge = registry.gauge("deepxy_draining", "是否处于排空模式")
+        self._draining_gauge.set_function(lambda: 1 if self.draining else 0)
+        self._elapsed_gauge = registry.gauge("deepxy_drain_elapsed_seconds", "排空已持续的时间")
+        self._elapsed_gauge.set_function(
+            lambda: time.monotonic() - self.drain_started_at if self.drain_started_at else 0
+        )
+        self._finished = registry.counter(
+            "deepxy_drain_requests_total", "排空期间结束的请求数", ("outcome",)
+        )
+        self._rejected = registry.counter(
+            "deepxy_rejected_requests_total", "被拒绝的请求数", ("reason",)
+        )
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def admit(self) -> Optional[DrainSlot]:
+        """接受新的请求并占用一个计数，排空期间返回 None
+
+        从接受请求起就计入进行中的请求，排空不会在请求交给 track_request/track_stream
+        之前结束。调用方必须把返回的计数交给其中之一，或在出错时调用其 release()。
+        """
+        if self.draining:
+            self._rejected.inc(reason="draining")
+            return None
+        return DrainSlot(self)
+
+    def _enter(self) -> Optional[asyncio.Task]:
+        self._in_flight += 1
+        self._idle.clear()
+        task = asyncio.current_task()
+        if task is not None:
+            self._tasks.add(task)
+        return task
+
+    def _exit(self, task: Optional[asyncio.Task], cancelled: bool = False) -> None:
+        self._in_flight -= 1
+        if task is not None:
+            self._tasks.discard(task)
+        if self.draining:
+            self._finished.inc(outcome="cancelled" if cancelled else "completed")
+        if self._in_flight == 0:
+            self._idle.set()
+
+    @asynccontextmanager
+    async def track_request(self, slot: Optional[DrainSlot] = None):
+        """跟踪一个非流式请求
+
+        Args:
+            slot: admit() 占用的计数，为空时在这里占用
+        """
+        if slot is None:
+            slot = DrainSlot(self)
+        slot.adopt()
+        cancelled = False
+        try:
+            yield
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            slot.release(cancelled)
+
+    def track_stream(
+        self, stream: AsyncGenerator[bytes, None], slot: Optional[DrainSlot] = None
+    ) -> AsyncGenerator[bytes, None]:
+        """跟踪一个流式响应，流结束或被取消时计数减一
+
+        Args:
+            stream: 流式响应
+            slot: admit() 占用的计数，为空时在开始输出时占用。客户端在响应开始前断开时
+                生成器不会被执行，此时在生成器被回收时释放
+        """
+
+        async def tracked():
+            nonlocal slot
+            if slot is None:
+                slot = DrainSlot(self)
+            slot.adopt()
+            cancelled = False
+            try:
+                async for item in stream:
+                    yield item
+            except asyncio.CancelledError:
+                cancelled = True
+                raise
+            finally:
+                slot.release(cancelled)
+                await stream.aclose()
+
+        generator = tracked()
+        if slot is not None:
+            weakref.finalize(generator, slot.release)
+        return generator
+
+    def install_signal_handler(self, sig: int = signal.SIGTERM) -> None:
+        """接管 SIGTERM，排空结束后再交给原有的处理函数"""
+        self._previous_handler = signal.getsignal(sig)
+        loop = asyncio.get_running_loop()
+        try:
+            loop.add_signal_handler(sig, self.begin_drain, sig)
+        except (NotImplementedError, RuntimeError):  # pragma: no cover - Windows
+            logger.warning("当前平台不支持信号处理，优雅退出不可用")
+
+    def begin_drain(self, sig: Optional[int] = signal.SIGTERM) -> None:
+        """开始排空；已经在排空时跳过剩余的宽限期"""
+        if self._drain_task is not None:
+            logger.warning("再次收到退出信号，跳过剩余的宽限期")
+            self._skip_grace.set()
+            return
+        self._drain_task = asyncio.get_running_loop().create_task(self.drain(sig))
+
+    async def drain(self, sig: Optional[int] = None) -> None:
+        """执行排空流程
+
+        Args:
+            sig: 触发排空的信号，排空结束后转交给原有的处理函数；为空时不转交
+        """
+        self.draining = True
+        self.drain_started_at = time.monotonic()
+        self.readiness.mark_not_ready("draining")
+        logger.info(f"开始排空，进行中的请求 {self._in_flight} 个，宽限期 {self.grace_period:.0f}s")
+
+        idle = asyncio.ensure_future(self._idle.wait())
+        skip = asyncio.ensure_future(self._skip_grace.wait())
+        await asyncio.wait({idle, skip}, timeout=self.grace_period, return_when=asyncio.FIRST_COMPLETED)
+        idle.cancel()
+        skip.cancel()
+
+        if self._in_flight:
+            logger.warning(f"宽限期结束，取消 {self._in_flight} 个未完成的请求")
+            for task in list(self._tasks):
+                task.cancel()
+            try:
+                await asyncio.wait_for(self._idle.wait(), 5)
+            except asyncio.TimeoutError:
+                logger.error(f"仍有 {self._in_flight} 个请求未能结束")
+
+        if self.on_drained is not None:
+            await self.on_drained()
+        logger.info(f"排空完成，耗时 {time.monotonic() - self.drain_started_at:.1f}s")
+
+        if sig is not None:
+            self._forward_signal(sig)
+
+    def _forward_signal(self, sig: int) -> None:
+        """把信号交给原有的处理函数"""
+        loop = asyncio.get_running_loop()
+        loop.remove_signal_handler(sig)
+        previous = self._previous_handler
+        if callable(previous):
+            signal.signal(sig, previous)
+            previous(sig, None)
+        elif previous != signal.SIG_IGN:
+            signal.signal(sig, signal.SIG_DFL)
+            os.kill(os.getpid(), sig)
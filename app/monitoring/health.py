@@ -0,0 +1,124 @@
+"""健康检查与启动预热
+
+- 存活（liveness）：进程能响应请求即可
+- 就绪（readiness）：启动预热完成后才就绪，预热包括解析上游域名、
+  预先建立到各上游的连接放入连接池，以及加载 tokenizer
+
+预热中的单项失败不会阻止服务就绪（例如上游不允许 HEAD 请求），
+结果会记录在就绪检查的详情中。
+"""
+
+import asyncio
+import importlib.util
+import time
+from typing import Dict, Iterable, Optional
+from urllib.parse import urlsplit
+
+from app.utils.logger import logger
+
+
+class ReadinessState:
+    """服务的就绪状态"""
+
+    def __init__(self):
+        self.ready = False
+        self.reason: Optional[str] = "warming_up"
+        self.checks: Dict[str, str] = {}
+        self.started_at = time.time()
+        self.ready_at: Optional[float] = None
+
+    def mark_ready(self) -> None:
+        self.ready = True
+        self.reason = None
+        self.ready_at = time.time()
+
+    def mark_not_ready(self, reason: str) -> None:
+        self.ready = False
+        self.reason = reason
+
+    def snapshot(self) -> Dict:
+        """就绪检查的响应内容"""
+        return {
+            "status": "ready" if self.ready else "not_ready",
+            "reason": self.reason,
+            "checks": dict(self.checks),
+            "uptime": round(time.time() - self.started_at, 3),
+            "warmup_seconds": (
+                round(self.ready_at - self.started_at, 3) if self.ready_at else None
+            ),
+        }
+
+
+async def _resolve(host: str, port: int) -> str:
+    loop = asyncio.get_running_loop()
+    infos = await loop.getaddrinfo(host, port)
+    return f"ok ({len(infos)} addresses)"
+
+
+async def _warm(client, api_url: str, connections: int) -> str:
+    results = await asyncio.gather(
+        *(client.warm_connection(api_url) for _ in range(connections))
+    )
+    succeeded = sum(results)
+    if connections and not succeeded:
+        raise ConnectionError(f"0/{connections} connections")
+    return f"ok ({succeeded}/{connections} connections)"
+
+
+async def _preload_tokenizer() -> str:
+    if importlib.util.find_spec("tiktoken") is None:
+        return "skipped (tiktoken not installed)"
+    from app.utils import tokenizer
+
+    # 编码表首次加载可能需要读取或下载文件，放到线程中执行
+    await asyncio.to_thread(tokenizer.preload)
+    return "ok"
+
+
+async def warm_up(
+    state: ReadinessState,
+    client,
+    api_urls: Iterable[str],
+    connections: int = 2,
+    timeout: float = 10.0,
+    preload_tokenizer: bool = True,
+) -> None:
+    """执行启动预热，完成后标记为就绪
+
+    Args:
+        state: 就绪状态
+        client: 用于建立连接的客户端（共享连接池）
+        api_urls: 需要预热的上游地址
+        connections: 每个上游预先建立的连接数
+        timeout: 单项预热的超时时间(秒)
+        preload_tokenizer: 是否预先加载 tokenizer
+    """
+    checks = {}
+    origins = {}
+    for api_url in api_urls:
+        parts = urlsplit(api_url)
+        if parts.hostname:
+            origins.setdefault(f"{parts.scheme}://{parts.netloc}", (parts, api_url))
+
+    for origin, (parts, api_url) in origins.items():
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        checks[f"dns:{parts.hostname}"] = _resolve(parts.hostname, port)
+        checks[f"connect:{origin}"] = _warm(client, api_url, connections)
+    if preload_tokenizer:
+        checks["tokenizer"] = _preload_tokenizer()
+
+    names = list(checks)
+    results = await asyncio.gather(
+        *(asyncio.wait_for(checks[name], timeout) for name in names),
+        return_exceptions=True,
+    )
+    for name, result in zip(names, results):
+        if isinstance(result, BaseException):
+            result = f"failed ({type(result).__name__}: {result})"
+            logger.warning(f"启动预热失败 {name}: {result}")
+        state.checks[name] = result
+
+    logger.info(f"启动预热完成，耗时 {time.time() - state.started_at:.2f}s")
+    # 预热期间可能已经开始排空，此时保持未就绪
+    if state.reason == "warming_up":
+        state.mark_ready()
@@ -0,0 +1,175 @@
+"""用量账本
+
+每个请求结束时记录一行用量（租户、模型、token 数、耗时、缓存命中），
+写入本地 SQLite（WAL 模式）的追加表。
+
+请求路径上只把记录追加到内存缓冲区，由后台任务按批次在线程中写入数据库，
+记账不会给请求增加延迟。缓冲区已满时丢弃新的记录并计数，而不是阻塞请求。
+"""
+
+import asyncio
+import sqlite3
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+from app.utils.logger import logger
+from .metrics import REGISTRY, MetricsRegistry
+
+if TYPE_CHECKING:  # pragma: no cover
+    from app.utils.quota import QuotaLease
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts REAL NOT NULL,
+    tenant TEXT NOT NULL,
+    request_id TEXT,
+    model TEXT,
+    stream INTEGER NOT NULL,
+    prompt_tokens INTEGER NOT NULL,
+    reasoning_tokens INTEGER NOT NULL,
+    completion_tokens INTEGER NOT NULL,
+    cached_tokens INTEGER NOT NULL,
+    ttft_ms INTEGER,
+    latency_ms INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS usage_tenant_ts ON usage (tenant, ts);
+"""
+
+INSERT = (
+    "INSERT INTO usage (ts, tenant, request_id, model, stream, prompt_tokens, reasoning_tokens,"
+    " completion_tokens, cached_tokens, ttft_ms, latency_ms) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+
+class UsageLedger:
+    """批量异步写入的 SQLite 用量账本"""
+
+    def __init__(
+        self,
+        path: str,
+        batch_size: int = 256,
+        flush_interval: float = 1.0,
+        max_pending: int = 10000,
+        registry: MetricsRegistry = REGISTRY,
+    ):
+        """初始化账本
+
+        Args:
+            path: 数据库文件路径
+            batch_size: 缓冲区达到该数量时立即写入
+            flush_interval: 最长写入间隔(秒)
+            max_pending: 缓冲区上限，超出时丢弃新的记录
+            registry: 指标注册表
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending: List[Tuple] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._connection: Optional[sqlite3.Connection] = None
+
+        self._written = registry.counter("deepxy_ledger_records_total", "写入用量账本的记录数")
+        self._dropped = registry.counter("deepxy_ledger_dropped_total", "缓冲区已满或写入失败而丢弃的记录数")
+        self._flush_seconds = registry.histogram(
+            "deepxy_ledger_flush_seconds", "每批记录写入数据库的耗时"
+        )
+        registry.gauge("deepxy_ledger_pending", "等待写入用量账本的记录数").set_function(
+            lambda: len(self._pending)
+        )
+
+    def record(self, row: Tuple) -> None:
+        """追加一行记录，字段顺序与 INSERT 一致"""
+        if len(self._pending) >= self.max_pending:
+            self._dropped.inc()
+            return
+        self._pending.append(row)
+        if len(self._pending) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    def record_lease(self, lease: "QuotaLease") -> None:
+        """记录一个已结束请求的用量"""
+        usage = lease.usage
+        now = time.monotonic()
+        self.record((
+            time.time(),
+            lease.tenant.id,
+            lease.request_id,
+            lease.model,
+            int(lease.stream),
+            round(usage.prompt_tokens),
+            round(usage.reasoning_tokens),
+            round(usage.completion_tokens),
+            usage.cached_tokens,
+            round((usage.first_token_at - usage.started_at) * 1000) if usage.first_token_at else None,
+            round((now - usage.started_at) * 1000),
+        ))
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            # 只在写入线程中串行使用
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(SCHEMA)
+            self._connection = connection
+        return self._connection
+
+    def _write(self, rows: List[Tuple]) -> None:
+        connection = self._connect()
+        with connection:
+            connection.executemany(INSERT, rows)
+
+    async def flush(self) -> int:
+        """把缓冲区中的记录写入数据库
+
+        Returns:
+            int: 写入的记录数
+        """
+        if not self._pending:
+            return 0
+        rows, self._pending = self._pending, []
+        start = time.perf_counter()
+        try:
+            await asyncio.to_thread(self._write, rows)
+        except sqlite3.Error as e:
+            logger.error(f"写入用量账本失败，丢弃 {len(rows)} 条记录: {e}")
+            self._dropped.inc(len(rows))
+            return 0
+        self._flush_seconds.observe(time.perf_counter() - start)
+        self._written.inc(len(rows))
+        return len(rows)
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self) -> None:
+        """在当前事件循环中启动后台写入"""
+        if self._task is None or self._task.done():
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """停止后台写入，写入剩余的记录并关闭数据库"""
+        if self._task is not None:
+            # 不取消任务，避免正在进行的写入与最后一次写入同时使用连接
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
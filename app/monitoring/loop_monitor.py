@@ -0,0 +1,154 @@
+"""事件循环延迟采样与慢回调检测
+
+后台任务按固定间隔 sleep，实际唤醒时间与预期时间的差值即为事件循环延迟，
+反映同步代码占用事件循环的程度。
+
+慢回调检测由一个看门狗线程完成：采样任务每次唤醒时更新心跳，心跳超过
+阈值未更新说明某个回调正在阻塞事件循环，看门狗此时抓取事件循环线程的
+调用栈，阻塞结束后连同阻塞时长一起记录日志与指标。这种方式不依赖
+asyncio 的调试模式，在 uvloop 下同样可用。
+"""
+
+import asyncio
+import collections
+import sys
+import threading
+import time
+import traceback
+from typing import Deque, Dict, List, Optional
+
+from app.utils.logger import logger
+from .metrics import REGISTRY, MetricsRegistry
+
+# 日志中保留的调用栈帧数
+STACK_LIMIT = 12
+
+
+class LoopLagMonitor:
+    """事件循环延迟采样器与慢回调检测"""
+
+    def __init__(
+        self,
+        interval: float = 0.1,
+        alpha: float = 0.3,
+        slow_callback_threshold: float = 0.1,
+        history: int = 20,
+        registry: MetricsRegistry = REGISTRY,
+    ):
+        """初始化采样器
+
+        Args:
+            interval: 采样间隔(秒)
+            alpha: 指数加权平均的平滑系数
+            slow_callback_threshold: 慢回调阈值(秒)，0 表示不检测
+            history: 保留的慢回调记录数
+            registry: 指标注册表
+        """
+        self.interval = interval
+        self.alpha = alpha
+        self.slow_callback_threshold = slow_callback_threshold
+        self.lag = 0.0
+        self.lag_ewma = 0.0
+        self.lag_max = 0.0
+        self.slow_callbacks: Deque[Dict] = collections.deque(maxlen=history)
+        self._task: Optional[asyncio.Task] = None
+        self._heartbeat = 0.0
+        self._loop_thread_id: Optional[int] = None
+        # 看门狗抓取到的调用栈，阻塞结束后由采样任务取走
+        self._stalled_stack: Optional[List[str]] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._watchdog_stop = threading.Event()
+
+        registry.gauge("deepxy_event_loop_lag_seconds", "事件循环延迟（指数加权平均）").set_function(
+            lambda: self.lag_ewma
+        )
+        registry.gauge("deepxy_event_loop_lag_max_seconds", "采样期间观测到的最大事件循环延迟").set_function(
+            lambda: self.lag_max
+        )
+        self._slow_callback_seconds = registry.histogram(
+            "deepxy_slow_callback_seconds", "阻塞事件循环超过阈值的回调耗时"
+        )
+
+    def record(self, lag: float) -> None:
+        """记录一次采样结果"""
+        self.lag = lag
+        self.lag_ewma = self.alpha * lag + (1 - self.alpha) * self.lag_ewma
+        self.lag_max = max(self.lag_max, lag)
+
+    def record_slow_callback(self, duration: float, stack: Optional[List[str]]) -> None:
+        """记录一次阻塞事件循环的回调
+
+        Args:
+            duration: 阻塞时长(秒)
+            stack: 阻塞期间事件循环线程的调用栈，没有抓到时为空
+        """
+        self._slow_callback_seconds.observe(duration)
+        self.slow_callbacks.append({
+            "at": time.time(),
+            "duration": round(duration, 4),
+            "stack": stack or [],
+        })
+        where = "".join(stack[-STACK_LIMIT:]) if stack else "（未抓取到调用栈）\n"
+        logger.warning(f"事件循环被阻塞 {duration * 1000:.0f}ms，阻塞位置:\n{where}")
+
+    async def _run(self) -> None:
+        while True:
+            start = time.perf_counter()
+            self._heartbeat = start
+            await asyncio.sleep(self.interval)
+            lag = max(time.perf_counter() - start - self.interval, 0.0)
+            self.record(lag)
+            stack, self._stalled_stack = self._stalled_stack, None
+            if self.slow_callback_threshold and lag > self.slow_callback_threshold:
+                self.record_slow_callback(lag, stack)
+
+    def _watch(self) -> None:
+        """看门狗线程：心跳超时时抓取事件循环线程的调用栈"""
+        limit = self.interval + self.slow_callback_threshold
+        captured_for = None
+        while not self._watchdog_stop.wait(self.slow_callback_threshold / 2):
+            heartbeat = self._heartbeat
+            if heartbeat == captured_for or time.perf_counter() - heartbeat < limit:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is not None:
+                self._stalled_stack = traceback.format_stack(frame)
+                captured_for = heartbeat
+            del frame
+
+    def start(self) -> None:
+        """在当前事件循环中启动采样"""
+        if self._task is None or self._task.done():
+            self._heartbeat = time.perf_counter()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        if self.slow_callback_threshold and self._watchdog is None:
+            self._loop_thread_id = threading.get_ident()
+            self._watchdog_stop.clear()
+            self._watchdog = threading.Thread(
+                target=self._watch, name="loop-watchdog", daemon=True
+            )
+            self._watchdog.start()
+
+    async def stop(self) -> None:
+        """停止采样"""
+        if self._watchdog is not None:
+            self._watchdog_stop.set()
+            self._watchdog.join()
+            self._watchdog = None
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def snapshot(self) -> Dict:
+        """当前的延迟统计与最近的慢回调记录"""
+        return {
+            "lag": round(self.lag, 4),
+            "lag_ewma": round(self.lag_ewma, 4),
+            "lag_max": round(self.lag_max, 4),
+            "slow_callback_threshold": self.slow_callback_threshold,
+            "slow_callbacks": list(self.slow_callbacks),
+        }
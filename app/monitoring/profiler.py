@@ -0,0 +1,141 @@
+"""进程内性能剖析
+
+提供两种模式，同一时间只允许一个剖析任务：
+
+- sampling：后台线程按固定间隔读取 ``sys._current_frames()``，统计调用栈出现的次数，
+  输出 collapsed stack 格式（``frame;frame;frame count``），可以直接交给
+  flamegraph.pl、speedscope 或 inferno 生成火焰图。对被剖析的代码没有插桩开销。
+- cprofile：在事件循环线程上开启 cProfile，输出按累计耗时排序的统计结果。
+
+采样线程需要先拿到 GIL 才能读取调用栈，而事件循环线程在 select 等待 I/O 时
+会主动释放 GIL，因此 sampling 模式对空闲时间偏多、对很短的回调偏少；
+长时间占用事件循环的代码（正是需要定位的问题）可以被稳定采到。
+需要精确的调用次数与耗时时使用 cprofile 模式。
+"""
+
+import asyncio
+import collections
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+from typing import Counter, Optional
+
+# 剖析时长上限与采样间隔下限
+MAX_SECONDS = 120.0
+MIN_INTERVAL = 0.001
+
+
+class ProfilerBusyError(RuntimeError):
+    """已有剖析任务正在运行"""
+
+
+_lock = threading.Lock()
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """基于调用栈采样的剖析器"""
+
+    def __init__(self, interval: float = 0.005, thread_id: Optional[int] = None):
+        """初始化剖析器
+
+        Args:
+            interval: 采样间隔(秒)
+            thread_id: 只采样该线程，为空时采样除剖析线程外的所有线程
+        """
+        self.interval = max(interval, MIN_INTERVAL)
+        self.thread_id = thread_id
+        self.samples = 0
+        self.stacks: Counter[str] = collections.Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def sample(self) -> None:
+        """采样一次所有目标线程的调用栈"""
+        own = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own or (self.thread_id is not None and thread_id != self.thread_id):
+                continue
+            frames = []
+            while frame is not None:
+                frames.append(_frame_name(frame))
+                frame = frame.f_back
+            if self.thread_id is None:
+                frames.append(names.get(thread_id, f"thread-{thread_id}"))
+            self.stacks[";".join(reversed(frames))] += 1
+        self.samples += 1
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def collapsed(self) -> str:
+        """collapsed stack 格式的采样结果"""
+        lines = [f"{stack} {count}" for stack, count in self.stacks.most_common()]
+        return "\n".join(lines) + ("\n" if lines else "")
+
+
+async def profile(seconds: float, mode: str = "sampling", interval: float = 0.005) -> str:
+    """剖析当前进程一段时间
+
+    Args:
+        seconds: 剖析时长(秒)，不超过 MAX_SECONDS
+        mode: sampling 或 cprofile
+        interval: sampling 模式的采样间隔(秒)
+
+    Returns:
+        str: sampling 模式返回 collapsed stack，cprofile 模式返回统计结果文本
+
+    Raises:
+        ValueError: 参数无效
+        ProfilerBusyError: 已有剖析任务正在运行
+    """
+    if mode not in ("sampling", "cprofile"):
+        raise ValueError(f"不支持的剖析模式: {mode}")
+    if not 0 < seconds <= MAX_SECONDS:
+        raise ValueError(f"剖析时长必须在 0 到 {MAX_SECONDS:.0f} 秒之间")
+    if not _lock.acquire(blocking=False):
+        raise ProfilerBusyError("已有剖析任务正在运行")
+
+    try:
+        if mode == "sampling":
+            # 事件循环线程就是当前线程，只采样它即可得到请求处理的调用栈
+            profiler = SamplingProfiler(interval, threading.get_ident())
+            profiler.start()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                profiler.stop()
+            return profiler.collapsed()
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(80)
+        return output.getvalue()
+    finally:
+        _lock.release()
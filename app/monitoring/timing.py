@@ -0,0 +1,107 @@
+"""阶段耗时统计
+
+``timed`` 装饰协程函数或异步生成器函数，把每次调用的耗时记录到直方图：
+
+- ``deepxy_stage_duration_seconds{stage, outcome}``：从调用到结束的总耗时，
+  outcome 为 ok / error / cancelled / closed（异步生成器被提前关闭）
+- ``deepxy_stage_first_item_seconds{stage}``：异步生成器产出第一项的耗时，
+  对上游流式请求而言即收到第一个 SSE 事件的时间
+
+直方图是累计值，需要滚动窗口的使用方（例如降级控制器）通过 ``add_listener`` 订阅每次的耗时。
+"""
+
+import asyncio
+import functools
+import inspect
+import time
+from contextlib import aclosing
+from typing import Callable, List
+
+from .metrics import REGISTRY, Histogram, MetricsRegistry
+
+# 每次调用结束时以 (stage, outcome, 耗时) 调用
+_listeners: List[Callable[[str, str, float], None]] = []
+
+
+def add_listener(listener: Callable[[str, str, float], None]) -> None:
+    """订阅阶段耗时"""
+    _listeners.append(listener)
+
+
+def remove_listener(listener: Callable[[str, str, float], None]) -> None:
+    """取消订阅，未订阅时忽略"""
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+
+def _record(duration: Histogram, stage: str, outcome: str, seconds: float) -> None:
+    duration.observe(seconds, stage=stage, outcome=outcome)
+    for listener in _listeners:
+        listener(stage, outcome, seconds)
+
+
+def _outcome(error: BaseException) -> str:
+    if isinstance(error, asyncio.CancelledError):
+        return "cancelled"
+    if isinstance(error, GeneratorExit):
+        return "closed"
+    return "error"
+
+
+def timed(stage: str, registry: MetricsRegistry = REGISTRY) -> Callable:
+    """记录协程或异步生成器的耗时
+
+    Args:
+        stage: 阶段名称，作为指标的 stage 标签
+        registry: 指标注册表
+
+    Returns:
+        Callable: 装饰器
+    """
+    duration = registry.histogram(
+        "deepxy_stage_duration_seconds", "各阶段的耗时", ("stage", "outcome")
+    )
+    first_item = registry.histogram(
+        "deepxy_stage_first_item_seconds", "异步生成器产出第一项的耗时", ("stage",)
+    )
+
+    def decorator(function: Callable) -> Callable:
+        if inspect.isasyncgenfunction(function):
+            @functools.wraps(function)
+            async def generator_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                outcome = "ok"
+                waiting_first = True
+                try:
+                    async with aclosing(function(*args, **kwargs)) as stream:
+                        async for item in stream:
+                            if waiting_first:
+                                waiting_first = False
+                                first_item.observe(time.perf_counter() - start, stage=stage)
+                            yield item
+                except BaseException as e:
+                    outcome = _outcome(e)
+                    raise
+                finally:
+                    _record(duration, stage, outcome, time.perf_counter() - start)
+
+            return generator_wrapper
+
+        if not inspect.iscoroutinefunction(function):
+            raise TypeError(f"timed 只能用于协程函数或异步生成器函数: {function!r}")
+
+        @functools.wraps(function)
+        async def coroutine_wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            outcome = "ok"
+            try:
+                return await function(*args, **kwargs)
+            except BaseException as e:
+                outcome = _outcome(e)
+                raise
+            finally:
+                _record(duration, stage, outcome, time.perf_counter() - start)
+
+        return coroutine_wrapper
+
+    return decorator
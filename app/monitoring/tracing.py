@@ -0,0 +1,540 @@
+"""分布式追踪
+
+阶段耗时的直方图只能看出整体的分布，无法沿着一个慢请求看清它在哪一段变慢。这里按 OpenTelemetry
+的数据模型记录 span：
+
+- ``chat_completions``（server）：整个请求，流式请求在最后一个事件发出后结束
+- ``process_deepseek`` / ``process_qwen``：推理与回答阶段，记录模型、token 数与续写次数
+- ``upstream_request`` / ``upstream_post``（client）：每次上游 HTTP 请求，记录地址、模型、状态码与收发字节数
+
+当前 span 保存在上下文变量中，``asyncio.create_task`` 创建的阶段任务会继承它作为父 span。
+收到 W3C ``traceparent`` 请求头时沿用其中的 trace，发往上游的请求带上当前 span 的 ``traceparent``。
+
+采样在请求开始时决定（head sampling）：有上游传入的 ``traceparent`` 时沿用其采样标记，否则按比例抽样。
+未抽中的请求只生成 trace 与 span ID 用于传递，不记录属性也不导出。结束的 span 追加到内存缓冲区，
+由后台任务按批次交给导出器：``OtlpHttpExporter`` 以 OTLP/HTTP JSON 发往本地的 collector，
+``FileExporter`` 在线程中把同样的 JSON 逐行追加到文件。未配置导出器时所有函数都是空操作。
+"""
+
+import asyncio
+import functools
+import inspect
+import random
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from dataclasses import dataclass
+from pathlib import Path
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional, Protocol, Union
+
+import aiohttp
+
+from app.utils import json_codec
+from app.utils.logger import logger
+from .metrics import REGISTRY, MetricsRegistry
+
+TRACEPARENT_HEADER = "traceparent"
+TRACESTATE_HEADER = "tracestate"
+
+_TRACEPARENT = re.compile(r"([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})(-.*)?")
+_INVALID_TRACE_ID = "0" * 32
+_INVALID_SPAN_ID = "0" * 16
+
+# OTLP 的 SpanKind 与 StatusCode
+SPAN_KINDS = {"internal": 1, "server": 2, "client": 3}
+STATUS_CODES = {"unset": 0, "ok": 1, "error": 2}
+
+AttributeValue = Union[str, bool, int, float]
+
+
+@dataclass(frozen=True)
+class SpanContext:
+    """跨进程传递的 trace 信息"""
+
+    trace_id: str
+    span_id: str
+    sampled: bool
+    tracestate: Optional[str] = None
+
+
+def parse_traceparent(value: Optional[str], tracestate: Optional[str] = None) -> Optional[SpanContext]:
+    """解析 W3C ``traceparent`` 请求头，格式无效时返回 None"""
+    if not value:
+        return None
+    match = _TRACEPARENT.fullmatch(value.strip())
+    if match is None:
+        return None
+    version, trace_id, span_id, flags, rest = match.groups()
+    # 00 版本不允许附加字段，ff 是无效版本
+    if version == "ff" or (version == "00" and rest):
+        return None
+    if trace_id == _INVALID_TRACE_ID or span_id == _INVALID_SPAN_ID:
+        return None
+    return SpanContext(trace_id, span_id, bool(int(flags, 16) & 1), tracestate or None)
+
+
+class Span:
+    """记录中的 span"""
+
+    recording = True
+
+    def __init__(
+        self,
+        name: str,
+        context: SpanContext,
+        parent_id: Optional[str],
+        kind: str,
+        on_end: Optional[Callable[["Span"], None]],
+    ):
+        self.name = name
+        self.context = context
+        self.parent_id = parent_id
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes: Dict[str, AttributeValue] = {}
+        self.status = "unset"
+        self.status_message = ""
+        self._on_end = on_end
+
+    def set_attribute(self, key: str, value: Optional[AttributeValue]) -> None:
+        """设置属性，值为 None 时忽略"""
+        if value is not None:
+            self.attributes[key] = value
+
+    def set_attributes(self, attributes: Dict[str, Optional[AttributeValue]]) -> None:
+        for key, value in attributes.items():
+            self.set_attribute(key, value)
+
+    def add(self, key: str, amount: Union[int, float]) -> None:
+        """累加数值属性，例如收到的字节数"""
+        self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def record_error(self, error: BaseException) -> None:
+        """标记为失败，取消与提前关闭不算失败"""
+        if isinstance(error, (asyncio.CancelledError, GeneratorExit)):
+            self.set_attribute("deepxy.outcome", "cancelled" if isinstance(error, asyncio.CancelledError) else "closed")
+            return
+        self.status = "error"
+        self.status_message = f"{type(error).__name__}: {error}"
+
+    def traceparent(self) -> Optional[str]:
+        """当前 span 作为父 span 的 ``traceparent``"""
+        return f"00-{self.context.trace_id}-{self.context.span_id}-{'01' if self.context.sampled else '00'}"
+
+    def end(self) -> None:
+        """结束 span，重复调用时忽略"""
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if self._on_end is not None:
+            self._on_end(self)
+
+
+class NonRecordingSpan(Span):
+    """未抽中的 span，只用于传递 trace 信息"""
+
+    recording = False
+
+    def __init__(self, name: str, context: Optional[SpanContext]):
+        super().__init__(name, context, None, "internal", None)
+
+    def set_attribute(self, key: str, value: Optional[AttributeValue]) -> None:
+        pass
+
+    def add(self, key: str, amount: Union[int, float]) -> None:
+        pass
+
+    def record_error(self, error: BaseException) -> None:
+        pass
+
+    def traceparent(self) -> Optional[str]:
+        return super().traceparent() if self.context is not None else None
+
+
+# 未配置追踪时使用的 span，不传递任何信息
+NOOP_SPAN = NonRecordingSpan("noop", None)
+
+_current: ContextVar[Optional[Span]] = ContextVar("deepxy_span", default=None)
+
+
+class SpanProcessor(Protocol):
+    def on_end(self, span: Span) -> None:
+        """span 结束时调用"""
+
+
+class Tracer:
+    """创建 span 并按比例抽样"""
+
+    def __init__(
+        self,
+        processor: Optional[SpanProcessor] = None,
+        sample_rate: float = 1.0,
+        rng: Callable[[], float] = random.random,
+    ):
+        """初始化
+
+        Args:
+            processor: 接收结束的 span，为空时不追踪
+            sample_rate: 没有上游采样标记时记录的请求比例，0 到 1
+            rng: 返回 [0, 1) 随机数的函数，便于测试
+        """
+        self.processor = processor
+        self.sample_rate = sample_rate
+        self.rng = rng
+
+    def start_span(
+        self,
+        name: str,
+        kind: str = "internal",
+        parent: Union[Span, SpanContext, None] = None,
+    ) -> Span:
+        """创建 span
+
+        Args:
+            name: span 名称
+            kind: internal / server / client
+            parent: 父 span 或上游传入的 trace 信息，为空时使用当前 span
+
+        Returns:
+            Span: 抽中时为记录中的 span，否则为 NonRecordingSpan
+        """
+        if self.processor is None:
+            return NOOP_SPAN
+        if parent is None:
+            parent = _current.get()
+        if isinstance(parent, Span):
+            parent = parent.context
+        span_id = f"{random.getrandbits(64):016x}"
+        if parent is None:
+            context = SpanContext(f"{random.getrandbits(128):032x}", span_id, self.rng() < self.sample_rate)
+        else:
+            context = SpanContext(parent.trace_id, span_id, parent.sampled, parent.tracestate)
+        if not context.sampled:
+            return NonRecordingSpan(name, context)
+        return Span(name, context, parent.span_id if parent is not None else None, kind, self.processor.on_end)
+
+
+_tracer = Tracer()
+
+
+def set_tracer(tracer: Tracer) -> None:
+    """设置进程内使用的 Tracer"""
+    global _tracer
+    _tracer = tracer
+
+
+def get_tracer() -> Tracer:
+    return _tracer
+
+
+def start_span(name: str, kind: str = "internal", parent: Union[Span, SpanContext, None] = None) -> Span:
+    """用当前的 Tracer 创建 span，见 ``Tracer.start_span``"""
+    return _tracer.start_span(name, kind, parent)
+
+
+def current_span() -> Span:
+    """当前的 span，没有时返回 NOOP_SPAN"""
+    return _current.get() or NOOP_SPAN
+
+
+def use_span(span: Span) -> Token:
+    """把 span 设为当前 span
+
+    Returns:
+        Token: 用于 reset_span 恢复
+    """
+    return _current.set(span)
+
+
+def reset_span(token: Token) -> None:
+    """恢复设置之前的当前 span"""
+    _current.reset(token)
+
+
+@contextmanager
+def span(name: str, kind: str = "internal") -> Iterator[Span]:
+    """在 with 块中创建并使用 span，出错时标记为失败"""
+    current = start_span(name, kind)
+    token = use_span(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.record_error(e)
+        raise
+    finally:
+        reset_span(token)
+        current.end()
+
+
+def traced(name: str, kind: str = "internal") -> Callable:
+    """在 span 中运行协程函数，函数内可以通过 current_span() 设置属性
+
+    异步生成器在调用方的上下文中运行，不能安全地切换当前 span，需要在函数内显式创建。
+    """
+
+    def decorator(function: Callable) -> Callable:
+        if not inspect.iscoroutinefunction(function):
+            raise TypeError(f"traced 只能用于协程函数: {function!r}")
+
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            with span(name, kind):
+                return await function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def inject(headers: dict, span: Optional[Span] = None) -> dict:
+    """在请求头中加上 span（默认为当前 span）的 ``traceparent``"""
+    span = span or current_span()
+    traceparent = span.traceparent()
+    if traceparent is None:
+        return headers
+    headers = {**headers, TRACEPARENT_HEADER: traceparent}
+    if span.context.tracestate:
+        headers[TRACESTATE_HEADER] = span.context.tracestate
+    return headers
+
+
+async def end_after(events: AsyncIterator[bytes], span: Span) -> AsyncIterator[bytes]:
+    """转发流式响应，流结束或客户端断开时结束 span"""
+    try:
+        async for chunk in events:
+            span.add("http.response.body.size", len(chunk))
+            yield chunk
+    except BaseException as e:
+        span.record_error(e)
+        raise
+    finally:
+        span.end()
+
+
+def _attribute(key: str, value: AttributeValue) -> dict:
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        # OTLP JSON 中 64 位整数以字符串表示
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+
+def to_otlp(spans: List[Span], service_name: str) -> dict:
+    """转换为 OTLP/HTTP JSON 格式的 ExportTraceServiceRequest"""
+    return {"resourceSpans": [{
+        "resource": {"attributes": [_attribute("service.name", service_name)]},
+        "scopeSpans": [{
+            "scope": {"name": "deepxy"},
+            "spans": [
+                {
+                    "traceId": span.context.trace_id,
+                    "spanId": span.context.span_id,
+                    "parentSpanId": span.parent_id or "",
+                    "name": span.name,
+                    "kind": SPAN_KINDS.get(span.kind, 1),
+                    "startTimeUnixNano": str(span.start_ns),
+                    "endTimeUnixNano": str(span.end_ns),
+                    "attributes": [_attribute(key, value) for key, value in span.attributes.items()],
+                    "status": {"code": STATUS_CODES[span.status], "message": span.status_message},
+                }
+                for span in spans
+            ],
+        }],
+    }]}
+
+
+class SpanExporter(Protocol):
+    async def export(self, spans: List[Span]) -> None:
+        """导出一批 span，失败时抛出异常"""
+
+    async def shutdown(self) -> None:
+        """释放资源"""
+
+
+class FileExporter:
+    """把每批 span 以一行 OTLP JSON 追加到文件，可由 collector 的 otlpjsonfile 接收器读取"""
+
+    def __init__(self, path: str, service_name: str = "deepxy"):
+        self.path = Path(path)
+        self.service_name = service_name
+
+    def _write(self, data: bytes) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "ab") as f:
+            f.write(data)
+
+    async def export(self, spans: List[Span]) -> None:
+        data = json_codec.dumps(to_otlp(spans, self.service_name)) + b"\n"
+        await asyncio.to_thread(self._write, data)
+
+    async def shutdown(self) -> None:
+        pass
+
+
+class OtlpHttpExporter:
+    """以 OTLP/HTTP JSON 发送到 collector"""
+
+    def __init__(
+        self,
+        endpoint: str = "http://127.0.0.1:4318/v1/traces",
+        service_name: str = "deepxy",
+        timeout: float = 5.0,
+    ):
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        # 使用独立的会话，导出请求不占用上游的连接池
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def export(self, spans: List[Span]) -> None:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=self.timeout)
+        async with self._session.post(
+            self.endpoint,
+            data=json_codec.dumps(to_otlp(spans, self.service_name)),
+            headers={"Content-Type": "application/json"},
+        ) as response:
+            if response.status >= 300:
+                body = await response.text()
+                raise aiohttp.ClientError(f"状态码 {response.status}: {body[:200]}")
+
+    async def shutdown(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class BatchSpanProcessor:
+    """缓存结束的 span，由后台任务按批次导出"""
+
+    def __init__(
+        self,
+        exporter: SpanExporter,
+        batch_size: int = 512,
+        flush_interval: float = 2.0,
+        max_pending: int = 8192,
+        registry: MetricsRegistry = REGISTRY,
+    ):
+        """初始化
+
+        Args:
+            exporter: 导出器
+            batch_size: 缓冲区达到该数量时立即导出
+            flush_interval: 最长导出间隔(秒)
+            max_pending: 缓冲区上限，超出时丢弃新的 span
+            registry: 指标注册表
+        """
+        self.exporter = exporter
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending: List[Span] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+        self._exported = registry.counter("deepxy_trace_spans_exported_total", "导出的 span 数")
+        self._dropped = registry.counter(
+            "deepxy_trace_spans_dropped_total",
+            "没有导出的 span 数，reason 为 overflow（缓冲区已满）/ error（导出失败）",
+            ("reason",),
+        )
+        registry.gauge("deepxy_trace_spans_pending", "等待导出的 span 数").set_function(
+            lambda: len(self._pending)
+        )
+
+    def on_end(self, span: Span) -> None:
+        if len(self._pending) >= self.max_pending:
+            self._dropped.inc(reason="overflow")
+            return
+        self._pending.append(span)
+        if len(self._pending) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    async def flush(self) -> int:
+        """导出缓冲区中的 span
+
+        Returns:
+            int: 导出的 span 数
+        """
+        exported = 0
+        while self._pending:
+            spans = self._pending[:self.batch_size]
+            del self._pending[:self.batch_size]
+            try:
+                await self.exporter.export(spans)
+            except Exception as e:
+                logger.warning(f"导出 {len(spans)} 个 span 失败: {e}")
+                self._dropped.inc(len(spans), reason="error")
+                continue
+            self._exported.inc(len(spans))
+            exported += len(spans)
+        return exported
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self) -> None:
+        """在当前事件循环中启动后台导出"""
+        if self._task is None or self._task.done():
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """停止后台导出，导出剩余的 span 并关闭导出器"""
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+        await self.exporter.shutdown()
+
+
+def build_tracer(
+    exporter: str,
+    endpoint: str,
+    path: Optional[str],
+    sample_rate: float,
+    service_name: str = "deepxy",
+) -> Optional[Tracer]:
+    """按配置创建 Tracer
+
+    Args:
+        exporter: otlp / file，为空时不追踪
+        endpoint: OTLP/HTTP 的地址
+        path: file 导出器写入的文件
+        sample_rate: 采样比例
+        service_name: 上报的服务名
+
+    Returns:
+        Optional[Tracer]: 未启用时返回 None
+
+    Raises:
+        ValueError: 导出器名称无效或缺少文件路径
+    """
+    if not exporter:
+        return None
+    if exporter == "otlp":
+        span_exporter = OtlpHttpExporter(endpoint, service_name)
+    elif exporter == "file":
+        if not path:
+            raise ValueError("file 导出器需要设置 TRACING_FILE")
+        span_exporter = FileExporter(path, service_name)
+    else:
+        raise ValueError(f"无效的追踪导出器: {exporter}，可选 otlp / file")
+    return Tracer(BatchSpanProcessor(span_exporter), sample_rate)
@@ -1,28 +1,239 @@
-from fastapi import HTTPException, Header
-from typing import Optional
+"""API Key 认证
+
+租户与 API Key 的对应关系从 JSON 文件加载，文件中只保存 key 的 SHA-256 摘要，
+按摘要建立字典，每次认证只需要一次哈希与一次字典查找。后台任务定期检查文件，
+修改后在线程中读取并重新加载，认证路径上不读取文件。
+
+没有配置租户文件时：
+- 设置了 ALLOW_API_KEY：只接受该 key，对应名为 default 的租户
+- 都没有设置：不做认证，所有请求属于 anonymous 租户
+"""
+
+import asyncio
+import hashlib
+import hmac
+import json
 import os
-from dotenv import load_dotenv
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Tuple
+
+from fastapi import Header, HTTPException
+
+from app.utils.errors import APIKeyError
 from app.utils.logger import logger
 
-# 加载 .env 文件
-logger.info(f"当前工作目录: {os.getcwd()}")
-logger.info("尝试加载.env文件...")
-load_dotenv(override=True)  # 添加override=True强制覆盖已存在的环境变量
+PRIORITY_NAMES = ("high", "normal", "low")
+
+
+def hash_key(api_key: str) -> str:
+    """计算 API Key 的 SHA-256 摘要（十六进制）"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+@dataclass(frozen=True)
+class Tenant:
+    """租户及其配额，0 表示不限制"""
+
+    id: str
+    max_concurrency: int = 0
+    tokens_per_minute: int = 0
+    priority: Optional[str] = None
+
+    def __post_init__(self):
+        if self.priority is not None and self.priority not in PRIORITY_NAMES:
+            raise ValueError(f"无效的租户优先级: {self.priority}")
+
+
+ANONYMOUS = Tenant("anonymous")
+
+
+class KeyStore:
+    """API Key 摘要到租户的映射，支持热加载"""
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        allow_api_key: Optional[str] = None,
+        reload_interval: float = 5.0,
+    ):
+        """初始化 KeyStore
+
+        Args:
+            path: 租户文件路径
+            allow_api_key: 没有租户文件时使用的单个 API Key
+            reload_interval: 后台检查文件是否修改的间隔(秒)，0 表示不自动重新加载
+        """
+        self.path = path
+        self.reload_interval = reload_interval
+        self._tenants: Dict[str, Tenant] = {}
+        self._mtime: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+        if path:
+            self.reload()
+        elif allow_api_key:
+            self._tenants = {hash_key(allow_api_key): Tenant("default")}
+
+    @property
+    def enabled(self) -> bool:
+        """是否需要认证"""
+        return bool(self.path or self._tenants)
+
+    def load(self, config: dict) -> None:
+        """加载租户配置
+
+        格式::
+
+            {
+                "tenants": [
+                    {"id": "acme", "keys": ["<sha256>", "<sha256>"],
+                     "max_concurrency": 8, "tokens_per_minute": 200000, "priority": "high"}
+                ]
+            }
+
+        一个租户可以有多个 key，便于轮换。
+        """
+        tenants = {}
+        for item in config.get("tenants", []):
+            tenant = Tenant(
+                id=item["id"],
+                max_concurrency=int(item.get("max_concurrency", 0)),
+                tokens_per_minute=int(item.get("tokens_per_minute", 0)),
+                priority=item.get("priority"),
+            )
+            for key_hash in item.get("keys", []):
+                key_hash = key_hash.strip().lower()
+                if key_hash in tenants:
+                    raise ValueError(f"重复的 API Key 摘要: {key_hash[:8]}…")
+                tenants[key_hash] = tenant
+        self._tenants = tenants
+
+    def _read_if_changed(self) -> Optional[Tuple[float, dict]]:
+        """文件修改后读取内容，读取失败或未修改时返回 None"""
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError as e:
+            logger.error(f"读取租户文件失败: {e}")
+            return None
+        if mtime == self._mtime:
+            return None
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return mtime, json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"加载租户文件失败，继续使用原有配置: {e}")
+            return None
+
+    def _apply(self, changed: Optional[Tuple[float, dict]]) -> bool:
+        if changed is None:
+            return False
+        mtime, config = changed
+        try:
+            self.load(config)
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            logger.error(f"加载租户文件失败，继续使用原有配置: {e}")
+            return False
+        self._mtime = mtime
+        logger.info(f"已加载租户文件，共 {len(set(self._tenants.values()))} 个租户")
+        return True
+
+    def reload(self) -> bool:
+        """文件修改后重新加载，加载失败时保留原有配置（同步读取文件，只在启动时使用）
+
+        Returns:
+            bool: 是否重新加载了配置
+        """
+        return self._apply(self._read_if_changed())
+
+    async def refresh(self) -> bool:
+        """在线程中读取文件，修改后重新加载，加载失败时保留原有配置
+
+        Returns:
+            bool: 是否重新加载了配置
+        """
+        if not self.path:
+            return False
+        return self._apply(await asyncio.to_thread(self._read_if_changed))
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.exception(f"检查租户文件时发生错误: {e}")
+
+    def start(self) -> None:
+        """在当前事件循环中启动后台热加载"""
+        if self.path and self.reload_interval > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """停止后台热加载"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def lookup(self, api_key: Optional[str]) -> Optional[Tenant]:
+        """查找 API Key 对应的租户
+
+        Args:
+            api_key: 请求中的 API Key
+
+        Returns:
+            Optional[Tenant]: 不需要认证时返回 anonymous 租户，key 无效时返回 None
+        """
+        if not self.enabled:
+            return ANONYMOUS
+        if not api_key:
+            return None
+        return self._tenants.get(hash_key(api_key))
+
+
+def api_key_verifier(store: KeyStore) -> Callable:
+    """生成对话接口的鉴权依赖
+
+    API Key 通过 ``Authorization: Bearer`` 传递。
+
+    Args:
+        store: 租户配置
+
+    Returns:
+        Callable: FastAPI 依赖，返回请求所属的租户
+    """
+    async def verify_api_key(authorization: Optional[str] = Header(None)) -> Tenant:
+        api_key = (authorization or "").removeprefix("Bearer ").strip()
+        tenant = store.lookup(api_key)
+        if tenant is None:
+            raise APIKeyError("无效的 API Key")
+        return tenant
+
+    return verify_api_key
+
 
-# 获取环境变量
-ALLOW_API_KEY = os.getenv("ALLOW_API_KEY")
-DASHSCOPE_API_KEY = os.getenv("DASHSCOPE_API_KEY")
+def admin_key_verifier(admin_key: Optional[str]) -> Callable:
+    """生成管理接口的鉴权依赖
 
-# 检查环境变量状态
-logger.info(f"DASHSCOPE_API_KEY环境变量状态: {'已设置' if DASHSCOPE_API_KEY else '未设置'}")
+    未配置管理密钥时管理接口不可用（返回 404）。密钥可以通过
+    ``X-Admin-Key`` 请求头或 ``Authorization: Bearer`` 传递。
 
-if not DASHSCOPE_API_KEY:
-    logger.critical("请设置环境变量 DASHSCOPE_API_KEY")
-    raise ValueError("DASHSCOPE_API_KEY environment variable must be set")
+    Args:
+        admin_key: 管理密钥
 
-# 打印API密钥的前4位用于调试
-logger.info(f"Loaded API key starting with: {ALLOW_API_KEY[:4] if ALLOW_API_KEY and len(ALLOW_API_KEY) >= 4 else ALLOW_API_KEY}")
+    Returns:
+        Callable: FastAPI 依赖
+    """
+    async def verify_admin_key(
+        authorization: Optional[str] = Header(None),
+        x_admin_key: Optional[str] = Header(None),
+    ) -> None:
+        if not admin_key:
+            raise HTTPException(status_code=404)
+        token = x_admin_key or (authorization or "").removeprefix("Bearer ").strip()
+        if not hmac.compare_digest(token.encode(), admin_key.encode()):
+            raise APIKeyError("无效的管理密钥")
 
-async def verify_api_key(authorization: Optional[str] = Header(None)) -> None:
-    """验证API密钥（已禁用）"""
-    pass
+    return verify_admin_key
@@ -48,6 +48,16 @@ class InvalidRequestError(DeepClaudeError):
             details=details
         )
 
+class PayloadTooLargeError(DeepClaudeError):
+    """请求体过大错误"""
+    def __init__(self, message: str, details: Optional[Dict] = None):
+        super().__init__(
+            message=message,
+            error_code="PAYLOAD_TOO_LARGE",
+            http_status=413,
+            details=details
+        )
+
 class APIError(DeepClaudeError):
     """API调用错误"""
     def __init__(self, message: str, details: Optional[Dict] = None):
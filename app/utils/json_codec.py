@@ -0,0 +1,338 @@
+"""JSON 编解码模块
+
+上游 SSE 的每一行和下发给客户端的每一个 chunk 都要经过一次 JSON 编解码，
+属于逐 token 执行的热路径。本模块按 msgspec > orjson > 标准库 json 的顺序
+选择可用的后端，并提供只读取 ``choices[0].delta`` / ``output.choices[0].message``
+中 ``content`` 与 ``reasoning_content`` 两个字段的类型化解码函数。DashScope 原生协议的事件
+另外解析结束原因、用量、request_id 与错误码。
+
+可以通过配置 ``JSON_BACKEND`` (msgspec / orjson / json) 强制指定后端，启动时由
+``use_backend`` 切换。
+"""
+
+import json
+from typing import Any, Iterator, List, NamedTuple, Optional, Tuple, Type, Union
+
+try:  # pragma: no cover - 取决于运行环境
+    import msgspec
+except ImportError:  # pragma: no cover
+    msgspec = None
+
+try:  # pragma: no cover - 取决于运行环境
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+class StreamDelta(NamedTuple):
+    """流式响应中我们关心的增量字段"""
+
+    content: Optional[str] = None
+    reasoning_content: Optional[str] = None
+
+
+class DashScopeUsage(NamedTuple):
+    """DashScope 原生协议报告的用量（流式响应中为累计值）"""
+
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cached_tokens: int = 0
+    request_id: Optional[str] = None
+
+
+class DashScopeEvent(NamedTuple):
+    """DashScope 原生协议的一个流式事件"""
+
+    delta: Optional[StreamDelta] = None
+    finish_reason: Optional[str] = None
+    usage: Optional[DashScopeUsage] = None
+    request_id: Optional[str] = None
+    # 出错时的错误码与错误信息
+    code: Optional[str] = None
+    message: Optional[str] = None
+
+
+def _pick(data: Any, key: str) -> Any:
+    """从可能为 None 或非字典的对象中取值"""
+    return data.get(key) if isinstance(data, dict) else None
+
+
+def _delta_from_dict(delta: Any) -> Optional[StreamDelta]:
+    if not delta or not isinstance(delta, dict):
+        return None
+    return StreamDelta(delta.get("content"), delta.get("reasoning_content"))
+
+
+class _StdlibCodec:
+    """标准库 json 后端"""
+
+    name = "json"
+    decode_errors: Tuple[Type[Exception], ...] = (ValueError, TypeError)
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        return json.loads(data)
+
+    def dumps(self, obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def decode_chat_delta(self, data: Union[bytes, str]) -> Optional[StreamDelta]:
+        """解析 OpenAI 兼容格式的 ``choices[0].delta``"""
+        choices = _pick(self.loads(data), "choices")
+        if not choices:
+            return None
+        return _delta_from_dict(_pick(choices[0], "delta"))
+
+    def decode_dashscope_delta(self, data: Union[bytes, str]) -> Optional[StreamDelta]:
+        """解析 DashScope 原生格式的 ``output.choices[0].message``"""
+        choices = _pick(_pick(self.loads(data), "output"), "choices")
+        if not choices:
+            return None
+        return _delta_from_dict(_pick(choices[0], "message"))
+
+    def decode_dashscope_event(self, data: Union[bytes, str]) -> DashScopeEvent:
+        """解析 DashScope 原生格式的完整事件"""
+        body = self.loads(data)
+        choices = _pick(_pick(body, "output"), "choices")
+        choice = choices[0] if choices else None
+        usage = _pick(body, "usage")
+        request_id = _pick(body, "request_id")
+        if isinstance(usage, dict):
+            usage = DashScopeUsage(
+                usage.get("input_tokens") or 0,
+                usage.get("output_tokens") or 0,
+                _pick(usage.get("prompt_tokens_details"), "cached_tokens") or 0,
+                request_id,
+            )
+        else:
+            usage = None
+        return DashScopeEvent(
+            _delta_from_dict(_pick(choice, "message")),
+            _pick(choice, "finish_reason"),
+            usage,
+            request_id,
+            _pick(body, "code"),
+            _pick(body, "message"),
+        )
+
+    def decode_completion_message(self, data: Union[bytes, str]) -> Optional[StreamDelta]:
+        """解析非流式响应的 ``choices[0].message`` 或 ``output.choices[0].message``"""
+        body = self.loads(data)
+        choices = _pick(body, "choices") or _pick(_pick(body, "output"), "choices")
+        if not choices:
+            return None
+        return _delta_from_dict(_pick(choices[0], "message"))
+
+
+class _OrjsonCodec(_StdlibCodec):
+    """orjson 后端，解码得到 dict 后再提取字段"""
+
+    name = "orjson"
+
+    def __init__(self):
+        self.decode_errors = (ValueError, TypeError, orjson.JSONDecodeError)
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        return orjson.loads(data)
+
+    def dumps(self, obj: Any) -> bytes:
+        return orjson.dumps(obj)
+
+
+class _MsgspecCodec(_StdlibCodec):
+    """msgspec 后端，直接解码为只包含所需字段的结构体"""
+
+    name = "msgspec"
+
+    def __init__(self):
+        class Delta(msgspec.Struct):
+            content: Optional[str] = None
+            reasoning_content: Optional[str] = None
+
+        class ChatChoice(msgspec.Struct):
+            delta: Optional[Delta] = None
+
+        class ChatChunk(msgspec.Struct):
+            choices: Optional[List[ChatChoice]] = None
+
+        class DashScopeChoice(msgspec.Struct):
+            message: Optional[Delta] = None
+            finish_reason: Optional[str] = None
+
+        class DashScopeOutput(msgspec.Struct):
+            choices: Optional[List[DashScopeChoice]] = None
+
+        class TokenDetails(msgspec.Struct):
+            cached_tokens: int = 0
+
+        class Usage(msgspec.Struct):
+            input_tokens: int = 0
+            output_tokens: int = 0
+            prompt_tokens_details: Optional[TokenDetails] = None
+
+        class DashScopeChunk(msgspec.Struct):
+            output: Optional[DashScopeOutput] = None
+
+        class DashScopeEventChunk(DashScopeChunk):
+            usage: Optional[Usage] = None
+            request_id: Optional[str] = None
+            code: Optional[str] = None
+            message: Optional[str] = None
+
+        self._chat_decoder = msgspec.json.Decoder(ChatChunk)
+        self._dashscope_decoder = msgspec.json.Decoder(DashScopeChunk)
+        self._dashscope_event_decoder = msgspec.json.Decoder(DashScopeEventChunk)
+        self._encoder = msgspec.json.Encoder()
+        self.decode_errors = (ValueError, TypeError, msgspec.DecodeError)
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        return msgspec.json.decode(data)
+
+    def dumps(self, obj: Any) -> bytes:
+        return self._encoder.encode(obj)
+
+    def decode_chat_delta(self, data: Union[bytes, str]):
+        chunk = self._chat_decoder.decode(data)
+        if not chunk.choices:
+            return None
+        delta = chunk.choices[0].delta
+        if delta is None or (delta.content is None and delta.reasoning_content is None):
+            return None
+        return delta
+
+    def decode_dashscope_delta(self, data: Union[bytes, str]):
+        chunk = self._dashscope_decoder.decode(data)
+        if chunk.output is None or not chunk.output.choices:
+            return None
+        message = chunk.output.choices[0].message
+        if message is None or (message.content is None and message.reasoning_content is None):
+            return None
+        return message
+
+    def decode_dashscope_event(self, data: Union[bytes, str]) -> DashScopeEvent:
+        chunk = self._dashscope_event_decoder.decode(data)
+        choice = chunk.output.choices[0] if chunk.output is not None and chunk.output.choices else None
+        usage = chunk.usage
+        if usage is not None:
+            details = usage.prompt_tokens_details
+            usage = DashScopeUsage(
+                usage.input_tokens,
+                usage.output_tokens,
+                details.cached_tokens if details is not None else 0,
+                chunk.request_id,
+            )
+        return DashScopeEvent(
+            choice.message if choice is not None else None,
+            choice.finish_reason if choice is not None else None,
+            usage,
+            chunk.request_id,
+            chunk.code,
+            chunk.message,
+        )
+
+
+_BACKENDS = {
+    "msgspec": (_MsgspecCodec, lambda: msgspec is not None),
+    "orjson": (_OrjsonCodec, lambda: orjson is not None),
+    "json": (_StdlibCodec, lambda: True),
+}
+
+
+def get_codec(backend: Optional[str] = None) -> _StdlibCodec:
+    """获取 JSON 编解码器
+
+    Args:
+        backend: 指定后端名称，为空时按 msgspec > orjson > json 自动选择；
+            指定的后端不可用时同样回退到自动选择
+
+    Returns:
+        编解码器实例
+    """
+    if backend:
+        codec_cls, available = _BACKENDS.get(backend.lower(), (None, lambda: False))
+        if codec_cls is not None and available():
+            return codec_cls()
+    for codec_cls, available in _BACKENDS.values():
+        if available():
+            return codec_cls()
+    return _StdlibCodec()
+
+
+def use_backend(backend: Optional[str]) -> None:
+    """切换模块级的编解码函数，启动时按配置调用一次
+
+    Args:
+        backend: 后端名称，为空时按 msgspec > orjson > json 自动选择
+    """
+    global codec, BACKEND, DecodeError, loads, dumps
+    global decode_chat_delta, decode_dashscope_delta, decode_dashscope_event, decode_completion_message
+    codec = get_codec(backend)
+    BACKEND = codec.name
+    DecodeError = codec.decode_errors
+    loads = codec.loads
+    dumps = codec.dumps
+    decode_chat_delta = codec.decode_chat_delta
+    decode_dashscope_delta = codec.decode_dashscope_delta
+    decode_dashscope_event = codec.decode_dashscope_event
+    decode_completion_message = codec.decode_completion_message
+
+
+codec = get_codec()
+
+BACKEND = codec.name
+DecodeError = codec.decode_errors
+loads = codec.loads
+dumps = codec.dumps
+decode_chat_delta = codec.decode_chat_delta
+decode_dashscope_delta = codec.decode_dashscope_delta
+decode_dashscope_event = codec.decode_dashscope_event
+decode_completion_message = codec.decode_completion_message
+
+
+def sse_event(obj: Any) -> bytes:
+    """将对象编码为一条 SSE data 事件"""
+    return b"data: " + dumps(obj) + b"\n\n"
+
+
+def _iter_item(item: Any, max_chars: int) -> Iterator[bytes]:
+    """编码列表中的一项，超长的字符串字段分片编码"""
+    if not isinstance(item, dict) or not any(
+        isinstance(value, str) and len(value) > max_chars for value in item.values()
+    ):
+        yield dumps(item)
+        return
+    yield b"{"
+    for index, (name, value) in enumerate(item.items()):
+        yield (b"," if index else b"") + dumps(name) + b":"
+        if isinstance(value, str) and len(value) > max_chars:
+            # 转义按字符进行，分片编码后去掉各自的引号再拼接，结果与整体编码相同
+            yield b'"'
+            for offset in range(0, len(value), max_chars):
+                yield dumps(value[offset:offset + max_chars])[1:-1]
+            yield b'"'
+        else:
+            yield dumps(value)
+    yield b"}"
+
+
+def iter_dumps(obj: dict, key: str, max_chars: int = 64 * 1024) -> Iterator[bytes]:
+    """分段编码对象，key 对应的列表逐项编码
+
+    各段拼接后与 ``dumps(obj)`` 等价（key 移到最后）。列表中每一项单独编码，
+    其中超过 max_chars 的字符串字段（例如长上下文的消息内容）再分片编码，
+    任意时刻只持有一小段编码结果，用于流式上传很大的请求体。
+
+    Args:
+        obj: 要编码的对象
+        key: 逐项编码的列表字段
+        max_chars: 字符串字段按该长度分片
+
+    Yields:
+        bytes: JSON 片段
+    """
+    head = dumps({name: value for name, value in obj.items() if name != key})
+    yield head[:-1] + (b"," if len(head) > 2 else b"") + dumps(key) + b":["
+    for index, item in enumerate(obj.get(key) or ()):
+        if index:
+            yield b","
+        yield from _iter_item(item, max_chars)
+    yield b"]}"
@@ -102,7 +102,13 @@ class StructuredLogger:
             self.logger.addHandler(file_handler)
     
     def _log(self, level: int, msg: str, *args, **kwargs):
-        """统一的日志记录方法"""
+        """统一的日志记录方法
+
+        未启用的级别直接返回。参数使用 %s 占位符延迟格式化，
+        不输出时不会把很大的请求体转换为字符串。
+        """
+        if not self.logger.isEnabledFor(level):
+            return
         extra = kwargs.pop("extra", {})
         # 添加时间戳
         extra["timestamp"] = int(time.time())
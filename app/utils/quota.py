@@ -0,0 +1,232 @@
+"""租户配额
+
+每个租户有两类限制，都在进程内完成判断，不依赖外部存储：
+- 并发数：同时进行中的请求数
+- token 速率：令牌桶，容量为一分钟的额度，按秒匀速补充
+
+请求开始时按估算的输入 token 数预扣，结束时按实际用量多退少补，
+余额允许暂时为负（长回答的用量在结束时才知道），为负期间新的请求会被拒绝。
+"""
+
+import time
+from typing import TYPE_CHECKING, Dict, Optional
+
+from app.utils.errors import RateLimitError
+
+if TYPE_CHECKING:  # pragma: no cover
+    from app.monitoring.ledger import UsageLedger
+    from app.utils.auth import Tenant
+
+
+def estimate_tokens(text: str) -> float:
+    """不加载编码表，快速估算文本的 token 数
+
+    ASCII 字符按约 4 个字符一个 token，其余字符（中文等）按每个字符一个 token 计算。
+
+    Args:
+        text: 文本内容
+
+    Returns:
+        float: 估算的 token 数
+    """
+    if not text:
+        return 0.0
+    chars = len(text)
+    # isascii() 只检查字符串的内部标记，纯 ASCII 文本不需要编码
+    if text.isascii():
+        return chars / 4
+    # UTF-8 下非 ASCII 字符占 2~4 个字节，中文通常是 3 个字节
+    wide = (len(text.encode("utf-8")) - chars) / 2
+    return (chars - wide) / 4 + wide
+
+
+def estimate_message_tokens(messages: list) -> float:
+    """估算消息列表的输入 token 数"""
+    total = 0.0
+    for message in messages or ():
+        content = message.get("content") if isinstance(message, dict) else None
+        if isinstance(content, str):
+            total += estimate_tokens(content)
+        elif isinstance(content, list):
+            for part in content:
+                if isinstance(part, dict) and isinstance(part.get("text"), str):
+                    total += estimate_tokens(part["text"])
+    return total
+
+
+class Usage:
+    """单个请求的用量，流式输出时逐片段累加"""
+
+    __slots__ = (
+        "prompt_tokens", "reasoning_tokens", "completion_tokens", "cached_tokens",
+        "started_at", "first_token_at",
+    )
+
+    def __init__(self, prompt_tokens: float = 0.0):
+        self.prompt_tokens = prompt_tokens
+        self.reasoning_tokens = 0.0
+        self.completion_tokens = 0.0
+        # 上游报告的命中前缀缓存的输入 token 数
+        self.cached_tokens = 0
+        self.started_at = time.monotonic()
+        self.first_token_at: Optional[float] = None
+
+    def add_reasoning(self, text: str) -> None:
+        if self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+        self.reasoning_tokens += estimate_tokens(text)
+
+    def add_completion(self, text: str) -> None:
+        if self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+        self.completion_tokens += estimate_tokens(text)
+
+    @property
+    def total_tokens(self) -> int:
+        return round(self.prompt_tokens + self.reasoning_tokens + self.completion_tokens)
+
+
+class TokenBucket:
+    """令牌桶，余额可以为负"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated_at")
+
+    def __init__(self, rate: float, capacity: float):
+        """初始化令牌桶
+
+        Args:
+            rate: 每秒补充的令牌数
+            capacity: 桶的容量
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def available(self) -> float:
+        """当前余额"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        return self.tokens
+
+    def consume(self, amount: float) -> None:
+        """扣除令牌，amount 为负时退回"""
+        self.available()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+    def time_until(self, amount: float) -> float:
+        """余额达到 amount 还需要的时间(秒)"""
+        missing = amount - self.available()
+        return max(missing / self.rate, 0.0) if self.rate else float("inf")
+
+
+class QuotaLease:
+    """请求占用的配额，请求结束时释放"""
+
+    __slots__ = ("manager", "tenant", "usage", "charged", "model", "stream", "request_id", "_released")
+
+    def __init__(self, manager: "QuotaManager", tenant: "Tenant", usage: Usage, charged: float):
+        self.manager = manager
+        self.tenant = tenant
+        self.usage = usage
+        self.charged = charged
+        self.model = ""
+        self.stream = True
+        self.request_id = ""
+        self._released = False
+
+    def release(self) -> None:
+        """按实际用量结算并释放并发额度，重复调用无副作用"""
+        if not self._released:
+            self._released = True
+            self.manager._release(self, record=True)
+
+    def cancel(self) -> None:
+        """请求没有被执行（例如被准入控制拒绝），退回预扣的额度且不记账"""
+        if not self._released:
+            self._released = True
+            self.usage.prompt_tokens = 0.0
+            self.manager._release(self, record=False)
+
+
+class QuotaManager:
+    """按租户限制并发数与 token 速率，并把用量写入账本"""
+
+    def __init__(self, ledger: Optional["UsageLedger"] = None):
+        """初始化配额管理器
+
+        Args:
+            ledger: 用量账本，为空时不记录用量
+        """
+        self.ledger = ledger
+        self._in_flight: Dict[str, int] = {}
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    def in_flight(self, tenant_id: str) -> int:
+        return self._in_flight.get(tenant_id, 0)
+
+    def _bucket(self, tenant: "Tenant") -> Optional[TokenBucket]:
+        if not tenant.tokens_per_minute:
+            return None
+        bucket = self._buckets.get(tenant.id)
+        if bucket is None:
+            bucket = self._buckets[tenant.id] = TokenBucket(
+                tenant.tokens_per_minute / 60, tenant.tokens_per_minute
+            )
+        elif bucket.capacity != tenant.tokens_per_minute:
+            # 配置热更新后沿用当前余额
+            bucket.available()
+            bucket.rate = tenant.tokens_per_minute / 60
+            bucket.capacity = tenant.tokens_per_minute
+        return bucket
+
+    def acquire(self, tenant: "Tenant", messages: Optional[list] = None) -> QuotaLease:
+        """检查租户配额并占用一个并发额度
+
+        Args:
+            tenant: 租户
+            messages: 请求的消息列表，用于估算并预扣输入 token
+
+        Returns:
+            QuotaLease: 请求结束时需要调用 release()
+
+        Raises:
+            RateLimitError: 超出并发数或 token 配额，details 中包含 retry_after
+        """
+        if tenant.max_concurrency and self.in_flight(tenant.id) >= tenant.max_concurrency:
+            raise RateLimitError(
+                "超出租户并发数限制",
+                details={"reason": "tenant_concurrency", "tenant": tenant.id, "retry_after": 1},
+            )
+
+        usage = Usage(estimate_message_tokens(messages))
+        bucket = self._bucket(tenant)
+        charged = 0.0
+        if bucket is not None:
+            # 输入超过一分钟额度的请求至少要等到桶满
+            needed = min(usage.prompt_tokens, bucket.capacity)
+            available = bucket.available()
+            if available <= 0 or available < needed:
+                raise RateLimitError(
+                    "超出租户 token 配额",
+                    details={
+                        "reason": "tenant_tokens",
+                        "tenant": tenant.id,
+                        "retry_after": max(1, int(bucket.time_until(max(needed, 1)) + 1)),
+                    },
+                )
+            charged = usage.prompt_tokens
+            bucket.consume(charged)
+
+        self._in_flight[tenant.id] = self.in_flight(tenant.id) + 1
+        return QuotaLease(self, tenant, usage, charged)
+
+    def _release(self, lease: QuotaLease, record: bool) -> None:
+        tenant_id = lease.tenant.id
+        self._in_flight[tenant_id] = self.in_flight(tenant_id) - 1
+        bucket = self._buckets.get(tenant_id)
+        if bucket is not None:
+            bucket.consume(lease.usage.total_tokens - lease.charged)
+        if record and self.ledger is not None:
+            self.ledger.record_lease(lease)
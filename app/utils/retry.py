@@ -1,6 +1,7 @@
 """请求重试机制模块"""
 
-import time
+import asyncio
+import builtins
 import random
 from functools import wraps
 from typing import Type, Tuple, Optional, Callable, Any
@@ -37,13 +38,13 @@ class RetryConfig:
         self.exponential_base = exponential_base
         self.jitter = jitter
         
-        # 默认重试的错误类型
+        # 默认重试的错误类型，builtins.TimeoutError 包括上游连接超时与流卡顿（StreamStallError）
         self.retry_errors = retry_errors or (
             APIError,
             TimeoutError,
             RateLimitError,
             ConnectionError,
-            TimeoutError
+            builtins.TimeoutError
         )
     
     def calculate_delay(self, attempt: int) -> float:
@@ -132,7 +133,7 @@ def retry(
                         on_retry(e, attempt)
                     
                     # 等待后重试
-                    await time.sleep(delay)
+                    await asyncio.sleep(delay)
             
             # 不应该到达这里
             raise last_exception
@@ -0,0 +1,288 @@
+"""对话请求的校验
+
+请求体在读取时就限制大小，读取完成后用编译好的 pydantic 校验器一次完成
+JSON 解析与校验（解析与校验都在 pydantic-core 中完成，不会先得到 dict 再逐项检查），
+输出仍然是普通的 dict / list，可以直接传给后续的处理流程。
+
+所有检查都在连接上游之前完成，失败时返回 OpenAI 风格的 400 错误，
+``details.param`` 指出出错的字段，例如 ``messages[2].content``。
+"""
+
+from functools import lru_cache
+from typing import AsyncIterator, Dict, List, Literal, Optional, Tuple, Union
+
+from pydantic import ConfigDict, Field, TypeAdapter, ValidationError
+from typing_extensions import Annotated, NotRequired, TypedDict
+
+from app.utils.errors import InvalidRequestError, PayloadTooLargeError
+
+# 默认限制
+MAX_BODY_BYTES = 4 * 1024 * 1024
+MAX_MESSAGES = 256
+MAX_MESSAGE_CHARS = 200_000
+# 一次请求最多生成的候选回答数
+MAX_N = 8
+
+ROLES = Literal["system", "developer", "user", "assistant", "tool", "function"]
+
+# 未在请求中出现时使用的默认参数
+DEFAULTS = {
+    "model": "qwen2.5-14b-instruct-1m",
+    "stream": True,
+    "temperature": 0.7,
+    "top_p": 0.95,
+    "presence_penalty": 0.0,
+    "frequency_penalty": 0.0,
+}
+
+
+@lru_cache(maxsize=8)
+def request_adapter(max_messages: int = MAX_MESSAGES, max_message_chars: int = MAX_MESSAGE_CHARS) -> TypeAdapter:
+    """生成对话请求的校验器，相同的限制只编译一次
+
+    Args:
+        max_messages: 最大消息条数
+        max_message_chars: 单条消息（或单个内容片段）的最大字符数
+
+    Returns:
+        TypeAdapter: 校验器，validate_json 返回 dict
+    """
+    Text = Annotated[str, Field(max_length=max_message_chars)]
+
+    # strict 模式下不做类型转换（"1" 不是合法的 temperature），整数仍然可以作为浮点数
+    config = ConfigDict(extra="allow", strict=True)
+
+    class ContentPart(TypedDict):
+        __pydantic_config__ = config
+
+        type: str
+        text: NotRequired[Text]
+
+    class Message(TypedDict):
+        __pydantic_config__ = config
+
+        role: ROLES
+        content: NotRequired[Optional[Union[Text, List[ContentPart]]]]
+        name: NotRequired[str]
+
+    class Candidate(TypedDict):
+        # 单个候选回答的模型与采样参数，未设置的项使用请求中的值
+        __pydantic_config__ = config
+
+        model: NotRequired[Annotated[str, Field(min_length=1, max_length=256)]]
+        temperature: NotRequired[Annotated[float, Field(ge=0, le=2)]]
+        top_p: NotRequired[Annotated[float, Field(gt=0, le=1)]]
+        presence_penalty: NotRequired[Annotated[float, Field(ge=-2, le=2)]]
+        frequency_penalty: NotRequired[Annotated[float, Field(ge=-2, le=2)]]
+
+    class ChatCompletionRequest(TypedDict):
+        # 其他 OpenAI 参数原样保留，由后续流程决定是否使用
+        __pydantic_config__ = config
+
+        messages: Annotated[List[Message], Field(min_length=1, max_length=max_messages)]
+        model: NotRequired[Annotated[str, Field(min_length=1, max_length=256)]]
+        stream: NotRequired[bool]
+        # 整数也是合法的取值，例如 "temperature": 1
+        temperature: NotRequired[Annotated[float, Field(ge=0, le=2)]]
+        top_p: NotRequired[Annotated[float, Field(gt=0, le=1)]]
+        presence_penalty: NotRequired[Annotated[float, Field(ge=-2, le=2)]]
+        frequency_penalty: NotRequired[Annotated[float, Field(ge=-2, le=2)]]
+        n: NotRequired[Annotated[int, Field(ge=1, le=MAX_N)]]
+        candidates: NotRequired[Annotated[List[Candidate], Field(min_length=1, max_length=MAX_N)]]
+        # 服务端保存的对话，见 app.deepxy.conversations
+        store: NotRequired[bool]
+        previous_response_id: NotRequired[Annotated[str, Field(pattern=r"^chatcmpl-[0-9A-Za-z]+$", max_length=64)]]
+        # 是否执行推理阶段，auto 时由网关判断，见 app.deepxy.bypass
+        reasoning: NotRequired[Literal["auto", "always", "never"]]
+
+    return TypeAdapter(ChatCompletionRequest)
+
+
+def _param(loc: tuple) -> str:
+    """把 pydantic 的错误位置转换为 ``messages[0].content`` 形式"""
+    param = ""
+    for item in loc:
+        if isinstance(item, int):
+            param += f"[{item}]"
+        elif "[" in item or "-" in item:
+            # Union 的分支名（例如 constrained-str、list[ContentPart]）不属于字段路径
+            continue
+        else:
+            param += f".{item}" if param else item
+    return param
+
+
+def validate_chat_request(
+    body: Union[bytes, str],
+    max_messages: int = MAX_MESSAGES,
+    max_message_chars: int = MAX_MESSAGE_CHARS,
+) -> Dict:
+    """解析并校验对话请求
+
+    Args:
+        body: 请求体
+        max_messages: 最大消息条数
+        max_message_chars: 单条消息的最大字符数
+
+    Returns:
+        Dict: 校验后的请求，缺少的参数使用 DEFAULTS 补全
+
+    Raises:
+        InvalidRequestError: 请求体不是合法的 JSON 或参数无效
+    """
+    try:
+        request = request_adapter(max_messages, max_message_chars).validate_json(body)
+    except ValidationError as e:
+        # Union 字段的每个分支都会产生错误，位置最深的错误最能说明问题
+        error = max(e.errors(include_url=False), key=lambda item: len(item["loc"]))
+        if error["type"] == "json_invalid":
+            raise InvalidRequestError(
+                "请求体不是有效的 JSON", details={"type": "invalid_request_error"}
+            ) from None
+        param = _param(error["loc"])
+        raise InvalidRequestError(
+            f"参数 {param} 无效: {error['msg']}" if param else f"请求无效: {error['msg']}",
+            details={"type": "invalid_request_error", "param": param or None},
+        ) from None
+    candidates = request.get("candidates")
+    if candidates is not None and request.get("n", len(candidates)) != len(candidates):
+        raise InvalidRequestError(
+            f"参数 n 无效: 与 candidates 的数量 {len(candidates)} 不一致",
+            details={"type": "invalid_request_error", "param": "n"},
+        )
+    _flatten_last_user_content(request)
+    for name, value in DEFAULTS.items():
+        request.setdefault(name, value)
+    return request
+
+
+def check_message_limits(
+    messages: List[Dict],
+    max_messages: int = MAX_MESSAGES,
+    max_message_chars: int = MAX_MESSAGE_CHARS,
+    param: str = "messages",
+) -> None:
+    """检查拼接后的消息列表是否超出单个请求的限制
+
+    拼接服务端保存的对话历史后，消息列表不再经过请求体校验（历史中的回答也从未校验过），
+    按与请求体相同的条数与单条字符数上限再检查一次。
+
+    Args:
+        messages: 消息列表
+        max_messages: 最大消息条数
+        max_message_chars: 单条消息（或单个内容片段）的最大字符数
+        param: 超出限制时错误信息中的参数名
+
+    Raises:
+        InvalidRequestError: 消息条数或某条消息的字符数超出上限
+    """
+    if len(messages) > max_messages:
+        raise InvalidRequestError(
+            f"参数 {param} 无效: 拼接对话历史后共 {len(messages)} 条消息，超过上限 {max_messages}",
+            details={"type": "invalid_request_error", "param": param},
+        )
+    for message in messages:
+        content = message.get("content")
+        parts = content if isinstance(content, list) else [{"text": content}]
+        if any(len(part.get("text") or "") > max_message_chars for part in parts):
+            raise InvalidRequestError(
+                f"参数 {param} 无效: 对话历史中的消息超过 {max_message_chars} 个字符",
+                details={"type": "invalid_request_error", "param": param},
+            )
+
+
+def _flatten_last_user_content(request: Dict) -> None:
+    """检查最后一条用户消息的内容并把文本片段拼接为字符串
+
+    回答阶段把最后一条用户消息的内容作为字符串填入提示词模板，内容为空、缺失
+    或包含图片等非文本片段时无法处理，在连接上游之前返回 400。
+
+    Raises:
+        InvalidRequestError: 没有用户消息，或最后一条用户消息的内容不是非空的文本
+    """
+    messages = request["messages"]
+    index = next((i for i in range(len(messages) - 1, -1, -1) if messages[i]["role"] == "user"), None)
+    if index is None:
+        if "previous_response_id" in request:
+            # 用户消息在已保存的对话历史中
+            return
+        raise InvalidRequestError(
+            "参数 messages 无效: 至少需要一条用户消息",
+            details={"type": "invalid_request_error", "param": "messages"},
+        )
+    param = f"messages[{index}].content"
+    content = messages[index].get("content")
+    if isinstance(content, list):
+        if any(part["type"] != "text" for part in content):
+            raise InvalidRequestError(
+                f"参数 {param} 无效: 最后一条用户消息只支持文本内容",
+                details={"type": "invalid_request_error", "param": param},
+            )
+        content = "".join(part.get("text") or "" for part in content)
+        messages[index]["content"] = content
+    if not content:
+        raise InvalidRequestError(
+            f"参数 {param} 无效: 最后一条用户消息的内容不能为空",
+            details={"type": "invalid_request_error", "param": param},
+        )
+
+
+def answer_candidates(
+    request: Dict, default_model: str
+) -> List[Tuple[str, Tuple[float, float, float, float]]]:
+    """根据 n / candidates 生成各个候选回答的 (模型, 参数)
+
+    Args:
+        request: 校验后的请求
+        default_model: 候选回答没有指定模型时使用的回答模型
+
+    Returns:
+        List[Tuple[str, Tuple[float, float, float, float]]]: 候选回答的模型与
+        (temperature, top_p, presence_penalty, frequency_penalty)，按 index 排列
+    """
+    names = ("temperature", "top_p", "presence_penalty", "frequency_penalty")
+    overrides = request.get("candidates") or [{}] * request.get("n", 1)
+    return [
+        (
+            override.get("model", default_model),
+            tuple(override.get(name, request[name]) for name in names),
+        )
+        for override in overrides
+    ]
+
+
+async def read_body(
+    chunks: AsyncIterator[bytes],
+    max_bytes: int = MAX_BODY_BYTES,
+    content_length: Optional[str] = None,
+) -> bytes:
+    """读取请求体，超过大小限制时立即停止读取
+
+    Args:
+        chunks: 请求体的数据块
+        max_bytes: 最大字节数
+        content_length: Content-Length 请求头，超过限制时不读取请求体
+
+    Returns:
+        bytes: 完整的请求体
+
+    Raises:
+        PayloadTooLargeError: 请求体超过大小限制
+    """
+    def too_large() -> PayloadTooLargeError:
+        return PayloadTooLargeError(
+            f"请求体超过 {max_bytes} 字节的限制",
+            details={"type": "invalid_request_error", "max_bytes": max_bytes},
+        )
+
+    if content_length is not None and content_length.isdigit() and int(content_length) > max_bytes:
+        raise too_large()
+    # 保存收到的分块，最后只拼接一次；大请求体不会在扩容时反复复制
+    parts = []
+    size = 0
+    async for chunk in chunks:
+        parts.append(chunk)
+        size += len(chunk)
+        if size > max_bytes:
+            raise too_large()
+    return parts[0] if len(parts) == 1 else b"".join(parts)
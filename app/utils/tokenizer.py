@@ -0,0 +1,37 @@
+"""token 计数
+
+tiktoken 导入与加载编码表都比较耗时（编码表首次使用时还可能需要下载），
+因此在首次调用时才加载；服务启动预热时可以调用 preload() 提前加载。
+"""
+
+from functools import lru_cache
+
+DEFAULT_ENCODING = "cl100k_base"
+
+
+@lru_cache(maxsize=4)
+def get_encoding(name: str = DEFAULT_ENCODING):
+    """获取 tiktoken 编码，同名编码只加载一次"""
+    import tiktoken
+
+    return tiktoken.get_encoding(name)
+
+
+def count_tokens(text: str, encoding: str = DEFAULT_ENCODING) -> int:
+    """计算文本的 token 数
+
+    Args:
+        text: 文本内容
+        encoding: tiktoken 编码名称
+
+    Returns:
+        int: token 数
+    """
+    if not text:
+        return 0
+    return len(get_encoding(encoding).encode(text, disallowed_special=()))
+
+
+def preload(encoding: str = DEFAULT_ENCODING) -> None:
+    """预先加载编码表"""
+    get_encoding(encoding)
@@ -0,0 +1,73 @@
+"""DeepXY API 调用示例
+
+用法::
+
+    python examples/test_api.py --url http://localhost:8000 --api-key your_api_key "你好，请简单介绍一下你自己"
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+import aiohttp
+
+
+async def chat(url: str, api_key: str, prompt: str, stream: bool) -> None:
+    headers = {"Authorization": f"Bearer {api_key}"}
+    body = {
+        "model": "deepxy",
+        "stream": stream,
+        "messages": [{"role": "user", "content": prompt}],
+    }
+    start = time.perf_counter()
+    first_token = None
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None)) as session:
+        async with session.post(f"{url}/v1/chat/completions", json=body, headers=headers) as response:
+            if not stream:
+                data = await response.json()
+                message = data["choices"][0]["message"]
+                print("[推理]", message.get("reasoning_content", ""))
+                print("[回答]", message.get("content", ""))
+            else:
+                phase = None
+                async for line in response.content:
+                    if not line.startswith(b"data:"):
+                        continue
+                    payload = line[5:].strip()
+                    if payload == b"[DONE]":
+                        break
+                    if first_token is None:
+                        first_token = time.perf_counter() - start
+                    delta = json.loads(payload)["choices"][0]["delta"]
+                    if delta.get("reasoning_content"):
+                        if phase != "reasoning":
+                            phase = "reasoning"
+                            print("\n[推理]")
+                        print(delta["reasoning_content"], end="", flush=True)
+                    elif delta.get("content"):
+                        if phase != "answer":
+                            phase = "answer"
+                            print("\n\n[回答]")
+                        print(delta["content"], end="", flush=True)
+                print()
+
+    total = time.perf_counter() - start
+    if first_token is not None:
+        print(f"\n首个 token: {first_token:.2f}s，总耗时: {total:.2f}s")
+    else:
+        print(f"\n总耗时: {total:.2f}s")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="DeepXY API 调用示例")
+    parser.add_argument("prompt", nargs="?", default="你好，请简单介绍一下你自己")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--api-key", default="your_api_key")
+    parser.add_argument("--no-stream", action="store_true", help="使用非流式输出")
+    args = parser.parse_args()
+    asyncio.run(chat(args.url, args.api_key, args.prompt, not args.no_stream))
+
+
+if __name__ == "__main__":
+    main()
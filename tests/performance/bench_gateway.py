@@ -0,0 +1,372 @@
+"""网关端到端基准测试
+
+启动模拟上游和 ``app.main:app``（独立的 uvicorn 子进程），按指定并发级别发起
+流式请求，报告：
+- 网关额外延迟：端到端耗时减去上游 R1 推理与 Qwen 回答的耗时
+- 首包延迟与端到端延迟的 p50 / p95
+- 吞吐量（每秒下发的 SSE 事件数）
+- 网关进程每个 token 消耗的 CPU 时间与峰值 RSS
+
+结果可以保存为基线，之后的运行与基线对比，超过容忍度即视为性能回退并以非零状态退出。
+
+用法::
+
+    python -m tests.performance.bench_gateway --concurrency 1 8 32 --requests 64
+    python -m tests.performance.bench_gateway --save-baseline tests/performance/baselines/gateway.json
+    python -m tests.performance.bench_gateway --baseline tests/performance/baselines/gateway.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import aiohttp
+
+from tests.performance.mock_upstream import MockConfig, MockUpstream
+
+DEFAULT_BASELINE = Path(__file__).parent / "baselines" / "gateway.json"
+
+# 基线对比时各指标的方向：True 表示越大越差
+REGRESSION_METRICS = {
+    "gateway_added_ms": True,
+    "cpu_us_per_token": True,
+    "peak_rss_mb": True,
+    "throughput_tokens_per_s": False,
+}
+
+
+@dataclass
+class LevelResult:
+    """单个并发级别的测试结果"""
+    concurrency: int
+    requests: int
+    errors: int
+    tokens: int
+    wall_time: float
+    latency_p50_ms: float
+    latency_p95_ms: float
+    ttfb_p50_ms: float
+    ttfb_p95_ms: float
+    gateway_added_ms: float
+    throughput_tokens_per_s: float
+    cpu_us_per_token: float
+    peak_rss_mb: float
+
+
+class ProcessSampler:
+    """读取子进程的 CPU 时间和 RSS（基于 /proc，仅支持 Linux）"""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self._clock_ticks = os.sysconf("SC_CLK_TCK")
+        self.peak_rss = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def cpu_seconds(self) -> float:
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        # utime 与 stime 分别是 ')' 之后的第 12、13 个字段
+        return (int(fields[11]) + int(fields[12])) / self._clock_ticks
+
+    def rss_bytes(self) -> int:
+        with open(f"/proc/{self.pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+        return 0
+
+    async def _sample(self, interval: float) -> None:
+        while True:
+            self.peak_rss = max(self.peak_rss, self.rss_bytes())
+            await asyncio.sleep(interval)
+
+    def start(self, interval: float = 0.05) -> None:
+        self.peak_rss = self.rss_bytes()
+        self._task = asyncio.create_task(self._sample(interval))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(int(round(pct / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def start_gateway(port: int, upstream_url: str, extra_env: Optional[Dict[str, str]] = None) -> subprocess.Popen:
+    """以子进程方式启动网关"""
+    env = dict(os.environ)
+    env.update({
+        "DASHSCOPE_API_KEY": "bench-key",
+        "DASHSCOPE_API_URL": f"{upstream_url}/compatible-mode/v1/chat/completions",
+        "OPENROUTER_API_KEY": "bench-key",
+        "OPENROUTER_API_URL": f"{upstream_url}/api/v1/chat/completions",
+        "DEEPSEEK_MODEL": "deepseek-r1",
+        "QWEN_MODEL": "qwen2.5-14b-instruct-1m",
+        "IS_ORIGIN_REASONING": "true",
+        "LOG_LEVEL": "WARNING",
+    })
+    env.update(extra_env or {})
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1",
+         "--port", str(port), "--log-level", "warning", "--no-access-log"],
+        env=env,
+        cwd=Path(__file__).resolve().parents[2],
+    )
+
+
+async def wait_until_up(session: aiohttp.ClientSession, url: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(f"{url}/health/ready") as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError(f"网关在 {timeout} 秒内没有就绪")
+
+
+async def _one_request(session: aiohttp.ClientSession, url: str, body: dict) -> tuple:
+    """发送一个流式请求，返回 (首包延迟, 总耗时, 事件数)"""
+    start = time.perf_counter()
+    ttfb = None
+    events = 0
+    async with session.post(f"{url}/v1/chat/completions", json=body) as response:
+        if response.status != 200:
+            raise RuntimeError(f"状态码 {response.status}")
+        async for line in response.content:
+            if not line.startswith(b"data:"):
+                continue
+            if ttfb is None:
+                ttfb = time.perf_counter() - start
+            if line.strip() != b"data: [DONE]":
+                events += 1
+    return ttfb or 0.0, time.perf_counter() - start, events
+
+
+async def run_level(
+    session: aiohttp.ClientSession,
+    gateway_url: str,
+    upstream_url: str,
+    sampler: ProcessSampler,
+    concurrency: int,
+    total_requests: int,
+    body: dict,
+) -> LevelResult:
+    """在给定并发级别下发送 total_requests 个请求"""
+    async with session.post(f"{upstream_url}/__reset") as response:
+        await response.read()
+
+    latencies, ttfbs = [], []
+    tokens = errors = 0
+    queue: asyncio.Queue = asyncio.Queue()
+    for _ in range(total_requests):
+        queue.put_nowait(None)
+
+    async def worker():
+        nonlocal tokens, errors
+        while not queue.empty():
+            queue.get_nowait()
+            try:
+                ttfb, latency, events = await _one_request(session, gateway_url, body)
+                ttfbs.append(ttfb)
+                latencies.append(latency)
+                tokens += events
+            except Exception:
+                errors += 1
+
+    sampler.peak_rss = 0
+    cpu_start = sampler.cpu_seconds()
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - start
+    cpu = sampler.cpu_seconds() - cpu_start
+
+    async with session.get(f"{upstream_url}/__stats") as response:
+        stats = (await response.json())["stats"]
+    upstream_time = stats["r1"]["mean_duration"] + stats["qwen"]["mean_duration"]
+    mean_latency = sum(latencies) / len(latencies) if latencies else 0.0
+
+    return LevelResult(
+        concurrency=concurrency,
+        requests=total_requests,
+        errors=errors,
+        tokens=tokens,
+        wall_time=round(wall, 3),
+        latency_p50_ms=round(_percentile(latencies, 50) * 1000, 2),
+        latency_p95_ms=round(_percentile(latencies, 95) * 1000, 2),
+        ttfb_p50_ms=round(_percentile(ttfbs, 50) * 1000, 2),
+        ttfb_p95_ms=round(_percentile(ttfbs, 95) * 1000, 2),
+        gateway_added_ms=round(max(mean_latency - upstream_time, 0.0) * 1000, 2),
+        throughput_tokens_per_s=round(tokens / wall, 1) if wall else 0.0,
+        cpu_us_per_token=round(cpu / tokens * 1e6, 2) if tokens else 0.0,
+        peak_rss_mb=round(sampler.peak_rss / 1024 / 1024, 1),
+    )
+
+
+async def run_benchmark(
+    concurrency_levels: List[int],
+    requests_per_level: int,
+    mock_config: Optional[MockConfig] = None,
+    gateway_env: Optional[Dict[str, str]] = None,
+) -> List[LevelResult]:
+    """启动模拟上游与网关并依次运行各个并发级别"""
+    upstream = MockUpstream(mock_config or MockConfig())
+    upstream_url = await upstream.start(port=_free_port())
+    gateway_port = _free_port()
+    gateway = start_gateway(gateway_port, upstream_url, gateway_env)
+    gateway_url = f"http://127.0.0.1:{gateway_port}"
+    body = {
+        "model": "deepxy",
+        "stream": True,
+        "messages": [{"role": "user", "content": "请简单介绍一下你自己"}],
+    }
+
+    results = []
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=None, sock_read=120)
+    try:
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            await wait_until_up(session, gateway_url)
+            sampler = ProcessSampler(gateway.pid)
+            sampler.start()
+            try:
+                # 预热一次，避免把导入和首次建连计入第一个级别
+                await _one_request(session, gateway_url, body)
+                for concurrency in concurrency_levels:
+                    results.append(await run_level(
+                        session, gateway_url, upstream_url, sampler,
+                        concurrency, requests_per_level, body,
+                    ))
+            finally:
+                await sampler.stop()
+    finally:
+        gateway.terminate()
+        try:
+            gateway.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            gateway.kill()
+        await upstream.stop()
+    return results
+
+
+def compare_with_baseline(
+    results: List[LevelResult], baseline: Dict, tolerance: float
+) -> List[str]:
+    """与基线对比，返回回退描述列表"""
+    regressions = []
+    baseline_levels = {item["concurrency"]: item for item in baseline.get("results", [])}
+    for result in results:
+        base = baseline_levels.get(result.concurrency)
+        if not base:
+            continue
+        current = asdict(result)
+        for metric, higher_is_worse in REGRESSION_METRICS.items():
+            old, new = base.get(metric), current[metric]
+            if not old:
+                continue
+            change = (new - old) / old
+            if (higher_is_worse and change > tolerance) or (not higher_is_worse and -change > tolerance):
+                regressions.append(
+                    f"并发 {result.concurrency}: {metric} {old} -> {new} ({change:+.0%})"
+                )
+    return regressions
+
+
+def print_results(results: List[LevelResult]) -> None:
+    header = (
+        f"{'并发':>6} {'请求':>6} {'错误':>4} {'p50(ms)':>9} {'p95(ms)':>9} {'首包p50':>9} "
+        f"{'额外延迟':>9} {'token/s':>9} {'CPU us/tok':>11} {'RSS(MB)':>8}"
+    )
+    print(header)
+    for r in results:
+        print(
+            f"{r.concurrency:>6} {r.requests:>6} {r.errors:>4} {r.latency_p50_ms:>9} "
+            f"{r.latency_p95_ms:>9} {r.ttfb_p50_ms:>9} {r.gateway_added_ms:>9} "
+            f"{r.throughput_tokens_per_s:>9} {r.cpu_us_per_token:>11} {r.peak_rss_mb:>8}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="网关端到端基准测试")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=64, help="每个并发级别的请求数")
+    parser.add_argument("--reasoning-tokens", type=int, default=200)
+    parser.add_argument("--answer-tokens", type=int, default=200)
+    parser.add_argument("--reasoning-rate", type=float, default=0.0, help="推理 token/s，0 不限速")
+    parser.add_argument("--answer-rate", type=float, default=0.0, help="回答 token/s，0 不限速")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--midstream-failure-rate", type=float, default=0.0)
+    parser.add_argument("--r1-file", help="录制的 R1 流文件")
+    parser.add_argument("--qwen-file", help="录制的 Qwen 流文件")
+    parser.add_argument("--baseline", help="与指定基线对比")
+    parser.add_argument("--save-baseline", nargs="?", const=str(DEFAULT_BASELINE), help="保存为基线")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允许的性能回退比例")
+    args = parser.parse_args()
+
+    mock_config = MockConfig(
+        reasoning_tokens=args.reasoning_tokens,
+        answer_tokens=args.answer_tokens,
+        reasoning_rate=args.reasoning_rate,
+        answer_rate=args.answer_rate,
+        jitter=args.jitter,
+        failure_rate=args.failure_rate,
+        midstream_failure_rate=args.midstream_failure_rate,
+        r1_file=args.r1_file,
+        qwen_file=args.qwen_file,
+        seed=0,
+    )
+    results = asyncio.run(run_benchmark(args.concurrency, args.requests, mock_config))
+    print_results(results)
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "mock_config": asdict(mock_config),
+        "results": [asdict(r) for r in results],
+    }
+    if args.save_baseline:
+        path = Path(args.save_baseline)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(report, ensure_ascii=False, indent=2))
+        print(f"基线已保存: {path}")
+
+    if args.baseline:
+        regressions = compare_with_baseline(
+            results, json.loads(Path(args.baseline).read_text()), args.tolerance
+        )
+        if regressions:
+            print("检测到性能回退:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("未检测到性能回退")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""JSON 编解码基准测试
+
+在录制的 R1 流上对比各个 JSON 后端逐 token 的 CPU 开销，包括：
+- 解码：上游 SSE data 行 -> choices[0].delta
+- 编码：下发给客户端的 chat.completion.chunk
+
+用法::
+
+    python -m tests.performance.bench_json_codec --tokens 20000
+    python -m tests.performance.bench_json_codec --file recorded_r1.sse
+"""
+
+import argparse
+import time
+from typing import Callable, List
+
+from app.utils import json_codec
+from tests.performance.recorded_streams import load_recording, r1_stream_events, sse_payloads
+
+
+def _cpu_per_call(func: Callable, items: List, repeat: int) -> float:
+    """返回每次调用的 CPU 时间（微秒），取多轮中的最小值"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.process_time()
+        for item in items:
+            func(item)
+        best = min(best, time.process_time() - start)
+    return best / len(items) * 1e6
+
+
+def _output_chunks(payloads: List[bytes]) -> List[dict]:
+    decoder = json_codec.get_codec("json")
+    chunks = []
+    for payload in payloads:
+        delta = decoder.decode_chat_delta(payload)
+        chunks.append({
+            "id": "chatcmpl-bench",
+            "object": "chat.completion.chunk",
+            "created": 1700000000,
+            "model": "deepseek-r1",
+            "choices": [{
+                "index": 0,
+                "delta": {
+                    "role": "assistant",
+                    "reasoning_content": (delta.reasoning_content or "") if delta else "",
+                    "content": "",
+                },
+            }],
+        })
+    return chunks
+
+
+def run(payloads: List[bytes], repeat: int) -> None:
+    chunks = _output_chunks(payloads)
+    results = {}
+    for backend in ("json", "orjson", "msgspec"):
+        codec = json_codec.get_codec(backend)
+        if codec.name != backend:
+            print(f"{backend:>8}: 未安装，跳过")
+            continue
+        decode_us = _cpu_per_call(codec.decode_chat_delta, payloads, repeat)
+        encode_us = _cpu_per_call(codec.dumps, chunks, repeat)
+        results[backend] = decode_us + encode_us
+        print(f"{backend:>8}: 解码 {decode_us:6.2f} us/token  编码 {encode_us:6.2f} us/token")
+
+    baseline = results.get("json")
+    print(f"当前默认后端: {json_codec.BACKEND}")
+    for backend, total in results.items():
+        if backend != "json" and baseline:
+            saved = baseline - total
+            print(f"{backend:>8}: 每 token 节省 {saved:6.2f} us ({saved / baseline:.0%})")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="JSON 编解码基准测试")
+    parser.add_argument("--tokens", type=int, default=20000, help="生成的推理 token 数")
+    parser.add_argument("--file", help="录制的 .sse 文件，指定后忽略 --tokens")
+    parser.add_argument("--repeat", type=int, default=5, help="重复轮数")
+    args = parser.parse_args()
+
+    events = load_recording(args.file) if args.file else r1_stream_events(args.tokens)
+    payloads = sse_payloads(events)
+    print(f"共 {len(payloads)} 个 SSE 事件")
+    run(payloads, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
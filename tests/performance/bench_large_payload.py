@@ -0,0 +1,156 @@
+"""长上下文请求基准测试
+
+以不同的上下文长度（默认 100k / 500k / 1M token）向网关发送流式请求，报告
+端到端延迟、首包延迟与网关进程的峰值 RSS（相对空闲时的增量）。
+
+每个长度与上传方式的组合启动一个新的网关进程，峰值 RSS 不受之前请求的影响：
+- streaming: 默认配置，超大请求体按消息分段编码并流式上传
+- buffered: LARGE_PAYLOAD_CHARS=0，请求体一次编码
+
+用法::
+
+    python -m tests.performance.bench_large_payload
+    python -m tests.performance.bench_large_payload --tokens 100000 1000000 --requests 5 --modes streaming
+"""
+
+import argparse
+import asyncio
+import subprocess
+import time
+from dataclasses import dataclass
+from typing import Dict, List
+
+import aiohttp
+
+from tests.performance.bench_gateway import (
+    ProcessSampler,
+    _free_port,
+    _one_request,
+    _percentile,
+    start_gateway,
+    wait_until_up,
+)
+from tests.performance.mock_upstream import MockConfig, MockUpstream
+
+# 纯 ASCII 文本约 4 个字符一个 token
+CHARS_PER_TOKEN = 4
+
+MODES: Dict[str, Dict[str, str]] = {
+    "streaming": {},
+    "buffered": {"LARGE_PAYLOAD_CHARS": "0"},
+}
+
+
+@dataclass
+class PayloadResult:
+    """单个上下文长度的测试结果"""
+    mode: str
+    tokens: int
+    body_mb: float
+    requests: int
+    errors: int
+    latency_p50_ms: float
+    ttfb_p50_ms: float
+    idle_rss_mb: float
+    peak_rss_delta_mb: float
+
+
+def make_prompt(tokens: int) -> str:
+    """生成约 tokens 个 token 的 ASCII 文本"""
+    sentence = "The quick brown fox jumps over the lazy dog. "
+    chars = tokens * CHARS_PER_TOKEN
+    return (sentence * (chars // len(sentence) + 1))[:chars]
+
+
+async def run_size(upstream_url: str, mode: str, tokens: int, requests: int) -> PayloadResult:
+    """启动新的网关，发送 requests 个指定长度的请求"""
+    prompt = make_prompt(tokens)
+    body = {"stream": True, "messages": [{"role": "user", "content": prompt}]}
+    limit = str(len(prompt) * 2 + 1024 * 1024)
+    port = _free_port()
+    gateway = start_gateway(port, upstream_url, {
+        "MAX_BODY_BYTES": limit,
+        "MAX_MESSAGE_CHARS": limit,
+        **MODES[mode],
+    })
+    gateway_url = f"http://127.0.0.1:{port}"
+    latencies, ttfbs = [], []
+    errors = 0
+    timeout = aiohttp.ClientTimeout(total=None, sock_read=300)
+    try:
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            await wait_until_up(session, gateway_url)
+            sampler = ProcessSampler(gateway.pid)
+            idle_rss = sampler.rss_bytes()
+            sampler.start(interval=0.01)
+            try:
+                for _ in range(requests):
+                    try:
+                        ttfb, latency, _ = await _one_request(session, gateway_url, body)
+                        ttfbs.append(ttfb)
+                        latencies.append(latency)
+                    except Exception:
+                        errors += 1
+            finally:
+                await sampler.stop()
+    finally:
+        gateway.terminate()
+        try:
+            gateway.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            gateway.kill()
+
+    return PayloadResult(
+        mode=mode,
+        tokens=tokens,
+        body_mb=round(len(prompt) / 1024 / 1024, 1),
+        requests=requests,
+        errors=errors,
+        latency_p50_ms=round(_percentile(latencies, 50) * 1000, 1),
+        ttfb_p50_ms=round(_percentile(ttfbs, 50) * 1000, 1),
+        idle_rss_mb=round(idle_rss / 1024 / 1024, 1),
+        peak_rss_delta_mb=round((sampler.peak_rss - idle_rss) / 1024 / 1024, 1),
+    )
+
+
+async def run_benchmark(token_sizes: List[int], requests: int, modes: List[str]) -> List[PayloadResult]:
+    """依次测试各个上传方式与上下文长度"""
+    upstream = MockUpstream(MockConfig(reasoning_tokens=20, answer_tokens=20, seed=0))
+    upstream_url = await upstream.start(port=_free_port())
+    results = []
+    try:
+        for mode in modes:
+            for tokens in token_sizes:
+                results.append(await run_size(upstream_url, mode, tokens, requests))
+    finally:
+        await upstream.stop()
+    return results
+
+
+def print_results(results: List[PayloadResult]) -> None:
+    print(
+        f"{'方式':>10} {'token':>9} {'请求体MB':>8} {'错误':>4} {'p50(ms)':>9} "
+        f"{'首包p50':>9} {'空闲RSS':>8} {'峰值增量MB':>10}"
+    )
+    for r in results:
+        print(
+            f"{r.mode:>10} {r.tokens:>9} {r.body_mb:>8} {r.errors:>4} {r.latency_p50_ms:>9} "
+            f"{r.ttfb_p50_ms:>9} {r.idle_rss_mb:>8} {r.peak_rss_delta_mb:>10}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="长上下文请求基准测试")
+    parser.add_argument("--tokens", type=int, nargs="+", default=[100_000, 500_000, 1_000_000])
+    parser.add_argument("--requests", type=int, default=3, help="每个长度的请求数")
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    results = asyncio.run(run_benchmark(args.tokens, args.requests, args.modes))
+    print_results(results)
+    print(f"总耗时 {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
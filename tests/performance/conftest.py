@@ -0,0 +1,39 @@
+"""性能测试公共配置
+
+未安装 pytest-benchmark 时提供一个同名的简化 fixture，按 pyperf 的方式取多轮
+运行中的最短耗时，保证微基准测试在任何环境下都可以执行。
+"""
+
+import time
+
+import pytest
+
+try:
+    import pytest_benchmark  # noqa: F401
+except ImportError:
+    class _SimpleBenchmark:
+        """pytest-benchmark 的最小替代实现"""
+
+        def __init__(self, name: str):
+            self.name = name
+
+        def pedantic(self, func, args=(), kwargs=None, rounds=3, iterations=1, setup=None):
+            kwargs = kwargs or {}
+            best = float("inf")
+            result = None
+            for _ in range(rounds):
+                if setup is not None:
+                    args, kwargs = setup() or (args, kwargs)
+                start = time.perf_counter()
+                for _ in range(iterations):
+                    result = func(*args, **kwargs)
+                best = min(best, (time.perf_counter() - start) / iterations)
+            print(f"\n{self.name}: {best * 1000:.3f} ms")
+            return result
+
+        def __call__(self, func, *args, **kwargs):
+            return self.pedantic(func, args, kwargs, rounds=5)
+
+    @pytest.fixture
+    def benchmark(request):
+        return _SimpleBenchmark(request.node.name)
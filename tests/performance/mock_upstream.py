@@ -0,0 +1,305 @@
+"""模拟上游 SSE 服务
+
+在本地回放录制的 R1 / Qwen 流，模拟 DashScope 兼容模式、DashScope 原生接口、
+OpenRouter 以及本地 OpenAI 兼容服务。可以配置 token 速率、首 token 延迟、抖动
+以及请求失败和流中断的概率，用于在没有真实上游的情况下测量网关自身的开销。
+
+用法::
+
+    python -m tests.performance.mock_upstream --port 9000 --reasoning-rate 50 --answer-rate 80
+
+网关侧将 DASHSCOPE_API_URL 指向 http://127.0.0.1:9000/compatible-mode/v1/chat/completions，
+OPENROUTER_API_URL 指向 http://127.0.0.1:9000/api/v1/chat/completions 即可。
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+from tests.performance.recorded_streams import (
+    load_recording,
+    qwen_stream_events,
+    r1_stream_events,
+    reasoning_end_index,
+    sse_payloads,
+)
+
+
+@dataclass
+class MockConfig:
+    """模拟上游配置"""
+    reasoning_tokens: int = 200
+    answer_tokens: int = 200
+    r1_answer_tokens: int = 8  # R1 推理结束后的回答 token 数，网关只消费第一个
+    reasoning_rate: float = 0.0  # 推理阶段每秒 token 数，0 表示不限速
+    answer_rate: float = 0.0  # 回答阶段每秒 token 数，0 表示不限速
+    ttft: float = 0.0  # 首 token 延迟（秒）
+    jitter: float = 0.0  # 每个 token 间隔的随机抖动比例，0~1
+    failure_rate: float = 0.0  # 直接返回 500 的概率
+    midstream_failure_rate: float = 0.0  # 流进行到一半时断开连接的概率
+    origin_reasoning: bool = True  # R1 是否使用 reasoning_content 字段
+    r1_file: Optional[str] = None  # 录制的 R1 流文件
+    qwen_file: Optional[str] = None  # 录制的 Qwen 流文件
+    seed: Optional[int] = None
+
+
+@dataclass
+class StreamStats:
+    """单个模拟流的统计
+
+    对于 R1 流，duration 是写出推理结束后第一个回答事件的时间，即网关推理阶段
+    需要等待上游的时间；对于 Qwen 流是写完全部事件的时间。
+    """
+    kind: str
+    events: int
+    duration: float
+    failed: bool = False
+
+
+@dataclass
+class MockStats:
+    streams: List[StreamStats] = field(default_factory=list)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        result = {}
+        for kind in ("r1", "qwen"):
+            items = [s for s in self.streams if s.kind == kind and not s.failed]
+            result[kind] = {
+                "count": len(items),
+                "failed": sum(1 for s in self.streams if s.kind == kind and s.failed),
+                "mean_duration": sum(s.duration for s in items) / len(items) if items else 0.0,
+                "events": sum(s.events for s in items),
+            }
+        return result
+
+
+class MockUpstream:
+    """模拟上游服务"""
+
+    def __init__(self, config: Optional[MockConfig] = None):
+        self.config = config or MockConfig()
+        self.stats = MockStats()
+        self._random = random.Random(self.config.seed)
+        self._r1_events = None
+        self._r1_end = 0
+        self._qwen_events = None
+        self._runner: Optional[web.AppRunner] = None
+
+    def _events(self, kind: str, native: bool, incremental: bool = True) -> List[bytes]:
+        cfg = self.config
+        if kind == "r1" and native:
+            return r1_stream_events(cfg.reasoning_tokens, cfg.r1_answer_tokens, native=True, incremental=incremental)
+        if kind == "r1":
+            if self._r1_events is None:
+                self._r1_events = (
+                    load_recording(cfg.r1_file) if cfg.r1_file
+                    else r1_stream_events(cfg.reasoning_tokens, cfg.r1_answer_tokens, cfg.origin_reasoning)
+                )
+                self._r1_end = reasoning_end_index(self._r1_events)
+            return self._r1_events
+        if native:
+            return qwen_stream_events(cfg.answer_tokens, native=True, incremental=incremental)
+        if self._qwen_events is None:
+            self._qwen_events = (
+                load_recording(cfg.qwen_file) if cfg.qwen_file
+                else qwen_stream_events(cfg.answer_tokens)
+            )
+        return self._qwen_events
+
+    def _interval(self, rate: float) -> float:
+        if rate <= 0:
+            return 0.0
+        interval = 1.0 / rate
+        if self.config.jitter:
+            interval *= 1 + self._random.uniform(-self.config.jitter, self.config.jitter)
+        return max(interval, 0.0)
+
+    async def _handle_chat(self, request: web.Request, native: bool = False) -> web.StreamResponse:
+        cfg = self.config
+        body = await request.json()
+        model = str(body.get("model", ""))
+        kind = "r1" if ("deepseek" in model.lower() or "r1" in model.lower()) else "qwen"
+        # 原生协议没有开启 incremental_output 时每个事件重复携带全部文本
+        incremental = bool((body.get("parameters") or {}).get("incremental_output"))
+
+        if self._random.random() < cfg.failure_rate:
+            self.stats.streams.append(StreamStats(kind, 0, 0.0, failed=True))
+            return web.json_response({"error": {"message": "mock upstream failure"}}, status=500)
+
+        if body.get("stream") is False or (native and request.headers.get("X-DashScope-SSE") != "enable"):
+            return await self._complete(kind, native)
+
+        start = time.perf_counter()
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+
+        events = self._events(kind, native, incremental)
+        rate = cfg.reasoning_rate if kind == "r1" else cfg.answer_rate
+        cut_at = None
+        if self._random.random() < cfg.midstream_failure_rate:
+            cut_at = self._random.randint(1, max(len(events) - 2, 1))
+
+        if kind == "r1":
+            mark_at = min(cfg.reasoning_tokens, len(events) - 1) if native else self._r1_end
+        else:
+            mark_at = len(events) - 1
+        duration = None
+        written = 0
+        try:
+            if cfg.ttft:
+                await asyncio.sleep(cfg.ttft)
+            for index, event in enumerate(events):
+                if cut_at is not None and index == cut_at:
+                    self.stats.streams.append(
+                        StreamStats(kind, index, time.perf_counter() - start, failed=True)
+                    )
+                    if request.transport is not None:
+                        request.transport.close()
+                    return response
+                await response.write(event)
+                written = index + 1
+                if index == mark_at:
+                    duration = time.perf_counter() - start
+                interval = self._interval(rate)
+                if interval:
+                    await asyncio.sleep(interval)
+            await response.write_eof()
+        except (ConnectionResetError, asyncio.CancelledError):
+            # 网关在推理阶段结束后会主动断开 R1 流，这是正常情况
+            if duration is None:
+                self.stats.streams.append(
+                    StreamStats(kind, written, time.perf_counter() - start, failed=True)
+                )
+                raise
+        self.stats.streams.append(StreamStats(kind, written, duration or time.perf_counter() - start))
+        return response
+
+    async def _complete(self, kind: str, native: bool) -> web.Response:
+        """stream=false 时等待整段生成完毕后一次返回完整响应"""
+        cfg = self.config
+        start = time.perf_counter()
+        payloads = sse_payloads(self._events(kind, native))
+        rate = cfg.reasoning_rate if kind == "r1" else cfg.answer_rate
+        delay = (cfg.ttft or 0.0) + (len(payloads) / rate if rate > 0 else 0.0)
+        if delay:
+            await asyncio.sleep(delay)
+
+        content = []
+        for payload in payloads:
+            data = json.loads(payload)
+            if "output" in data:
+                message = data["output"]["choices"][0]["message"]
+            else:
+                message = data["choices"][0]["delta"]
+            content.append(message.get("content") or "")
+        self.stats.streams.append(StreamStats(kind, len(payloads), time.perf_counter() - start))
+        if native:
+            return web.json_response({
+                "output": {"choices": [{
+                    "message": {"role": "assistant", "content": "".join(content)},
+                    "finish_reason": "stop",
+                }]},
+                "usage": {"input_tokens": 16, "output_tokens": len(payloads)},
+                "request_id": "mock",
+            })
+        return web.json_response({
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(content)},
+                "finish_reason": "stop",
+            }],
+        })
+
+    async def _handle_native(self, request: web.Request) -> web.StreamResponse:
+        return await self._handle_chat(request, native=True)
+
+    async def _handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response({"config": asdict(self.config), "stats": self.stats.summary()})
+
+    async def _handle_reset(self, request: web.Request) -> web.Response:
+        self.stats = MockStats()
+        return web.json_response({"ok": True})
+
+    async def _handle_config(self, request: web.Request) -> web.Response:
+        """运行时修改配置，便于基准测试在不同场景之间切换"""
+        updates = await request.json()
+        for key, value in updates.items():
+            if hasattr(self.config, key):
+                setattr(self.config, key, value)
+        self._r1_events = None
+        self._qwen_events = None
+        self._random = random.Random(self.config.seed)
+        return web.json_response(asdict(self.config))
+
+    def create_app(self) -> web.Application:
+        app = web.Application(client_max_size=1024 ** 3)
+        app.router.add_post("/compatible-mode/v1/chat/completions", self._handle_chat)
+        app.router.add_post("/api/v1/chat/completions", self._handle_chat)
+        app.router.add_post("/v1/chat/completions", self._handle_chat)
+        app.router.add_post("/api/v1/services/aigc/text-generation/generation", self._handle_native)
+        app.router.add_get("/__stats", self._handle_stats)
+        app.router.add_post("/__reset", self._handle_reset)
+        app.router.add_post("/__config", self._handle_config)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 9000) -> str:
+        """在当前事件循环中启动服务，返回基础地址"""
+        self._runner = web.AppRunner(self.create_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        return f"http://{host}:{port}"
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+def parse_config(argv: Optional[List[str]] = None) -> tuple:
+    parser = argparse.ArgumentParser(description="模拟上游 SSE 服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    defaults = MockConfig()
+    for name, value in asdict(defaults).items():
+        flag = "--" + name.replace("_", "-")
+        if isinstance(value, bool):
+            parser.add_argument(flag, type=lambda v: v.lower() == "true", default=value)
+        elif value is None:
+            parser.add_argument(flag, type=str if name.endswith("file") else int, default=None)
+        else:
+            parser.add_argument(flag, type=type(value), default=value)
+    args = parser.parse_args(argv)
+    config = MockConfig(**{name: getattr(args, name) for name in asdict(defaults)})
+    return args.host, args.port, config
+
+
+async def _serve(host: str, port: int, config: MockConfig) -> None:
+    upstream = MockUpstream(config)
+    url = await upstream.start(host, port)
+    print(f"模拟上游已启动: {url}")
+    print(json.dumps(asdict(config), ensure_ascii=False))
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await upstream.stop()
+
+
+def main() -> None:
+    host, port, config = parse_config()
+    try:
+        asyncio.run(_serve(host, port, config))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
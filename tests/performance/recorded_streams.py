@@ -0,0 +1,212 @@
+"""录制流数据
+
+生成与 DashScope 兼容模式 / OpenRouter / DashScope 原生接口返回格式一致的 SSE 事件序列，
+供基准测试和模拟上游回放使用。也可以通过 ``load_recording`` 读取线上抓取的 ``.sse`` 文件，
+文件格式即上游原始响应体（以空行分隔的 ``data: ...`` 事件）。
+"""
+
+import json
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+# 模拟真实输出的 token 片段，中英文混合，长度与 R1 的平均 delta 相近
+_VOCAB = [
+    "好的", "，", "用户", "问", "的是", "关于", " the", " model", "的", "问题", "。",
+    "首先", "我", "需要", "考虑", " reasoning", "步骤", "\n\n", "然后", "再", "确认",
+    "答案", "是否", "正确", " and", " check", "一下", "边界", "情况", "：", "1", ".",
+]
+
+
+def token_at(index: int) -> str:
+    """返回确定性的第 index 个 token 文本"""
+    return _VOCAB[(index * 7 + index // len(_VOCAB)) % len(_VOCAB)]
+
+
+def _openai_event(chat_id: str, model: str, delta: dict) -> bytes:
+    body = {
+        "id": chat_id,
+        "object": "chat.completion.chunk",
+        "created": 1700000000,
+        "model": model,
+        "system_fingerprint": None,
+        "choices": [{"index": 0, "delta": delta, "logprobs": None, "finish_reason": None}],
+    }
+    return b"data: " + json.dumps(body, ensure_ascii=False).encode("utf-8") + b"\n\n"
+
+
+def _dashscope_event(
+    request_id: str, seq: int, text: str, output_tokens: int, finish_reason: str, reasoning: Optional[str] = None
+) -> bytes:
+    message = {"content": text, "role": "assistant"}
+    if reasoning is not None:
+        message["reasoning_content"] = reasoning
+    body = {
+        "output": {
+            "choices": [{"message": message, "finish_reason": finish_reason}]
+        },
+        "usage": {"total_tokens": 16 + output_tokens, "input_tokens": 16, "output_tokens": output_tokens},
+        "request_id": request_id,
+    }
+    return b"id:%d\nevent:result\n:HTTP_STATUS/200\ndata:" % seq + json.dumps(
+        body, ensure_ascii=False
+    ).encode("utf-8") + b"\n\n"
+
+
+def r1_stream_events(
+    reasoning_tokens: int,
+    answer_tokens: int = 32,
+    origin_reasoning: bool = True,
+    model: str = "deepseek-r1",
+    native: bool = False,
+    incremental: bool = True,
+) -> List[bytes]:
+    """生成 DeepSeek R1 的流式响应事件
+
+    Args:
+        reasoning_tokens: 推理阶段的 token 数
+        answer_tokens: 推理结束后回答阶段的 token 数
+        origin_reasoning: True 时使用 reasoning_content 字段，False 时使用 <think> 标签
+        model: 响应中的模型名称
+        native: True 时生成 DashScope 原生格式（推理内容位于 message.reasoning_content）
+        incremental: 原生格式是否为增量输出，False 时每个事件携带截至目前的全部文本
+
+    Returns:
+        List[bytes]: 每个元素是一条完整的 SSE 事件
+    """
+    if native:
+        events = []
+        reasoning = text = ""
+        for i in range(reasoning_tokens + answer_tokens):
+            token = token_at(i)
+            if i < reasoning_tokens:
+                reasoning = token if incremental else reasoning + token
+                piece = "" if incremental else text
+            else:
+                reasoning = "" if incremental else reasoning
+                text = token if incremental else text + token
+                piece = text
+            finish_reason = "stop" if i == reasoning_tokens + answer_tokens - 1 else "null"
+            events.append(_dashscope_event("recorded-r1", i + 1, piece, i + 1, finish_reason, reasoning))
+        return events
+    chat_id = "chatcmpl-recorded-r1"
+    events = [_openai_event(chat_id, model, {"role": "assistant", "content": ""})]
+    if origin_reasoning:
+        for i in range(reasoning_tokens):
+            events.append(
+                _openai_event(chat_id, model, {"content": None, "reasoning_content": token_at(i)})
+            )
+        for i in range(answer_tokens):
+            events.append(
+                _openai_event(chat_id, model, {"content": token_at(i), "reasoning_content": None})
+            )
+    else:
+        events.append(_openai_event(chat_id, model, {"content": "<think>"}))
+        for i in range(reasoning_tokens):
+            events.append(_openai_event(chat_id, model, {"content": token_at(i)}))
+        events.append(_openai_event(chat_id, model, {"content": "</think>"}))
+        for i in range(answer_tokens):
+            events.append(_openai_event(chat_id, model, {"content": token_at(i)}))
+    events.append(b"data: [DONE]\n\n")
+    return events
+
+
+def qwen_stream_events(
+    answer_tokens: int,
+    native: bool = False,
+    model: str = "qwen2.5-14b-instruct-1m",
+    incremental: bool = True,
+) -> List[bytes]:
+    """生成 Qwen 回答阶段的流式响应事件
+
+    Args:
+        answer_tokens: 回答 token 数
+        native: True 时生成 DashScope 原生格式（没有 [DONE]），否则为 OpenAI 兼容格式
+        model: 响应中的模型名称
+        incremental: 原生格式是否为增量输出，False 时每个事件携带截至目前的全部文本
+
+    Returns:
+        List[bytes]: 每个元素是一条完整的 SSE 事件
+    """
+    if native:
+        events = []
+        text = ""
+        for i in range(answer_tokens):
+            text = token_at(i) if incremental else text + token_at(i)
+            finish_reason = "stop" if i == answer_tokens - 1 else "null"
+            events.append(_dashscope_event("recorded-qwen", i + 1, text, i + 1, finish_reason))
+        return events
+    else:
+        chat_id = "chatcmpl-recorded-qwen"
+        events = [_openai_event(chat_id, model, {"role": "assistant", "content": ""})]
+        events.extend(
+            _openai_event(chat_id, model, {"content": token_at(i)}) for i in range(answer_tokens)
+        )
+    events.append(b"data: [DONE]\n\n")
+    return events
+
+
+def rechunk(events: Iterable[bytes], chunk_size: Optional[int] = None) -> List[bytes]:
+    """把事件重新切分为网络分块
+
+    Args:
+        events: SSE 事件序列
+        chunk_size: 每个分块的字节数，为空时保持一个事件一个分块；
+            指定时分块边界可能落在行中间，用于验证解析器的健壮性
+
+    Returns:
+        List[bytes]: 分块列表
+    """
+    if not chunk_size:
+        return list(events)
+    data = b"".join(events)
+    return [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+
+
+def sse_payloads(events: Iterable[bytes]) -> List[bytes]:
+    """提取事件中的 data 字段内容（不含 [DONE]）"""
+    payloads = []
+    for event in events:
+        for line in event.split(b"\n"):
+            if line.startswith(b"data:"):
+                payload = line[5:].strip()
+                if payload and payload != b"[DONE]":
+                    payloads.append(payload)
+    return payloads
+
+
+def reasoning_end_index(events: List[bytes]) -> int:
+    """返回推理阶段结束后第一个回答事件的下标
+
+    网关在收到这个事件后即结束推理阶段，基准测试据此计算上游推理耗时。
+    找不到时返回最后一个事件的下标。
+    """
+    in_think = False
+    for index, payload in enumerate(event.split(b"data:", 1)[-1].strip() for event in events):
+        if not payload or payload == b"[DONE]":
+            continue
+        try:
+            choices = json.loads(payload).get("choices") or []
+        except ValueError:
+            continue
+        delta = (choices[0].get("delta") or {}) if choices else {}
+        content = delta.get("content")
+        if delta.get("reasoning_content") or not content:
+            continue
+        if "<think>" in content:
+            in_think = True
+        if in_think:
+            in_think = "</think>" not in content
+            continue
+        return index
+    return len(events) - 1
+
+
+def load_recording(path: str) -> List[bytes]:
+    """读取录制的 .sse 文件，按空行切分为事件"""
+    data = Path(path).read_bytes().replace(b"\r\n", b"\n")
+    return [event + b"\n\n" for event in data.split(b"\n\n") if event.strip()]
+
+
+def save_recording(path: str, events: Iterable[bytes]) -> None:
+    """保存事件序列为 .sse 文件"""
+    Path(path).write_bytes(b"".join(events))
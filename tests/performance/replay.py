@@ -0,0 +1,209 @@
+"""录制流量回放
+
+读取 ``CAPTURE_DIR`` 下录制的请求（见 ``app.monitoring.capture``），按录制时的时间间隔
+（或按 ``--speed`` 缩放后的速率）发送给正在运行的网关，报告回放与录制时的延迟差：
+
+- 端到端延迟与首包延迟的 p50 / p95（录制时、回放时）
+- 逐个请求的延迟差（回放 - 录制）的 p50 / p95，只统计两次都成功的请求
+- 状态码分布与错误数
+
+用法::
+
+    python -m tests.performance.replay captures/ --url http://127.0.0.1:8000 --api-key sk-...
+    python -m tests.performance.replay captures/ --speed 4 --limit 1000 --output replay.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import Counter
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+import aiohttp
+
+from app.monitoring.capture import iter_records
+from tests.performance.bench_gateway import _percentile
+
+
+@dataclass
+class ReplayResult:
+    """一个请求的回放结果，耗时单位为毫秒"""
+    status: int
+    ttft_ms: Optional[float]
+    latency_ms: float
+    captured_status: int
+    captured_ttft_ms: Optional[float]
+    captured_latency_ms: float
+    error: Optional[str] = None
+
+
+def schedule(records: Iterable[dict], speed: float = 1.0) -> List[Tuple[float, dict]]:
+    """按录制时间计算每个请求相对第一个请求的发送时间(秒)
+
+    Args:
+        records: 录制的记录
+        speed: 回放速率相对录制时的倍数，0 表示不等待
+
+    Returns:
+        List[Tuple[float, dict]]: 按发送时间排列的 (发送时间, 记录)
+    """
+    ordered = sorted(records, key=lambda record: record["ts"])
+    if not ordered:
+        return []
+    first = ordered[0]["ts"]
+    return [((record["ts"] - first) / speed if speed > 0 else 0.0, record) for record in ordered]
+
+
+async def send_record(session: aiohttp.ClientSession, url: str, record: dict, api_key: Optional[str]) -> ReplayResult:
+    """把一条录制的请求发送给网关"""
+    headers = dict(record.get("headers") or {})
+    if api_key:
+        headers["Authorization"] = f"Bearer {api_key}"
+    start = time.perf_counter()
+    ttft = None
+    status = 0
+    error = None
+    try:
+        async with session.post(f"{url}/v1/chat/completions", json=record["request"], headers=headers) as response:
+            status = response.status
+            async for _ in response.content.iter_any():
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        error = f"{type(e).__name__}: {e}"
+    return ReplayResult(
+        status=status,
+        ttft_ms=round(ttft * 1000, 2) if ttft is not None and record.get("stream") else None,
+        latency_ms=round((time.perf_counter() - start) * 1000, 2),
+        captured_status=record.get("status", 200),
+        captured_ttft_ms=record.get("ttft_ms"),
+        captured_latency_ms=record.get("latency_ms", 0),
+        error=error,
+    )
+
+
+async def replay(
+    records: Iterable[dict],
+    send: Callable[[dict], Awaitable[ReplayResult]],
+    speed: float = 1.0,
+    concurrency: int = 0,
+) -> List[ReplayResult]:
+    """按录制时的间隔发送请求
+
+    Args:
+        records: 录制的记录
+        send: 发送一条记录的函数
+        speed: 回放速率相对录制时的倍数，0 表示不等待
+        concurrency: 同时进行的请求数上限，0 表示不限制
+
+    Returns:
+        List[ReplayResult]: 按发送顺序排列的结果
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency) if concurrency > 0 else None
+
+    async def run(record: dict) -> ReplayResult:
+        if semaphore is None:
+            return await send(record)
+        async with semaphore:
+            return await send(record)
+
+    tasks = []
+    start = loop.time()
+    for offset, record in schedule(records, speed):
+        delay = start + offset - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(run(record)))
+    return list(await asyncio.gather(*tasks))
+
+
+def _quantiles(values: List[float]) -> Dict[str, float]:
+    return {"p50": round(_percentile(values, 50), 2), "p95": round(_percentile(values, 95), 2)}
+
+
+def summarize(results: List[ReplayResult]) -> Dict:
+    """汇总延迟与录制时的差异"""
+    ok = [r for r in results if r.error is None and r.status == 200 and r.captured_status == 200]
+    ttft_pairs = [r for r in ok if r.ttft_ms is not None and r.captured_ttft_ms is not None]
+    return {
+        "requests": len(results),
+        "errors": sum(1 for r in results if r.error is not None),
+        "status": dict(Counter(r.status for r in results)),
+        "compared": len(ok),
+        "latency_ms": {
+            "captured": _quantiles([r.captured_latency_ms for r in ok]),
+            "replayed": _quantiles([r.latency_ms for r in ok]),
+            "delta": _quantiles([r.latency_ms - r.captured_latency_ms for r in ok]),
+        },
+        "ttft_ms": {
+            "captured": _quantiles([r.captured_ttft_ms for r in ttft_pairs]),
+            "replayed": _quantiles([r.ttft_ms for r in ttft_pairs]),
+            "delta": _quantiles([r.ttft_ms - r.captured_ttft_ms for r in ttft_pairs]),
+        },
+    }
+
+
+def print_summary(summary: Dict) -> None:
+    print(
+        f"请求 {summary['requests']}，错误 {summary['errors']}，状态码 {summary['status']}，"
+        f"参与对比 {summary['compared']}"
+    )
+    print(f"{'':>10} {'录制p50':>9} {'录制p95':>9} {'回放p50':>9} {'回放p95':>9} {'差值p50':>9} {'差值p95':>9}")
+    for name in ("latency_ms", "ttft_ms"):
+        item = summary[name]
+        print(
+            f"{name:>10} {item['captured']['p50']:>9} {item['captured']['p95']:>9} "
+            f"{item['replayed']['p50']:>9} {item['replayed']['p95']:>9} "
+            f"{item['delta']['p50']:>9} {item['delta']['p95']:>9}"
+        )
+
+
+async def run_replay(args: argparse.Namespace) -> List[ReplayResult]:
+    records = [record for record in iter_records(args.paths) if record.get("request")]
+    if args.limit:
+        records = records[:args.limit]
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=None, sock_read=args.timeout)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        return await replay(
+            records,
+            lambda record: send_record(session, args.url.rstrip("/"), record, args.api_key),
+            speed=args.speed,
+            concurrency=args.concurrency,
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="回放录制的流量并对比延迟")
+    parser.add_argument("paths", nargs="+", help="录制目录或分段文件")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="网关地址")
+    parser.add_argument("--api-key", default=os.getenv("ALLOW_API_KEY"), help="网关的 API 密钥")
+    parser.add_argument("--speed", type=float, default=1.0, help="回放速率相对录制时的倍数，0 表示不等待")
+    parser.add_argument("--concurrency", type=int, default=0, help="同时进行的请求数上限，0 不限制")
+    parser.add_argument("--limit", type=int, default=0, help="最多回放的请求数")
+    parser.add_argument("--timeout", type=float, default=300.0, help="读取响应的超时(秒)")
+    parser.add_argument("--output", help="保存汇总与逐个请求的结果")
+    args = parser.parse_args()
+
+    results = asyncio.run(run_replay(args))
+    summary = summarize(results)
+    print_summary(summary)
+    if args.output:
+        path = Path(args.output)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(
+            {"summary": summary, "results": [asdict(r) for r in results]}, ensure_ascii=False, indent=2
+        ))
+        print(f"结果已保存: {path}")
+    if not results:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
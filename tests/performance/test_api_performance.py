@@ -1 +1,67 @@
- 
\ No newline at end of file
+"""API 性能测试
+
+模拟上游的回放测试默认执行；完整的网关基准测试需要启动 uvicorn 子进程，
+耗时较长，设置 RUN_PERF_TESTS=1 时才执行。
+"""
+
+import json
+import os
+from pathlib import Path
+
+import pytest
+from aiohttp.client_exceptions import ClientError
+
+from app.clients import BaseClient, DeepSeekClient
+from tests.performance.bench_gateway import DEFAULT_BASELINE, compare_with_baseline, run_benchmark
+from tests.performance.mock_upstream import MockConfig, MockUpstream
+
+RUN_PERF_TESTS = os.getenv("RUN_PERF_TESTS") == "1"
+
+
+@pytest.mark.asyncio
+async def test_mock_upstream_replay(unused_tcp_port):
+    """测试模拟上游回放的 R1 流可以被客户端完整解析"""
+    upstream = MockUpstream(MockConfig(reasoning_tokens=50, reasoning_rate=5000, jitter=0.5, seed=1))
+    url = await upstream.start(port=unused_tcp_port)
+    try:
+        client = DeepSeekClient("key", f"{url}/compatible-mode/v1/chat/completions")
+        reasoning = 0
+        async for content_type, _ in client.stream_chat([{"role": "user", "content": "hi"}], "deepseek-r1"):
+            if content_type == "reasoning":
+                reasoning += 1
+            else:
+                break
+        assert reasoning == 50
+    finally:
+        await BaseClient.close_sessions()
+        await upstream.stop()
+
+
+@pytest.mark.asyncio
+async def test_mock_upstream_failure(unused_tcp_port):
+    """测试模拟上游的失败注入"""
+    upstream = MockUpstream(MockConfig(failure_rate=1.0))
+    url = await upstream.start(port=unused_tcp_port)
+    try:
+        client = DeepSeekClient("key", f"{url}/compatible-mode/v1/chat/completions")
+        with pytest.raises(ClientError):
+            async for _ in client.stream_chat([{"role": "user", "content": "hi"}], "deepseek-r1"):
+                pass
+    finally:
+        await BaseClient.close_sessions()
+        await upstream.stop()
+
+
+@pytest.mark.asyncio
+@pytest.mark.skipif(not RUN_PERF_TESTS, reason="设置 RUN_PERF_TESTS=1 运行网关基准测试")
+async def test_gateway_benchmark():
+    """运行小规模网关基准测试，存在基线时检查性能回退"""
+    pytest.importorskip("uvicorn")
+    results = await run_benchmark([1, 4], 8, MockConfig(reasoning_rate=500, answer_rate=500, seed=0))
+    assert all(result.errors == 0 for result in results)
+    assert all(result.tokens > 0 for result in results)
+
+    baseline_path = Path(DEFAULT_BASELINE)
+    if baseline_path.exists():
+        regressions = compare_with_baseline(results, json.loads(baseline_path.read_text()), 0.5)
+        assert not regressions, regressions
@@ -0,0 +1,239 @@
+"""逐 token 热路径微基准测试
+
+覆盖每个 token 都会执行的代码：
+- DeepSeekClient.stream_chat 的 SSE 解析（原生推理与 <think> 标签两种格式）
+- <think> 标签增量解析（ThinkTagParser）
+- process_deepseek / process_qwen 中的 chunk 编码
+- asyncio.Queue 的生产者/消费者交接
+- DEBUG 关闭时的日志调用
+
+每项在 1k / 10k / 100k token 的流上测量，耗时较长，设置 RUN_PERF_TESTS=1 时才执行。
+另外的伸缩性检查总是执行，比较小流与大流上每个 token 的耗时，算法复杂度退化
+（例如 O(n²)）会直接导致测试失败。
+
+安装 pytest-benchmark 后可以使用 --benchmark-* 参数保存与对比结果。
+"""
+
+import asyncio
+import logging
+import os
+import time
+
+import pytest
+
+from app.clients import DeepSeekClient
+from app.clients.think_parser import ThinkTagParser
+from app.deepxy.deepxy import DeepXY
+from app.utils.logger import StructuredLogger
+from tests.performance.recorded_streams import r1_stream_events, rechunk, token_at
+
+RUN_PERF_TESTS = os.getenv("RUN_PERF_TESTS") == "1"
+perf = pytest.mark.skipif(not RUN_PERF_TESTS, reason="设置 RUN_PERF_TESTS=1 运行热路径微基准测试")
+
+SIZES = [1_000, 10_000, 100_000]
+
+# 伸缩性检查：大流与小流每 token 耗时之比的上限
+SCALING_SMALL = 2_000
+SCALING_LARGE = 50_000
+MAX_SCALING_RATIO = 3.0
+
+
+@pytest.fixture(scope="module")
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+def _deepseek_client(chunks):
+    client = DeepSeekClient("key", "http://upstream")
+
+    async def fake_make_request(headers, data, api_url=None, timeout=None):
+        for chunk in chunks:
+            yield chunk
+
+    client._make_request = fake_make_request
+    return client
+
+
+def _stream_chat_runner(loop, n_tokens, origin_reasoning):
+    chunks = rechunk(r1_stream_events(n_tokens, answer_tokens=1, origin_reasoning=origin_reasoning), 4096)
+    messages = [{"role": "user", "content": "hi"}]
+
+    async def consume():
+        client = _deepseek_client(chunks)
+        count = 0
+        async for content_type, _ in client.stream_chat(messages, "deepseek-r1", origin_reasoning):
+            count += 1
+        return count
+
+    return lambda: loop.run_until_complete(consume())
+
+
+def _think_tag_runner(n_tokens):
+    # 标签被拆分在两个 delta 中
+    tokens = ["<thi", "nk>"] + [token_at(i) for i in range(n_tokens)] + ["</thi", "nk>"]
+
+    def run():
+        parser = ThinkTagParser()
+        for token in tokens:
+            parser.feed(token)
+        parser.flush()
+
+    return run
+
+
+def _encode_runner(n_tokens):
+    tokens = [token_at(i) for i in range(n_tokens)]
+
+    def run():
+        for token in tokens:
+            DeepXY._encode_chunk("chatcmpl-bench", 1700000000, "deepseek-r1", reasoning_content=token)
+        for token in tokens:
+            DeepXY._encode_chunk("chatcmpl-bench", 1700000000, "qwen", content=token)
+
+    return run
+
+
+def _queue_runner(loop, n_tokens):
+    item = b"data: {}\n\n"
+
+    async def handoff():
+        queue = asyncio.Queue()
+
+        async def producer():
+            for _ in range(n_tokens):
+                await queue.put(item)
+            await queue.put(None)
+
+        task = asyncio.create_task(producer())
+        count = 0
+        while await queue.get() is not None:
+            count += 1
+        await task
+        return count
+
+    return lambda: loop.run_until_complete(handoff())
+
+
+def _pipeline_runner(loop, n_tokens):
+    """不经过网络的完整 DeepXY 流式管道：编码 + 两级队列交接"""
+    deep_xy = DeepXY("key", "key", "http://upstream", "http://upstream")
+    reasoning = [token_at(i) for i in range(n_tokens)]
+    answer = [token_at(i) for i in range(n_tokens)]
+
+    async def fake_deepseek(messages, model, is_origin_reasoning=True):
+        for token in reasoning:
+            yield "reasoning", token
+        yield "content", "好"
+
+    async def fake_qwen(messages, model_arg, model):
+        for token in answer:
+            yield "answer", token
+
+    deep_xy.deepseek_client.stream_chat = fake_deepseek
+    deep_xy.qwen_client.stream_chat = fake_qwen
+    messages = [{"role": "user", "content": "hi"}]
+
+    async def consume():
+        count = 0
+        async for _ in deep_xy.chat_completions_with_stream(messages, (0.7, 0.95, 0.0, 0.0)):
+            count += 1
+        return count
+
+    return lambda: loop.run_until_complete(consume())
+
+
+def _logger_runner(n_tokens):
+    bench_logger = StructuredLogger("deepxy.bench")
+    bench_logger.logger.setLevel(logging.INFO)
+    tokens = [token_at(i) for i in range(n_tokens)]
+
+    def run():
+        for content in tokens:
+            bench_logger.debug(f"提取推理内容：{content}")
+
+    return run
+
+
+def _rounds(n_tokens):
+    return 1 if n_tokens >= 100_000 else 3
+
+
+@perf
+@pytest.mark.parametrize("n_tokens", SIZES)
+def test_sse_parse_origin_reasoning(benchmark, loop, n_tokens):
+    run = _stream_chat_runner(loop, n_tokens, origin_reasoning=True)
+    assert benchmark.pedantic(run, rounds=_rounds(n_tokens)) == n_tokens + 1
+
+
+@perf
+@pytest.mark.parametrize("n_tokens", SIZES)
+def test_sse_parse_think_tags(benchmark, loop, n_tokens):
+    run = _stream_chat_runner(loop, n_tokens, origin_reasoning=False)
+    assert benchmark.pedantic(run, rounds=_rounds(n_tokens)) >= n_tokens
+
+
+@perf
+@pytest.mark.parametrize("n_tokens", SIZES)
+def test_think_tag_parser(benchmark, n_tokens):
+    benchmark.pedantic(_think_tag_runner(n_tokens), rounds=_rounds(n_tokens))
+
+
+@perf
+@pytest.mark.parametrize("n_tokens", SIZES)
+def test_chunk_encoding(benchmark, n_tokens):
+    benchmark.pedantic(_encode_runner(n_tokens), rounds=_rounds(n_tokens))
+
+
+@perf
+@pytest.mark.parametrize("n_tokens", SIZES)
+def test_queue_handoff(benchmark, loop, n_tokens):
+    assert benchmark.pedantic(_queue_runner(loop, n_tokens), rounds=_rounds(n_tokens)) == n_tokens
+
+
+@perf
+@pytest.mark.parametrize("n_tokens", SIZES)
+def test_stream_pipeline(benchmark, loop, n_tokens):
+    count = benchmark.pedantic(_pipeline_runner(loop, n_tokens), rounds=_rounds(n_tokens))
+    assert count == 2 * n_tokens + 1
+
+
+@perf
+@pytest.mark.parametrize("n_tokens", SIZES)
+def test_logger_debug_disabled(benchmark, n_tokens):
+    benchmark.pedantic(_logger_runner(n_tokens), rounds=_rounds(n_tokens))
+
+
+def _per_token_cost(make_runner, n_tokens, repeat=3):
+    run = make_runner(n_tokens)
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+    return best / n_tokens
+
+
+SCALING_CASES = {
+    "sse_parse_origin_reasoning": lambda loop: lambda n: _stream_chat_runner(loop, n, True),
+    "sse_parse_think_tags": lambda loop: lambda n: _stream_chat_runner(loop, n, False),
+    "think_tag_parser": lambda loop: _think_tag_runner,
+    "chunk_encoding": lambda loop: _encode_runner,
+    "queue_handoff": lambda loop: lambda n: _queue_runner(loop, n),
+    "stream_pipeline": lambda loop: lambda n: _pipeline_runner(loop, n),
+    "logger_debug_disabled": lambda loop: _logger_runner,
+}
+
+
+@pytest.mark.parametrize("case", list(SCALING_CASES))
+def test_per_token_cost_scaling(loop, case):
+    """大流上每个 token 的耗时不应明显高于小流"""
+    make_runner = SCALING_CASES[case](loop)
+    small = _per_token_cost(make_runner, SCALING_SMALL)
+    large = _per_token_cost(make_runner, SCALING_LARGE)
+    ratio = large / small
+    assert ratio < MAX_SCALING_RATIO, (
+        f"{case}: {SCALING_LARGE} token 时每 token {large * 1e6:.2f}us，"
+        f"{SCALING_SMALL} token 时 {small * 1e6:.2f}us，比值 {ratio:.1f}"
+    )
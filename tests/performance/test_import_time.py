@@ -0,0 +1,94 @@
+"""启动耗时回归测试
+
+在干净的子进程中用 ``python -X importtime`` 导入 app.main，检查：
+- 导入总耗时不超过预算（IMPORT_TIME_BUDGET_MS，默认 1500ms，主要是 fastapi 与 aiohttp）
+- 项目自身模块的耗时不超过预算（APP_IMPORT_BUDGET_MS，默认 100ms）
+- 可选子系统（tiktoken、监控组件等）不会在启动时被导入
+
+也可以直接运行查看耗时最多的模块::
+
+    python -m tests.performance.test_import_time
+"""
+
+import os
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, Tuple
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[2]
+
+IMPORT_TIME_BUDGET_MS = float(os.getenv("IMPORT_TIME_BUDGET_MS", "1500"))
+APP_IMPORT_BUDGET_MS = float(os.getenv("APP_IMPORT_BUDGET_MS", "100"))
+
+# 启动时不应导入的模块
+LAZY_MODULES = (
+    "tiktoken",
+    "app.monitoring.performance",
+    "app.monitoring.failover",
+    "app.monitoring.cache",
+    "app.utils.tokenizer",
+)
+
+
+def measure_import(module: str = "app.main") -> Dict[str, Tuple[int, int]]:
+    """在子进程中导入模块并解析 -X importtime 的输出
+
+    Args:
+        module: 要导入的模块
+
+    Returns:
+        Dict[str, Tuple[int, int]]: 模块名 -> (自身耗时, 累计耗时)，单位微秒
+    """
+    env = dict(os.environ)
+    env.setdefault("DASHSCOPE_API_KEY", "import-time-key")
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    timings = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if not self_us.strip().isdigit():
+            continue
+        timings[name.strip()] = (int(self_us), int(cumulative_us))
+    return timings
+
+
+@pytest.fixture(scope="module")
+def timings():
+    return measure_import()
+
+
+def test_import_time_budget(timings):
+    total_ms = timings["app.main"][1] / 1000
+    assert total_ms < IMPORT_TIME_BUDGET_MS, f"导入 app.main 耗时 {total_ms:.0f}ms"
+
+
+def test_app_modules_budget(timings):
+    app_ms = sum(self_us for name, (self_us, _) in timings.items() if name.split(".")[0] == "app") / 1000
+    assert app_ms < APP_IMPORT_BUDGET_MS, f"项目模块自身导入耗时 {app_ms:.0f}ms"
+
+
+@pytest.mark.parametrize("module", LAZY_MODULES)
+def test_optional_modules_are_lazy(timings, module):
+    assert module not in timings, f"{module} 不应在启动时导入"
+
+
+def main() -> None:
+    timings = measure_import(sys.argv[1] if len(sys.argv) > 1 else "app.main")
+    for name, (self_us, cumulative_us) in sorted(timings.items(), key=lambda item: -item[1][1])[:30]:
+        print(f"{cumulative_us / 1000:9.1f}ms {self_us / 1000:9.1f}ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""准入控制单元测试"""
+
+import asyncio
+import gc
+import time
+
+import pytest
+
+from app.monitoring.admission import (
+    PRIORITIES,
+    AdmissionController,
+    parse_priority_keys,
+    release_after,
+)
+from app.monitoring.metrics import MetricsRegistry
+from app.utils.errors import RateLimitError
+
+HIGH, NORMAL, LOW = PRIORITIES["high"], PRIORITIES["normal"], PRIORITIES["low"]
+
+
+def _controller(**kwargs):
+    kwargs.setdefault("registry", MetricsRegistry())
+    return AdmissionController(**kwargs)
+
+
+def test_priority_for():
+    controller = _controller(priority_keys=parse_priority_keys("vip:high,batch:low"))
+    assert controller.priority_for("vip") == HIGH
+    assert controller.priority_for("batch") == LOW
+    assert controller.priority_for("other") == NORMAL
+    # 请求头只能降低优先级
+    assert controller.priority_for("vip", "low") == LOW
+    assert controller.priority_for("batch", "high") == LOW
+    assert controller.priority_for(None, "unknown") == NORMAL
+    with pytest.raises(ValueError):
+        parse_priority_keys("vip:urgent")
+
+
+@pytest.mark.asyncio
+async def test_queue_orders_by_priority():
+    controller = _controller(max_in_flight=2, queue_timeout=1)
+    tickets = [await controller.acquire(HIGH), await controller.acquire(HIGH)]
+
+    order = []
+
+    async def wait(priority, name):
+        ticket = await controller.acquire(priority)
+        order.append(name)
+        return ticket
+
+    low = asyncio.create_task(wait(LOW, "low"))
+    await asyncio.sleep(0)
+    high = asyncio.create_task(wait(HIGH, "high"))
+    await asyncio.sleep(0)
+
+    tickets[0].release()
+    await asyncio.sleep(0.01)
+    assert order == ["high"]
+    (await high).release()
+    tickets[1].release()
+    (await low).release()
+    assert order == ["high", "low"]
+    assert controller.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_queue_timeout_returns_retry_after():
+    controller = _controller(max_in_flight=1, queue_timeout=0.05)
+    ticket = await controller.acquire()
+    with pytest.raises(RateLimitError) as exc_info:
+        await controller.acquire()
+    assert exc_info.value.http_status == 429
+    assert exc_info.value.details["reason"] == "queue_timeout"
+    assert exc_info.value.details["retry_after"] >= 1
+    ticket.release()
+    assert controller.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_full_queue_evicts_lower_priority():
+    controller = _controller(max_in_flight=1, max_queue=1, queue_timeout=1)
+    ticket = await controller.acquire(HIGH)
+    low = asyncio.create_task(controller.acquire(LOW))
+    await asyncio.sleep(0)
+    high = asyncio.create_task(controller.acquire(HIGH))
+    await asyncio.sleep(0)
+
+    with pytest.raises(RateLimitError) as exc_info:
+        await low
+    assert exc_info.value.details["reason"] == "evicted"
+
+    with pytest.raises(RateLimitError) as exc_info:
+        await controller.acquire(LOW)
+    assert exc_info.value.details["reason"] == "queue_full"
+
+    ticket.release()
+    (await high).release()
+
+
+@pytest.mark.asyncio
+async def test_deadline_aware_rejection():
+    """预计排队时间超过截止时间时立即拒绝"""
+    controller = _controller(max_in_flight=1, queue_timeout=10)
+    controller.avg_service_time = 30
+    ticket = await controller.acquire()
+    with pytest.raises(RateLimitError) as exc_info:
+        await controller.acquire(timeout=5)
+    assert exc_info.value.details["reason"] == "deadline"
+    assert exc_info.value.details["retry_after"] == 30
+    ticket.release()
+
+
+def test_loop_lag_sheds_low_priority_first():
+    class Monitor:
+        lag_ewma = 0.15
+
+    controller = _controller(max_loop_lag=0.2, loop_monitor=Monitor())
+    assert controller._pressure(LOW) == "loop_lag"
+    assert controller._pressure(NORMAL) is None
+    assert controller._pressure(HIGH) is None
+
+
+@pytest.mark.asyncio
+async def test_unstarted_stream_releases_ticket():
+    """响应开始前客户端断开时，生成器被回收后释放额度"""
+    controller = _controller(max_in_flight=1)
+    ticket = await controller.acquire()
+
+    async def stream():
+        yield b"data"
+
+    generator = release_after(stream(), ticket)
+    assert controller.in_flight == 1
+    del generator
+    gc.collect()
+    assert controller.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_high_priority_latency_under_overload():
+    """大量低优先级请求过载时，高优先级请求的排队时间保持很低"""
+    controller = _controller(max_in_flight=8, max_queue=64, queue_timeout=5)
+
+    async def request(priority, hold):
+        start = time.perf_counter()
+        try:
+            ticket = await controller.acquire(priority)
+        except RateLimitError:
+            return None
+        waited = time.perf_counter() - start
+        await asyncio.sleep(hold)
+        ticket.release()
+        return waited
+
+    flood = [asyncio.create_task(request(LOW, 0.05)) for _ in range(200)]
+    await asyncio.sleep(0.01)
+    high_waits = await asyncio.gather(*(request(HIGH, 0.01) for _ in range(10)))
+    await asyncio.gather(*flood)
+
+    assert all(wait is not None for wait in high_waits)
+    assert max(high_waits) < 0.1
@@ -0,0 +1,180 @@
+"""简单问题跳过推理阶段单元测试"""
+
+import json
+
+import pytest
+
+from app.deepxy.bypass import (
+    HeuristicClassifier,
+    NgramClassifier,
+    ReasoningBypass,
+    build_bypass,
+    last_user_text,
+    main,
+)
+from app.monitoring.metrics import MetricsRegistry
+from tests.test_non_stream import MESSAGES, _deep_xy
+
+TRIVIAL = ["你好", "您好！", "你好，请简单介绍一下你自己", "Hello there!", "谢谢～", "你是谁？", "早上好呀"]
+COMPLEX = ["为什么天空是蓝色的", "证明根号2是无理数", "12 * 34 = ?", "```python\nprint(1)\n```", "Explain why X"]
+UNDECIDED = ["你好，帮我写一篇论文", "hi, what is the capital of France?", "北京今天天气怎么样"]
+
+
+def test_heuristic_classifier():
+    classifier = HeuristicClassifier()
+    assert [classifier.classify(text) for text in TRIVIAL] == [True] * len(TRIVIAL)
+    assert [classifier.classify(text) for text in COMPLEX] == [False] * len(COMPLEX)
+    assert [classifier.classify(text) for text in UNDECIDED] == [None] * len(UNDECIDED)
+    assert HeuristicClassifier(max_chars=5).classify("你好，请简单介绍一下你自己") is None
+
+
+def test_last_user_text():
+    assert last_user_text(MESSAGES) == MESSAGES[-1]["content"]
+    assert last_user_text([{"role": "user", "content": [{"type": "text", "text": "你"}, {"type": "text", "text": "好"}]}]) == "你好"
+    assert last_user_text([{"role": "user", "content": [{"type": "image_url", "image_url": {"url": "x"}}]}]) is None
+    assert last_user_text([{"role": "assistant", "content": "你好"}]) is None
+    assert last_user_text([]) is None
+
+
+SAMPLES = [(text, True) for text in ["你好", "您好", "嗨", "谢谢", "再见", "早上好", "晚安", "hello", "hi", "thanks"]] + [
+    (text, False) for text in [
+        "写一篇关于气候变化的论文", "帮我设计数据库表结构", "解释量子纠缠", "比较 Python 和 Go 的并发模型",
+        "写一个快速排序", "分析这段代码的复杂度", "给出三种证明方法", "如何实现一个 LRU 缓存",
+        "帮我规划一次欧洲旅行", "推荐几本机器学习的书",
+    ]
+]
+
+
+def test_ngram_classifier_train_and_load(tmp_path):
+    classifier = NgramClassifier.train(SAMPLES, buckets=4096, epochs=50)
+    assert all(classifier.classify(text) is label for text, label in SAMPLES)
+    assert classifier.probability("您好") > 0.8
+    assert NgramClassifier(classifier.weights, max_chars=3).classify("写一篇关于气候变化的论文") is None
+
+    path = tmp_path / "bypass.json"
+    classifier.save(str(path))
+    loaded = NgramClassifier.load(str(path), threshold=0.9)
+    assert loaded.threshold == 0.9
+    assert loaded.probability("您好") == pytest.approx(classifier.probability("您好"))
+
+    path.write_text(json.dumps({"weights": []}))
+    with pytest.raises(ValueError):
+        NgramClassifier.load(str(path))
+
+
+def test_train_cli(tmp_path, capsys):
+    samples = tmp_path / "samples.jsonl"
+    samples.write_text("\n".join(json.dumps({"text": t, "bypass": b}) for t, b in SAMPLES * 3))
+    model = tmp_path / "model.json"
+    main(["train", str(samples), "-o", str(model), "--buckets", "4096"])
+    main(["eval", str(model), str(samples)])
+    output = capsys.readouterr().out
+    assert "保存到" in output and "验证 60 条" in output
+    assert NgramClassifier.load(str(model)).buckets == 4096
+
+
+class Fixed:
+    name = "fixed"
+
+    def __init__(self, result):
+        self.result = result
+
+    def classify(self, text):
+        return self.result
+
+
+def test_decide_and_metrics():
+    """测试按顺序询问分类器、请求覆盖与节省时间的统计"""
+    registry = MetricsRegistry()
+    bypass = ReasoningBypass([HeuristicClassifier(), Fixed(True)], default_reasoning_seconds=10.0, registry=registry)
+    decisions = registry.counter("deepxy_reasoning_bypass_decisions_total", "", ("decision", "source"))
+    saved = registry.counter("deepxy_reasoning_bypass_saved_seconds_total", "")
+
+    assert bypass.decide([{"role": "user", "content": "你好"}]) is True
+    assert bypass.decide([{"role": "user", "content": "为什么"}]) is False
+    # 规则不下结论时由下一个分类器判断
+    assert bypass.decide([{"role": "user", "content": "北京今天天气怎么样"}]) is True
+    assert bypass.decide([{"role": "user", "content": "你好"}], "always") is False
+    assert bypass.decide([{"role": "user", "content": "为什么"}], "never") is True
+    assert bypass.decide([{"role": "assistant", "content": "你好"}]) is False
+
+    assert decisions.get(decision="bypass", source="heuristic") == 1
+    assert decisions.get(decision="reason", source="heuristic") == 1
+    assert decisions.get(decision="bypass", source="fixed") == 1
+    assert decisions.get(decision="reason", source="override") == 1
+    assert decisions.get(decision="bypass", source="override") == 1
+    assert decisions.get(decision="reason", source="default") == 1
+    assert saved.get() == 30.0
+
+    # 按完整推理阶段耗时的移动平均估计节省的时间
+    bypass.observe("deepseek_stage", "ok", 30.0)
+    bypass.observe("deepseek_stage", "cancelled", 100.0)
+    bypass.observe("qwen_stage", "ok", 100.0)
+    assert bypass.reasoning_seconds == pytest.approx(12.0)
+
+
+def test_build_bypass(tmp_path):
+    assert build_bypass(False) is None
+    assert [c.name for c in build_bypass(True).classifiers] == ["heuristic"]
+    path = tmp_path / "model.json"
+    NgramClassifier.train(SAMPLES, buckets=256, epochs=1).save(str(path))
+    bypass = build_bypass(True, str(path), 0.95)
+    assert [c.name for c in bypass.classifiers] == ["heuristic", "model"]
+    assert bypass.classifiers[1].threshold == 0.95
+
+
+def _fakes(deep_xy, seen):
+    async def fake_deepseek(messages, model, is_origin_reasoning=True):
+        yield "reasoning", "思考"
+        yield "content", ""
+
+    async def fake_qwen(messages, model_arg, model):
+        seen.append(messages)
+        yield "answer", "答"
+
+    async def fake_complete(messages, model_arg, model, timeout=None):
+        seen.append(messages)
+        return "答"
+
+    deep_xy.deepseek_client.stream_chat = fake_deepseek
+    deep_xy.qwen_client.stream_chat = fake_qwen
+    deep_xy.qwen_client.complete_chat = fake_complete
+
+
+@pytest.mark.asyncio
+async def test_deep_xy_bypass():
+    """测试简单问题直接交给回答模型，请求可以覆盖判断结果"""
+    deep_xy = _deep_xy()
+    deep_xy.reasoning_bypass = ReasoningBypass([HeuristicClassifier()], registry=MetricsRegistry())
+    seen = []
+    _fakes(deep_xy, seen)
+    args = (0.7, 0.95, 0.0, 0.0)
+    greeting = [{"role": "user", "content": "你好，请简单介绍一下你自己"}]
+
+    chunks = [c async for c in deep_xy.chat_completions_with_stream(greeting, args)]
+    assert not any("思考".encode() in c for c in chunks)
+    assert seen[-1] == greeting
+
+    chunks = [c async for c in deep_xy.chat_completions_with_stream(greeting, args, reasoning="always")]
+    assert any("思考".encode() in c for c in chunks)
+    assert seen[-1] != greeting
+
+    response = await deep_xy.chat_completions_without_stream(greeting, args)
+    assert response["choices"][0]["message"]["reasoning_content"] == ""
+    response = await deep_xy.chat_completions_without_stream(MESSAGES, args)
+    assert response["choices"][0]["message"]["reasoning_content"] == "思考"
+
+
+@pytest.mark.asyncio
+async def test_deep_xy_never_without_classifier():
+    """测试没有启用判断时 reasoning=never 仍然跳过推理阶段"""
+    deep_xy = _deep_xy()
+    seen = []
+    _fakes(deep_xy, seen)
+    args = (0.7, 0.95, 0.0, 0.0)
+
+    response = await deep_xy.chat_completions_without_stream(MESSAGES, args, reasoning="never")
+    assert response["choices"][0]["message"]["reasoning_content"] == ""
+    assert seen[-1] == MESSAGES
+    response = await deep_xy.chat_completions_without_stream(MESSAGES, args)
+    assert response["choices"][0]["message"]["reasoning_content"] == "思考"
@@ -0,0 +1,185 @@
+"""多候选回答（n > 1）单元测试"""
+
+import asyncio
+import json
+
+import pytest
+
+from app.utils import errors
+from tests.test_non_stream import MESSAGES, _deep_xy
+
+ARGS = (0.7, 0.95, 0.0, 0.0)
+
+
+def _fake_deepseek(calls):
+    async def stream_chat(messages, model, is_origin_reasoning=True):
+        calls.append(model)
+        for token in ["想", "好了"]:
+            yield "reasoning", token
+        yield "content", ""
+
+    return stream_chat
+
+
+def _events(chunks):
+    events = []
+    for chunk in chunks:
+        payload = chunk.decode().split("data: ", 1)[1].strip()
+        if payload != "[DONE]":
+            events.append(json.loads(payload)["choices"][0])
+    return events
+
+
+@pytest.mark.asyncio
+async def test_stream_fans_out_one_reasoning_pass():
+    """测试一次推理并发生成多个候选回答，按 index 交错输出"""
+    deep_xy = _deep_xy()
+    calls = []
+    seen = []
+
+    async def fake_qwen(messages, model_arg, model):
+        seen.append((model, model_arg))
+        assert "想好了" in messages[-1]["content"]
+        for token in ["甲", "乙"]:
+            await asyncio.sleep(0)
+            yield "answer", f"{model}-{token}"
+
+    deep_xy.deepseek_client.stream_chat = _fake_deepseek(calls)
+    deep_xy.qwen_client.stream_chat = fake_qwen
+
+    candidates = [("qwen-a", ARGS), ("qwen-b", (0.2, 0.5, 0.0, 0.0)), ("qwen-a", (1.0, 0.9, 0.0, 0.0))]
+    chunks = [
+        chunk async for chunk in deep_xy.chat_completions_with_stream(
+            MESSAGES, ARGS, candidates=candidates
+        )
+    ]
+
+    assert calls == ["deepseek-r1"]
+    assert sorted(seen) == sorted(candidates)
+    assert chunks[-1].endswith(b"data: [DONE]\n\n")
+    events = _events(chunks)
+    reasoning = [e["delta"]["reasoning_content"] for e in events if e["delta"]["reasoning_content"]]
+    assert reasoning == ["想", "好了"]
+    assert all(e["index"] == 0 for e in events if e["delta"]["reasoning_content"])
+    for index, (model, _) in enumerate(candidates):
+        answer = [e["delta"]["content"] for e in events if e["index"] == index and e["delta"]["content"]]
+        assert answer == [f"{model}-甲", f"{model}-乙"]
+        finished = [e for e in events if e["index"] == index and "finish_reason" in e]
+        assert [e["finish_reason"] for e in finished] == ["stop"]
+
+
+@pytest.mark.asyncio
+async def test_stream_single_candidate_unchanged():
+    """测试只有一个回答时不输出额外的结束事件"""
+    deep_xy = _deep_xy()
+
+    async def fake_qwen(messages, model_arg, model):
+        yield "answer", "回答"
+
+    deep_xy.deepseek_client.stream_chat = _fake_deepseek([])
+    deep_xy.qwen_client.stream_chat = fake_qwen
+
+    chunks = [chunk async for chunk in deep_xy.chat_completions_with_stream(MESSAGES, ARGS)]
+    events = _events(chunks)
+    assert all("finish_reason" not in e and e["index"] == 0 for e in events)
+    assert [e["delta"]["content"] for e in events if e["delta"]["content"]] == ["回答"]
+
+
+@pytest.mark.asyncio
+async def test_stream_without_answer_from_deepseek():
+    """测试 DeepSeek 没有输出回答就结束时候选回答不会一直等待"""
+    deep_xy = _deep_xy()
+
+    async def reasoning_only(messages, model, is_origin_reasoning=True):
+        yield "reasoning", "推理"
+
+    async def fake_qwen(messages, model_arg, model):
+        yield "answer", "回答"
+
+    deep_xy.deepseek_client.stream_chat = reasoning_only
+    deep_xy.qwen_client.stream_chat = fake_qwen
+
+    chunks = await asyncio.wait_for(
+        _collect(deep_xy.chat_completions_with_stream(MESSAGES, ARGS, candidates=[("a", ARGS), ("b", ARGS)])),
+        timeout=2,
+    )
+    assert chunks[-1].endswith(b"data: [DONE]\n\n")
+
+
+async def _collect(stream):
+    return [chunk async for chunk in stream]
+
+
+@pytest.mark.asyncio
+async def test_stream_close_cancels_candidates():
+    """测试客户端断开时取消仍在生成的候选回答"""
+    deep_xy = _deep_xy()
+    cancelled = []
+
+    async def endless_qwen(messages, model_arg, model):
+        try:
+            while True:
+                yield "answer", "x"
+                await asyncio.sleep(0.01)
+        finally:
+            cancelled.append(model)
+
+    deep_xy.deepseek_client.stream_chat = _fake_deepseek([])
+    deep_xy.qwen_client.stream_chat = endless_qwen
+
+    stream = deep_xy.chat_completions_with_stream(MESSAGES, ARGS, candidates=[("a", ARGS), ("b", ARGS)])
+    async for chunk in stream:
+        if b'"content":"x"' in chunk:
+            break
+    await stream.aclose()
+    await asyncio.sleep(0.05)
+    assert sorted(cancelled) == ["a", "b"]
+
+
+@pytest.mark.asyncio
+async def test_non_stream_candidates_share_reasoning():
+    """测试非流式请求返回多个 choices，推理只进行一次"""
+    deep_xy = _deep_xy()
+    calls = []
+
+    async def fake_complete(messages, model_arg, model, timeout=None):
+        return f"{model}:{model_arg[0]}"
+
+    deep_xy.deepseek_client.stream_chat = _fake_deepseek(calls)
+    deep_xy.qwen_client.complete_chat = fake_complete
+
+    response = await deep_xy.chat_completions_without_stream(
+        MESSAGES, ARGS, candidates=[("qwen-a", (0.1, 1, 0, 0)), ("qwen-b", (0.9, 1, 0, 0))]
+    )
+    assert calls == ["deepseek-r1"]
+    choices = response["choices"]
+    assert [c["index"] for c in choices] == [0, 1]
+    assert [c["message"]["content"] for c in choices] == ["qwen-a:0.1", "qwen-b:0.9"]
+    assert all(c["message"]["reasoning_content"] == "想好了" for c in choices)
+
+
+@pytest.mark.asyncio
+async def test_non_stream_candidate_failure():
+    """测试部分候选回答失败时标记失败的 choice，全部失败时返回 502"""
+    deep_xy = _deep_xy()
+
+    async def fake_complete(messages, model_arg, model, timeout=None):
+        if model == "qwen-b":
+            raise RuntimeError("上游返回 500")
+        return "回答"
+
+    deep_xy.deepseek_client.stream_chat = _fake_deepseek([])
+    deep_xy.qwen_client.complete_chat = fake_complete
+
+    response = await deep_xy.chat_completions_without_stream(
+        MESSAGES, ARGS, candidates=[("qwen-a", ARGS), ("qwen-b", ARGS)]
+    )
+    ok, failed = response["choices"]
+    assert ok["finish_reason"] == "stop" and ok["message"]["content"] == "回答"
+    assert failed["finish_reason"] == "error" and failed["message"]["content"] == ""
+    assert failed["error"]["code"] == "API_ERROR" and failed["error"]["status"] == 502
+
+    with pytest.raises(errors.APIError) as info:
+        await deep_xy.chat_completions_without_stream(MESSAGES, ARGS, qwen_model="qwen-b")
+    assert info.value.http_status == 502
+
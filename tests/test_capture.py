@@ -0,0 +1,184 @@
+"""流量录制与回放单元测试"""
+
+import asyncio
+import gzip
+
+import pytest
+
+from app.monitoring.capture import TrafficCapture, iter_records, list_segments, load_redactor, redact_pii
+from app.monitoring.metrics import MetricsRegistry
+from app.utils import json_codec
+from tests.performance.replay import ReplayResult, replay, schedule, summarize
+
+REQUEST = {"model": "deepxy", "stream": True, "messages": [{"role": "user", "content": "你好"}]}
+
+
+def _capture(tmp_path, **kwargs):
+    kwargs.setdefault("registry", MetricsRegistry())
+    kwargs.setdefault("rng", lambda: 0.0)
+    return TrafficCapture(str(tmp_path), sample_rate=1.0, **kwargs)
+
+
+def _entry(capture, content="你好", **headers):
+    entry = capture.begin("tenant", {"Authorization": "Bearer sk-secret", **headers})
+    entry.request = {**REQUEST, "messages": [{"role": "user", "content": content}]}
+    return entry
+
+
+def test_redact_pii():
+    record = {
+        "tenant": "a@b.com",
+        "request": {"messages": [{"role": "user", "content": "邮箱 test.user@example.com 手机 13812345678"}]},
+        "response": {"choices": ["身份证 11010519491231002X 卡号 6222020200112233445 密钥 sk-abcdefghijklmnop1234"]},
+    }
+    redacted = redact_pii(record)
+    assert redacted["request"]["messages"][0]["content"] == "邮箱 [EMAIL] 手机 [PHONE]"
+    assert redacted["response"]["choices"][0] == "身份证 [ID] 卡号 [CARD] 密钥 [SECRET]"
+    # 只处理请求与响应
+    assert redacted["tenant"] == "a@b.com"
+
+    assert load_redactor("app.monitoring.capture:redact_pii") is redact_pii
+    for path in ("redact_pii", "app.monitoring.capture:missing"):
+        with pytest.raises(ValueError):
+            load_redactor(path)
+
+
+def test_sampling(tmp_path):
+    values = iter([0.05, 0.2, 0.5])
+    capture = _capture(tmp_path, rng=lambda: next(values))
+    capture.sample_rate = 0.1
+    entry = capture.begin("tenant", {"X-Priority": "high", "Authorization": "Bearer sk-secret"})
+    assert entry.headers == {"X-Priority": "high"}
+    assert capture.begin("tenant", {}) is None
+
+    capture.sample_rate = 0.0
+    assert capture.begin("tenant", {}) is None
+
+    # 请求体校验失败的请求不录制
+    capture.sample_rate = 1.0
+    capture.finish(capture.begin("tenant", {}), status=400)
+    assert capture._pending == []
+
+
+@pytest.mark.asyncio
+async def test_stream_capture(tmp_path):
+    """测试流式响应原样转发，并记录首包时间与回答"""
+    capture = _capture(tmp_path)
+
+    def event(delta):
+        return json_codec.sse_event({"choices": [{"index": 0, "delta": delta}]})
+
+    async def events():
+        yield event({"reasoning_content": "想"})
+        yield event({"content": "答"})
+        yield event({"content": "案 13812345678"}) + b"data: [DONE]\n\n"
+
+    chunks = [chunk async for chunk in capture.wrap_stream(events(), _entry(capture))]
+    assert len(chunks) == 3
+
+    # 客户端中途断开
+    stream = capture.wrap_stream(events(), _entry(capture, "再见"))
+    await stream.__anext__()
+    await stream.aclose()
+
+    assert await capture.flush() == 2
+    first, second = iter_records([str(tmp_path)])
+    assert first["stream"] and first["completed"] and first["status"] == 200
+    assert first["ttft_ms"] is not None and first["latency_ms"] >= first["ttft_ms"]
+    assert first["response"] == {"reasoning_content": "想", "choices": ["答案 [PHONE]"]}
+    assert first["response_bytes"] == sum(map(len, chunks))
+    assert "raw" not in first
+    assert not second["completed"]
+
+
+@pytest.mark.asyncio
+async def test_rotation_and_redactors(tmp_path):
+    """测试分段达到上限后换新文件，只保留最新的分段，钩子可以丢弃记录"""
+    registry = MetricsRegistry()
+    dropped = registry.counter("deepxy_capture_dropped_total", "", ("reason",))
+    capture = _capture(
+        tmp_path,
+        max_segment_bytes=1,
+        max_segments=2,
+        registry=registry,
+        redactors=[redact_pii, lambda record: None if "丢弃" in str(record["request"]) else record],
+    )
+    capture.start()
+    for i in range(4):
+        capture.finish(_entry(capture, f"问题{i}"), response={"choices": []})
+        await capture.flush()
+    capture.finish(_entry(capture, "丢弃"))
+    capture.finish(_entry(capture, "最后"))
+    await capture.stop()
+
+    segments = list_segments(tmp_path)
+    assert len(segments) == 2
+    contents = [r["request"]["messages"][0]["content"] for r in iter_records(map(str, segments))]
+    assert contents == ["问题3", "最后"]
+    assert dropped.get(reason="redacted") == 1
+    # 每个分段都是完整的 gzip 文件
+    assert gzip.decompress(segments[0].read_bytes()).count(b"\n") == 1
+
+    capture.max_pending = 0
+    capture.finish(_entry(capture))
+    assert dropped.get(reason="overflow") == 1
+
+
+@pytest.mark.asyncio
+async def test_writer_survives_errors(tmp_path):
+    """测试写入出错时后台任务继续运行，出错的记录计入丢弃"""
+    registry = MetricsRegistry()
+    dropped = registry.counter("deepxy_capture_dropped_total", "", ("reason",))
+    capture = _capture(tmp_path, registry=registry, batch_size=1)
+    capture.start()
+    # 无法编码的记录
+    capture.finish(_entry(capture, "出错"), response={"choices": [object()]})
+    for _ in range(100):
+        if dropped.get(reason="error"):
+            break
+        await asyncio.sleep(0.01)
+    assert dropped.get(reason="error") == 1
+    assert not capture._task.done()
+
+    capture.finish(_entry(capture, "正常"))
+    await capture.stop()
+    assert [r["request"]["messages"][0]["content"] for r in iter_records([str(tmp_path)])] == ["正常"]
+
+
+def test_schedule():
+    records = [{"ts": 10.0, "id": 1}, {"ts": 14.0, "id": 2}, {"ts": 11.0, "id": 3}]
+    assert [(offset, r["id"]) for offset, r in schedule(records)] == [(0.0, 1), (1.0, 3), (4.0, 2)]
+    assert [offset for offset, _ in schedule(records, speed=2)] == [0.0, 0.5, 2.0]
+    assert [offset for offset, _ in schedule(records, speed=0)] == [0.0, 0.0, 0.0]
+    assert schedule([]) == []
+
+
+@pytest.mark.asyncio
+async def test_replay_and_summary():
+    """测试按缩放后的间隔发送，并汇总与录制时的延迟差"""
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    sent = []
+
+    async def send(record):
+        sent.append((record["id"], loop.time() - start))
+        await asyncio.sleep(0.01)
+        return ReplayResult(
+            status=record["replay_status"], ttft_ms=100.0, latency_ms=500.0,
+            captured_status=200, captured_ttft_ms=80.0, captured_latency_ms=400.0,
+        )
+
+    records = [
+        {"ts": 0.0, "id": 1, "replay_status": 200},
+        {"ts": 0.2, "id": 2, "replay_status": 200},
+        {"ts": 0.4, "id": 3, "replay_status": 503},
+    ]
+    results = await replay(records, send, speed=4, concurrency=1)
+    assert [record_id for record_id, _ in sent] == [1, 2, 3]
+    assert 0.1 <= sent[2][1] < 0.3
+
+    summary = summarize(results)
+    assert summary["requests"] == 3 and summary["compared"] == 2
+    assert summary["status"] == {200: 2, 503: 1}
+    assert summary["latency_ms"]["delta"] == {"p50": 100.0, "p95": 100.0}
+    assert summary["ttft_ms"]["delta"]["p50"] == 20.0
@@ -0,0 +1,211 @@
+"""客户端流式解析单元测试"""
+
+import asyncio
+import json
+
+import pytest
+from aiohttp.client_exceptions import ClientError
+
+from app.clients import (
+    BaseClient,
+    DashScopeClient,
+    DeepSeekClient,
+    ProviderConfig,
+    ProviderRegistry,
+    QwenClient,
+)
+from app.config import Settings
+from app.monitoring import timing
+from tests.performance.mock_upstream import MockConfig, MockUpstream
+from tests.performance.recorded_streams import qwen_stream_events, r1_stream_events, rechunk, token_at
+
+
+def _replay(client, chunks):
+    """用录制的分块替换真实的网络请求"""
+    async def fake_make_request(headers, data, api_url=None, timeout=None):
+        for chunk in chunks:
+            yield chunk
+
+    client._make_request = fake_make_request
+    return client
+
+
+async def _collect(agen):
+    return [item async for item in agen]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("chunk_size", [None, 7, 64])
+async def test_deepseek_origin_reasoning(chunk_size):
+    """测试原生推理格式，分块边界落在行中间时也能正确解析"""
+    chunks = rechunk(r1_stream_events(20, answer_tokens=3), chunk_size)
+    client = _replay(DeepSeekClient("key", "http://upstream"), chunks)
+
+    items = await _collect(client.stream_chat([{"role": "user", "content": "hi"}]))
+    reasoning = [c for t, c in items if t == "reasoning"]
+    content = [c for t, c in items if t == "content"]
+    assert len(reasoning) == 20
+    assert len(content) == 3
+
+
+@pytest.mark.asyncio
+async def test_qwen_openrouter_answer():
+    """测试 OpenAI 兼容格式的回答解析"""
+    chunks = rechunk(qwen_stream_events(10), 50)
+    client = _replay(QwenClient("key", "http://upstream"), chunks)
+
+    items = await _collect(client.stream_chat([{"role": "user", "content": "hi"}], model="google/gemini"))
+    assert [t for t, _ in items] == ["answer"] * 10
+
+
+@pytest.mark.asyncio
+async def test_qwen_dashscope_answer():
+    """测试 DashScope 原生格式的回答解析，流结束时输出上游报告的用量"""
+    chunks = rechunk(qwen_stream_events(10, native=True))
+    client = QwenClient("key", "http://upstream")
+    _replay(client.native, chunks)
+
+    items = await _collect(client.stream_chat([{"role": "user", "content": "hi"}]))
+    assert [t for t, _ in items] == ["answer"] * 10 + ["usage"]
+    usage = items[-1][1]
+    assert (usage.input_tokens, usage.output_tokens, usage.request_id) == (16, 10, "recorded-qwen")
+
+
+@pytest.mark.asyncio
+async def test_dashscope_native_protocol(unused_tcp_port):
+    """测试按模型选择原生协议：增量输出、非流式调用与错误事件"""
+    upstream = MockUpstream(MockConfig(answer_tokens=6, seed=0))
+    url = await upstream.start(port=unused_tcp_port)
+    try:
+        registry = ProviderRegistry.from_settings(Settings(
+            dashscope_api_key="key",
+            dashscope_api_url=f"{url}/compatible-mode/v1/chat/completions",
+            dashscope_native_api_url=f"{url}/api/v1/services/aigc/text-generation/generation",
+            dashscope_native_models=("qwen-native*",),
+        ))
+        assert registry.resolve("qwen-max").provider.request_format == "openai"
+        assert registry.resolve("qwen-native-plus").provider.request_format == "dashscope"
+        client = QwenClient("key", registry=registry)
+        messages = [{"role": "user", "content": "hi"}]
+        expected = "".join(token_at(i) for i in range(6))
+
+        # 上游只在请求开启 incremental_output 时发送增量，否则拼接结果会重复
+        items = await _collect(client.stream_chat(messages, model="qwen-native-plus"))
+        assert "".join(c for t, c in items if t == "answer") == expected
+        assert items[-1][1].output_tokens == 6
+        assert await client.complete_chat(messages, model="qwen-native-plus") == expected
+        # 兼容模式的模型不受影响
+        assert len([c for t, c in await _collect(client.stream_chat(messages, model="qwen-max"))]) == 6
+    finally:
+        await BaseClient.close_sessions()
+        await upstream.stop()
+
+
+@pytest.mark.asyncio
+async def test_deepseek_native_api_url(unused_tcp_port):
+    """测试 DASHSCOPE_API_URL 为原生接口时，推理模型经原生协议请求并映射 reasoning_content"""
+    upstream = MockUpstream(MockConfig(reasoning_tokens=12, r1_answer_tokens=3, seed=0))
+    url = await upstream.start(port=unused_tcp_port)
+    try:
+        registry = ProviderRegistry.from_settings(Settings(
+            dashscope_api_key="key",
+            dashscope_api_url=f"{url}/api/v1/services/aigc/text-generation/generation",
+        ))
+        assert registry.resolve("deepseek-r1").provider.request_format == "dashscope"
+        client = DeepSeekClient("key", registry=registry)
+
+        # 上游只在请求开启 incremental_output 时发送增量，否则拼接结果会重复
+        items = await _collect(client.stream_chat([{"role": "user", "content": "hi"}], model="deepseek-r1"))
+        assert "".join(c for t, c in items if t == "reasoning") == "".join(token_at(i) for i in range(12))
+        assert [c for t, c in items if t == "content"] == [token_at(i) for i in range(12, 15)]
+        assert upstream.stats.streams[-1].kind == "r1"
+    finally:
+        await BaseClient.close_sessions()
+        await upstream.stop()
+
+
+@pytest.mark.asyncio
+async def test_upstream_request_outcome(unused_tcp_port):
+    """测试以 [DONE] 结束的流记录为 ok，而不是被关闭的 closed（降级控制器会丢弃 closed 样本）"""
+    upstream = MockUpstream(MockConfig(answer_tokens=4, seed=0))
+    url = await upstream.start(port=unused_tcp_port)
+    outcomes = []
+
+    def listener(stage, outcome, seconds):
+        if stage == "upstream_request":
+            outcomes.append(outcome)
+
+    timing.add_listener(listener)
+    try:
+        client = QwenClient("key", f"{url}/compatible-mode/v1/chat/completions")
+        messages = [{"role": "user", "content": "hi"}]
+        assert len(await _collect(client.stream_chat(messages, model="qwen-max"))) == 4
+        assert outcomes == ["ok"]
+    finally:
+        timing.remove_listener(listener)
+        await BaseClient.close_sessions()
+        await upstream.stop()
+
+
+@pytest.mark.asyncio
+async def test_dashscope_error_event():
+    """测试原生协议的错误事件抛出异常，并带上 request_id"""
+    error = b'data:{"code":"DataInspectionFailed","message":"bad","request_id":"req-1"}\n\n'
+    client = _replay(DashScopeClient("key", "http://upstream"), qwen_stream_events(2, native=True)[:1] + [error])
+
+    with pytest.raises(ClientError, match="req-1"):
+        await _collect(client.stream_chat([{"role": "user", "content": "hi"}]))
+
+
+def test_dashscope_large_body_encoding(monkeypatch):
+    """测试原生请求体按 input.messages 分段编码，结果与一次编码相同"""
+    client = DashScopeClient("key", "http://upstream")
+    body = client._build_request_body([{"role": "user", "content": "长" * 300}], "qwen-plus", (0.7, 0.95, 0.0, 0.0))
+    assert body["parameters"]["incremental_output"] is True
+    monkeypatch.setattr(BaseClient, "LARGE_PAYLOAD_CHARS", 100)
+
+    async def join():
+        return b"".join([segment async for segment in client._encode_body(body)])
+
+    assert json.loads(asyncio.run(join())) == body
+
+
+@pytest.mark.asyncio
+async def test_deepseek_think_tags():
+    """测试 <think> 标签格式，推理结束时输出空的 content"""
+    chunks = rechunk(r1_stream_events(20, answer_tokens=3, origin_reasoning=False), 5)
+    client = _replay(DeepSeekClient("key", "http://upstream"), chunks)
+
+    items = await _collect(client.stream_chat([{"role": "user", "content": "hi"}], is_origin_reasoning=False))
+    first_content = next(i for i, (t, _) in enumerate(items) if t == "content")
+    assert items[first_content] == ("content", "")
+    assert all(t == "reasoning" for t, _ in items[:first_content])
+    assert "<think>" not in "".join(c for _, c in items)
+
+
+
+@pytest.mark.asyncio
+async def test_large_payload_streams_request_body(unused_tcp_port, monkeypatch):
+    """测试超大请求体按消息分段流式上传，上游收到的内容不变"""
+    upstream = MockUpstream(MockConfig(answer_tokens=5, seed=0))
+    url = await upstream.start(port=unused_tcp_port)
+    try:
+        registry = ProviderRegistry(ProviderConfig(
+            "default", f"{url}/v1/chat/completions", "key", request_format="openai"
+        ))
+        client = QwenClient("key", f"{url}/v1/chat/completions", registry=registry)
+        messages = [{"role": "user", "content": "长上下文" * 100}]
+        monkeypatch.setattr(BaseClient, "LARGE_PAYLOAD_CHARS", 100)
+        body = client._encode_body({"messages": messages})
+        assert not isinstance(body, bytes)
+        assert json.loads(b"".join([segment async for segment in body])) == {"messages": messages}
+
+        # 分块传输编码的请求体可以被上游正常解析
+        parts = [content async for _, content in client.stream_chat(messages, model="qwen-max")]
+        assert len(parts) == 5
+
+        monkeypatch.setattr(BaseClient, "LARGE_PAYLOAD_CHARS", 0)
+        assert isinstance(client._encode_body({"messages": messages}), bytes)
+    finally:
+        await BaseClient.close_sessions()
+        await upstream.stop()
@@ -0,0 +1,39 @@
+"""配置加载单元测试"""
+
+import dataclasses
+
+import pytest
+
+from app.config import Settings
+
+
+def test_defaults():
+    settings = Settings.from_env({})
+    assert settings.dashscope_api_key is None
+    assert settings.allow_origins == ("*",)
+    assert settings.is_origin_reasoning is True
+    assert settings.non_stream_timeout == 300.0
+
+
+def test_from_env():
+    settings = Settings.from_env({
+        "DASHSCOPE_API_KEY": "key",
+        "ALLOW_ORIGINS": "http://a,http://b",
+        "IS_ORIGIN_REASONING": "False",
+        "PROMPT_CACHE_HINTS": "true",
+        "NON_STREAM_TIMEOUT": "30",
+        "LOCAL_OPENAI_MODELS": "a, b*,",
+        "JSON_BACKEND": " ORJSON ",
+    })
+    assert settings.dashscope_api_key == "key"
+    assert settings.allow_origins == ("http://a", "http://b")
+    assert settings.is_origin_reasoning is False
+    assert settings.prompt_cache_hints is True
+    assert settings.non_stream_timeout == 30.0
+    assert settings.local_openai_models == ("a", "b*")
+    assert settings.json_backend == "orjson"
+
+
+def test_settings_are_frozen():
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        Settings().qwen_model = "other"
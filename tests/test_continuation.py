@@ -0,0 +1,150 @@
+"""回答阶段续写恢复单元测试"""
+
+import pytest
+from aiohttp.client_exceptions import ClientPayloadError
+
+from app.clients import UpstreamStatusError
+from app.clients.registry import ProviderConfig
+from app.deepxy.continuation import PrefixDeduper, continuation_messages
+from tests.test_candidates import _events
+from tests.test_non_stream import MESSAGES, _deep_xy
+
+ARGS = (0.7, 0.95, 0.0, 0.0)
+PARTIAL = "北京是中华人民共和国的首都，"
+
+
+def _run(deduper, chunks):
+    return "".join(deduper.feed(chunk) for chunk in chunks) + deduper.flush()
+
+
+def test_deduper_continues():
+    assert _run(PrefixDeduper(PARTIAL), ["也是全国的", "政治中心。"]) == "也是全国的政治中心。"
+    # 缓存满 window 后不再等待
+    deduper = PrefixDeduper(PARTIAL, window=4)
+    assert deduper.feed("也是全国") == "也是全国"
+    assert deduper.feed("的") == "的"
+
+
+def test_deduper_restart():
+    """测试模型从头重写时丢弃已输出的部分"""
+    deduper = PrefixDeduper(PARTIAL)
+    assert deduper.feed("北京是") == ""
+    assert deduper.feed("中华人民共和国的首都，也是") == "也是"
+    assert deduper.feed("全国") == "全国"
+    assert deduper.dropped == len(PARTIAL)
+
+    # 重写到一半换了说法时，只丢弃相同的部分
+    assert _run(PrefixDeduper(PARTIAL), ["北京是中国", "的首都。"]) == "国的首都。"
+    # 续写在重写完成前就结束
+    assert _run(PrefixDeduper(PARTIAL), ["北京是中华"]) == ""
+
+
+def test_deduper_tail_overlap():
+    """测试模型重复已输出内容的结尾"""
+    assert _run(PrefixDeduper(PARTIAL), ["共和国的首都，", "也是全国的政治中心。"]) == "也是全国的政治中心。"
+    # 重叠太短时不认为重复
+    assert _run(PrefixDeduper(PARTIAL), ["都，也是"]) == "都，也是"
+
+
+def test_continuation_messages():
+    messages = [{"role": "user", "content": "你好"}]
+    assert continuation_messages(messages, "答", "partial") == [
+        {"role": "user", "content": "你好"},
+        {"role": "assistant", "content": "答", "partial": True},
+    ]
+    assert continuation_messages(messages, "答")[-1] == {"role": "assistant", "content": "答"}
+    assert len(messages) == 1
+
+
+def _failing_qwen(calls, outputs):
+    """依次按 outputs 输出，项为异常时在此处中断"""
+
+    async def fake_qwen(messages, model_arg, model):
+        calls.append((model, messages))
+        for item in outputs[len(calls) - 1]:
+            if isinstance(item, Exception):
+                raise item
+            yield "answer", item
+
+    return fake_qwen
+
+
+async def _answer(deep_xy, **kwargs):
+    chunks = [c async for c in deep_xy.chat_completions_with_stream(MESSAGES, ARGS, max_reasoning_tokens=0, **kwargs)]
+    assert chunks[-1].endswith(b"data: [DONE]\n\n")
+    events = _events(chunks)
+    return "".join(e["delta"].get("content") or "" for e in events), events
+
+
+@pytest.mark.asyncio
+async def test_stream_continues_after_failure():
+    """测试回答流中断后以已输出的回答续写，不重复输出"""
+    deep_xy = _deep_xy()
+    deep_xy.registry.register_provider(ProviderConfig("default", "http://upstream", "key", assistant_prefix="partial"))
+    calls = []
+    deep_xy.qwen_client.stream_chat = _failing_qwen(calls, [
+        ["北京是", "中华人民共和国的首都，", ClientPayloadError("连接中断")],
+        ["北京是中华人民共和国的首都，也是", "全国的政治中心。"],
+    ])
+    finished = []
+    resumed = deep_xy._continuations.attempts.get(outcome="resumed")
+    duplicates = deep_xy._continuations.duplicate_chars.get()
+
+    answer, _ = await _answer(deep_xy, on_finish=lambda reasoning, answer: finished.append(answer))
+    assert answer == "北京是中华人民共和国的首都，也是全国的政治中心。"
+    assert finished == [answer]
+    assert calls[1][1][-1] == {"role": "assistant", "content": PARTIAL, "partial": True}
+    assert calls[1][1][:-1] == MESSAGES
+    assert deep_xy._continuations.attempts.get(outcome="resumed") == resumed + 1
+    assert deep_xy._continuations.duplicate_chars.get() == duplicates + len(PARTIAL)
+
+
+@pytest.mark.asyncio
+async def test_stream_continuation_fallback_models():
+    """测试续写依次使用备用模型，次数用完后输出已有的回答"""
+    deep_xy = _deep_xy()
+    deep_xy.answer_fallback_models = ("backup-a", "backup-b")
+    calls = []
+    error = ClientPayloadError("连接中断")
+    deep_xy.qwen_client.stream_chat = _failing_qwen(calls, [["一", error], [error], ["二", error]])
+
+    answer, events = await _answer(deep_xy)
+    assert answer == "一二"
+    assert [model for model, _ in calls] == ["qwen2.5-14b-instruct-1m", "backup-a", "backup-b"]
+    # 没有 assistant_prefix 的上游只追加 assistant 消息
+    assert calls[2][1][-1] == {"role": "assistant", "content": "一"}
+
+    deep_xy.continuation_attempts = 0
+    calls.clear()
+    deep_xy.qwen_client.stream_chat = _failing_qwen(calls, [["一", error]])
+    answer, _ = await _answer(deep_xy)
+    assert answer == "一" and len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_stream_retries_before_first_token():
+    """测试还没有输出回答时按原消息重新请求"""
+    deep_xy = _deep_xy()
+    calls = []
+    deep_xy.qwen_client.stream_chat = _failing_qwen(calls, [[ClientPayloadError("连接中断")], ["回答"]])
+
+    answer, _ = await _answer(deep_xy)
+    assert answer == "回答"
+    assert calls[1][1] == MESSAGES
+
+
+@pytest.mark.asyncio
+async def test_stream_does_not_retry_client_errors():
+    """测试上游返回 4xx 时不续写，5xx 与 429 仍然续写"""
+    deep_xy = _deep_xy()
+    calls = []
+    deep_xy.qwen_client.stream_chat = _failing_qwen(calls, [[UpstreamStatusError(400, "状态码 400")], ["回答"]])
+
+    answer, _ = await _answer(deep_xy)
+    assert answer == "" and len(calls) == 1
+
+    for status in (503, 429):
+        calls.clear()
+        deep_xy.qwen_client.stream_chat = _failing_qwen(calls, [["一", UpstreamStatusError(status, "错误")], ["二"]])
+        answer, _ = await _answer(deep_xy)
+        assert answer == "一二" and len(calls) == 2
@@ -0,0 +1,115 @@
+"""服务端对话保存单元测试"""
+
+import time
+
+import pytest
+
+from app.deepxy.conversations import ConversationStore
+from app.monitoring.metrics import MetricsRegistry
+from app.utils.errors import InvalidRequestError
+from tests.test_non_stream import _deep_xy
+
+
+def _store(**kwargs) -> ConversationStore:
+    return ConversationStore(registry=MetricsRegistry(), **kwargs)
+
+
+def _user(content):
+    return {"role": "user", "content": content}
+
+
+def test_history_follows_parent_chain():
+    store = _store()
+    system = {"role": "system", "content": "sys"}
+    store.save("chatcmpl-a", "acme", None, [system, _user("一")], "答一", "想一")
+    store.save("chatcmpl-b", "acme", "chatcmpl-a", [_user("二")], "答二", "想二")
+
+    history = store.history("chatcmpl-b", "acme")
+    assert history == [
+        system,
+        _user("一"),
+        {"role": "assistant", "content": "答一"},
+        _user("二"),
+        {"role": "assistant", "content": "答二"},
+    ]
+    # 保存的消息在各轮之间共享，不会复制
+    assert history[0] is system
+    # 从中间分叉
+    store.save("chatcmpl-c", "acme", "chatcmpl-a", [_user("另一个问题")], "答三")
+    assert store.history("chatcmpl-c", "acme")[-2] == _user("另一个问题")
+    assert len(store.history("chatcmpl-c", "acme")) == 5
+
+
+def test_history_missing_or_other_tenant():
+    store = _store()
+    store.save("chatcmpl-a", "acme", None, [_user("一")], "答")
+    for response_id, tenant_id in (("chatcmpl-x", "acme"), ("chatcmpl-a", "other")):
+        with pytest.raises(InvalidRequestError) as exc_info:
+            store.history(response_id, tenant_id)
+        assert exc_info.value.details["param"] == "previous_response_id"
+
+
+def test_ttl_refreshed_by_use():
+    store = _store(ttl=0.1)
+    store.save("chatcmpl-a", "acme", None, [_user("一")], "答")
+    store.save("chatcmpl-b", "acme", "chatcmpl-a", [_user("二")], "答")
+    time.sleep(0.06)
+    # 读取 b 时刷新了 a 的过期时间
+    store.history("chatcmpl-b", "acme")
+    time.sleep(0.06)
+    assert len(store.history("chatcmpl-b", "acme")) == 4
+    time.sleep(0.12)
+    with pytest.raises(InvalidRequestError):
+        store.history("chatcmpl-b", "acme")
+    assert len(store) == 0
+
+
+def test_max_turns_evicts_leaves_first():
+    store = _store(max_turns=3)
+    store.save("chatcmpl-a", "acme", None, [_user("一")], "答")
+    store.save("chatcmpl-b", "acme", "chatcmpl-a", [_user("二")], "答")
+    store.save("chatcmpl-c", "acme", "chatcmpl-b", [_user("三")], "答")
+    store.save("chatcmpl-x", "acme", None, [_user("新对话")], "答")
+    assert len(store) == 3
+    # 最新的叶子被淘汰，祖先保留，b 仍然可以继续
+    assert len(store.history("chatcmpl-b", "acme")) == 4
+    with pytest.raises(InvalidRequestError):
+        store.history("chatcmpl-c", "acme")
+
+
+def test_max_depth():
+    store = _store(max_depth=2)
+    store.save("chatcmpl-a", "acme", None, [_user("一")], "答")
+    store.save("chatcmpl-b", "acme", "chatcmpl-a", [_user("二")], "答")
+    store.save("chatcmpl-c", "acme", "chatcmpl-b", [_user("三")], "答")
+    with pytest.raises(InvalidRequestError):
+        store.history("chatcmpl-c", "acme")
+
+
+@pytest.mark.asyncio
+async def test_stream_reports_answer_on_finish():
+    """测试流正常结束时返回推理内容与第一个候选回答"""
+    deep_xy = _deep_xy()
+    finished = []
+
+    async def fake_deepseek(messages, model, is_origin_reasoning=True):
+        yield "reasoning", "想"
+        yield "reasoning", "好了"
+        yield "content", ""
+
+    async def fake_qwen(messages, model_arg, model):
+        for token in (model, "的回答"):
+            yield "answer", token
+
+    deep_xy.deepseek_client.stream_chat = fake_deepseek
+    deep_xy.qwen_client.stream_chat = fake_qwen
+
+    args = (0.7, 0.95, 0.0, 0.0)
+    async for _ in deep_xy.chat_completions_with_stream(
+        [_user("问题")],
+        args,
+        candidates=[("first", args), ("second", args)],
+        on_finish=lambda reasoning, answer: finished.append((reasoning, answer)),
+    ):
+        pass
+    assert finished == [("想好了", "first的回答")]
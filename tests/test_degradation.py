@@ -0,0 +1,215 @@
+"""按 SLO 自动降级单元测试"""
+
+import pytest
+
+from app.monitoring import timing
+from app.monitoring.admission import PRIORITIES
+from app.monitoring.degradation import DegradationController, parse_levels, parse_slo
+from app.monitoring.metrics import MetricsRegistry
+from tests.test_non_stream import MESSAGES, _deep_xy
+
+LEVELS = "reasoning=2000; reasoning=1000,model=qwen-turbo; reasoning=1000,model=qwen-turbo,skip=low"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _controller(clock, queue=None, **kwargs):
+    registry = MetricsRegistry()
+    controller = DegradationController(
+        {"qwen_stage": 10.0},
+        parse_levels(LEVELS),
+        queue_depth=(lambda: queue[0]) if queue is not None else None,
+        max_queue_depth=10,
+        window=60,
+        min_samples=5,
+        interval=5,
+        recover_after=30,
+        clock=clock,
+        registry=registry,
+        **kwargs,
+    )
+    return controller, registry
+
+
+def _observe(controller, seconds, count=10):
+    for _ in range(count):
+        controller.observe("qwen_stage", "ok", seconds)
+
+
+def test_parse_levels():
+    levels = parse_levels(LEVELS)
+    assert [level.name for level in levels] == ["normal", "level1", "level2", "level3"]
+    assert levels[1].max_reasoning_tokens == 2000 and levels[1].answer_model is None
+    assert levels[3].reasoning_tokens_for(PRIORITIES["low"]) == 0
+    assert levels[3].reasoning_tokens_for(PRIORITIES["normal"]) == 1000
+    assert parse_levels("") == levels[:1]
+    for value in ("reasoning", "tokens=1", "reasoning=x", "skip=urgent"):
+        with pytest.raises(ValueError):
+            parse_levels(value)
+
+    assert parse_slo("deepseek_stage=30, qwen_stage=1.5") == {"deepseek_stage": 30.0, "qwen_stage": 1.5}
+    assert parse_slo("") == {}
+    for value in ("qwen_stage", "qwen_stage=0", "=3"):
+        with pytest.raises(ValueError):
+            parse_slo(value)
+
+
+def test_steps_down_and_recovers():
+    """测试延迟超标时逐级降级，恢复并保持一段时间后逐级升回"""
+    clock = FakeClock()
+    controller, registry = _controller(clock)
+    _observe(controller, 20.0)
+    # 评估间隔内不调整
+    assert controller.evaluate().name == "normal"
+
+    clock.now += 5
+    assert controller.evaluate().name == "level1"
+    # 调整后窗口被清空，新等级下样本不足时不继续降级
+    clock.now += 5
+    assert controller.evaluate().name == "level1"
+    _observe(controller, 20.0)
+    clock.now += 5
+    assert controller.evaluate().name == "level2"
+    assert registry.gauge("deepxy_degradation_level", "").samples() == [((), 2.0)]
+    transitions = registry.counter("deepxy_degradation_transitions_total", "", ("direction", "reason"))
+    assert transitions.get(direction="down", reason="latency") == 2
+
+    # 延迟恢复后需要保持 recover_after 才升高一级
+    _observe(controller, 5.0)
+    clock.now += 5
+    assert controller.evaluate().name == "level2"
+    clock.now += 30
+    assert controller.evaluate().name == "level1"
+    # 没有流量时同样逐级恢复
+    clock.now += 5
+    controller.evaluate()
+    clock.now += 30
+    assert controller.evaluate().name == "normal"
+    assert transitions.get(direction="up", reason="recovered") == 2
+
+
+def test_between_thresholds_holds_level():
+    """测试延迟低于 SLO 但高于恢复阈值时保持当前等级"""
+    clock = FakeClock()
+    controller, _ = _controller(clock)
+    _observe(controller, 20.0)
+    clock.now += 5
+    assert controller.evaluate().name == "level1"
+    for _ in range(10):
+        _observe(controller, 9.0)
+        clock.now += 10
+        assert controller.evaluate().name == "level1"
+
+
+def test_queue_depth_and_old_samples():
+    """测试排队过多时降级，窗口外的样本不计入"""
+    clock = FakeClock()
+    queue = [50]
+    controller, registry = _controller(clock, queue)
+    clock.now += 5
+    assert controller.evaluate().name == "level1"
+    transitions = registry.counter("deepxy_degradation_transitions_total", "", ("direction", "reason"))
+    assert transitions.get(direction="down", reason="queue") == 1
+
+    queue[0] = 0
+    _observe(controller, 20.0)
+    clock.now += 61
+    assert controller.evaluate().name == "level1"
+    assert controller.snapshot()["latency"] == {}
+
+
+def test_plan_and_metrics():
+    """测试按等级与优先级确定请求的降级方式"""
+    clock = FakeClock()
+    controller, registry = _controller(clock)
+    assert controller.plan(PRIORITIES["low"]) == (None, None)
+    controller.index = 3
+    assert controller.plan(PRIORITIES["low"]) == (0, "qwen-turbo")
+    assert controller.plan(PRIORITIES["high"]) == (1000, "qwen-turbo")
+    degraded = registry.counter("deepxy_degraded_requests_total", "", ("action",))
+    assert degraded.get(action="skip_reasoning") == 1
+    assert degraded.get(action="reasoning_budget") == 1
+    assert degraded.get(action="answer_model") == 2
+
+
+@pytest.mark.asyncio
+async def test_listens_to_timed_stages():
+    """测试通过 timed 订阅阶段耗时，客户端断开的调用不计入"""
+    clock = FakeClock()
+    controller, _ = _controller(clock)
+    controller.install()
+    try:
+        @timing.timed("qwen_stage", registry=MetricsRegistry())
+        async def stage():
+            return 1
+
+        for _ in range(3):
+            await stage()
+        controller.observe("qwen_stage", "cancelled", 99.0)
+        controller.observe("other_stage", "ok", 99.0)
+    finally:
+        controller.uninstall()
+    await stage()
+    assert len(controller._samples["qwen_stage"]) == 3
+
+
+def _fakes(deep_xy, seen):
+    async def fake_deepseek(messages, model, is_origin_reasoning=True):
+        for _ in range(10):
+            yield "reasoning", "思考" * 10
+        yield "content", ""
+
+    async def fake_qwen(messages, model_arg, model):
+        seen.append(messages)
+        yield "answer", "答"
+
+    deep_xy.deepseek_client.stream_chat = fake_deepseek
+    deep_xy.qwen_client.stream_chat = fake_qwen
+
+    async def fake_complete(messages, model_arg, model, timeout=None):
+        seen.append(messages)
+        return "答"
+
+    deep_xy.qwen_client.complete_chat = fake_complete
+
+
+@pytest.mark.asyncio
+async def test_stream_reasoning_budget_and_skip():
+    """测试流式请求按推理 token 上限提前结束推理，上限为 0 时跳过推理阶段"""
+    deep_xy = _deep_xy()
+    seen = []
+    _fakes(deep_xy, seen)
+    args = (0.7, 0.95, 0.0, 0.0)
+
+    chunks = [c async for c in deep_xy.chat_completions_with_stream(MESSAGES, args, max_reasoning_tokens=25)]
+    # 每段推理 20 token，达到 25 token 时已输出两段
+    assert sum("思考".encode() in c for c in chunks) == 2
+    assert "思考" * 20 in seen[-1][-1]["content"]
+    assert "思考" * 21 not in seen[-1][-1]["content"]
+
+    chunks = [c async for c in deep_xy.chat_completions_with_stream(MESSAGES, args, max_reasoning_tokens=0)]
+    assert not any("思考".encode() in c for c in chunks)
+    assert seen[-1] == MESSAGES
+    assert chunks[-1].endswith(b"data: [DONE]\n\n")
+
+
+@pytest.mark.asyncio
+async def test_non_stream_reasoning_budget_and_skip():
+    """测试非流式请求的推理 token 上限与跳过推理阶段"""
+    deep_xy = _deep_xy()
+    seen = []
+    _fakes(deep_xy, seen)
+    args = (0.7, 0.95, 0.0, 0.0)
+
+    response = await deep_xy.chat_completions_without_stream(MESSAGES, args, max_reasoning_tokens=25)
+    assert response["choices"][0]["message"]["reasoning_content"] == "思考" * 20
+
+    response = await deep_xy.chat_completions_without_stream(MESSAGES, args, max_reasoning_tokens=0)
+    assert response["choices"][0]["message"] == {"role": "assistant", "content": "答", "reasoning_content": ""}
+    assert seen[-1] == MESSAGES
@@ -0,0 +1,162 @@
+"""事件循环诊断、剖析与阶段耗时单元测试"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from app.monitoring import profiler
+from app.monitoring.loop_monitor import LoopLagMonitor
+from app.monitoring.metrics import MetricsRegistry
+from app.monitoring.timing import timed
+from app.utils.auth import admin_key_verifier
+from app.utils.errors import APIKeyError
+
+
+def test_histogram_render():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("latency_seconds", "延迟", ("stage",), buckets=(0.1, 1.0))
+    histogram.observe(0.05, stage="a")
+    histogram.observe(0.5, stage="a")
+    histogram.observe(5, stage="a")
+
+    text = registry.render()
+    assert "# TYPE latency_seconds histogram" in text
+    assert 'latency_seconds_bucket{stage="a",le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{stage="a",le="1"} 2' in text
+    assert 'latency_seconds_bucket{stage="a",le="+Inf"} 3' in text
+    assert 'latency_seconds_count{stage="a"} 3' in text
+    assert histogram.sum(stage="a") == pytest.approx(5.55)
+
+
+@pytest.mark.asyncio
+async def test_timed_coroutine_and_generator():
+    registry = MetricsRegistry()
+
+    @timed("work", registry)
+    async def work(fail=False):
+        await asyncio.sleep(0.01)
+        if fail:
+            raise ValueError("boom")
+        return 1
+
+    @timed("stream", registry)
+    async def stream():
+        for i in range(3):
+            await asyncio.sleep(0.01)
+            yield i
+
+    assert await work() == 1
+    with pytest.raises(ValueError):
+        await work(fail=True)
+    assert [item async for item in stream()] == [0, 1, 2]
+    # 提前关闭的生成器记为 closed
+    generator = stream()
+    await generator.__anext__()
+    await generator.aclose()
+
+    duration = registry.histogram("deepxy_stage_duration_seconds", "", ("stage", "outcome"))
+    first_item = registry.histogram("deepxy_stage_first_item_seconds", "", ("stage",))
+    assert duration.count(stage="work", outcome="ok") == 1
+    assert duration.count(stage="work", outcome="error") == 1
+    assert duration.count(stage="stream", outcome="ok") == 1
+    assert duration.count(stage="stream", outcome="closed") == 1
+    assert first_item.count(stage="stream") == 2
+    assert duration.sum(stage="work", outcome="ok") >= 0.01
+
+    with pytest.raises(TypeError):
+        timed("sync", registry)(lambda: None)
+
+
+def _block_loop(seconds):
+    time.sleep(seconds)
+
+
+@pytest.mark.asyncio
+async def test_slow_callback_captures_stack():
+    monitor = LoopLagMonitor(interval=0.02, slow_callback_threshold=0.05, registry=MetricsRegistry())
+    monitor.start()
+    try:
+        await asyncio.sleep(0.05)
+        _block_loop(0.2)
+        await asyncio.sleep(0.1)
+    finally:
+        await monitor.stop()
+
+    assert monitor.lag_max >= 0.15
+    snapshot = monitor.snapshot()
+    assert len(snapshot["slow_callbacks"]) == 1
+    record = snapshot["slow_callbacks"][0]
+    assert record["duration"] >= 0.15
+    assert any("_block_loop" in line for line in record["stack"])
+
+
+def test_sampling_profiler_collapsed():
+    stop = threading.Event()
+
+    def busy_worker():
+        while not stop.is_set():
+            sum(range(1000))
+
+    thread = threading.Thread(target=busy_worker)
+    thread.start()
+    sampler = profiler.SamplingProfiler(interval=0.001, thread_id=thread.ident)
+    sampler.start()
+    time.sleep(0.1)
+    sampler.stop()
+    stop.set()
+    thread.join()
+
+    assert sampler.samples > 0
+    lines = sampler.collapsed().splitlines()
+    assert lines
+    stack, count = lines[0].rsplit(" ", 1)
+    assert int(count) > 0
+    assert "busy_worker" in stack
+    assert stack.split(";")[0].startswith("Thread._bootstrap")
+
+
+@pytest.mark.asyncio
+async def test_profile_modes_and_busy():
+    async def spin():
+        # 持续占用事件循环，模拟阻塞的同步代码
+        await asyncio.sleep(0.01)
+        deadline = time.perf_counter() + 0.1
+        while time.perf_counter() < deadline:
+            sum(range(1000))
+
+    task = asyncio.create_task(spin())
+    collapsed = await profiler.profile(0.1, interval=0.002)
+    await task
+    assert "spin" in collapsed
+
+    stats = await profiler.profile(0.05, mode="cprofile")
+    assert "cumulative" in stats
+
+    with pytest.raises(ValueError):
+        await profiler.profile(0.1, mode="yappi")
+    with pytest.raises(ValueError):
+        await profiler.profile(profiler.MAX_SECONDS + 1)
+
+    running = asyncio.create_task(profiler.profile(0.1))
+    await asyncio.sleep(0.01)
+    with pytest.raises(profiler.ProfilerBusyError):
+        await profiler.profile(0.1)
+    await running
+
+
+@pytest.mark.asyncio
+async def test_admin_key_verifier():
+    with pytest.raises(HTTPException) as exc_info:
+        await admin_key_verifier(None)(authorization="Bearer x", x_admin_key=None)
+    assert exc_info.value.status_code == 404
+
+    verify = admin_key_verifier("secret")
+    await verify(authorization="Bearer secret", x_admin_key=None)
+    await verify(authorization=None, x_admin_key="secret")
+    with pytest.raises(APIKeyError):
+        await verify(authorization="Bearer wrong", x_admin_key=None)
+    with pytest.raises(APIKeyError):
+        await verify(authorization=None, x_admin_key=None)
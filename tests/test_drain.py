@@ -0,0 +1,170 @@
+"""优雅退出与指标单元测试"""
+
+import asyncio
+import signal
+
+import aiohttp
+import pytest
+
+from app.monitoring.drain import DrainController
+from app.monitoring.health import ReadinessState
+from app.monitoring.metrics import MetricsRegistry
+from tests.performance.bench_gateway import _free_port, start_gateway, wait_until_up
+from tests.performance.mock_upstream import MockConfig, MockUpstream
+
+
+async def _stream(n, delay):
+    for i in range(n):
+        await asyncio.sleep(delay)
+        yield f"data: {i}\n\n".encode()
+
+
+def _controller(grace_period=5.0, on_drained=None):
+    readiness = ReadinessState()
+    readiness.mark_ready()
+    registry = MetricsRegistry()
+    return DrainController(readiness, grace_period, on_drained, registry), registry
+
+
+def test_metrics_render():
+    registry = MetricsRegistry()
+    counter = registry.counter("requests_total", "请求数", ("status",))
+    counter.inc(status="ok")
+    counter.inc(2, status='a"b')
+    gauge = registry.gauge("in_flight", "进行中")
+    gauge.set_function(lambda: 3)
+
+    text = registry.render()
+    assert "# TYPE requests_total counter" in text
+    assert 'requests_total{status="ok"} 1' in text
+    assert 'requests_total{status="a\\"b"} 2' in text
+    assert "in_flight 3" in text
+    assert registry.counter("requests_total", "请求数", ("status",)) is counter
+    with pytest.raises(ValueError):
+        counter.inc(other="x")
+
+
+@pytest.mark.asyncio
+async def test_drain_waits_for_streams():
+    """测试排空时拒绝新请求，等待进行中的流结束后再清理"""
+    drained = []
+
+    async def on_drained():
+        drained.append(True)
+
+    drain, registry = _controller(on_drained=on_drained)
+    received = []
+
+    async def consume():
+        async for item in drain.track_stream(_stream(5, 0.02)):
+            received.append(item)
+
+    consumer = asyncio.create_task(consume())
+    await asyncio.sleep(0.01)
+    assert drain.in_flight == 1
+
+    drain_task = asyncio.create_task(drain.drain())
+    await asyncio.sleep(0)
+    assert not drain.readiness.ready
+    assert not drain.admit()
+    assert not drained
+
+    await drain_task
+    await consumer
+    assert len(received) == 5
+    assert drained == [True]
+    text = registry.render()
+    assert 'deepxy_drain_requests_total{outcome="completed"} 1' in text
+    assert 'deepxy_rejected_requests_total{reason="draining"} 1' in text
+
+
+@pytest.mark.asyncio
+async def test_drain_cancels_after_grace_period():
+    """测试宽限期结束后取消仍未完成的流"""
+    drain, registry = _controller(grace_period=0.1)
+
+    async def consume():
+        async for _ in drain.track_stream(_stream(100, 1)):
+            pass
+
+    consumer = asyncio.create_task(consume())
+    await asyncio.sleep(0.01)
+    await drain.drain()
+
+    with pytest.raises(asyncio.CancelledError):
+        await consumer
+    assert drain.in_flight == 0
+    assert 'deepxy_drain_requests_total{outcome="cancelled"} 1' in registry.render()
+
+
+@pytest.mark.asyncio
+async def test_admitted_request_holds_drain():
+    """测试请求从被接受起计入进行中的请求，交给跟踪器之前排空不会结束"""
+    drained = []
+
+    async def on_drained():
+        drained.append(True)
+
+    drain, _ = _controller(on_drained=on_drained)
+    slot = drain.admit()
+    assert drain.in_flight == 1
+
+    drain_task = asyncio.create_task(drain.drain())
+    await asyncio.sleep(0.01)
+    assert not drained
+
+    # 计数交给流，流结束时才释放
+    items = [item async for item in drain.track_stream(_stream(2, 0), slot)]
+    assert len(items) == 2
+    await drain_task
+    assert drained == [True] and drain.in_flight == 0
+
+    # 出错时由调用方释放，可以重复释放
+    drain, _ = _controller()
+    slot = drain.admit()
+    slot.release()
+    slot.release()
+    assert drain.in_flight == 0
+
+    # 没有开始输出的流在回收时释放
+    drain.track_stream(_stream(1, 0), drain.admit())
+    assert drain.in_flight == 0
+
+    async with drain.track_request(drain.admit()):
+        assert drain.in_flight == 1
+    assert drain.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_sigterm_drains_gateway():
+    """测试网关收到 SIGTERM 后完成进行中的流再退出"""
+    pytest.importorskip("uvicorn")
+    upstream = MockUpstream(MockConfig(reasoning_tokens=20, answer_tokens=20, reasoning_rate=40, answer_rate=40))
+    upstream_url = await upstream.start(port=_free_port())
+    port = _free_port()
+    gateway = start_gateway(port, upstream_url, {"DRAIN_GRACE_PERIOD": "30"})
+    url = f"http://127.0.0.1:{port}"
+    try:
+        async with aiohttp.ClientSession() as session:
+            await wait_until_up(session, url)
+            body = {"model": "deepxy", "messages": [{"role": "user", "content": "hi"}], "stream": True}
+            async with session.post(f"{url}/v1/chat/completions", json=body) as response:
+                await response.content.readline()
+                gateway.send_signal(signal.SIGTERM)
+                await asyncio.sleep(0.2)
+
+                async with aiohttp.ClientSession() as probe:
+                    async with probe.get(f"{url}/health/ready") as ready:
+                        assert ready.status == 503
+                    async with probe.post(f"{url}/v1/chat/completions", json=body) as rejected:
+                        assert rejected.status == 503
+
+                lines = [line async for line in response.content if line.startswith(b"data:")]
+                assert lines[-1].strip() == b"data: [DONE]"
+
+        # 新版 uvicorn 在优雅退出后会重新触发捕获到的信号
+        assert await asyncio.to_thread(gateway.wait, 10) in (0, -signal.SIGTERM)
+    finally:
+        if gateway.poll() is None:
+            gateway.kill()
+        await upstream.stop()
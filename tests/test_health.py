@@ -0,0 +1,53 @@
+"""健康检查与启动预热单元测试"""
+
+import pytest
+
+from app.clients import BaseClient, QwenClient
+from app.monitoring.health import ReadinessState, warm_up
+from tests.performance.mock_upstream import MockConfig, MockUpstream
+
+
+def test_readiness_state():
+    state = ReadinessState()
+    assert state.snapshot()["status"] == "not_ready"
+    state.mark_ready()
+    assert state.snapshot()["status"] == "ready"
+    state.mark_not_ready("draining")
+    assert state.snapshot()["reason"] == "draining"
+
+
+@pytest.mark.asyncio
+async def test_warm_up_pre_seeds_pool(unused_tcp_port):
+    """测试预热后连接池中保留了到上游的空闲连接"""
+    upstream = MockUpstream(MockConfig())
+    url = await upstream.start(port=unused_tcp_port)
+    try:
+        client = QwenClient("key", f"{url}/v1/chat/completions")
+        state = ReadinessState()
+        await warm_up(state, client, [f"{url}/v1/chat/completions"], connections=3)
+
+        assert state.ready
+        assert state.checks[f"connect:{url}"] == "ok (3/3 connections)"
+        assert state.checks["dns:127.0.0.1"].startswith("ok")
+        assert "tokenizer" in state.checks
+        assert sum(len(conns) for conns in client._get_session().connector._conns.values()) == 3
+    finally:
+        await BaseClient.close_sessions()
+        await upstream.stop()
+
+
+@pytest.mark.asyncio
+async def test_warm_up_failures_do_not_block_readiness(unused_tcp_port):
+    """测试单项预热失败时仍然就绪，失败原因记录在检查结果中"""
+    client = QwenClient("key", f"http://127.0.0.1:{unused_tcp_port}/v1/chat/completions")
+    state = ReadinessState()
+    try:
+        await warm_up(
+            state, client, [f"http://127.0.0.1:{unused_tcp_port}/v1/chat/completions"],
+            connections=1, timeout=2, preload_tokenizer=False,
+        )
+    finally:
+        await BaseClient.close_sessions()
+
+    assert state.ready
+    assert state.checks[f"connect:http://127.0.0.1:{unused_tcp_port}"] == "failed (ConnectionError: 0/1 connections)"
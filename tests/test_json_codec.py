@@ -0,0 +1,119 @@
+"""JSON 编解码模块单元测试"""
+
+import pytest
+from app.utils import json_codec
+from app.utils.json_codec import get_codec
+
+BACKENDS = ["json", "orjson", "msgspec"]
+
+
+def _codec_or_skip(backend):
+    codec = get_codec(backend)
+    if codec.name != backend:
+        pytest.skip(f"{backend} 未安装")
+    return codec
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_decode_chat_delta(backend):
+    """测试解析 OpenAI 兼容格式的 delta"""
+    codec = _codec_or_skip(backend)
+    payload = b'{"id":"x","choices":[{"index":0,"delta":{"content":null,"reasoning_content":"\xe6\x80\x9d\xe8\x80\x83"}}]}'
+    delta = codec.decode_chat_delta(payload)
+    assert delta.content is None
+    assert delta.reasoning_content == "思考"
+
+    # 没有 choices（例如 usage 统计块）时返回 None
+    assert codec.decode_chat_delta(b'{"choices":[],"usage":{"total_tokens":3}}') is None
+    assert codec.decode_chat_delta(b'{"choices":[{"index":0,"delta":{}}]}') is None
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_decode_dashscope_delta(backend):
+    """测试解析 DashScope 原生格式的 message"""
+    codec = _codec_or_skip(backend)
+    payload = '{"output":{"choices":[{"message":{"content":"你好","role":"assistant"}}]},"request_id":"r"}'
+    message = codec.decode_dashscope_delta(payload)
+    assert message.content == "你好"
+    assert codec.decode_dashscope_delta('{"output":{"choices":[]}}') is None
+    assert codec.decode_dashscope_delta('{"code":"InvalidParameter"}') is None
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_decode_dashscope_event(backend):
+    """测试解析 DashScope 原生事件的用量、request_id 与错误码"""
+    codec = _codec_or_skip(backend)
+    event = codec.decode_dashscope_event(
+        '{"output":{"choices":[{"message":{"content":"好","role":"assistant"},"finish_reason":"stop"}]},'
+        '"usage":{"input_tokens":9,"output_tokens":3,"prompt_tokens_details":{"cached_tokens":8}},'
+        '"request_id":"r"}'
+    )
+    assert event.delta.content == "好"
+    assert event.finish_reason == "stop"
+    assert tuple(event.usage) == (9, 3, 8, "r")
+    assert event.code is None
+
+    event = codec.decode_dashscope_event('{"code":"InvalidParameter","message":"bad","request_id":"r"}')
+    assert (event.delta, event.usage, event.code, event.message) == (None, None, "InvalidParameter", "bad")
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_decode_error(backend):
+    """测试非法 JSON 抛出的异常能被 DecodeError 捕获"""
+    codec = _codec_or_skip(backend)
+    with pytest.raises(codec.decode_errors):
+        codec.decode_chat_delta(b'{"choices": [')
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_dumps_roundtrip(backend):
+    """测试编码结果可被标准库解析且不转义中文"""
+    codec = _codec_or_skip(backend)
+    obj = {"choices": [{"delta": {"content": "你好"}}]}
+    data = codec.dumps(obj)
+    assert isinstance(data, bytes)
+    assert "你好".encode("utf-8") in data
+    assert get_codec("json").loads(data) == obj
+
+
+def test_unknown_backend_falls_back():
+    """测试指定未知后端时自动回退"""
+    assert get_codec("unknown").name in BACKENDS
+
+
+def test_sse_event():
+    """测试 SSE 事件格式"""
+    event = json_codec.sse_event({"a": 1})
+    assert event.startswith(b"data: ")
+    assert event.endswith(b"\n\n")
+
+
+@pytest.mark.parametrize(
+    "obj",
+    [
+        {"model": "qwen", "stream": True, "messages": [
+            {"role": "system", "content": "sys"},
+            {"role": "user", "content": '长"文本\\带转义\n' * 7, "name": "u"},
+            {"role": "user", "content": [{"type": "text", "text": "片段"}]},
+        ]},
+        {"messages": []},
+        {"messages": [{"role": "user", "content": "😀" * 11}]},
+    ],
+)
+def test_iter_dumps_matches_dumps(obj):
+    """测试分段（含长字符串分片）编码的结果与整体编码等价"""
+    segments = list(json_codec.iter_dumps(obj, "messages", max_chars=5))
+    assert json_codec.loads(b"".join(segments)) == obj
+    assert max(len(segment) for segment in segments) < len(json_codec.dumps(obj))
+
+
+def test_use_backend():
+    """测试按配置切换模块级的编解码函数"""
+    previous = json_codec.BACKEND
+    try:
+        json_codec.use_backend("json")
+        assert json_codec.BACKEND == "json"
+        assert json_codec.loads(json_codec.sse_event({"a": 1})[6:]) == {"a": 1}
+    finally:
+        json_codec.use_backend(previous)
+    assert json_codec.BACKEND == previous
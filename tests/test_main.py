@@ -0,0 +1,123 @@
+"""网关接口测试
+
+直接以 ASGI 协议调用应用，不经过网络与上游服务。
+"""
+
+import importlib
+
+import pytest
+
+from app.config import get_settings
+from app.utils import json_codec
+from app.utils.schemas import validate_chat_request
+
+API_KEY = "sk-test"
+
+
+@pytest.fixture
+def main(monkeypatch):
+    """导入 app.main，首次导入时按测试环境加载配置"""
+    monkeypatch.setenv("DASHSCOPE_API_KEY", "sk-upstream")
+    monkeypatch.setenv("ALLOW_API_KEY", API_KEY)
+    get_settings.cache_clear()
+    return importlib.import_module("app.main")
+
+
+async def post(app, path, body):
+    """发送 POST 请求
+
+    Returns:
+        tuple: (状态码, 响应体)
+    """
+    payload = json_codec.dumps(body)
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [
+            (b"authorization", f"Bearer {API_KEY}".encode()),
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(payload)).encode()),
+        ],
+        "client": ("127.0.0.1", 12345),
+        "server": ("testserver", 80),
+    }
+    received = False
+    messages = []
+
+    async def receive():
+        nonlocal received
+        if received:
+            return {"type": "http.disconnect"}
+        received = True
+        return {"type": "http.request", "body": payload, "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope, receive, send)
+    status = next(m["status"] for m in messages if m["type"] == "http.response.start")
+    body = b"".join(m.get("body", b"") for m in messages if m["type"] == "http.response.body")
+    return status, json_codec.loads(body)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("content, param", [
+    ([{"type": "image_url", "image_url": {"url": "https://example.com/a.png"}}], "messages[1].content"),
+    ([{"type": "text", "text": ""}], "messages[1].content"),
+    (None, "messages[1].content"),
+    ("", "messages[1].content"),
+])
+async def test_invalid_user_content(main, content, param):
+    """最后一条用户消息不是非空文本时在连接上游之前返回 400"""
+    messages = [{"role": "system", "content": "你是助手"}, {"role": "user", "content": content}]
+    status, body = await post(main.app, "/v1/chat/completions", {"model": "deepxy", "messages": messages})
+    assert status == 400
+    assert body["error"]["param"] == param
+    assert main.drain.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_missing_user_content(main):
+    messages = [{"role": "user", "content": "你好"}, {"role": "assistant", "content": "你好"}, {"role": "user"}]
+    status, body = await post(main.app, "/v1/chat/completions", {"model": "deepxy", "messages": messages})
+    assert status == 400
+    assert body["error"]["param"] == "messages[2].content"
+
+    status, body = await post(main.app, "/v1/chat/completions", {
+        "model": "deepxy", "messages": [{"role": "system", "content": "你是助手"}],
+    })
+    assert status == 400
+    assert body["error"]["param"] == "messages"
+
+
+def test_flatten_text_parts():
+    request = validate_chat_request(json_codec.dumps({"model": "deepxy", "messages": [
+        {"role": "user", "content": [{"type": "text", "text": "第一段"}, {"type": "text", "text": "第二段"}]},
+    ]}))
+    assert request["messages"][0]["content"] == "第一段第二段"
+
+
+@pytest.mark.asyncio
+async def test_history_exceeds_message_limits(main):
+    """拼接保存的对话历史后超出消息条数或单条字符数上限时返回 400"""
+    settings = main.settings
+    question = {"role": "user", "content": "你好"}
+    main.conversations.save("chatcmpl-many", "default", None, [question] * settings.max_messages, "好")
+    main.conversations.save("chatcmpl-long", "default", None, [question], "长" * (settings.max_message_chars + 1))
+
+    for response_id in ("chatcmpl-many", "chatcmpl-long"):
+        status, body = await post(main.app, "/v1/chat/completions", {
+            "model": "deepxy",
+            "messages": [{"role": "user", "content": "继续"}],
+            "previous_response_id": response_id,
+        })
+        assert status == 400
+        assert body["error"]["param"] == "previous_response_id"
+    assert main.drain.in_flight == 0
@@ -0,0 +1,130 @@
+"""非流式输出引擎单元测试"""
+
+import asyncio
+
+import pytest
+
+from app.clients import BaseClient, ProviderConfig, ProviderRegistry
+from app.deepxy.deepxy import DeepXY
+from app.utils import errors
+from tests.performance.mock_upstream import MockConfig, MockUpstream
+
+MESSAGES = [
+    {"role": "system", "content": "sys"},
+    {"role": "user", "content": "第一个问题"},
+    {"role": "assistant", "content": "第一个回答"},
+    {"role": "user", "content": "第二个问题"},
+]
+
+
+def _deep_xy(api_url="http://upstream", supports_non_stream=True):
+    registry = ProviderRegistry(ProviderConfig(
+        "default", api_url, "key", request_format="openai", supports_non_stream=supports_non_stream
+    ))
+    deep_xy = DeepXY("key", "key", api_url, api_url, registry=registry)
+
+    async def no_warm(api_url=None):
+        return True
+
+    deep_xy.qwen_client.warm_connection = no_warm
+    return deep_xy
+
+
+def test_build_qwen_messages_does_not_mutate():
+    """测试构造 Qwen 消息时不修改传入的消息，且 DeepSeek 的回答位于最后一条用户消息之前"""
+    deep_xy = _deep_xy()
+    original = [dict(message) for message in MESSAGES]
+
+    result = deep_xy._build_qwen_messages(MESSAGES, "推理", "好", "qwen-max")
+
+    assert MESSAGES == original
+    assert [m["role"] for m in result] == ["system", "user", "assistant", "assistant", "user"]
+    assert result[3] == {"role": "assistant", "content": "好"}
+    assert "第二个问题" in result[-1]["content"] and "推理" in result[-1]["content"]
+
+
+@pytest.mark.asyncio
+async def test_complete_with_deepseek_content():
+    """测试 R1 返回回答内容时非流式请求仍然成功"""
+    deep_xy = _deep_xy()
+
+    async def fake_deepseek(messages, model, is_origin_reasoning=True):
+        for token in ["一", "二", "三"]:
+            yield "reasoning", token
+        yield "content", "好"
+
+    async def fake_complete(messages, model_arg, model, timeout=None):
+        assert messages[-1]["role"] == "user"
+        return "回答"
+
+    deep_xy.deepseek_client.stream_chat = fake_deepseek
+    deep_xy.qwen_client.complete_chat = fake_complete
+
+    response = await deep_xy.chat_completions_without_stream(MESSAGES, (0.7, 0.95, 0.0, 0.0))
+    message = response["choices"][0]["message"]
+    assert message["content"] == "回答"
+    assert message["reasoning_content"] == "一二三"
+
+
+@pytest.mark.asyncio
+async def test_reasoning_budget_keeps_partial_reasoning():
+    """测试推理阶段超出预算时保留已收到的推理内容"""
+    deep_xy = _deep_xy()
+
+    async def slow_deepseek(messages, model, is_origin_reasoning=True):
+        yield "reasoning", "部分"
+        await asyncio.sleep(10)
+        yield "reasoning", "不会收到"
+
+    async def fake_complete(messages, model_arg, model, timeout=None):
+        return "回答"
+
+    deep_xy.deepseek_client.stream_chat = slow_deepseek
+    deep_xy.qwen_client.complete_chat = fake_complete
+
+    response = await deep_xy.chat_completions_without_stream(
+        MESSAGES, (0.7, 0.95, 0.0, 0.0), timeout=0.2
+    )
+    assert response["choices"][0]["message"]["reasoning_content"] == "部分"
+
+
+@pytest.mark.asyncio
+async def test_answer_deadline_raises_timeout():
+    """测试回答阶段超过截止时间时抛出 TimeoutError"""
+    deep_xy = _deep_xy()
+
+    async def fake_deepseek(messages, model, is_origin_reasoning=True):
+        yield "reasoning", "推理"
+        yield "content", ""
+
+    async def slow_complete(messages, model_arg, model, timeout=None):
+        await asyncio.sleep(10)
+
+    deep_xy.deepseek_client.stream_chat = fake_deepseek
+    deep_xy.qwen_client.complete_chat = slow_complete
+
+    with pytest.raises(errors.TimeoutError):
+        await deep_xy.chat_completions_without_stream(MESSAGES, (0.7, 0.95, 0.0, 0.0), timeout=0.2)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("supports_non_stream", [True, False])
+async def test_complete_chat_against_mock_upstream(unused_tcp_port, supports_non_stream):
+    """测试 stream=false 与流式拼接两种方式得到相同的回答"""
+    upstream = MockUpstream(MockConfig(answer_tokens=20, seed=0))
+    url = await upstream.start(port=unused_tcp_port)
+    try:
+        deep_xy = _deep_xy(f"{url}/v1/chat/completions", supports_non_stream)
+        answer = await deep_xy.qwen_client.complete_chat(
+            [{"role": "user", "content": "hi"}], model="qwen-max"
+        )
+        parts = [
+            content async for _, content in deep_xy.qwen_client.stream_chat(
+                [{"role": "user", "content": "hi"}], model="qwen-max"
+            )
+        ]
+        assert answer == "".join(parts)
+        assert len(answer) > 0
+    finally:
+        await BaseClient.close_sessions()
+        await upstream.stop()
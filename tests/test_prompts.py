@@ -0,0 +1,61 @@
+"""提示词模板单元测试"""
+
+import pytest
+
+from app.clients import ProviderConfig, ProviderRegistry
+from app.deepxy import prompts
+from app.deepxy.deepxy import DeepXY
+
+
+@pytest.mark.parametrize("name", list(prompts.PROMPT_TEMPLATES))
+def test_compiled_matches_format(name):
+    """测试编译后的模板与 str.format 的渲染结果一致，且原始问题位于推理内容之前"""
+    source = prompts.PROMPT_TEMPLATES[name]
+    template = prompts.get_template(name)
+    rendered = template.render("问题{x}", "推理")
+    assert rendered == source.format(original_content="问题{x}", reasoning="推理")
+
+    stable, variable = template.render_parts("<question>", "<reasoning>")
+    assert "<question>" in stable and "<reasoning>" not in stable
+    assert "<reasoning>" in variable
+
+
+def test_compile_is_content_addressed():
+    """测试相同内容的模板只编译一次"""
+    source = "Q: {original_content}\nR: {reasoning}"
+    first = prompts.compile_template(source)
+    assert prompts.compile_template("".join(list(source))) is first
+    assert first.digest != prompts.get_template("default").digest
+
+
+@pytest.mark.parametrize("source", [
+    "{reasoning}\n{original_content}",
+    "{original_content} {unknown}",
+    "{original_content:>10} {reasoning}",
+])
+def test_invalid_templates(source):
+    with pytest.raises(ValueError):
+        prompts.CompiledTemplate(source)
+
+
+@pytest.mark.parametrize("hints, supported, expect_parts", [
+    (True, True, True),
+    (True, False, False),
+    (False, True, False),
+])
+def test_cache_control_hints(hints, supported, expect_parts):
+    """测试只有开启提示且上游支持时才发送 cache_control"""
+    registry = ProviderRegistry(ProviderConfig(
+        "default", "http://upstream", "key", supports_cache_control=supported
+    ))
+    deep_xy = DeepXY("key", "key", registry=registry, prompt_cache_hints=hints)
+    messages = [{"role": "system", "content": "sys"}, {"role": "user", "content": "问题"}]
+
+    result = deep_xy._build_qwen_messages(messages, "<reasoning>", "", "qwen-max")
+    assert result[0]["role"] == "system"
+    content = result[-1]["content"]
+    if expect_parts:
+        assert content[0]["cache_control"] == {"type": "ephemeral"}
+        assert "问题" in content[0]["text"] and "<reasoning>" in content[1]["text"]
+    else:
+        assert isinstance(content, str)
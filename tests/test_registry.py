@@ -0,0 +1,139 @@
+"""上游服务注册表单元测试"""
+
+import json
+
+import pytest
+from app.clients.registry import ProviderConfig, ProviderRegistry
+from app.config import Settings
+
+
+@pytest.fixture
+def registry():
+    return ProviderRegistry.from_settings(Settings(
+        dashscope_api_key="ds-key",
+        dashscope_api_url="https://dashscope.example/v1/chat/completions",
+        openrouter_api_key="or-key",
+    ))
+
+
+def test_default_routes(registry):
+    """测试默认路由规则"""
+    route = registry.resolve("qwen2.5-14b-instruct-1m")
+    assert route.provider.name == "dashscope"
+    # /chat/completions 地址为兼容模式
+    assert route.provider.request_format == "openai"
+    assert route.prompt_template == "qwen"
+    assert route.headers["Authorization"] == "Bearer ds-key"
+    assert route.provider.assistant_prefix == "partial"
+
+    route = registry.resolve("anthropic/claude-3.5-sonnet")
+    assert route.provider.name == "openrouter"
+    assert route.provider.request_format == "openai"
+    assert route.prompt_template == "anthropic/"
+    assert route.headers["X-Title"] == "DeepClaude"
+    assert route.provider.assistant_prefix is None
+
+    route = registry.resolve("deepseek-r1")
+    assert route.provider.name == "dashscope"
+    assert route.prompt_template == "default"
+
+
+def test_resolve_is_cached(registry):
+    """测试同一模型的解析结果被缓存"""
+    assert registry.resolve("google/gemini-pro") is registry.resolve("google/gemini-pro")
+
+
+def test_resolve_cache_is_bounded():
+    """测试客户端传入任意模型名时缓存不会无限增长，淘汰最久未使用的模型名"""
+    registry = ProviderRegistry(ProviderConfig("dashscope", "https://dashscope.example"), max_cached_routes=2)
+    first = registry.resolve("model-a")
+    registry.resolve("model-b")
+    assert registry.resolve("model-a") is first
+    for i in range(100):
+        registry.resolve(f"random-{i}")
+    assert len(registry._cache) == 2
+    assert registry.resolve("model-a") is not first
+    assert registry.resolve("model-a") == first
+
+
+def test_exact_and_longest_prefix(registry):
+    """测试精确匹配优先，其次为最长前缀"""
+    registry.register_provider(ProviderConfig("vllm", "http://vllm/v1/chat/completions"))
+    registry.add_model("google/gemma*", "vllm")
+    registry.add_model("google/gemma-2-9b", "dashscope", "default")
+
+    assert registry.resolve("google/gemma-2-27b").provider.name == "vllm"
+    # 前缀规则没有设置模板时由较短的前缀规则补全
+    assert registry.resolve("google/gemma-2-27b").prompt_template == "google/"
+    assert registry.resolve("google/gemma-2-9b").provider.name == "dashscope"
+    assert registry.resolve("google/gemini-pro").provider.name == "openrouter"
+
+
+def test_dashscope_native_models():
+    """测试原生协议按地址或按模型选择"""
+    settings = Settings.from_env({
+        "DASHSCOPE_API_KEY": "ds-key",
+        "DASHSCOPE_API_URL": "https://dashscope.example/compatible-mode/v1/chat/completions",
+        "DASHSCOPE_NATIVE_MODELS": "qwen-plus, qwen3-*",
+    })
+    registry = ProviderRegistry.from_settings(settings)
+
+    route = registry.resolve("qwen3-32b")
+    assert route.provider.name == "dashscope-native"
+    assert route.provider.request_format == "dashscope"
+    assert route.provider.api_url.endswith("/api/v1/services/aigc/text-generation/generation")
+    assert route.prompt_template == "qwen"
+    assert route.headers["X-DashScope-SSE"] == "enable"
+    assert route.headers["Authorization"] == "Bearer ds-key"
+    assert registry.resolve("qwen-max").provider.name == "dashscope"
+    assert "X-DashScope-SSE" not in registry.resolve("qwen-max").headers
+
+    # 默认上游配置为原生地址时整体使用原生协议
+    registry = ProviderRegistry.from_settings(Settings(
+        dashscope_api_key="ds-key",
+        dashscope_api_url="https://dashscope.example/api/v1/services/aigc/text-generation/generation",
+    ))
+    assert registry.resolve("qwen-max").provider.request_format == "dashscope"
+
+
+def test_local_provider_from_env():
+    """测试本地 OpenAI 兼容服务"""
+    registry = ProviderRegistry.from_settings(Settings.from_env({
+        "DASHSCOPE_API_KEY": "ds-key",
+        "LOCAL_OPENAI_API_URL": "http://127.0.0.1:8001/v1/chat/completions",
+        "LOCAL_OPENAI_MODELS": "qwen2.5-7b-instruct, llama/*",
+    }))
+
+    route = registry.resolve("qwen2.5-7b-instruct")
+    assert route.provider.name == "local"
+    assert route.prompt_template == "qwen"
+    assert "Authorization" not in route.headers
+    assert registry.resolve("llama/3.1-8b").provider.name == "local"
+
+
+def test_load_file(tmp_path):
+    """测试从 JSON 文件加载配置，api_key_env 指定的环境变量由 Settings 读取"""
+    path = tmp_path / "providers.json"
+    path.write_text(json.dumps({
+        "providers": {"vllm": {
+            "api_url": "http://vllm/v1/chat/completions", "api_key_env": "VLLM_KEY", "assistant_prefix": "prefix"
+        }},
+        "models": {"my-model": {"provider": "vllm", "prompt_template": "meta/"}},
+    }))
+    settings = Settings.from_env({"PROVIDERS_FILE": str(path), "VLLM_KEY": "secret", "OTHER_KEY": "x"})
+    assert settings.provider_api_keys == (("VLLM_KEY", "secret"),)
+    registry = ProviderRegistry.from_settings(settings)
+
+    route = registry.resolve("my-model")
+    assert route.provider.api_url == "http://vllm/v1/chat/completions"
+    assert route.headers["Authorization"] == "Bearer secret"
+    assert route.prompt_template == "meta/"
+    assert route.provider.assistant_prefix == "prefix"
+
+
+def test_invalid_config(registry):
+    """测试无效配置"""
+    with pytest.raises(ValueError):
+        registry.add_model("x", "missing")
+    with pytest.raises(ValueError):
+        ProviderConfig("bad", "http://x", request_format="grpc")
@@ -0,0 +1,178 @@
+"""断线续传单元测试"""
+
+import asyncio
+import os
+
+import pytest
+
+from app.deepxy.resume import StreamBuffer, StreamRegistry, parse_event_id
+from app.monitoring.metrics import MetricsRegistry
+from tests.test_non_stream import MESSAGES, _deep_xy
+
+CHAT_ID = "chatcmpl-abc123"
+
+
+def _event(seq: int) -> bytes:
+    return b"id: %s:%d\ndata: %d\n\n" % (CHAT_ID.encode(), seq, seq)
+
+
+class FakePipeline:
+    """由测试控制输出节奏的管道，记录被启动的次数"""
+
+    def __init__(self):
+        self.queue = asyncio.Queue()
+        self.started = 0
+        self.closed = False
+
+    async def run(self):
+        self.started += 1
+        try:
+            seq = 0
+            while True:
+                item = await self.queue.get()
+                if item is None:
+                    return
+                yield _event(seq)
+                seq += 1
+        finally:
+            self.closed = True
+
+    async def emit(self, count: int):
+        for _ in range(count):
+            await self.queue.put(1)
+        await asyncio.sleep(0.01)
+
+
+def _registry(**kwargs) -> StreamRegistry:
+    return StreamRegistry(registry=MetricsRegistry(), **kwargs)
+
+
+async def _take(stream, count: int):
+    return [await stream.__anext__() for _ in range(count)]
+
+
+def test_parse_event_id():
+    assert parse_event_id(f"{CHAT_ID}:12") == (CHAT_ID, 12)
+    assert parse_event_id(" chatcmpl-x:0 ") == ("chatcmpl-x", 0)
+    for value in (None, "", "12", f"{CHAT_ID}:-1", f"{CHAT_ID}:x", "other-abc:1"):
+        assert parse_event_id(value) is None
+
+
+@pytest.mark.asyncio
+async def test_stream_events_carry_ids():
+    """测试每个事件（包括结束标记）都带有连续的 id"""
+    deep_xy = _deep_xy()
+
+    async def fake_deepseek(messages, model, is_origin_reasoning=True):
+        yield "reasoning", "想"
+        yield "content", ""
+
+    async def fake_qwen(messages, model_arg, model):
+        yield "answer", "答"
+
+    deep_xy.deepseek_client.stream_chat = fake_deepseek
+    deep_xy.qwen_client.stream_chat = fake_qwen
+
+    chunks = [
+        chunk async for chunk in deep_xy.chat_completions_with_stream(
+            MESSAGES, (0.7, 0.95, 0.0, 0.0), chat_id=CHAT_ID
+        )
+    ]
+    ids = [chunk.split(b"\n", 1)[0] for chunk in chunks]
+    assert ids == [b"id: %s:%d" % (CHAT_ID.encode(), seq) for seq in range(len(chunks))]
+    assert chunks[-1].endswith(b"data: [DONE]\n\n")
+    assert parse_event_id(f"{deep_xy.new_chat_id()}:0") is not None
+
+
+@pytest.mark.asyncio
+async def test_reattach_to_running_pipeline():
+    """测试断开后重新连接时补发断开期间的事件，且不重新请求上游"""
+    streams = _registry(detach_timeout=10)
+    pipeline = FakePipeline()
+    first = streams.attach(streams.start(CHAT_ID, "acme", pipeline.run()))
+
+    await pipeline.emit(3)
+    assert await _take(first, 2) == [_event(0), _event(1)]
+    # 客户端断开，管道继续运行
+    await first.aclose()
+    await pipeline.emit(2)
+    assert not pipeline.closed
+
+    # 其他租户不能续传
+    assert streams.resume(f"{CHAT_ID}:1", "other") is None
+
+    resumed = streams.resume(f"{CHAT_ID}:1", "acme")
+    assert await _take(resumed, 3) == [_event(2), _event(3), _event(4)]
+    await pipeline.emit(1)
+    await pipeline.queue.put(None)
+    assert [event async for event in resumed] == [_event(5)]
+    assert pipeline.started == 1
+    await streams.close()
+
+
+@pytest.mark.asyncio
+async def test_replay_finished_stream_until_ttl():
+    """测试流结束后在 ttl 内可以重放，过期后按新请求处理"""
+    streams = _registry(ttl=0.1)
+    pipeline = FakePipeline()
+    streams.start(CHAT_ID, "acme", pipeline.run())
+    await pipeline.emit(3)
+    await pipeline.queue.put(None)
+    await asyncio.sleep(0.01)
+
+    assert [event async for event in streams.resume(f"{CHAT_ID}:0", "acme")] == [_event(1), _event(2)]
+    assert [event async for event in streams.resume(f"{CHAT_ID}:2", "acme")] == []
+    # 客户端声称收到了还不存在的事件
+    assert streams.resume(f"{CHAT_ID}:3", "acme") is None
+
+    await asyncio.sleep(0.15)
+    assert streams.resume(f"{CHAT_ID}:0", "acme") is None
+
+
+@pytest.mark.asyncio
+async def test_detached_pipeline_cancelled_after_timeout():
+    """测试客户端没有重新连接时取消上游请求"""
+    streams = _registry(detach_timeout=0.05)
+    pipeline = FakePipeline()
+    stream = streams.attach(streams.start(CHAT_ID, "acme", pipeline.run()))
+    await pipeline.emit(1)
+    assert await _take(stream, 1) == [_event(0)]
+    await stream.aclose()
+
+    await asyncio.sleep(0.1)
+    assert pipeline.closed
+    # 已经输出的部分仍然可以取回
+    assert streams.resume(f"{CHAT_ID}:0", "acme") is not None
+    await streams.close()
+
+
+@pytest.mark.asyncio
+async def test_ring_buffer_eviction():
+    """测试超出内存上限后丢弃最早的事件，之前的位置无法续传"""
+    buffer = StreamBuffer(CHAT_ID, "acme", max_bytes=len(_event(0)) * 2)
+    for seq in range(5):
+        buffer.append(_event(seq))
+    buffer.finish()
+    assert buffer.size <= buffer.max_bytes
+    assert not buffer.can_resume(1)
+    assert buffer.can_resume(2)
+    assert [event async for event in buffer.subscribe(2)] == [_event(3), _event(4)]
+
+
+@pytest.mark.asyncio
+async def test_spill_to_disk(tmp_path):
+    """测试配置溢出目录后可以从磁盘取回被丢弃的事件"""
+    streams = _registry(max_bytes=len(_event(0)) * 2, spill_dir=str(tmp_path), ttl=0)
+    pipeline = FakePipeline()
+    stream = streams.attach(streams.start(CHAT_ID, "acme", pipeline.run()))
+    await pipeline.emit(4)
+    await stream.aclose()
+
+    resumed = streams.resume(f"{CHAT_ID}:0", "acme")
+    assert b"".join(await _take(resumed, 2)) == _event(1) + _event(2)
+    await pipeline.emit(4)
+    await pipeline.queue.put(None)
+    rest = b"".join([event async for event in resumed])
+    assert rest == b"".join(_event(seq) for seq in range(3, 8))
+    # ttl 为 0 时流结束后立即删除溢出文件
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,147 @@
+"""请求校验单元测试"""
+
+import json
+
+import pytest
+
+from app.utils.errors import InvalidRequestError, PayloadTooLargeError
+from app.utils.schemas import DEFAULTS, answer_candidates, read_body, validate_chat_request
+
+
+def _validate(body, **kwargs):
+    return validate_chat_request(json.dumps(body), **kwargs)
+
+
+def _error(body, **kwargs) -> InvalidRequestError:
+    with pytest.raises(InvalidRequestError) as exc_info:
+        _validate(body, **kwargs)
+    return exc_info.value
+
+
+def test_defaults_and_passthrough():
+    request = _validate({"messages": [{"role": "user", "content": "hi", "name": "u"}], "user": "abc"})
+    assert request["messages"] == [{"role": "user", "content": "hi", "name": "u"}]
+    assert request["user"] == "abc"
+    for name, value in DEFAULTS.items():
+        assert request[name] == value
+
+
+def test_integer_temperature_accepted():
+    request = _validate({"messages": [{"role": "user", "content": "hi"}], "temperature": 1})
+    assert request["temperature"] == 1.0
+    assert _validate({"messages": [{"role": "user", "content": "hi"}], "temperature": 2})["temperature"] == 2
+
+
+@pytest.mark.parametrize(
+    "body, param",
+    [
+        ({"messages": [{"role": "user", "content": "hi"}], "temperature": 2.5}, "temperature"),
+        ({"messages": [{"role": "user", "content": "hi"}], "temperature": "1"}, "temperature"),
+        ({"messages": [{"role": "user", "content": "hi"}], "stream": "yes"}, "stream"),
+        ({"messages": [{"role": "user", "content": "hi"}], "top_p": 0}, "top_p"),
+        ({"messages": []}, "messages"),
+        ({"model": "x"}, "messages"),
+        ({"messages": [{"role": "bot", "content": "hi"}]}, "messages[0].role"),
+        ({"messages": [{"role": "user", "content": "hi"}, {"role": "user", "content": 5}]}, "messages[1].content"),
+    ],
+)
+def test_invalid_params(body, param):
+    error = _error(body)
+    assert error.http_status == 400
+    assert error.details == {"type": "invalid_request_error", "param": param}
+    assert param in error.message
+
+
+def test_message_limits():
+    message = {"role": "user", "content": "x" * 11}
+    assert _error({"messages": [message]}, max_message_chars=10).details["param"] == "messages[0].content"
+    parts = {"role": "user", "content": [{"type": "text", "text": "x" * 11}]}
+    assert _error({"messages": [parts]}, max_message_chars=10).details["param"] == "messages[0].content[0].text"
+    many = {"messages": [{"role": "user", "content": "hi"}] * 5}
+    assert _error(many, max_messages=4).details["param"] == "messages"
+    assert _validate(many, max_messages=5)
+
+
+def test_invalid_json():
+    with pytest.raises(InvalidRequestError) as exc_info:
+        validate_chat_request(b'{"messages": [')
+    assert "JSON" in exc_info.value.message
+    with pytest.raises(InvalidRequestError):
+        validate_chat_request(b"[1, 2]")
+
+
+async def _chunks(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+@pytest.mark.asyncio
+async def test_read_body_limits():
+    assert await read_body(_chunks(b"ab", b"cd"), max_bytes=4) == b"abcd"
+
+    consumed = []
+
+    async def endless():
+        while True:
+            consumed.append(1)
+            yield b"x" * 3
+
+    # 超过限制后立即停止读取
+    with pytest.raises(PayloadTooLargeError) as exc_info:
+        await read_body(endless(), max_bytes=10)
+    assert exc_info.value.http_status == 413
+    assert len(consumed) == 4
+
+    # Content-Length 已经超过限制时不读取请求体
+    consumed.clear()
+    with pytest.raises(PayloadTooLargeError):
+        await read_body(endless(), max_bytes=10, content_length="11")
+    assert not consumed
+
+
+def test_answer_candidates():
+    messages = [{"role": "user", "content": "hi"}]
+    single = _validate({"messages": messages})
+    assert answer_candidates(single, "qwen") == [("qwen", (0.7, 0.95, 0.0, 0.0))]
+
+    fan_out = _validate({"messages": messages, "n": 3, "temperature": 1})
+    assert answer_candidates(fan_out, "qwen") == [("qwen", (1, 0.95, 0.0, 0.0))] * 3
+
+    mixed = _validate({
+        "messages": messages,
+        "n": 2,
+        "candidates": [{"temperature": 0.2}, {"model": "qwen-max", "top_p": 0.5}],
+    })
+    assert answer_candidates(mixed, "qwen") == [
+        ("qwen", (0.2, 0.95, 0.0, 0.0)),
+        ("qwen-max", (0.7, 0.5, 0.0, 0.0)),
+    ]
+
+
+@pytest.mark.parametrize(
+    "extra, param",
+    [
+        ({"n": 0}, "n"),
+        ({"n": 9}, "n"),
+        ({"n": 2, "candidates": [{}]}, "n"),
+        ({"candidates": []}, "candidates"),
+        ({"candidates": [{"temperature": 3}]}, "candidates[0].temperature"),
+    ],
+)
+def test_invalid_candidates(extra, param):
+    error = _error({"messages": [{"role": "user", "content": "hi"}], **extra})
+    assert error.details["param"] == param
+
+
+def test_previous_response_id():
+    messages = [{"role": "user", "content": "hi"}]
+    request = _validate({"messages": messages, "previous_response_id": "chatcmpl-18f3ab12", "store": True})
+    assert request["previous_response_id"] == "chatcmpl-18f3ab12"
+    assert _error({"messages": messages, "previous_response_id": "../etc"}).details["param"] == "previous_response_id"
+    assert _error({"messages": messages, "store": "yes"}).details["param"] == "store"
+
+
+def test_reasoning_override():
+    messages = [{"role": "user", "content": "你好"}]
+    assert _validate({"messages": messages, "reasoning": "never"})["reasoning"] == "never"
+    assert _error({"messages": messages, "reasoning": "maybe"}).details["param"] == "reasoning"
@@ -0,0 +1,169 @@
+"""租户认证、配额与用量账本单元测试"""
+
+import asyncio
+import json
+import os
+import sqlite3
+
+import pytest
+
+from app.monitoring.ledger import UsageLedger
+from app.monitoring.metrics import MetricsRegistry
+from app.utils.auth import ANONYMOUS, KeyStore, Tenant, api_key_verifier, hash_key
+from app.utils.errors import APIKeyError, RateLimitError
+from app.utils.quota import QuotaManager, TokenBucket, estimate_tokens
+
+
+def _write_tenants(path, tenants, mtime=None):
+    path.write_text(json.dumps({"tenants": tenants}), encoding="utf-8")
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("abcd" * 10) == pytest.approx(10)
+    assert estimate_tokens("你好世界") == pytest.approx(4)
+
+
+def test_key_store_modes():
+    assert KeyStore().lookup(None) is ANONYMOUS
+    single = KeyStore(allow_api_key="secret")
+    assert single.lookup("secret").id == "default"
+    assert single.lookup("wrong") is None
+    assert single.lookup(None) is None
+
+
+@pytest.mark.asyncio
+async def test_key_store_hot_reload(tmp_path):
+    path = tmp_path / "tenants.json"
+    _write_tenants(path, [{"id": "acme", "keys": [hash_key("k1")], "max_concurrency": 2}], mtime=1000)
+    store = KeyStore(str(path), reload_interval=0.01)
+    assert store.lookup("k1") == Tenant("acme", max_concurrency=2)
+    assert store.lookup("k2") is None
+
+    # 认证路径上不读取文件，轮换 key 后由后台任务重新加载
+    _write_tenants(path, [{"id": "acme", "keys": [hash_key("k2")]}], mtime=2000)
+    assert store.lookup("k2") is None
+    store.start()
+    try:
+        for _ in range(100):
+            if store.lookup("k2") is not None:
+                break
+            await asyncio.sleep(0.01)
+        assert store.lookup("k1") is None
+        assert store.lookup("k2").id == "acme"
+    finally:
+        await store.stop()
+
+    # 文件损坏时保留原有配置
+    path.write_text("{", encoding="utf-8")
+    os.utime(path, (3000, 3000))
+    assert not await store.refresh()
+    assert store.lookup("k2").id == "acme"
+
+
+@pytest.mark.asyncio
+async def test_api_key_verifier():
+    verify = api_key_verifier(KeyStore(allow_api_key="secret"))
+    assert (await verify(authorization="Bearer secret")).id == "default"
+    with pytest.raises(APIKeyError):
+        await verify(authorization="Bearer other")
+    with pytest.raises(APIKeyError):
+        await verify(authorization=None)
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=10, capacity=100)
+    bucket.consume(150)
+    assert bucket.available() < 0
+    assert bucket.time_until(1) > 4
+    bucket.consume(-1000)
+    assert bucket.available() == 100
+
+
+def test_quota_concurrency_limit():
+    quota = QuotaManager()
+    tenant = Tenant("acme", max_concurrency=2)
+    leases = [quota.acquire(tenant), quota.acquire(tenant)]
+    with pytest.raises(RateLimitError) as exc_info:
+        quota.acquire(tenant)
+    assert exc_info.value.details["reason"] == "tenant_concurrency"
+    # 其他租户不受影响
+    quota.acquire(Tenant("other", max_concurrency=1)).release()
+
+    leases[0].release()
+    leases[0].release()
+    assert quota.in_flight("acme") == 1
+    quota.acquire(tenant).cancel()
+    assert quota.in_flight("acme") == 1
+
+
+def test_quota_token_bucket_settles_actual_usage():
+    quota = QuotaManager()
+    tenant = Tenant("acme", tokens_per_minute=600)
+    lease = quota.acquire(tenant, [{"role": "user", "content": "abcd" * 100}])
+    assert lease.charged == pytest.approx(100)
+    # 回答用量在结束时结算，余额可以为负
+    lease.usage.add_completion("你" * 1000)
+    lease.release()
+    with pytest.raises(RateLimitError) as exc_info:
+        quota.acquire(tenant, [{"role": "user", "content": "hi"}])
+    assert exc_info.value.details["reason"] == "tenant_tokens"
+    assert exc_info.value.details["retry_after"] >= 1
+
+    # 被取消的请求退回预扣的额度
+    fresh = Tenant("fresh", tokens_per_minute=600)
+    quota.acquire(fresh, [{"role": "user", "content": "abcd" * 100}]).cancel()
+    assert quota._buckets["fresh"].available() == pytest.approx(600, abs=1)
+
+
+@pytest.mark.asyncio
+async def test_ledger_batches_writes(tmp_path):
+    path = tmp_path / "ledger" / "usage.db"
+    registry = MetricsRegistry()
+    ledger = UsageLedger(str(path), batch_size=2, flush_interval=10, registry=registry)
+    quota = QuotaManager(ledger)
+    ledger.start()
+
+    tenant = Tenant("acme")
+
+    def finish(request_id):
+        lease = quota.acquire(tenant, [{"role": "user", "content": "hello world!"}])
+        lease.model = "qwen"
+        lease.request_id = request_id
+        lease.usage.add_reasoning("思考")
+        lease.usage.add_completion("answer")
+        lease.release()
+
+    finish("req-0")
+    finish("req-1")
+    # 被拒绝的请求不记账
+    quota.acquire(tenant).cancel()
+
+    # 达到批次大小后立即写入，剩余的记录在停止时写入
+    await asyncio.sleep(0.05)
+    assert registry.counter("deepxy_ledger_records_total", "").get() == 2
+    finish("req-2")
+    await ledger.stop()
+    assert registry.counter("deepxy_ledger_records_total", "").get() == 3
+
+    connection = sqlite3.connect(path)
+    assert connection.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    rows = connection.execute(
+        "SELECT tenant, request_id, model, prompt_tokens, reasoning_tokens, completion_tokens FROM usage"
+    ).fetchall()
+    connection.close()
+    assert rows == [
+        ("acme", "req-0", "qwen", 3, 2, 2),
+        ("acme", "req-1", "qwen", 3, 2, 2),
+        ("acme", "req-2", "qwen", 3, 2, 2),
+    ]
+
+
+def test_ledger_drops_when_full(tmp_path):
+    registry = MetricsRegistry()
+    ledger = UsageLedger(str(tmp_path / "usage.db"), max_pending=1, registry=registry)
+    ledger.record((0,) * 11)
+    ledger.record((0,) * 11)
+    assert registry.counter("deepxy_ledger_dropped_total", "").get() == 1
@@ -0,0 +1,56 @@
+"""<think> 标签解析器单元测试"""
+
+import pytest
+from app.clients.think_parser import ThinkTagParser
+
+
+def _run(deltas):
+    parser = ThinkTagParser()
+    items = []
+    for delta in deltas:
+        items.extend(parser.feed(delta))
+    items.extend(parser.flush())
+    return items
+
+
+def _joined(items, content_type):
+    return "".join(text for kind, text in items if kind == content_type)
+
+
+def test_complete_tags():
+    """测试标签完整出现在单个 delta 中"""
+    items = _run(["<think>", "先想一想", "</think>", "答案"])
+    assert _joined(items, "reasoning") == "先想一想"
+    assert _joined(items, "content") == "答案"
+    # 推理结束时先输出空的 content，通知下一阶段开始
+    assert items[1] == ("content", "")
+
+
+@pytest.mark.parametrize("split", range(1, 20))
+def test_tags_split_across_deltas(split):
+    """测试标签在任意位置被拆分"""
+    text = "\n<think>推理过程</think>\n\n回答"
+    items = _run([text[:split], text[split:]])
+    assert _joined(items, "reasoning") == "推理过程"
+    assert _joined(items, "content") == "\n\n回答"
+
+
+def test_char_by_char():
+    """测试逐字符输入"""
+    text = "<think>a<b</think>c"
+    items = _run(list(text))
+    assert _joined(items, "reasoning") == "a<b"
+    assert _joined(items, "content") == "c"
+
+
+def test_without_think_tag():
+    """测试模型没有输出推理标签时全部作为回答"""
+    items = _run(["直接", "回答 <think>"])
+    assert _joined(items, "reasoning") == ""
+    assert _joined(items, "content") == "直接回答 <think>"
+
+
+def test_unterminated_reasoning_is_flushed():
+    """测试流结束时输出前瞻缓冲中的内容"""
+    items = _run(["<think>未完成</thi"])
+    assert _joined(items, "reasoning") == "未完成</thi"
@@ -0,0 +1,205 @@
+"""分阶段超时与卡顿检测单元测试"""
+
+import asyncio
+
+import aiohttp
+import pytest
+
+from app.clients import DeepSeekClient
+from app.clients.timeouts import (
+    ANSWER_TIMEOUTS,
+    DEADLINE_HEADER,
+    AdaptiveTimeouts,
+    StreamStallError,
+    StreamTimeouts,
+    parse_deadline_header,
+    parse_timeouts,
+    request_timeout,
+    reset_deadline,
+    set_deadline,
+)
+from app.monitoring.metrics import MetricsRegistry
+from tests.test_non_stream import MESSAGES, _deep_xy
+
+EVENT = b'data: {"choices":[{"delta":{"reasoning_content":"r"}}]}\n\n'
+FAST = StreamTimeouts(connect=1.0, first_token=0.2, idle=0.2)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_parse():
+    assert parse_timeouts("first_token=30, idle=5", ANSWER_TIMEOUTS) == StreamTimeouts(10.0, 30.0, 5.0)
+    assert parse_timeouts("", ANSWER_TIMEOUTS) == ANSWER_TIMEOUTS
+    for value in ("read=3", "idle=x", "idle=0"):
+        with pytest.raises(ValueError):
+            parse_timeouts(value, ANSWER_TIMEOUTS)
+
+    assert parse_deadline_header("2.5") == 2.5
+    assert parse_deadline_header(None) is None
+    assert parse_deadline_header("-1") is None
+    assert parse_deadline_header("soon") is None
+
+
+def test_adaptive_timeouts():
+    """测试样本足够后按分位数收紧超时，并限制在上下限之间"""
+    clock = FakeClock()
+    registry = MetricsRegistry()
+    adaptive = AdaptiveTimeouts("answer", ANSWER_TIMEOUTS, min_samples=10, clock=clock, registry=registry)
+    gauge = registry.gauge("deepxy_stream_timeout_seconds", "", ("stage", "phase"))
+    for _ in range(9):
+        adaptive.observe_first_token(2.0)
+        adaptive.observe_gap(0.01)
+    clock.now += 10
+    assert adaptive.current() == ANSWER_TIMEOUTS
+
+    adaptive.observe_first_token(2.0)
+    adaptive.observe_gap(0.01)
+    # 刷新间隔内不重新计算
+    assert adaptive.current() == ANSWER_TIMEOUTS
+    clock.now += 10
+    # first_token 为 4 倍的 2s，idle 不低于 5s 的下限
+    assert adaptive.current() == StreamTimeouts(connect=10.0, first_token=8.0, idle=5.0)
+    assert gauge.get(stage="answer", phase="first_token") == 8.0
+
+    for _ in range(20):
+        adaptive.observe_first_token(100.0)
+    clock.now += 10
+    assert adaptive.current().first_token == ANSWER_TIMEOUTS.first_token
+
+
+def test_deadline_propagation():
+    """测试请求的截止时间限制上游请求的总时长并转发给上游"""
+    client = DeepSeekClient("key", "http://upstream")
+    assert client._deadline_headers({"a": "1"}) == {"a": "1"}
+    assert request_timeout(FAST, client.timeout).total == client.timeout.total
+
+    token = set_deadline(5.0)
+    try:
+        headers = client._deadline_headers({"a": "1"})
+        assert 4.0 < float(headers[DEADLINE_HEADER]) <= 5.0
+        timeout = request_timeout(FAST, client.timeout)
+        assert 4.0 < timeout.total <= 5.0
+        assert timeout.connect == 1.0 and timeout.sock_read is None
+    finally:
+        reset_deadline(token)
+
+    token = set_deadline(0.0)
+    try:
+        assert request_timeout(FAST, aiohttp.ClientTimeout()).total == pytest.approx(0.001)
+    finally:
+        reset_deadline(token)
+
+
+def _client(script, registry):
+    """script 中的 float 表示等待的秒数，bytes 表示输出的分块"""
+    client = DeepSeekClient("key", "http://upstream")
+    client.stream_timeouts = AdaptiveTimeouts("reasoning", FAST, registry=registry)
+
+    async def fake_make_request(headers, data, api_url=None, timeout=None):
+        assert timeout.connect == FAST.connect
+        for item in script:
+            if isinstance(item, float):
+                await asyncio.sleep(item)
+            else:
+                yield item
+
+    client._make_request = fake_make_request
+    return client
+
+
+async def _read(client, consumer_delay=0.0):
+    items = []
+    async for item in client._iter_sse_data({}, {}):
+        items.append(item)
+        await asyncio.sleep(consumer_delay)
+    return items
+
+
+@pytest.mark.asyncio
+async def test_stall_detection():
+    registry = MetricsRegistry()
+    stalls = registry.counter("deepxy_upstream_stalls_total", "", ("stage", "phase"))
+
+    with pytest.raises(StreamStallError) as error:
+        await _read(_client([1.0, EVENT], registry))
+    assert error.value.phase == "first_token"
+    assert isinstance(error.value, aiohttp.ServerTimeoutError)
+
+    # 心跳注释不算输出
+    client = _client([EVENT, 0.1, b": keep-alive\n\n", 0.15, EVENT], registry)
+    with pytest.raises(StreamStallError) as error:
+        await _read(client)
+    assert error.value.phase == "idle"
+    assert stalls.get(stage="reasoning", phase="first_token") == 1
+    assert stalls.get(stage="reasoning", phase="idle") == 1
+
+    # 调用方处理事件的时间不计入间隔
+    client = _client([EVENT, 0.1, EVENT, 0.1, EVENT, b"data: [DONE]\n\n"], registry)
+    assert len(await _read(client, consumer_delay=0.3)) == 3
+    assert len(client.stream_timeouts._first_token) == 1
+    assert len(client.stream_timeouts._gaps) == 2
+
+
+@pytest.mark.asyncio
+async def test_reasoning_stall_keeps_partial_reasoning():
+    """测试推理阶段卡顿时使用已收到的推理内容继续"""
+    deep_xy = _deep_xy()
+    seen = []
+
+    async def stalled_deepseek(messages, model, is_origin_reasoning=True):
+        yield "reasoning", "已有的推理"
+        raise StreamStallError("reasoning", "idle", 60.0)
+
+    async def fake_qwen(messages, model_arg, model):
+        seen.append(messages)
+        yield "answer", "答"
+
+    deep_xy.deepseek_client.stream_chat = stalled_deepseek
+    deep_xy.qwen_client.stream_chat = fake_qwen
+
+    chunks = [c async for c in deep_xy.chat_completions_with_stream(MESSAGES, (0.7, 0.95, 0.0, 0.0))]
+    assert chunks[-1].endswith(b"data: [DONE]\n\n")
+    assert "已有的推理" in seen[0][-1]["content"]
+    assert "获取推理内容失败" not in seen[0][-1]["content"]
+
+
+@pytest.mark.asyncio
+async def test_reasoning_first_token_stall_retries_once():
+    """测试推理阶段在第一个片段之前卡住时重试一次，重试后仍然卡住时跳过推理"""
+    deep_xy = _deep_xy()
+    attempts = []
+
+    async def flaky_deepseek(messages, model, is_origin_reasoning=True):
+        attempts.append(model)
+        if len(attempts) == 1:
+            raise StreamStallError("reasoning", "first_token", 60.0)
+        yield "reasoning", "重试后的推理"
+        yield "content", ""
+
+    async def fake_qwen(messages, model_arg, model):
+        yield "answer", "答"
+
+    deep_xy.deepseek_client.stream_chat = flaky_deepseek
+    deep_xy.qwen_client.stream_chat = fake_qwen
+    chunks = [c async for c in deep_xy.chat_completions_with_stream(MESSAGES, (0.7, 0.95, 0.0, 0.0))]
+    assert len(attempts) == 2
+    assert any("重试后的推理" in c.decode() for c in chunks)
+
+    # 重试后仍然卡住时不再重试，跳过推理继续回答
+    attempts.clear()
+
+    async def stalled_deepseek(messages, model, is_origin_reasoning=True):
+        attempts.append(model)
+        raise StreamStallError("reasoning", "first_token", 60.0)
+        yield
+
+    deep_xy.deepseek_client.stream_chat = stalled_deepseek
+    chunks = [c async for c in deep_xy.chat_completions_with_stream(MESSAGES, (0.7, 0.95, 0.0, 0.0))]
+    assert len(attempts) == 2
+    assert chunks[-1].endswith(b"data: [DONE]\n\n")
@@ -0,0 +1,204 @@
+"""分布式追踪单元测试"""
+
+import asyncio
+import json
+
+import pytest
+
+from app.clients import BaseClient
+from app.monitoring import tracing
+from app.monitoring.metrics import MetricsRegistry
+from tests.performance.mock_upstream import MockConfig, MockUpstream
+from tests.test_non_stream import MESSAGES, _deep_xy
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+PARENT = f"00-{TRACE_ID}-00f067aa0ba902b7-01"
+
+
+class Collector:
+    """保存结束的 span"""
+
+    def __init__(self):
+        self.spans = []
+
+    def on_end(self, span):
+        self.spans.append(span)
+
+    def named(self, name):
+        return [span for span in self.spans if span.name == name]
+
+
+@pytest.fixture
+def collector():
+    collector = Collector()
+    previous = tracing.get_tracer()
+    tracing.set_tracer(tracing.Tracer(collector, sample_rate=1.0))
+    yield collector
+    tracing.set_tracer(previous)
+
+
+def test_parse_traceparent():
+    context = tracing.parse_traceparent(PARENT, "vendor=a")
+    assert context == tracing.SpanContext(TRACE_ID, "00f067aa0ba902b7", True, "vendor=a")
+    assert not tracing.parse_traceparent(PARENT[:-2] + "00").sampled
+    # 更高的版本允许附加字段
+    assert tracing.parse_traceparent("01" + PARENT[2:] + "-extra").trace_id == TRACE_ID
+    for value in (
+        None, "", PARENT + "-extra", "ff" + PARENT[2:], PARENT.upper(),
+        f"00-{'0' * 32}-00f067aa0ba902b7-01", f"00-{TRACE_ID}-{'0' * 16}-01", f"00-{TRACE_ID}-01",
+    ):
+        assert tracing.parse_traceparent(value) is None
+
+
+def test_sampling():
+    """测试按比例抽样，有上游传入的 trace 时沿用其采样标记"""
+    collector = Collector()
+    tracer = tracing.Tracer(collector, sample_rate=0.0)
+    span = tracer.start_span("root")
+    assert not span.recording
+    span.set_attribute("a", 1)
+    span.end()
+    assert collector.spans == []
+    # 未抽中的请求仍然传递 trace
+    headers = tracing.inject({"a": "1"}, span)
+    assert headers["traceparent"] == f"00-{span.context.trace_id}-{span.context.span_id}-00"
+
+    child = tracer.start_span("child", parent=tracing.parse_traceparent(PARENT, "vendor=a"))
+    assert child.recording and child.context.trace_id == TRACE_ID and child.parent_id == "00f067aa0ba902b7"
+    assert tracing.inject({}, child)["tracestate"] == "vendor=a"
+
+    # 未配置追踪时不传递任何信息
+    span = tracing.Tracer().start_span("root")
+    assert span is tracing.NOOP_SPAN
+    assert tracing.inject({"a": "1"}, span) == {"a": "1"}
+
+
+@pytest.mark.asyncio
+async def test_span_hierarchy(collector):
+    """测试阶段任务继承当前 span，异常标记为失败，取消不算失败"""
+
+    @tracing.traced("stage")
+    async def stage(fail):
+        tracing.current_span().set_attribute("fail", fail)
+        if fail:
+            raise ValueError("上游出错")
+        await asyncio.sleep(1)
+
+    with tracing.span("root", kind="server") as root:
+        ok = asyncio.create_task(stage(False))
+        with pytest.raises(ValueError):
+            await asyncio.create_task(stage(True))
+        ok.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await ok
+    assert tracing.current_span() is tracing.NOOP_SPAN
+
+    cancelled, failed = sorted(collector.named("stage"), key=lambda span: span.attributes["fail"])
+    assert failed.parent_id == cancelled.parent_id == root.context.span_id
+    assert failed.context.trace_id == root.context.trace_id
+    assert failed.status == "error" and "上游出错" in failed.status_message
+    assert cancelled.status == "unset" and cancelled.attributes["deepxy.outcome"] == "cancelled"
+    assert collector.spans[-1] is root and root.end_ns >= root.start_ns
+
+
+class RecordingUpstream(MockUpstream):
+    """记录收到的 traceparent 请求头"""
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.traceparents = []
+
+    async def _handle_chat(self, request, native=False):
+        self.traceparents.append(request.headers.get("traceparent"))
+        return await super()._handle_chat(request, native)
+
+
+@pytest.mark.asyncio
+async def test_stream_request_spans(collector, unused_tcp_port):
+    """测试流式请求的各阶段与上游请求的 span 及 traceparent 的传递"""
+    upstream = RecordingUpstream(MockConfig(reasoning_tokens=5, answer_tokens=4, seed=0))
+    url = await upstream.start(port=unused_tcp_port)
+    try:
+        deep_xy = _deep_xy(f"{url}/compatible-mode/v1/chat/completions")
+        root = tracing.start_span("chat_completions", kind="server", parent=tracing.parse_traceparent(PARENT))
+        token = tracing.use_span(root)
+        try:
+            events = tracing.end_after(
+                deep_xy.chat_completions_with_stream(MESSAGES, (0.7, 0.95, 0.0, 0.0)), root
+            )
+            chunks = [chunk async for chunk in events]
+        finally:
+            tracing.reset_span(token)
+    finally:
+        await BaseClient.close_sessions()
+        await upstream.stop()
+
+    assert chunks[-1].endswith(b"data: [DONE]\n\n")
+    assert {span.context.trace_id for span in collector.spans} == {TRACE_ID}
+    assert root.parent_id == "00f067aa0ba902b7"
+    assert root.attributes["http.response.body.size"] == sum(map(len, chunks))
+
+    [deepseek], [qwen] = collector.named("process_deepseek"), collector.named("process_qwen")
+    assert deepseek.parent_id == qwen.parent_id == root.context.span_id
+    assert deepseek.attributes["gen_ai.request.model"] == "deepseek-r1"
+    assert deepseek.attributes["gen_ai.usage.reasoning_tokens"] > 0
+    assert qwen.attributes["gen_ai.usage.output_tokens"] > 0
+
+    requests = collector.named("upstream_request")
+    assert sorted(span.parent_id for span in requests) == sorted([deepseek.context.span_id, qwen.context.span_id])
+    for span in requests:
+        assert span.kind == "client"
+        assert span.attributes["http.response.status_code"] == 200
+        assert span.attributes["http.response.body.size"] > 0
+        assert span.attributes["server.address"] == "127.0.0.1"
+    # 上游收到的 traceparent 指向对应的 client span
+    assert sorted(upstream.traceparents) == sorted(span.traceparent() for span in requests)
+
+
+@pytest.mark.asyncio
+async def test_batch_export(tmp_path):
+    """测试批量导出为 OTLP JSON，导出失败与缓冲区已满时丢弃并计数"""
+    registry = MetricsRegistry()
+    dropped = registry.counter("deepxy_trace_spans_dropped_total", "", ("reason",))
+    path = tmp_path / "spans.jsonl"
+    processor = tracing.BatchSpanProcessor(tracing.FileExporter(str(path)), batch_size=2, registry=registry)
+    tracer = tracing.Tracer(processor)
+    processor.start()
+    for i in range(3):
+        span = tracer.start_span("request", kind="server")
+        span.set_attributes({"index": i, "ratio": 0.5, "ok": True, "model": "m", "missing": None})
+        span.end()
+    await processor.stop()
+
+    batches = [json.loads(line) for line in path.read_text().splitlines()]
+    assert len(batches) == 2
+    spans = [s for batch in batches for s in batch["resourceSpans"][0]["scopeSpans"][0]["spans"]]
+    assert len(spans) == 3
+    assert batches[0]["resourceSpans"][0]["resource"]["attributes"][0]["value"] == {"stringValue": "deepxy"}
+    assert spans[0]["kind"] == 2 and spans[0]["parentSpanId"] == ""
+    assert spans[0]["attributes"] == [
+        {"key": "index", "value": {"intValue": "0"}},
+        {"key": "ratio", "value": {"doubleValue": 0.5}},
+        {"key": "ok", "value": {"boolValue": True}},
+        {"key": "model", "value": {"stringValue": "m"}},
+    ]
+
+    class FailingExporter:
+        async def export(self, spans):
+            raise OSError("collector 不可用")
+
+        async def shutdown(self):
+            pass
+
+    processor = tracing.BatchSpanProcessor(FailingExporter(), max_pending=1, registry=registry)
+    tracer = tracing.Tracer(processor)
+    tracer.start_span("a").end()
+    tracer.start_span("b").end()
+    assert await processor.flush() == 0
+    assert dropped.get(reason="overflow") == 1
+    assert dropped.get(reason="error") == 1
+
+    assert tracing.build_tracer("", "", None, 1.0) is None
+    for exporter, path in (("zipkin", None), ("file", None)):
+        with pytest.raises(ValueError):
+            tracing.build_tracer(exporter, "", path, 1.0)